@@ -0,0 +1,134 @@
+"""
+Throttle-storm behaviour of bedrock_gateway vs the per-invocation clients it replaces.
+
+A local stand-in for bedrock-runtime serves invoke_model with a fixed latency and a
+requests-per-second quota; requests over the quota get a ThrottlingException, like
+an on-demand model under load. --threads workers (documents of concurrent SQS
+batches) each make --calls calls.
+
+"before" builds a new bedrock-runtime client per call after a simulated assume_role
+round trip (like get_bedrock_client in the summary/chatbot lambdas) and retries
+throttling with botocore's standard-mode backoff (10 attempts); the old execute_model
+then returned "" for calls that still failed. "gateway" reuses the cached client and
+paces each model with its adaptive token bucket.
+
+Usage:
+    python bench_bedrock_gateway.py [--threads 16] [--calls 10] [--quota-rps 8]
+"""
+import argparse
+import contextlib
+import io
+import json
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.exceptions import ClientError
+
+import bench_env  # noqa: F401 - fake credentials and the common layer on sys.path
+import bedrock_gateway
+
+MODEL_ID = bedrock_gateway.HAIKU_MODEL_ID
+REGION = "us-west-2"
+
+
+class StubBedrockRuntime:
+    """invoke_model with latency and a server-side token bucket quota"""
+
+    def __init__(self, quota_rps, latency_sec):
+        self.quota_rps = quota_rps
+        self.latency_sec = latency_sec
+        self.tokens = quota_rps
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.accepted = 0
+        self.throttled = 0
+
+    def invoke_model(self, modelId, body, **kwargs):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.quota_rps, self.tokens + (now - self.updated) * self.quota_rps)
+            self.updated = now
+            if self.tokens < 1:
+                self.throttled += 1
+                raise ClientError({"Error": {"Code": "ThrottlingException", "Message": "Too many requests"}},
+                                  "InvokeModel")
+            self.tokens -= 1
+            self.accepted += 1
+        time.sleep(self.latency_sec)
+        answer = {"content": [{"type": "text", "text": '{"classification_type": "ClaimForm"}'}],
+                  "usage": {"input_tokens": len(json.loads(body)["messages"][0]["content"][0]["text"]) // 4,
+                            "output_tokens": 12}}
+        return {"body": io.BytesIO(json.dumps(answer).encode())}
+
+
+def before_call(stub, sts_sec, setup_times):
+    """One execute_model of the old lambdas: new client, botocore standard retries, "" on failure"""
+    start = time.perf_counter()
+    time.sleep(sts_sec)  # sts.assume_role
+    boto3.client("bedrock-runtime", region_name=REGION)  # the client the old code built every time
+    setup_times.append(time.perf_counter() - start)
+    for attempt in range(10):
+        try:
+            stub.invoke_model(modelId=MODEL_ID, body=json.dumps(
+                {"messages": [{"role": "user", "content": [{"type": "text", "text": "x" * 4000}]}]}))
+            return True
+        except ClientError:
+            time.sleep(random.random() * min(20, 2 ** attempt))  # botocore standard-mode backoff
+    return False
+
+
+def gateway_call(stub, sts_sec, setup_times):
+    try:
+        bedrock_gateway.invoke_claude("x" * 4000, MODEL_ID, region=REGION, stage="bench")
+        return True
+    except bedrock_gateway.BedrockGatewayError:
+        return False
+
+
+def run(name, call, args):
+    stub = StubBedrockRuntime(args.quota_rps, args.latency_ms / 1000.0)
+    bedrock_gateway._clients.clear()
+    bedrock_gateway._buckets.clear()
+    bedrock_gateway._clients[(REGION, None)] = stub
+    setup_times, latencies = [], []
+
+    def worker(_):
+        results = []
+        for _ in range(args.calls):
+            start = time.perf_counter()
+            results.append(call(stub, args.sts_ms / 1000.0, setup_times))
+            latencies.append(time.perf_counter() - start)
+        return results
+
+    start = time.perf_counter()
+    # The gateway prints a log line and EMF metrics per call
+    with contextlib.redirect_stdout(io.StringIO()), ThreadPoolExecutor(max_workers=args.threads) as executor:
+        outcomes = [ok for results in executor.map(worker, range(args.threads)) for ok in results]
+    wall = time.perf_counter() - start
+    latencies.sort()
+    print(f"{name:>8} {wall:>7.1f} {sum(outcomes):>9} {outcomes.count(False):>6} {stub.throttled:>10} "
+          f"{statistics.median(latencies):>7.2f} {latencies[int(0.99 * (len(latencies) - 1))]:>7.2f} "
+          f"{sum(setup_times):>9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--calls", type=int, default=10)
+    parser.add_argument("--quota-rps", type=float, default=8.0)
+    parser.add_argument("--latency-ms", type=float, default=300.0)
+    parser.add_argument("--sts-ms", type=float, default=60.0)
+    args = parser.parse_args()
+
+    print(f"{args.threads} threads x {args.calls} calls, quota {args.quota_rps} rps, {args.latency_ms:.0f} ms per call\n")
+    print(f"{'':>8} {'wall s':>7} {'succeeded':>9} {'failed':>6} {'throttled':>10} {'p50 s':>7} {'p99 s':>7} {'setup s':>9}")
+    run("before", before_call, args)
+    run("gateway", gateway_call, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmark the Textract block-graph parsing of the frontend document-extraction-lambda.
+
+extract_document_text resolves KEY_VALUE_SET and TABLE relationships through an
+id -> block index. The "scan" variant plugs the previous helpers back in, which
+looked every child up with a linear search over all blocks (quadratic in block
+count). Both must produce the same rawtext/tbltxt/keyvalues. The scan variant is
+only run up to --scan-max-blocks because it takes minutes beyond that.
+
+Usage:
+    pip install -r requirements.txt
+    python bench_block_index.py [--sizes 10000 50000 200000] [--scan-max-blocks 60000]
+"""
+import argparse
+import contextlib
+import importlib.util
+import io
+import os
+import time
+
+from bench_env import BENCH_DIR, aws_env
+from textract_stub import StubTextract, synthetic_analysis_blocks
+
+FRONTEND_LAMBDA = os.path.join(BENCH_DIR, "..", "..", "frontend-reactjs", "AI-IDP-current-latest",
+                               "lambda-functions", "document-extraction-lambda.py")
+
+
+def scan_extract_text_from_block(block, all_blocks):
+    text = ""
+    for relationship in block.get('Relationships', []):
+        if relationship['Type'] == 'CHILD':
+            for child_id in relationship['Ids']:
+                child_block = next((b for b in all_blocks if b['Id'] == child_id), None)
+                if child_block and child_block['BlockType'] == 'WORD':
+                    text += child_block['Text'] + " "
+    return text.strip()
+
+
+def scan_find_value_block(key_block, all_blocks):
+    for relationship in key_block.get('Relationships', []):
+        if relationship['Type'] == 'VALUE':
+            value_id = relationship['Ids'][0]
+            return next((b for b in all_blocks if b['Id'] == value_id), None)
+    return None
+
+
+def scan_extract_table_text(table_block, all_blocks):
+    table_data = {}
+    for relationship in table_block.get('Relationships', []):
+        if relationship['Type'] == 'CHILD':
+            for cell_id in relationship['Ids']:
+                cell_block = next((b for b in all_blocks if b['Id'] == cell_id), None)
+                if cell_block and cell_block['BlockType'] == 'CELL':
+                    table_data.setdefault(cell_block.get('RowIndex', 0), {})[cell_block.get('ColumnIndex', 0)] = \
+                        scan_extract_text_from_block(cell_block, all_blocks)
+    return table_data
+
+
+def load_frontend_lambda():
+    spec = importlib.util.spec_from_file_location("frontend_document_extraction_lambda", FRONTEND_LAMBDA)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run(module, blocks):
+    module.textract = StubTextract(blocks_for=lambda name: blocks, auto_complete=True)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = module.extract_document_text("claims/large-form.pdf")
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000, 200000], help="approximate block counts")
+    parser.add_argument("--scan-max-blocks", type=int, default=60000)
+    args = parser.parse_args()
+
+    blocks_per_page = len(synthetic_analysis_blocks(pages=1))
+    with aws_env():
+        module = load_frontend_lambda()
+        indexed = (module.build_block_index, module.extract_text_from_block, module.find_value_block, module.extract_table_text)
+        scan = (lambda blocks: blocks, scan_extract_text_from_block, scan_find_value_block, scan_extract_table_text)
+
+        print(f"{'blocks':>8} {'pages':>6} {'indexed s':>10} {'scan s':>9} {'speedup':>8}")
+        for size in args.sizes:
+            pages = max(1, round(size / blocks_per_page))
+            blocks = synthetic_analysis_blocks(pages=pages)
+            (module.build_block_index, module.extract_text_from_block,
+             module.find_value_block, module.extract_table_text) = indexed
+            indexed_sec, indexed_result = run(module, blocks)
+            scan_cell, speedup_cell = "-", "-"
+            if len(blocks) <= args.scan_max_blocks:
+                (module.build_block_index, module.extract_text_from_block,
+                 module.find_value_block, module.extract_table_text) = scan
+                scan_sec, scan_result = run(module, blocks)
+                assert scan_result == indexed_result, "indexed parse differs from the linear-search parse"
+                scan_cell, speedup_cell = f"{scan_sec:.2f}", f"{scan_sec / indexed_sec:.0f}x"
+            print(f"{len(blocks):>8} {pages:>6} {indexed_sec:>10.3f} {scan_cell:>9} {speedup_cell:>8}")
+        (module.build_block_index, module.extract_text_from_block,
+         module.find_value_block, module.extract_table_text) = indexed
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Bedrock calls saved by the chatbot answer cache and FAQ answers, and wrong or stale answers served.
+
+Adjusters ask --questions questions per document about --docs documents, drawn with a
+skew towards the usual ones ("what is the date of injury", "who is the claimant", ...)
+in several wordings, plus open and follow-up questions, through chatbot_lambda.lambda_handler
+against moto tables. Halfway through, the extracted entities of half of the documents
+change (as when the confidence score lambda or a reviewer rewrites them).
+
+A stand-in LLM answers every question correctly for the document revision it is asked
+about and marks its answer with the question's intent and that revision. The stand-in
+for the Titan embedding hashes word and character trigrams, so it only puts wordings that
+share words close together - real embeddings also match paraphrases without shared words.
+
+Per configuration it reports the Bedrock chat calls, the share of answers served from the
+cache and from extracted_entities, answers of another intent (wrong) or of an older
+revision (stale), and the p50 handler time.
+
+Usage:
+    python bench_chat_answer_cache.py [--docs 12] [--questions 15] [--llm-ms 150]
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import math
+import random
+import re
+import statistics
+import time
+
+from bench_env import aws_env, create_pipeline_tables, load_lambda
+from bench_chat_history import create_history_tables
+
+import bedrock_gateway
+from prompt_budget import estimate_tokens
+
+# intent -> (weight, wordings); the intents named like a field are answerable from extracted_entities
+QUESTIONS = {
+    "date_of_injury": (5, ["What is the date of injury?", "what's the date of injury", "Date of injury?",
+                           "When did the injury happen?"]),
+    "employee_name": (5, ["Who is the claimant?", "What is the employee name?", "Who is the claimant"]),
+    "claim_number": (4, ["What is the claim number?", "claim number please", "What's the claim no?"]),
+    "employer_name": (3, ["Who is the employer?", "What is the employer name?"]),
+    "insurer_name": (2, ["Who is the insurer?", "Which insurance carrier covers this claim?"]),
+    "nature_of_injury": (2, ["What is the nature of injury?", "What was the injury?"]),
+    "summary": (2, ["Summarize the document", "Give me a summary of this document"]),
+    "work_status": (2, ["Is the employee back at work?", "Has the worker returned to work?"]),
+    "follow_up": (2, ["And when did that happen?", "Can you explain it more?"]),
+}
+INTENT_OF = {wording: intent for intent, (_, wordings) in QUESTIONS.items() for wording in wordings}
+CONFIGURATIONS = [
+    ("no cache", {}),
+    ("exact", {"CHAT_ANSWER_CACHE_ENABLED": True}),
+    ("exact + FAQ", {"CHAT_ANSWER_CACHE_ENABLED": True, "CHAT_FAQ_ANSWERS": True}),
+    ("similar + FAQ", {"CHAT_ANSWER_CACHE_ENABLED": True, "CHAT_FAQ_ANSWERS": True,
+                       "CHAT_ANSWER_CACHE_SIMILARITY": 0.85}),
+]
+revisions = {}
+
+
+class StubBedrockRuntime:
+    def __init__(self, llm_sec):
+        self.llm_sec = llm_sec
+        self.chat_calls = 0
+
+    def invoke_model(self, modelId, body, **kwargs):
+        request = json.loads(body)
+        if modelId.startswith("amazon.titan-embed"):
+            result = {"embedding": hashed_embedding(request["inputText"], request["dimensions"]),
+                      "inputTextTokenCount": estimate_tokens(request["inputText"])}
+            return {"body": io.BytesIO(json.dumps(result).encode())}
+        self.chat_calls += 1
+        time.sleep(self.llm_sec)
+        prompt = request["messages"][0]["content"][0]["text"]
+        # The last <userquery> node; the system text names the (empty) tags first
+        question = re.findall(r"<userquery>\s*(.*?)\s*</userquery>", prompt, re.DOTALL)[-1]
+        docid = re.search(r"'docid': '([^']+)'", prompt).group(1)
+        answer = f"ANSWER[{INTENT_OF[question]}|rev{revisions[docid]}] from claims/{docid}.pdf"
+        result = {"content": [{"type": "text", "text": answer}], "usage": {"input_tokens": 100, "output_tokens": 20}}
+        return {"body": io.BytesIO(json.dumps(result).encode())}
+
+
+def hashed_embedding(text, dimensions):
+    vector = [0.0] * dimensions
+    words = text.lower().split()
+    features = words + [text.lower()[i:i + 3] for i in range(max(0, len(text) - 2))]
+    for feature in features:
+        digest = hashlib.md5(feature.encode()).digest()
+        vector[int.from_bytes(digest[:4], "big") % dimensions] += 1.0 if feature in words else 0.3
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+
+def entities(docid, revision, rng):
+    values = {"employee_name": f"{rng.choice(['Maria Lopez', 'James Begay', 'Grace Romero'])} r{revision}",
+              "date_of_injury": f"0{rng.randint(1, 9)}/{rng.randint(10, 28)}/2024",
+              "claim_number": f"WC2024-{rng.randint(10000, 99999)}-{revision}",
+              "employer_name": rng.choice(["Mesa Logistics", "Sandia Builders LLC"]),
+              "insurer_name": rng.choice(["New Mexico Mutual", "Zenith Insurance"]),
+              "nature_of_injury": rng.choice(["lower back strain", "left wrist fracture"])}
+    low_confidence = rng.choice(list(values))
+    # Confidences as the confidence score lambda stores them (apply_scores)
+    return {
+        "claimant_information": {"employee_name": {"value": values["employee_name"], "confidence": "96%"}},
+        "claim_details": {name: {"value": value, "confidence": "55%" if name == low_confidence else "93%"}
+                          for name, value in values.items() if name != "employee_name"},
+    }, values
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=12)
+    parser.add_argument("--questions", type=int, default=15)
+    parser.add_argument("--llm-ms", type=float, default=150.0)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    print(f"{'configuration':>14} {'Bedrock calls':>13} {'from cache':>10} {'from entities':>13} "
+          f"{'wrong':>5} {'stale':>5} {'p50 ms':>7}")
+    for name, settings in CONFIGURATIONS:
+        rng = random.Random(args.seed)
+        with aws_env() as aws:
+            dynamodb = aws["dynamodb"]
+            create_pipeline_tables(dynamodb)
+            create_history_tables(dynamodb)
+            dynamodb.create_table(TableName="nmm-chat-answer-cache",
+                                  KeySchema=[{"AttributeName": "docid", "KeyType": "HASH"},
+                                             {"AttributeName": "query_key", "KeyType": "RANGE"}],
+                                  AttributeDefinitions=[{"AttributeName": "docid", "AttributeType": "S"},
+                                                        {"AttributeName": "query_key", "AttributeType": "S"}],
+                                  BillingMode="PAY_PER_REQUEST")
+            chatbot = load_lambda("chatbot_lambda")
+            cache = chatbot.answer_cache
+            for module in (chatbot, chatbot.chat_history, cache):
+                module.dynamodb_resource = dynamodb
+            chatbot.CHAT_HISTORY_STORE = "keyed"
+            cache.CHAT_ANSWER_CACHE_ENABLED, cache.CHAT_FAQ_ANSWERS, cache.CHAT_ANSWER_CACHE_SIMILARITY = False, False, 0
+            for setting, value in settings.items():
+                setattr(cache, setting, value)
+            stub = StubBedrockRuntime(args.llm_ms / 1000)
+            bedrock_gateway._clients[("us-west-2", chatbot.os.environ["BEDROCK_ASSUME_ROLE"])] = stub
+
+            current_values = {}
+
+            def write_document(docid, revision):
+                revisions[docid] = revision
+                tree, current_values[docid] = entities(docid, revision, rng)
+                dynamodb.Table("nmm-doc-extraction").put_item(Item={
+                    "docid": docid, "document_name": [f"claims/{docid}.pdf"], "current_datetime": "2025-01-01",
+                    "extracted_entities": json.dumps(tree), "rawtext": str([{f"claims/{docid}.pdf": "Claim text\n"}])})
+                dynamodb.Table("nmm-dashboard").put_item(Item={"docid": docid, "classification": "ClaimForm"})
+
+            docids = [f"DOC-{number}" for number in range(args.docs)]
+            for docid in docids:
+                write_document(docid, 1)
+            intents = list(QUESTIONS)
+            weights = [QUESTIONS[intent][0] for intent in intents]
+            asks = [(docid, session, rng.choices(intents, weights)[0])
+                    for session in range(args.questions) for docid in docids]
+
+            from_cache = from_entities = wrong = stale = 0
+            timings = []
+            for number, (docid, session, intent) in enumerate(asks):
+                if number == len(asks) // 2:
+                    for changed in docids[::2]:
+                        write_document(changed, 2)
+                question = rng.choice(QUESTIONS[intent][1])
+                event = {"body": json.dumps({"docid": docid, "userid": f"adjuster{session % 3}",
+                                             "sessionid": f"s{session}", "userquery": question})}
+                calls = stub.chat_calls
+                with contextlib.redirect_stdout(io.StringIO()):
+                    start = time.perf_counter()
+                    answer = chatbot.lambda_handler(event, None)["body"]
+                    timings.append((time.perf_counter() - start) * 1000)
+                if answer.startswith("ANSWER["):
+                    answered_intent, revision = answer[len("ANSWER["):answer.index("]")].split("|rev")
+                    from_cache += stub.chat_calls == calls
+                    wrong += answered_intent != intent
+                    stale += int(revision) != revisions[docid]
+                elif "(from the extracted fields" in answer:
+                    from_entities += 1
+                    field = answer[len("The "):answer.index(" is ")].replace(" ", "_")
+                    wrong += field != intent
+                    stale += current_values[docid].get(field, "") not in answer
+            print(f"{name:>14} {stub.chat_calls:>13} {from_cache / len(asks):>10.1%} {from_entities / len(asks):>13.1%} "
+                  f"{wrong:>5} {stale:>5} {statistics.median(timings):>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Per-turn cost of chat history storage as a conversation grows, legacy scan vs keyed turns.
+
+Runs a --turns long conversation through chatbot_lambda.getResponse against moto
+tables, with --other-items items of other conversations already in the history table
+and a local stand-in for Bedrock. "legacy" scans nmm-chathistory and writes the whole
+accumulated history as a new item every turn; "keyed" reads the summary item and the
+last CHAT_HISTORY_WINDOW turns of nmm-chathistory-turns and writes one turn.
+
+At sampled turns it reports the items DynamoDB read for the history (a scan reads - and
+bills - every item of the table), the KB returned and written, the history tokens in
+the prompt, and the time spent in DynamoDB calls.
+
+nmm-chathistory is keyed by docid and current_datetime here (save_chathistory's sort key).
+The legacy read takes the first scanned match, which is then the conversation's oldest
+item, and a single scan call stops at 1 MB - with more --other-items the conversation's
+items are not found at all.
+
+Usage:
+    python bench_chat_history.py [--turns 60] [--other-items 300] [--window 6]
+"""
+import argparse
+import contextlib
+import io
+import json
+import random
+import time
+
+from bench_env import aws_env, load_lambda
+
+import bedrock_gateway
+from prompt_budget import estimate_tokens
+
+ANSWER = ("The date of injury is 03/14/2024, reported on the First Report of Injury (claims/packet.pdf, page 2). "
+          "The employee strained the left shoulder lifting boxes and was seen at Presbyterian Occupational "
+          "Medicine the same day.")
+
+
+class StubBedrockRuntime:
+    def invoke_model(self, modelId, body, **kwargs):
+        prompt = json.loads(body)["messages"][0]["content"][0]["text"]
+        answer = {"content": [{"type": "text", "text": ANSWER}],
+                  "usage": {"input_tokens": estimate_tokens(prompt), "output_tokens": 60}}
+        return {"body": io.BytesIO(json.dumps(answer).encode())}
+
+
+class DynamoMeter:
+    """Counts items read, bytes returned/sent and time of DynamoDB calls through botocore events"""
+
+    def __init__(self, client):
+        self.reset()
+        client.meta.events.register("before-call.dynamodb", self.before_call)
+        client.meta.events.register("after-call.dynamodb", self.after_call)
+
+    def reset(self):
+        self.items_read, self.bytes_read, self.bytes_written, self.seconds = 0, 0, 0, 0.0
+
+    def before_call(self, model, params, **kwargs):
+        self.started = time.perf_counter()
+        if model.name in ("PutItem", "UpdateItem"):
+            self.bytes_written += len(params.get("body") or b"")
+
+    def after_call(self, model, http_response, parsed, **kwargs):
+        self.seconds += time.perf_counter() - self.started
+        if model.name in ("Scan", "Query"):
+            self.items_read += parsed.get("ScannedCount", parsed.get("Count", 0))
+            self.bytes_read += len(json.dumps(parsed.get("Items", [])))
+        elif model.name == "GetItem":
+            self.items_read += 1 if parsed.get("Item") else 0
+            self.bytes_read += len(json.dumps(parsed.get("Item", {})))
+
+
+def create_history_tables(dynamodb):
+    dynamodb.create_table(TableName="nmm-chathistory",
+                          KeySchema=[{"AttributeName": "docid", "KeyType": "HASH"},
+                                     {"AttributeName": "current_datetime", "KeyType": "RANGE"}],
+                          AttributeDefinitions=[{"AttributeName": "docid", "AttributeType": "S"},
+                                                {"AttributeName": "current_datetime", "AttributeType": "S"}],
+                          BillingMode="PAY_PER_REQUEST")
+    dynamodb.create_table(TableName="nmm-chathistory-turns",
+                          KeySchema=[{"AttributeName": "conversation", "KeyType": "HASH"},
+                                     {"AttributeName": "turn_at", "KeyType": "RANGE"}],
+                          AttributeDefinitions=[{"AttributeName": "conversation", "AttributeType": "S"},
+                                                {"AttributeName": "turn_at", "AttributeType": "S"}],
+                          BillingMode="PAY_PER_REQUEST")
+
+
+def fill_other_conversations(dynamodb, count, rng):
+    """count items of other users' conversations in both tables, as a table in use would hold"""
+    legacy, keyed = dynamodb.Table("nmm-chathistory"), dynamodb.Table("nmm-chathistory-turns")
+    with legacy.batch_writer() as legacy_batch, keyed.batch_writer() as keyed_batch:
+        for number in range(count):
+            docid, turn = f"DOC-{number % 300}", number // 300 + 1
+            history = "".join(f"\n------------------------------------\n User Query = question {t} \n\n Answer = "
+                              + ANSWER for t in range(turn))
+            stamp = f"2025-01-01T00:00:{number:06d}"
+            legacy_batch.put_item(Item={"docid": docid, "userid": f"user{rng.randint(1, 50)}",
+                                        "sessionid": f"s{number}", "historicqa": history,
+                                        "current_datetime": stamp})
+            keyed_batch.put_item(Item={"conversation": f"{docid}#user{number % 50}#s{number % 300}",
+                                       "turn_at": "turn#" + stamp, "query": f"question {turn}", "answer": ANSWER})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=60)
+    parser.add_argument("--other-items", type=int, default=300)
+    parser.add_argument("--window", type=int, default=6)
+    parser.add_argument("--sample", type=int, nargs="+", default=[1, 10, 30, 60])
+    args = parser.parse_args()
+
+    print(f"{'store':>6} {'turn':>4} {'items read':>10} {'KB read':>8} {'KB written':>10} "
+          f"{'history tokens':>14} {'DynamoDB ms':>11}")
+    for store in ("legacy", "keyed"):
+        with aws_env() as aws:
+            create_history_tables(aws["dynamodb"])
+            fill_other_conversations(aws["dynamodb"], args.other_items, random.Random(5))
+            chatbot = load_lambda("chatbot_lambda")
+            # Module-level resources were created outside this moto context
+            chatbot.dynamodb_resource = aws["dynamodb"]
+            chatbot.chat_history.dynamodb_resource = aws["dynamodb"]
+            chatbot.CHAT_HISTORY_STORE = store
+            chatbot.chat_history.CHAT_HISTORY_WINDOW = args.window
+            bedrock_gateway._clients[("us-west-2", chatbot.os.environ["BEDROCK_ASSUME_ROLE"])] = StubBedrockRuntime()
+            meter = DynamoMeter(aws["dynamodb"].meta.client)
+            captured = {}
+            prep_query_response = chatbot.prep_query_response
+
+            def capture(query, historicqa, context):
+                captured["tokens"] = estimate_tokens(historicqa)
+                return prep_query_response(query, historicqa, context)
+
+            chatbot.prep_query_response = capture
+            for turn in range(1, args.turns + 1):
+                meter.reset()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    chatbot.getResponse(f"Follow-up question number {turn} about the injury?", "DOC-BENCH",
+                                        "user-bench", "session-bench", "context")
+                if turn in args.sample:
+                    print(f"{store:>6} {turn:>4} {meter.items_read:>10} {meter.bytes_read / 1024:>8.1f} "
+                          f"{meter.bytes_written / 1024:>10.1f} {captured['tokens']:>14} {meter.seconds * 1000:>11.1f}")
+            chatbot.prep_query_response = prep_query_response
+        print()
+
+
+if __name__ == "__main__":
+    main()
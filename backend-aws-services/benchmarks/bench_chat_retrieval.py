@@ -0,0 +1,148 @@
+"""
+Chatbot answer latency and input tokens with the whole document vs retrieved chunks.
+
+Builds synthetic claim documents of --pages pages (Textract-like filler lines of general
+medical and office words, a fifth of them claim vocabulary that the questions also use)
+and plants one fact per question on a random page. For each size it
+builds the chunk index the extraction lambda stores, then asks every question through
+chatbot_lambda.prep_query_response in "full" mode (raw text + dashboard item, as before)
+and "retrieval" mode (top-k chunks with their source pages). A local stand-in for
+bedrock-runtime answers after a latency that grows with the input tokens and rejects
+prompts over the 200k-token context window, like Claude 3 Haiku.
+
+Reports input tokens and answer latency per question, whether the retrieved context
+holds the planted fact and names its page, and the index build / load time and size.
+
+Usage:
+    python bench_chat_retrieval.py [--pages 20 100 400] [--top-k 8]
+"""
+import argparse
+import contextlib
+import io
+import json
+import random
+import statistics
+import time
+
+from botocore.exceptions import ClientError
+
+from bench_env import load_lambda
+from textract_stub import WORDS
+
+import bedrock_gateway
+import chunk_index
+from prompt_budget import estimate_tokens
+
+QUESTIONS = [
+    ("What is the date of injury?", "Date of Injury: 03/14/2024"),
+    ("Who is the treating physician?", "Treating Physician: Dr. Alan Reyes, Presbyterian Occupational Medicine"),
+    ("What is the claim number?", "Claim Number: WC2024-55812"),
+    ("Which body part was injured?", "Body part injured: left shoulder"),
+    ("What work restrictions were given?", "Work restrictions: no lifting over 10 lbs, no overhead reaching"),
+    ("When is the follow-up appointment?", "Follow-up appointment scheduled for 04/02/2024 at 9:30 AM"),
+    ("What medication was prescribed?", "Prescribed medication: ibuprofen 800 mg three times daily"),
+    ("Who is the employer?", "Employer: Mesa Logistics, 4100 Jefferson St NE, Albuquerque"),
+    ("What was the diagnosis?", "Diagnosis: rotator cuff strain of the left shoulder (S46.012A)"),
+    ("What is the policy number?", "Policy Number: PN-88213-07"),
+]
+LINES_PER_PAGE = 45
+FILLER_WORDS = ["patient", "reported", "pain", "exam", "normal", "history", "follow", "visit", "clinic", "signed",
+                "form", "page", "office", "notes", "review", "plan", "level", "range", "motion", "tenderness",
+                "mild", "moderate", "left", "right", "lower", "upper", "back", "knee", "hand", "wrist", "shoulder",
+                "therapy", "session", "week", "month", "daily", "hours", "duty", "light", "full", "denied", "approved",
+                "pending", "received", "faxed", "copy", "records", "request", "provider", "nurse", "case", "manager",
+                "adjuster", "carrier", "benefits", "payment", "invoice", "billing", "code", "service", "units",
+                "amount", "total", "balance", "signature", "phone", "fax", "email", "street", "suite", "city", "state"]
+CONTEXT_WINDOW_TOKENS = 200000
+
+
+class StubBedrockRuntime:
+    """invoke_model with latency by input tokens and a context window"""
+
+    def __init__(self, base_sec, per_ktoken_sec):
+        self.base_sec = base_sec
+        self.per_ktoken_sec = per_ktoken_sec
+
+    def invoke_model(self, modelId, body, **kwargs):
+        prompt = json.loads(body)["messages"][0]["content"][0]["text"]
+        tokens = estimate_tokens(prompt)
+        if tokens > CONTEXT_WINDOW_TOKENS:
+            raise ClientError({"Error": {"Code": "ValidationException",
+                                         "Message": "Input is too long for requested model."}}, "InvokeModel")
+        time.sleep(self.base_sec + self.per_ktoken_sec * tokens / 1000)
+        answer = {"content": [{"type": "text", "text": "The answer, from claims/packet."}],
+                  "usage": {"input_tokens": tokens, "output_tokens": 40}}
+        return {"body": io.BytesIO(json.dumps(answer).encode())}
+
+
+def synthetic_document(pages, seed=3):
+    """(rawtext list, page_lines, planted page of each question)"""
+    rng = random.Random(seed + pages)
+    page_texts, planted = [], {}
+    fact_pages = {question: rng.randint(1, pages) for question, _ in QUESTIONS}
+    for page in range(1, pages + 1):
+        lines = [" ".join(rng.choice(WORDS if rng.random() < 0.2 else FILLER_WORDS) for _ in range(rng.randint(4, 10)))
+                 for _ in range(LINES_PER_PAGE)]
+        for question, fact in QUESTIONS:
+            if fact_pages[question] == page:
+                lines.insert(rng.randint(0, len(lines)), fact)
+                planted[question] = page
+        page_texts.append(lines)
+    rawtext = [{"claims/packet": "".join(line + "\n" for lines in page_texts for line in lines)}]
+    return rawtext, [[len(lines) for lines in page_texts]], planted
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[20, 100, 400])
+    parser.add_argument("--top-k", type=int, default=8)
+    parser.add_argument("--base-ms", type=float, default=400.0)
+    parser.add_argument("--per-ktoken-ms", type=float, default=8.0)
+    args = parser.parse_args()
+
+    chatbot = load_lambda("chatbot_lambda")
+    chatbot.CHATBOT_TOP_K = args.top_k
+    bedrock_gateway._clients[("us-west-2", chatbot.os.environ["BEDROCK_ASSUME_ROLE"])] = StubBedrockRuntime(
+        args.base_ms / 1000, args.per_ktoken_ms / 1000)
+    dashboard = {"docid": "DOC-1", "classification": "ClaimForm", "extraction_status": "Completed"}
+
+    print(f"{'pages':>5} {'mode':>9} {'tokens/question':>15} {'p50 s':>6} {'max s':>6} {'answered':>8} "
+          f"{'fact kept':>9} {'page cited':>10}")
+    for pages in args.pages:
+        rawtext, page_lines, planted = synthetic_document(pages)
+        start = time.perf_counter()
+        stored = chunk_index.dumps(chunk_index.build_index(rawtext, page_lines))
+        build_sec = time.perf_counter() - start
+        start = time.perf_counter()
+        index = chunk_index.loads(stored)
+        load_sec = time.perf_counter() - start
+        for mode in ("full", "retrieval"):
+            tokens, latencies, answered, kept, cited = [], [], 0, 0, 0
+            for question, fact in QUESTIONS:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    if mode == "full":
+                        context = str(rawtext) + str(dashboard)
+                    else:
+                        context = chatbot.retrieval_context(index, question, "") + "\n\n" + str(dashboard)
+                    start = time.perf_counter()
+                    answer = chatbot.prep_query_response(question, "", context)
+                latencies.append(time.perf_counter() - start)
+                tokens.append(estimate_tokens(context))
+                answered += answer.startswith("The answer")
+                kept += fact in context
+                cited += mode == "full" or f"page {planted[question]}]" in context or (
+                    f"-{planted[question]}]" in context or f"pages {planted[question]}-" in context)
+            print(f"{pages:>5} {mode:>9} {int(statistics.mean(tokens)):>15} {statistics.median(latencies):>6.2f} "
+                  f"{max(latencies):>6.2f} {answered:>5}/{len(QUESTIONS):<2} {kept:>6}/{len(QUESTIONS):<2} "
+                  + (f"{cited:>7}/{len(QUESTIONS):<2}" if mode == "retrieval" else f"{'-':>10}"))
+        start = time.perf_counter()
+        for question, _ in QUESTIONS:
+            chunk_index.search(index, question, args.top_k)
+        search_ms = (time.perf_counter() - start) * 1000 / len(QUESTIONS)
+        print(f"{'':>5} index: {len(index['chunks'])} chunks, built in {build_sec:.2f} s, loaded in {load_sec:.2f} s, "
+              f"{len(stored) / 1024:.0f} KB stored ({len(str(rawtext)) / 1024:.0f} KB raw text), "
+              f"{search_ms:.1f} ms per search\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Chatbot time to first token and time to the whole answer, blocking vs streamed.
+
+Asks --questions questions about a stored document through chatbot_lambda against moto
+tables and a local stand-in for bedrock-runtime that starts answering after a latency
+growing with the input tokens and then generates --answer-tokens tokens at --tokens-per-sec.
+"blocking" is lambda_handler (invoke_model, the client sees nothing until it returns);
+"streamed" is websocket_handler (invoke_model_with_response_stream, answer pieces posted
+to a recording stand-in for the API Gateway connection as they arrive).
+
+Reports p50/p99 of the time until the client sees the first text and the whole answer,
+the WebSocket messages per answer, and whether the saved chat history holds every answer.
+
+Usage:
+    python bench_chat_streaming.py [--questions 20] [--answer-tokens 300] [--tokens-per-sec 120]
+"""
+import argparse
+import contextlib
+import io
+import json
+import statistics
+import time
+
+from bench_env import aws_env, create_pipeline_tables, load_lambda
+from bench_chat_history import create_history_tables
+
+import bedrock_gateway
+from prompt_budget import estimate_tokens
+
+WORD = "claim "
+
+
+class StubBedrockRuntime:
+    """invoke_model / invoke_model_with_response_stream with Claude-like timing"""
+
+    def __init__(self, answer_tokens, tokens_per_sec, base_sec=0.35, per_ktoken_sec=0.01):
+        self.answer_tokens, self.tokens_per_sec = answer_tokens, tokens_per_sec
+        self.base_sec, self.per_ktoken_sec = base_sec, per_ktoken_sec
+
+    def _first_token_delay(self, body):
+        prompt = json.loads(body)["messages"][0]["content"][0]["text"]
+        return estimate_tokens(prompt), self.base_sec + self.per_ktoken_sec * estimate_tokens(prompt) / 1000
+
+    def invoke_model(self, modelId, body, **kwargs):
+        tokens, delay = self._first_token_delay(body)
+        time.sleep(delay + self.answer_tokens / self.tokens_per_sec)
+        answer = {"content": [{"type": "text", "text": WORD * self.answer_tokens}],
+                  "usage": {"input_tokens": tokens, "output_tokens": self.answer_tokens}}
+        return {"body": io.BytesIO(json.dumps(answer).encode())}
+
+    def invoke_model_with_response_stream(self, modelId, body, **kwargs):
+        tokens, delay = self._first_token_delay(body)
+
+        def events():
+            time.sleep(delay)
+            yield {"chunk": {"bytes": json.dumps({"type": "message_start",
+                                                  "message": {"usage": {"input_tokens": tokens}}}).encode()}}
+            for _ in range(self.answer_tokens):
+                time.sleep(1 / self.tokens_per_sec)
+                yield {"chunk": {"bytes": json.dumps({"type": "content_block_delta",
+                                                      "delta": {"type": "text_delta", "text": WORD}}).encode()}}
+            yield {"chunk": {"bytes": json.dumps({"type": "message_delta",
+                                                  "usage": {"output_tokens": self.answer_tokens}}).encode()}}
+        return {"body": events()}
+
+
+class RecordingConnection:
+    """post_to_connection stand-in recording when each message reaches the client"""
+
+    def __init__(self):
+        self.messages = []
+
+    def post_to_connection(self, ConnectionId, Data):
+        self.messages.append((time.perf_counter(), json.loads(Data)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=20)
+    parser.add_argument("--answer-tokens", type=int, default=300)
+    parser.add_argument("--tokens-per-sec", type=float, default=120.0)
+    parser.add_argument("--document-pages", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'mode':>9} {'first text p50':>14} {'p99':>6} {'whole answer p50':>16} {'p99':>6} "
+          f"{'messages/answer':>15} {'history saved':>13}")
+    for mode in ("blocking", "streamed"):
+        with aws_env() as aws:
+            create_pipeline_tables(aws["dynamodb"])
+            create_history_tables(aws["dynamodb"])
+            chatbot = load_lambda("chatbot_lambda")
+            chatbot.dynamodb_resource = aws["dynamodb"]
+            chatbot.chat_history.dynamodb_resource = aws["dynamodb"]
+            chatbot.CHAT_HISTORY_STORE = "keyed"
+            chatbot.chat_history.CHAT_HISTORY_WINDOW = args.questions
+            bedrock_gateway._clients[("us-west-2", chatbot.os.environ["BEDROCK_ASSUME_ROLE"])] = StubBedrockRuntime(
+                args.answer_tokens, args.tokens_per_sec)
+            connection = RecordingConnection()
+            chatbot.connection_clients["https://chat.example/prod"] = connection
+            rawtext = [{"claims/packet.pdf": "Claim form line of text\n" * (45 * args.document_pages)}]
+            aws["dynamodb"].Table("nmm-doc-extraction").put_item(Item={
+                "docid": "DOC-1", "document_name": ["claims/packet.pdf"], "extracted_entities": "{}",
+                "rawtext": str(rawtext)})
+            aws["dynamodb"].Table("nmm-dashboard").put_item(Item={"docid": "DOC-1", "classification": "ClaimForm"})
+
+            first_text, whole_answer, message_counts = [], [], []
+            for number in range(args.questions):
+                question = {"docid": "DOC-1", "userid": "u1", "sessionid": "s1",
+                            "userquery": f"Question {number} about the claim?"}
+                connection.messages.clear()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    start = time.perf_counter()
+                    if mode == "blocking":
+                        chatbot.lambda_handler({"body": json.dumps(question)}, None)
+                        done = time.perf_counter() - start
+                        first_text.append(done)
+                        whole_answer.append(done)
+                    else:
+                        chatbot.websocket_handler({"requestContext": {
+                            "routeKey": "ask", "connectionId": "c1", "domainName": "chat.example", "stage": "prod"},
+                            "body": json.dumps(question)}, None)
+                        first_text.append(connection.messages[0][0] - start)
+                        whole_answer.append(connection.messages[-1][0] - start)
+                        message_counts.append(len(connection.messages))
+            with contextlib.redirect_stdout(io.StringIO()):
+                history = chatbot.chat_history.load_history("DOC-1", "u1", "s1")
+            saved = sum(1 for turn in history["turns"] if turn["answer"] == WORD * args.answer_tokens)
+
+            def p99(values):
+                return sorted(values)[int(0.99 * (len(values) - 1))]
+            print(f"{mode:>9} {statistics.median(first_text):>13.2f}s {p99(first_text):>5.2f}s "
+                  f"{statistics.median(whole_answer):>15.2f}s {p99(whole_answer):>5.2f}s "
+                  f"{(statistics.mean(message_counts) if message_counts else 1):>15.1f} "
+                  f"{saved:>9}/{args.questions}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Wall time of confidence scoring with sequential vs concurrent, adaptively sized batches.
+
+A local stand-in for bedrock-runtime answers the scoring prompts of
+score_entity_confidence with a fixed score per field name after a latency that grows
+with the fields in the batch (output tokens) and the prompt length (input tokens), with
+random jitter so calls finish out of order. "before" is the old loop: fixed batches of
+--batch-size scored one after the other. "concurrent" uses plan_batches and the thread
+pool. The last column checks the scored entity tree is identical to the sequential one.
+
+Usage:
+    python bench_confidence_batches.py [--fields 10 40 120] [--text-tokens 2000 30000 150000]
+"""
+import argparse
+import contextlib
+import copy
+import io
+import json
+import random
+import re
+import time
+import zlib
+
+import bench_env  # noqa: F401 - fake credentials and the common layer on sys.path
+from bench_env import load_lambda
+
+import bedrock_gateway
+
+REGION = "us-east-1"
+MODEL_ID = "anthropic.claude-3-5-sonnet-20240620-v1:0"
+FIELD_LINE_RE = re.compile(r"^- ([^:\n]+): ", re.MULTILINE)
+
+
+class StubBedrockRuntime:
+    """invoke_model answering confidence prompts, slower for more fields and longer prompts"""
+
+    def __init__(self, base_sec, per_field_sec, per_ktoken_sec):
+        self.base_sec = base_sec
+        self.per_field_sec = per_field_sec
+        self.per_ktoken_sec = per_ktoken_sec
+        self.input_tokens = 0
+
+    def invoke_model(self, modelId, body, **kwargs):
+        prompt = json.loads(body)["messages"][0]["content"][0]["text"]
+        fields = FIELD_LINE_RE.findall(prompt.split("Extracted Fields:\n", 1)[1])
+        self.input_tokens += len(prompt) // 4
+        time.sleep((self.base_sec + self.per_field_sec * len(fields) + self.per_ktoken_sec * len(prompt) / 4000)
+                   * random.uniform(0.85, 1.15))
+        scores = {field: (zlib.crc32(field.encode()) % 100) / 100 for field in fields}
+        answer = {"content": [{"type": "text", "text": json.dumps(scores)}],
+                  "usage": {"input_tokens": len(prompt) // 4, "output_tokens": 8 * len(fields)}}
+        return {"body": io.BytesIO(json.dumps(answer).encode())}
+
+
+def synthetic_entities(field_count):
+    """extracted_entities with field_count fields spread over sections, like the stored tree"""
+    entities = {}
+    for index in range(field_count):
+        section = entities.setdefault(f"section_{index % 6}", {})
+        section[f"field_{index}"] = {"value": f"value {index}", "confidence": ""}
+    return entities
+
+
+def sequential_plan(batch_size):
+    def plan(fields, text, _batch_size):
+        return [fields[i:i + batch_size] for i in range(0, len(fields), batch_size)], 1
+    return plan
+
+
+def run(utils, plan, stub, text, field_count, batch_size):
+    utils.plan_batches = plan
+    stub.input_tokens = 0
+    entities = synthetic_entities(field_count)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        scored = utils.score_entity_confidence(text, copy.deepcopy(entities), "sonnet", MODEL_ID, REGION, batch_size)
+    return time.perf_counter() - start, stub.input_tokens, scored
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fields", type=int, nargs="+", default=[10, 40, 120])
+    parser.add_argument("--text-tokens", type=int, nargs="+", default=[2000, 30000, 150000])
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--base-ms", type=float, default=800.0)
+    parser.add_argument("--per-field-ms", type=float, default=150.0)
+    parser.add_argument("--per-ktoken-ms", type=float, default=15.0)
+    args = parser.parse_args()
+
+    utils = load_lambda("confidence_score_lambda", "utils")
+    adaptive_plan = utils.plan_batches
+    stub = StubBedrockRuntime(args.base_ms / 1000, args.per_field_ms / 1000, args.per_ktoken_ms / 1000)
+    bedrock_gateway._clients[(REGION, None)] = stub
+    random.seed(7)
+
+    print(f"{'fields':>6} {'text tok':>8} {'batches':>7} {'workers':>7} {'before s':>8} {'concurrent s':>12} "
+          f"{'speedup':>7} {'in tok before':>13} {'in tok after':>12} {'same tree':>9}")
+    for text_tokens in args.text_tokens:
+        text = ("Employee reported lower back strain while lifting boxes. " * (text_tokens * 4 // 58 + 1))[:text_tokens * 4]
+        for field_count in args.fields:
+            with contextlib.redirect_stdout(io.StringIO()):
+                fields = utils.extract_fields_for_scoring(synthetic_entities(field_count))
+            batches, workers = adaptive_plan(fields, text, args.batch_size)
+            before, before_tokens, expected = run(utils, sequential_plan(args.batch_size), stub, text, field_count,
+                                                  args.batch_size)
+            after, after_tokens, scored = run(utils, adaptive_plan, stub, text, field_count, args.batch_size)
+            print(f"{field_count:>6} {text_tokens:>8} {len(batches):>7} {workers:>7} {before:>8.2f} {after:>12.2f} "
+                  f"{before / after:>6.1f}x {before_tokens:>13} {after_tokens:>12} {str(scored == expected):>9}")
+    utils.plan_batches = adaptive_plan
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Exercise the content-hash dedup cache of document_extraction_lambda.
+
+Uploads --unique distinct files to a moto S3 bucket and submits each of them
+--copies times under new docids. The first copy of each file is extracted
+through StubTextract and its LLM stages are marked complete; every later copy
+should be a cache hit that starts no Textract job and queues nothing for
+classification. Reports Textract jobs, queued messages, hit/miss metrics and the
+per-document handler time for misses vs hits.
+
+Usage:
+    pip install -r requirements.txt
+    python bench_dedup_cache.py [--unique 3] [--copies 4]
+"""
+import argparse
+import contextlib
+import io
+import json
+import statistics
+import time
+import uuid
+
+from bench_env import aws_env, create_pipeline_tables, create_pipeline_queues, load_lambda
+from textract_stub import StubTextract, synthetic_analysis_blocks
+
+
+def submit(extraction, docid, s3filename):
+    body = {"indexid": "IN" + docid, "docid": docid, "s3filename": s3filename, "source": "ManualUpload"}
+    out = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(out):
+        result = extraction.lambda_handler({"Records": [{"messageId": uuid.uuid4().hex, "body": json.dumps(body)}]}, None)
+    elapsed = time.perf_counter() - start
+    assert not result["batchItemFailures"], out.getvalue()[-2000:]
+    return elapsed, out.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--unique", type=int, default=3)
+    parser.add_argument("--copies", type=int, default=4)
+    parser.add_argument("--pages", type=int, default=5)
+    args = parser.parse_args()
+
+    with aws_env() as aws:
+        create_pipeline_tables(aws["dynamodb"])
+        queues = create_pipeline_queues(aws["sqs"])
+        extraction = load_lambda("document_extraction_lambda")
+        extraction.dynamodb_resource = aws["dynamodb"]
+        extraction.sqs = aws["sqs"]
+        extraction.DEDUP_CACHE_ENABLED = True
+        aws["s3"].create_bucket(Bucket=extraction.s3bkt)
+        blocks = synthetic_analysis_blocks(pages=args.pages)
+        stub = StubTextract(blocks_for=lambda name: blocks, auto_complete=True)
+        extraction.textract = stub
+        dashboard = aws["dynamodb"].Table("nmm-dashboard")
+
+        timings = {"miss": [], "hit": []}
+        metrics = {"DedupCacheHit": 0, "DedupCacheMiss": 0}
+        for copy in range(args.copies):
+            for n in range(args.unique):
+                s3filename = f"claims/upload-{n}-{copy}.pdf"
+                aws["s3"].put_object(Bucket=extraction.s3bkt, Key=s3filename, Body=f"%PDF-1.7 claim packet {n}".encode() * 5000)
+                docid = f"DOC{n}-{copy}"
+                elapsed, output = submit(extraction, docid, s3filename)
+                for line in output.splitlines():
+                    if line.startswith('{"_aws"'):
+                        for name in metrics:
+                            metrics[name] += json.loads(line).get(name, 0)
+                timings["miss" if copy == 0 else "hit"].append(elapsed)
+                if copy == 0:
+                    # Stand in for classification / entity extraction finishing on the first upload
+                    dashboard.update_item(Key={"docid": docid},
+                                          UpdateExpression="SET classification_status = :c, entity_extraction_status = :c, classification = :t",
+                                          ExpressionAttributeValues={":c": "Completed", ":t": "ClaimForm"})
+                else:
+                    item = dashboard.get_item(Key={"docid": docid})["Item"]
+                    assert item["dedup_source_docid"] == f"DOC{n}-0" and item["classification"] == "ClaimForm", item
+
+        queued = aws["sqs"].get_queue_attributes(QueueUrl=queues["NMM_DocProcessingAfterExtractionQueueNew"],
+                                                 AttributeNames=["ApproximateNumberOfMessages"])["Attributes"]
+        print(f"documents submitted    {args.unique * args.copies}")
+        print(f"Textract jobs started  {stub.calls['start_document_analysis']}")
+        print(f"queued for LLM stages  {queued['ApproximateNumberOfMessages']}")
+        print(f"cache hits / misses    {metrics['DedupCacheHit']} / {metrics['DedupCacheMiss']}")
+        print(f"median handler ms      miss {statistics.median(timings['miss']) * 1000:.1f}, "
+              f"hit {statistics.median(timings['hit']) * 1000:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Shared setup for the offline benchmarks: fake credentials, moto-backed tables and
+queues named like the real ones, and loading lambda modules by directory.
+"""
+import contextlib
+import importlib.util
+import os
+import sys
+
+import boto3
+
+try:
+    from moto import mock_aws
+except ImportError:  # moto < 5
+    from moto import mock_dynamodb as mock_aws
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+LAMBDAS_DIR = os.path.join(BENCH_DIR, "..", "lambdas")
+COMMON_LAYER_DIR = os.path.join(LAMBDAS_DIR, "common_layer", "python")
+
+# The lambdas hard-code queue URLs in this account
+ACCOUNT_ID = "040504913362"
+
+DOCID_TABLES = ["nmm-doc-extraction", "nmm-dashboard", "doc-extraction", "dashboard"]
+OTHER_TABLES = {"nmm-doc-dedup-cache": "content_sha256"}
+QUEUES = ["NMMDocProcessingQueue", "NMM_DocProcessingAfterExtractionQueueNew", "NMM_EntityExtractionQueue",
+          "NMM_ConfidenceScoreQueue"]
+
+if COMMON_LAYER_DIR not in sys.path:
+    sys.path.append(COMMON_LAYER_DIR)
+
+# Set before any lambda or layer module creates its module-level clients
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("AWS_REGION", "us-east-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+os.environ["MOTO_ACCOUNT_ID"] = ACCOUNT_ID
+
+
+@contextlib.contextmanager
+def aws_env():
+    """moto for every AWS service, yielding a resource/client bundle"""
+    with mock_aws():
+        yield {
+            "dynamodb": boto3.resource("dynamodb", region_name="us-east-1"),
+            "sqs": boto3.client("sqs", region_name="us-east-1"),
+            "s3": boto3.client("s3", region_name="us-east-1"),
+        }
+
+
+def create_pipeline_tables(dynamodb):
+    """Create the pipeline tables (all keyed by a single string hash key)"""
+    tables = {name: "docid" for name in DOCID_TABLES}
+    tables.update(OTHER_TABLES)
+    for name, hash_key in tables.items():
+        dynamodb.create_table(
+            TableName=name,
+            KeySchema=[{"AttributeName": hash_key, "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": hash_key, "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST",
+        )
+
+
+def create_pipeline_queues(sqs):
+    """Create the SQS queues the lambdas send to, returning {name: url}"""
+    return {name: sqs.create_queue(QueueName=name)["QueueUrl"] for name in QUEUES}
+
+
+def load_lambda(directory, module_name="lambda_function"):
+    """
+    Import a lambda module from backend-aws-services/lambdas/<directory>
+
+    Every lambda names its handler module lambda_function.py, so the module is registered
+    under "<directory>.<module_name>" to keep several lambdas loadable side by side.
+    """
+    lambda_dir = os.path.join(LAMBDAS_DIR, directory)
+    qualified_name = f"{directory}.{module_name}"
+    if qualified_name in sys.modules:
+        return sys.modules[qualified_name]
+    sys.path.insert(0, lambda_dir)
+    try:
+        spec = importlib.util.spec_from_file_location(qualified_name, os.path.join(lambda_dir, module_name + ".py"))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[qualified_name] = module
+        spec.loader.exec_module(module)
+    finally:
+        sys.path.remove(lambda_dir)
+    return module
@@ -0,0 +1,85 @@
+"""
+Benchmark inline vs S3-offloaded extraction payloads (extraction_payloads.py).
+
+Saves the extraction of synthetic documents through document_extraction_lambda's
+save_docs_extract with EXTRACTION_PAYLOAD_STORAGE=dynamodb and =s3, then reads it
+back through document_classification_lambda's get_docs_extract. Reports the
+nmm-doc-extraction item size, the read capacity one eventually consistent get_item
+costs (moto does not meter it, so it is computed from the item size), the gzip
+size in S3 and cold/warm read times under moto. Items over 400 KB cannot be
+saved inline at all.
+
+Usage:
+    pip install -r requirements.txt
+    python bench_extraction_payloads.py [--pages 5 50 400]
+"""
+import argparse
+import contextlib
+import io
+import math
+import time
+
+from bench_env import aws_env, create_pipeline_tables, load_lambda
+from textract_stub import paginate_blocks, synthetic_analysis_blocks
+
+import extraction_payloads
+
+
+def item_size(value):
+    """Approximate DynamoDB item size in bytes (names + values)"""
+    if isinstance(value, dict):
+        return sum(len(k.encode('utf-8')) + item_size(v) for k, v in value.items()) + 3
+    if isinstance(value, (list, tuple)):
+        return sum(item_size(v) for v in value) + 3
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    return 21  # numbers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[5, 50, 400])
+    args = parser.parse_args()
+
+    with aws_env() as aws:
+        create_pipeline_tables(aws["dynamodb"])
+        aws["s3"].create_bucket(Bucket=extraction_payloads.PAYLOAD_BUCKET)
+        extraction = load_lambda("document_extraction_lambda")
+        classification = load_lambda("document_classification_lambda", "utility")
+        extraction.dynamodb_resource = aws["dynamodb"]
+        classification.dynamodb_resource = aws["dynamodb"]
+        table = aws["dynamodb"].Table("nmm-doc-extraction")
+
+        print(f"{'pages':>6} {'storage':>9} {'item KB':>8} {'RCU/read':>9} {'S3 KB':>7} {'cold ms':>8} {'warm ms':>8}")
+        for pages in args.pages:
+            with contextlib.redirect_stdout(io.StringIO()):
+                tblcont, rawtext, keyvaluesText = extraction.parse_textract_stream(
+                    paginate_blocks(synthetic_analysis_blocks(pages=pages)))
+            for storage in ["dynamodb", "s3"]:
+                docid = f"DOC-{pages}-{storage}"
+                extraction_payloads.PAYLOAD_STORAGE = storage
+                extraction_payloads.payload_cache.__init__(extraction_payloads.CACHE_MAX_BYTES)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    saveres = extraction.save_docs_extract(docid, "IN1", ["doc.pdf"], str([{"doc": rawtext}]),
+                                                           str([{"doc": keyvaluesText}]), str([{"doc": tblcont}]), "ManualUpload")
+                if saveres != 'Saved successfully to DynamoDB':
+                    print(f"{pages:>6} {storage:>9}  {saveres} (likely over the 400 KB item limit)")
+                    continue
+                item = table.get_item(Key={"docid": docid})["Item"]
+                size = item_size(item)
+                stored = sum(ref["stored_size"] for ref in item.get("payload_refs", {}).values())
+                # Warm the cache with a fresh read (the writer already cached its own payloads)
+                extraction_payloads.payload_cache.__init__(extraction_payloads.CACHE_MAX_BYTES)
+                timings = []
+                for _ in range(2):
+                    start = time.perf_counter()
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        loaded = classification.get_docs_extract(docid)["Item"]
+                    timings.append((time.perf_counter() - start) * 1000)
+                    assert loaded["rawtext"] == str([{"doc": rawtext}])
+                rcu = math.ceil(size / 4096) * 0.5
+                print(f"{pages:>6} {storage:>9} {size / 1024:>8.1f} {rcu:>9.1f} {stored / 1024:>7.1f} {timings[0]:>8.1f} {timings[1]:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
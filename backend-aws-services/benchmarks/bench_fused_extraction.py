@@ -0,0 +1,193 @@
+"""
+Bedrock calls, tokens and latency of classification + entity extraction, two steps vs fused.
+
+Builds --docs synthetic documents of 2-12 pages (Textract-like filler lines and form
+key-values) over the seven types with an entity template, stores them in moto's
+nmm-doc-extraction and runs each through document_classification_lambda and
+entityextraction_lambda with stage_handoff.LocalRunner, up to a stand-in confidence score
+stage. Every --ambiguous-every th document shows the titles of two types.
+
+A local stand-in for bedrock-runtime answers from the prompt: the type from the document's
+title line (two titles: the first one, with confidence 0.6 in a fused answer), and for an
+extraction prompt one value per field of the template it is shown. It answers after a
+latency that grows with the input and output tokens. Latencies are added up, not slept.
+
+Reports per CLASSIFY_EXTRACT_MODE the Bedrock calls, input and output tokens and modeled
+Bedrock seconds per document, the documents that fell back to two steps, and how many
+documents reached confidence scoring with the right type and their entities stored.
+
+Usage:
+    python bench_fused_extraction.py [--docs 60] [--ambiguous-every 5]
+"""
+import argparse
+import contextlib
+import io
+import json
+import random
+import re
+import threading
+import time
+
+from bench_env import aws_env, create_pipeline_tables, load_lambda
+from bench_chat_retrieval import FILLER_WORDS, LINES_PER_PAGE
+from textract_stub import WORDS
+
+import bedrock_gateway
+import stage_handoff
+from entity_templates import DOCUMENT_TYPES, template_for
+from prompt_budget import estimate_tokens
+
+TYPES = [doc_type for doc_type in DOCUMENT_TYPES if template_for(doc_type)]
+TITLES = {
+    "MedicalReport": "MEDICAL REPORT - OFFICE VISIT NOTE",
+    "ClaimForm": "EMPLOYER'S FIRST REPORT OF INJURY - CLAIM FORM",
+    "DoctorReportMMI": "MAXIMUM MEDICAL IMPROVEMENT - DOCTOR REPORT",
+    "PhysicalTherapy": "PHYSICAL THERAPY PROGRESS NOTE",
+    "Prescription": "PRESCRIPTION - PHARMACY ORDER",
+    "CMS1500": "HEALTH INSURANCE CLAIM FORM CMS-1500",
+    "Legal": "NOTICE OF HEARING - WORKERS' COMPENSATION ADMINISTRATION",
+}
+TYPE_OF_TITLE = {title: doc_type for doc_type, title in TITLES.items()}
+TITLE_RE = re.compile("|".join(re.escape(title) for title in TITLES.values()))
+FIELD_RE = re.compile(r'"(\w+)":\s*\{\s*"value"')
+
+
+class StubBedrockRuntime:
+    """invoke_model that classifies by title line and fills the template fields, with Claude-like timing"""
+
+    def __init__(self, base_sec, per_ktoken_sec, tokens_per_sec):
+        self.base_sec, self.per_ktoken_sec, self.tokens_per_sec = base_sec, per_ktoken_sec, tokens_per_sec
+        self.calls = self.input_tokens = self.output_tokens = 0
+        self.seconds = 0.0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def entities(template):
+        fields = dict.fromkeys(FIELD_RE.findall(template))
+        return {"document_section": {field: {"value": f"{field} value", "confidence": "0.9"} for field in fields}}
+
+    def answer(self, prompt):
+        document = prompt.split("<raw_text>", 1)[-1].split("</raw_text>", 1)[0]
+        titles = list(dict.fromkeys(TITLE_RE.findall(document)))
+        doc_type = TYPE_OF_TITLE[titles[0]] if titles else "Unidentified Type"
+        if "<template type=" in prompt:
+            confidence = 0.95 if len(titles) == 1 else 0.6
+            template = re.search(f'<template type="{doc_type}">(.*?)</template>', prompt, re.S)
+            entities = self.entities(template.group(1)) if template and confidence >= 0.8 else {}
+            return {"classification_type": doc_type, "classification_confidence": confidence, "entities": entities}
+        if "identify the Classification Type" in prompt:
+            return {"classification_type": doc_type}
+        return self.entities(prompt.split("</table_text>", 1)[-1])
+
+    def invoke_model(self, modelId, body, **kwargs):
+        prompt = json.loads(body)["messages"][0]["content"][0]["text"]
+        text = json.dumps(self.answer(prompt))
+        tokens, output_tokens = estimate_tokens(prompt), estimate_tokens(text)
+        with self.lock:
+            self.calls += 1
+            self.input_tokens += tokens
+            self.output_tokens += output_tokens
+            self.seconds += self.base_sec + self.per_ktoken_sec * tokens / 1000 + output_tokens / self.tokens_per_sec
+        answer = {"content": [{"type": "text", "text": text}],
+                  "usage": {"input_tokens": tokens, "output_tokens": output_tokens}}
+        return {"body": io.BytesIO(json.dumps(answer).encode())}
+
+
+class StubComprehend:
+    def detect_dominant_language(self, Text):
+        return {"Languages": [{"LanguageCode": "en", "Score": 0.99}]}
+
+
+def synthetic_documents(count, ambiguous_every, seed=11):
+    """[(docid, type, titles, rawtext, keyvaluesText)]"""
+    rng = random.Random(seed)
+    documents = []
+    for number in range(count):
+        doc_type = TYPES[number % len(TYPES)]
+        titles = [TITLES[doc_type]]
+        if ambiguous_every and number % ambiguous_every == ambiguous_every - 1:
+            titles.append(TITLES[TYPES[(number + 3) % len(TYPES)]])
+        name = f"claims/doc-{number}.pdf"
+        lines = list(titles)
+        for _ in range(rng.randint(2, 12) * LINES_PER_PAGE):
+            lines.append(" ".join(rng.choice(WORDS if rng.random() < 0.2 else FILLER_WORDS)
+                                  for _ in range(rng.randint(4, 10))))
+        keyvalues = [f"Key: Claim Number, Value: WC-{rng.randint(100000, 999999)}",
+                     f"Key: Date of Injury, Value: 0{rng.randint(1, 9)}/1{rng.randint(0, 9)}/2024"]
+        documents.append((f"DOC-{number:03d}", doc_type, titles, [{name: "\n".join(lines)}], [{name: keyvalues}]))
+    return documents
+
+
+def run_mode(mode, documents, classification, entity, stub):
+    classification.CLASSIFY_EXTRACT_MODE = mode
+    reached = []
+
+    def confidence_score(event, context):
+        reached.append(json.loads(event['Records'][0]['body'])['docid'])
+        return {'batchItemFailures': []}
+
+    handlers = {"classification": classification.lambda_handler, "entity_extraction": entity.lambda_handler,
+                "confidence_score": confidence_score}
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        start = time.perf_counter()
+        with stage_handoff.LocalRunner(handlers) as runner:
+            for docid, *_ in documents:
+                runner.submit("classification", {"docid": docid, "indexid": "IN" + docid,
+                                                 "s3filename": f"claims/{docid}.pdf"})
+            runner.run()
+        wall = time.perf_counter() - start
+    fallbacks = output.getvalue().count('"FusedFallback": 1')
+    return reached, fallbacks, wall
+
+
+def check(dynamodb, documents, reached):
+    """Documents that reached confidence scoring with the type of their first title and entities"""
+    table = dynamodb.Table("nmm-doc-extraction")
+    good = 0
+    for docid, doc_type, titles, _, _ in documents:
+        item = table.get_item(Key={"docid": docid}).get("Item", {})
+        if docid in reached and item.get("classification") == TYPE_OF_TITLE[titles[0]] and item.get("extracted_entities"):
+            good += 1
+    return good
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=60)
+    parser.add_argument("--ambiguous-every", type=int, default=5)
+    parser.add_argument("--base-ms", type=float, default=400.0)
+    parser.add_argument("--per-ktoken-ms", type=float, default=8.0)
+    parser.add_argument("--tokens-per-sec", type=float, default=120.0)
+    args = parser.parse_args()
+
+    documents = synthetic_documents(args.docs, args.ambiguous_every)
+    print(f"{args.docs} documents, {sum(len(titles) > 1 for _, _, titles, _, _ in documents)} with two titles")
+    print(f"{'mode':>9} {'calls/doc':>10} {'input tok/doc':>14} {'output tok/doc':>15} {'Bedrock s/doc':>14} "
+          f"{'fallbacks':>10} {'complete':>9} {'run s':>6}")
+    for mode in ("two_step", "fused"):
+        with aws_env() as aws:
+            create_pipeline_tables(aws["dynamodb"])
+            with contextlib.redirect_stdout(io.StringIO()):
+                classification = load_lambda("document_classification_lambda")
+                entity = load_lambda("entityextraction_lambda", "entity_lambda_function")
+            classification.comprehend_client = StubComprehend()
+            stage_handoff.STAGE_HANDOFF = "sqs"  # unused - the LocalRunner takes every hand-off
+            stub = StubBedrockRuntime(args.base_ms / 1000, args.per_ktoken_ms / 1000, args.tokens_per_sec)
+            bedrock_gateway._clients.clear()
+            for region in ("us-east-1", "us-west-2"):
+                bedrock_gateway._clients[(region, None)] = stub
+            for docid, _, _, rawtext, keyvalues in documents:
+                aws["dynamodb"].Table("nmm-doc-extraction").put_item(Item={
+                    "docid": docid, "document_name": [name for entry in rawtext for name in entry],
+                    "rawtext": str(rawtext), "keyvaluesText": str(keyvalues), "tbltxt": str([])})
+            reached, fallbacks, wall = run_mode(mode, documents, classification, entity, stub)
+            complete = check(aws["dynamodb"], documents, reached)
+        docs = len(documents)
+        print(f"{mode:>9} {stub.calls / docs:>10.2f} {stub.input_tokens / docs:>14.0f} "
+              f"{stub.output_tokens / docs:>15.0f} {stub.seconds / docs:>14.2f} {fallbacks:>10} "
+              f"{complete:>4}/{docs:<4} {wall:>6.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+Share of fields resolved by the local evidence scorer and how its scores track the LLM's.
+
+Builds synthetic claim documents in the stored nmm-doc-extraction format (str() of
+per-file lists, Textract filler text, "Key: ..., Value: ..." form fields) with extracted
+values of known kinds: written verbatim, dates in another format, identifiers with
+other separators, OCR misreads, paraphrases the text only implies, and wrong values
+(not in the text, a neighbouring date, or another field's value - written in the text
+under that field's label). A stand-in LLM scores explicit support high,
+paraphrases mid and wrong values low, with noise.
+
+Per threshold it reports the share of fields the local scorer resolves (no LLM call),
+how many of those are wrong values (false accepts), the mean absolute difference to the
+stand-in LLM score on resolved fields, and the Pearson correlation of local and LLM
+scores over all fields, plus the local scoring time per document.
+
+Usage:
+    python bench_local_scorer.py [--docs 200] [--fields 20] [--pages 20]
+"""
+import argparse
+import random
+import time
+
+from bench_env import load_lambda
+from textract_stub import WORDS
+
+FIELDS = [
+    ("employee_name", "Employee Name", "name"), ("date_of_injury", "Date of Injury", "date"),
+    ("claim_administrator_claim_number", "Claim Administrator Claim Number", "identifier"),
+    ("wcb_case_number_jcn", "WCB Case Number JCN", "identifier"), ("date_of_birth", "Date of Birth", "date"),
+    ("city", "City", "city"), ("postal_code", "Postal Code", "postal"), ("insurer_name", "Insurer Name", "insurer"),
+    ("nature_of_injury", "Nature of Injury", "injury"), ("part_of_body", "Part of Body", "body"),
+    ("policy_number_id", "Policy Number", "identifier"), ("initial_return_to_work_date", "Return to Work Date", "date"),
+    ("employer_name", "Employer Name", "employer"), ("mailing_address", "Mailing Address", "address"),
+]
+FIRST = ["Maria", "James", "Aiyana", "Robert", "Lucia", "Daniel", "Grace", "Tomas"]
+LAST = ["Lopez", "Begay", "Johnson", "Martinez", "Chavez", "Nguyen", "Romero", "Baca"]
+CITIES = ["Albuquerque", "Santa Fe", "Las Cruces", "Rio Rancho", "Roswell", "Farmington", "Gallup"]
+INSURERS = ["New Mexico Mutual", "Hartford Casualty", "Travelers Indemnity", "Zenith Insurance"]
+EMPLOYERS = ["Sandia Builders LLC", "Mesa Logistics", "Desert Sun Hospital", "Route 66 Diner"]
+INJURIES = [("lower back strain", "strained the muscles of the lumbar region"),
+            ("left wrist fracture", "broke the bones of the left forearm near the hand"),
+            ("laceration", "deep cut requiring stitches"), ("knee sprain", "twisted the knee ligaments")]
+BODY = [("lower back", "lumbar spine"), ("left wrist", "distal left forearm"), ("right knee", "knee on the right side")]
+STREETS = ["Central Ave", "Montgomery Blvd", "Cerrillos Rd", "Main Street"]
+
+# Share of fields of each kind
+KINDS = [("verbatim", 0.40), ("date_format", 0.12), ("separators", 0.08), ("ocr", 0.08),
+         ("paraphrase", 0.12), ("wrong", 0.10), ("wrong_date", 0.05), ("other_field", 0.05)]
+# Labels of the other fields whose values an "other_field" value is taken from
+OTHER_LABELS = {"date": "Date Received", "name": "Witness", "city": "Branch Office"}
+OCR_SWAPS = {"o": "0", "l": "1", "e": "c", "u": "n", "a": "o", "i": "l", "s": "5"}
+
+
+def true_value(kind, rng):
+    """(value as extracted, text as written) for a field of the given value kind"""
+    if kind == "name":
+        name = f"{rng.choice(FIRST)} {rng.choice(LAST)}"
+        return name, name
+    if kind == "date":
+        year, month, day = rng.randint(1960, 2024), rng.randint(1, 12), rng.randint(1, 28)
+        return f"{month:02d}/{day:02d}/{year}", f"{month:02d}/{day:02d}/{year}"
+    if kind == "identifier":
+        number = f"{rng.choice(['WC', 'CL', 'PN'])}{rng.randint(2015, 2024)}{rng.randint(10000, 99999)}"
+        return number, number
+    if kind == "postal":
+        code = str(rng.randint(87001, 88439))
+        return code, code
+    if kind == "address":
+        address = f"{rng.randint(100, 9999)} {rng.choice(STREETS)}"
+        return address, address
+    choices = {"city": CITIES, "insurer": INSURERS, "employer": EMPLOYERS}
+    if kind in choices:
+        value = rng.choice(choices[kind])
+        return value, value
+    value, paraphrase = rng.choice(INJURIES if kind == "injury" else BODY)
+    return value, value
+
+
+def variant(field_kind, kind, rng):
+    """(kind, extracted value, text to plant, value is supported, stand-in LLM score); verbatim when kind does not apply"""
+    value, written = true_value(field_kind, rng)
+    explicit = rng.uniform(0.85, 1.0)
+    if kind == "date_format" and field_kind == "date":
+        month, day, year = written.split("/")
+        return kind, f"{year}-{month}-{day}", written, True, explicit
+    if kind == "separators" and field_kind in ("identifier", "postal"):
+        written = f"{value[:2]}-{value[2:6]}-{value[6:]}" if field_kind == "identifier" else f"{value[:3]} {value[3:]}"
+        return kind, value, written, True, explicit
+    if kind == "ocr" and len(value) > 6 and field_kind not in ("date", "identifier", "postal"):
+        chars = list(written)
+        position = rng.choice([i for i, char in enumerate(chars) if char.lower() in OCR_SWAPS])
+        chars[position] = OCR_SWAPS[chars[position].lower()]
+        return kind, value, "".join(chars), True, explicit
+    if kind == "paraphrase" and field_kind in ("injury", "body"):
+        value, paraphrase = rng.choice(INJURIES if field_kind == "injury" else BODY)
+        return kind, value, paraphrase, True, rng.uniform(0.5, 0.8)
+    if kind == "wrong":
+        other, _ = true_value(field_kind, rng)
+        if other == value:
+            other = value + " Jr" if field_kind == "name" else "Unknown " + other
+        return kind, other, written, False, rng.uniform(0.0, 0.25)
+    if kind == "other_field" and field_kind in OTHER_LABELS:
+        other, _ = true_value(field_kind, rng)
+        if other == value:
+            return "verbatim", value, written, True, explicit
+        return kind, other, written, False, rng.uniform(0.0, 0.3)
+    if kind == "wrong_date" and field_kind == "date":
+        month, day, year = written.split("/")
+        return kind, f"{month}/{int(day) + 1:02d}/{year}", written, False, rng.uniform(0.0, 0.3)
+    return "verbatim", value, written, True, explicit
+
+
+def synthetic_document(rng, field_count, pages):
+    """(rawtext, keyvaluesText, entities, per field path (kind, supported, llm score))"""
+    lines = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 10))) for _ in range(pages * 45)]
+    key_values, entities, truth = [], {}, {}
+    for name, label, field_kind in rng.sample(FIELDS, min(field_count, len(FIELDS))):
+        kind, value, written, supported, llm_score = variant(field_kind, rng.choices(
+            [k for k, _ in KINDS], weights=[w for _, w in KINDS])[0], rng)
+        lines.insert(rng.randint(0, len(lines)), f"{label}: {written}")
+        if kind == "other_field":
+            lines.insert(rng.randint(0, len(lines)), f"{OTHER_LABELS[field_kind]}: {value}")
+        if rng.random() < 0.5:
+            key_values.append(f"Key: {label}, Value: {written}")
+        section = entities.setdefault(rng.choice(["claim_details", "employee_information", "injury_details"]), {})
+        section[name] = {"value": value, "confidence": ""}
+        truth[f"{next(k for k, v in entities.items() if v is section)}.{name}"] = (kind, supported, llm_score)
+    rawtext = str([{"claims/packet.pdf": "\n".join(lines) + "\n"}])
+    return rawtext, str([{"claims/packet.pdf": key_values}]), entities, truth
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=200)
+    parser.add_argument("--fields", type=int, default=14)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.85, 0.9, 0.95])
+    parser.add_argument("--seed", type=int, default=11)
+    args = parser.parse_args()
+
+    local_scorer = load_lambda("confidence_score_lambda", "local_scorer")
+    utils = load_lambda("confidence_score_lambda", "utils")
+    utils.print = lambda *a, **k: None
+    rng = random.Random(args.seed)
+
+    rows, timings = [], []
+    for _ in range(args.docs):
+        rawtext, key_values, entities, truth = synthetic_document(rng, args.fields, args.pages)
+        fields = utils.extract_fields_for_scoring(entities)
+        start = time.perf_counter()
+        scores = local_scorer.score_fields_locally(fields, rawtext, key_values)
+        timings.append(time.perf_counter() - start)
+        for item, (score, _) in zip(fields, scores):
+            kind, supported, llm_score = truth[item["path"]]
+            rows.append((kind, supported, llm_score, score))
+
+    timings.sort()
+    correlation = local_scorer.pearson([row[3] for row in rows], [row[2] for row in rows])
+    print(f"{args.docs} docs, {len(rows)} fields, {args.pages} pages each; local scoring "
+          f"p50 {timings[len(timings) // 2] * 1000:.1f} ms, p99 {timings[int(0.99 * (len(timings) - 1))] * 1000:.1f} ms "
+          f"per document; correlation with LLM scores {correlation:.3f}\n")
+    print(f"{'threshold':>9} {'resolved':>9} {'false accepts':>13} {'abs diff to LLM':>15}")
+    for threshold in args.thresholds:
+        resolved = [row for row in rows if row[3] >= threshold]
+        false_accepts = sum(1 for row in resolved if not row[1])
+        abs_diff = sum(abs(row[3] - row[2]) for row in resolved) / max(1, len(resolved))
+        print(f"{threshold:>9.2f} {len(resolved) / len(rows):>8.1%} {false_accepts:>13} {abs_diff:>15.3f}")
+
+    print(f"\n{'kind':>11} {'fields':>6} {'resolved at 0.9':>15} {'mean local':>10} {'mean LLM':>8}")
+    for kind, _ in KINDS:
+        of_kind = [row for row in rows if row[0] == kind]
+        if of_kind:
+            print(f"{kind:>11} {len(of_kind):>6} {sum(1 for row in of_kind if row[3] >= 0.9) / len(of_kind):>14.1%} "
+                  f"{sum(row[3] for row in of_kind) / len(of_kind):>10.2f} {sum(row[2] for row in of_kind) / len(of_kind):>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
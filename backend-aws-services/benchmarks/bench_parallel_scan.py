@@ -0,0 +1,95 @@
+"""
+Benchmark dynamo_scan.parallel_scan against a moto-backed DynamoDB table.
+
+Compares 1, 4 and 16 scan segments over the same table. moto answers in-process,
+so --page-latency-ms adds a per-page delay that stands in for the network round
+trip a real DynamoDB page costs - that round trip is what the segments overlap.
+
+Usage:
+    pip install -r requirements.txt
+    python bench_parallel_scan.py [--items 2000] [--page-size 100] [--page-latency-ms 20]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import boto3
+
+try:
+    from moto import mock_aws
+except ImportError:  # moto < 5
+    from moto import mock_dynamodb as mock_aws
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambdas", "common_layer", "python"))
+from dynamo_scan import parallel_scan
+
+SEGMENT_COUNTS = [1, 4, 16]
+
+
+class LatencyTable:
+    """Wraps a Table resource and sleeps before every scan page"""
+
+    def __init__(self, table, latency_sec):
+        self._table = table
+        self._latency_sec = latency_sec
+        self.name = table.name
+
+    def scan(self, **kwargs):
+        time.sleep(self._latency_sec)
+        return self._table.scan(**kwargs)
+
+
+def load_table(dynamodb, item_count):
+    table = dynamodb.create_table(
+        TableName="bench-nmm-doc-extraction",
+        KeySchema=[{"AttributeName": "docid", "KeyType": "HASH"}],
+        AttributeDefinitions=[{"AttributeName": "docid", "AttributeType": "S"}],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    with table.batch_writer() as batch:
+        for i in range(item_count):
+            batch.put_item(Item={
+                "docid": f"DOC{i:07d}",
+                "indexid": f"IN{i % 5000:06d}",
+                "classification": "ClaimForm",
+                "mark_for_review": "Yes" if i % 10 == 0 else "No",
+                "rawtext": "lorem ipsum " * 20,
+            })
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=2000)
+    parser.add_argument("--page-size", type=int, default=100, help="scan Limit, controls the number of pages")
+    parser.add_argument("--page-latency-ms", type=float, default=20.0)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+
+    with mock_aws():
+        dynamodb = boto3.resource("dynamodb", region_name="us-east-1")
+        print(f"Loading {args.items} items...")
+        table = LatencyTable(load_table(dynamodb, args.items), args.page_latency_ms / 1000.0)
+
+        print(f"{'segments':>8} {'items':>8} {'median s':>9} {'items/s':>10} {'speedup':>8}")
+        baseline = None
+        for segments in SEGMENT_COUNTS:
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                items = parallel_scan(table, total_segments=segments, max_workers=segments, Limit=args.page_size)
+                timings.append(time.perf_counter() - start)
+                assert len(items) == args.items, f"expected {args.items} items, got {len(items)}"
+            median = statistics.median(timings)
+            baseline = baseline or median
+            print(f"{segments:>8} {len(items):>8} {median:>9.3f} {len(items) / median:>10.0f} {baseline / median:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
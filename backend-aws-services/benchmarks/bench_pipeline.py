@@ -0,0 +1,442 @@
+"""
+End-to-end throughput of the document pipeline, offline.
+
+Runs --docs uploads through the real handlers of document_extraction_lambda,
+document_classification_lambda, entityextraction_lambda and confidence_score_lambda
+against moto DynamoDB/S3/SQS, wired the way they are deployed with STAGE_HANDOFF=sqs:
+NMMDocProcessingQueue -> extraction -> NMM_DocProcessingAfterExtractionQueueNew ->
+classification -> NMM_EntityExtractionQueue -> entity extraction -> NMM_ConfidenceScoreQueue
+-> confidence scoring. --concurrency poller threads take messages from the four queues
+(later stages first, like event source mappings sharing the account limit) and run the
+function. Then the dashboard readers (history_dashboard_lambda with its parallel scans,
+dashboard_lambda by indexid and by docid, fetch_extracted_entities_lambda) read every document.
+
+Textract and Bedrock are deterministic local stand-ins:
+
+- StubTextract returns synthetic FORMS/TABLES pages of 2-8 pages per document, whose first
+  line is the title of one of the seven templated document types, or the recorded
+  get_document_analysis responses in --textract-recording (one JSON file per document, a
+  list of responses or a block list). Jobs take --textract-job-ms, API calls --textract-api-ms.
+- A bedrock-runtime stand-in classifies by title, fills the template fields and scores every
+  confidence field, or replays the answer recorded for the same prompt (sha256) in
+  --bedrock-recording (JSON lines {"prompt_sha256", "text"}, as written by
+  --save-bedrock-recording). Calls take --bedrock-base-ms + --bedrock-ms-per-ktoken per
+  1000 input tokens + output tokens at --bedrock-tokens-per-sec.
+
+confidence_score_lambda reads the doc-extraction table; the harness copies each document's
+nmm-doc-extraction item there before its confidence stage (not timed).
+
+Reports documents/minute, p50/p95/p99 latency per function and per instrumentation span
+stage (from the StageDuration lines the lambdas print), and the memory high-water mark of
+each function (tracemalloc, in a separate sequential pass of --memory-docs documents, with
+the process max RSS). --save writes the results as JSON; --baseline compares p95 latencies
+and memory with saved results and exits with 1 when any grew by more than --tolerance.
+
+Usage:
+    python bench_pipeline.py [--docs 24] [--concurrency 4] [--save results.json]
+    python bench_pipeline.py --baseline results.json [--tolerance 0.25]
+"""
+import argparse
+import contextlib
+import glob
+import hashlib
+import io
+import json
+import os
+import random
+import logging
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+
+from bench_env import aws_env, create_pipeline_tables, create_pipeline_queues, load_lambda
+from bench_fused_extraction import TITLES, TYPES, StubBedrockRuntime
+from textract_stub import StubTextract, synthetic_analysis_blocks
+
+import bedrock_gateway
+import stage_handoff
+from prompt_budget import estimate_tokens
+
+# Queue -> function, in the order the pollers look at them (later stages first)
+STAGE_QUEUES = [("confidence_score", "NMM_ConfidenceScoreQueue"),
+                ("entity_extraction", "NMM_EntityExtractionQueue"),
+                ("classification", "NMM_DocProcessingAfterExtractionQueueNew"),
+                ("extraction", "NMMDocProcessingQueue")]
+FUNCTIONS = [stage for stage, _ in STAGE_QUEUES[::-1]]
+READERS = ["history_dashboard", "dashboard_by_indexid", "dashboard_by_docid", "fetch_extracted_entities"]
+
+# confidence_score_lambda configures INFO logging at import
+logging.getLogger("botocore").setLevel(logging.WARNING)
+
+
+class ReplayBedrockRuntime:
+    """
+    bedrock-runtime stand-in: recorded answers by prompt hash, otherwise the synthetic ones of
+    bench_fused_extraction (type by title, template fields) plus a score for every confidence field
+    """
+
+    def __init__(self, base_sec, sec_per_ktoken, tokens_per_sec, recording=None):
+        self.base_sec, self.sec_per_ktoken, self.tokens_per_sec = base_sec, sec_per_ktoken, tokens_per_sec
+        self.recorded = recording or {}
+        self.answers = {}
+        self.synthetic = StubBedrockRuntime(0, 0, 1)
+        self.calls = self.replayed = 0
+        self.lock = threading.Lock()
+
+    def answer(self, prompt):
+        if "Extracted Fields:" in prompt:
+            fields = [line[2:].split(":", 1)[0] for line in prompt.split("Extracted Fields:", 1)[1].splitlines()
+                      if line.startswith("- ")]
+            return json.dumps({field: 0.9 for field in fields})
+        return json.dumps(self.synthetic.answer(prompt))
+
+    def invoke_model(self, modelId, body, **kwargs):
+        prompt = json.loads(body)["messages"][0]["content"][0]["text"]
+        key = hashlib.sha256(prompt.encode()).hexdigest()
+        text = self.recorded.get(key)
+        with self.lock:
+            self.calls += 1
+            self.replayed += text is not None
+        if text is None:
+            text = self.answer(prompt)
+        with self.lock:
+            self.answers[key] = text
+        tokens, output_tokens = estimate_tokens(prompt), estimate_tokens(text)
+        time.sleep(self.base_sec + self.sec_per_ktoken * tokens / 1000 + output_tokens / self.tokens_per_sec)
+        answer = {"content": [{"type": "text", "text": text}],
+                  "usage": {"input_tokens": tokens, "output_tokens": output_tokens}}
+        return {"body": io.BytesIO(json.dumps(answer).encode())}
+
+
+class SpanLines(io.TextIOBase):
+    """stdout replacement keeping only the span lines of the instrumentation module"""
+
+    def __init__(self):
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        if '"StageDuration"' in text:
+            record = json.loads(text)
+            with self.lock:
+                self.spans.append((record["Stage"], record["StageDuration"]))
+        return len(text)
+
+
+def recorded_textract(directory):
+    """Block lists of the recorded get_document_analysis output in a directory, one per file"""
+    recordings = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+        with open(path) as file:
+            data = json.load(file)
+        responses = data if isinstance(data, list) and data and "Blocks" in data[0] else None
+        if isinstance(data, dict):
+            responses = [data]
+        recordings.append([block for response in responses for block in response["Blocks"]] if responses else data)
+    return recordings
+
+
+def document_blocks(number):
+    """Synthetic analysis of document number: 2-8 pages whose first line is a type title"""
+    blocks = synthetic_analysis_blocks(pages=random.Random(number).randint(2, 8), seed=number)
+    first_line = next(block for block in blocks if block["BlockType"] == "LINE")
+    first_line["Text"] = TITLES[TYPES[number % len(TYPES)]]
+    return blocks
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {}
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {"count": len(values), "p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99), "max": values[-1]}
+
+
+class Pipeline:
+    """The pipeline lambdas in one moto account, with the stand-ins installed"""
+
+    def __init__(self, aws, args):
+        self.aws = aws
+        create_pipeline_tables(aws["dynamodb"])
+        aws["dynamodb"].create_table(
+            TableName="email_reader_v1",
+            KeySchema=[{"AttributeName": "seqid", "KeyType": "HASH"}, {"AttributeName": "seqid_sort", "KeyType": "RANGE"}],
+            AttributeDefinitions=[{"AttributeName": "seqid", "AttributeType": "S"},
+                                  {"AttributeName": "seqid_sort", "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST")
+        self.queues = create_pipeline_queues(aws["sqs"])
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.modules = {
+                "extraction": load_lambda("document_extraction_lambda"),
+                "classification": load_lambda("document_classification_lambda"),
+                "entity_extraction": load_lambda("entityextraction_lambda", "entity_lambda_function"),
+                "confidence_score": load_lambda("confidence_score_lambda", "lambda_confidence_handler"),
+                "history_dashboard": load_lambda("history_dashboard_lambda"),
+                "dashboard": load_lambda("dashboard_lambda"),
+                "fetch_extracted_entities": load_lambda("fetch_extracted_entities_lambda", "extraction_lambda_function"),
+            }
+        extraction = self.modules["extraction"]
+        extraction.dynamodb_resource, extraction.sqs = aws["dynamodb"], aws["sqs"]
+        extraction.TEXTRACT_COMPLETION_MODE = "poll"
+        extraction.TEXTRACT_POLL_BASE_SEC = extraction.TEXTRACT_POLL_MAX_SEC = max(0.01, args.textract_job_ms / 4000)
+
+        recordings = recorded_textract(args.textract_recording) if args.textract_recording else None
+
+        def blocks_for(name):
+            number = int(name.rsplit("-", 1)[1].split(".")[0])
+            return recordings[number % len(recordings)] if recordings else document_blocks(number)
+
+        self.textract = StubTextract(blocks_for=blocks_for, latency_sec=args.textract_api_ms / 1000,
+                                     job_duration_sec=args.textract_job_ms / 1000, fresh_responses=True)
+        extraction.textract = self.textract
+
+        recording = {}
+        if args.bedrock_recording:
+            with open(args.bedrock_recording) as file:
+                for line in file:
+                    if line.strip():
+                        entry = json.loads(line)
+                        recording[entry["prompt_sha256"]] = entry["text"]
+        self.bedrock = ReplayBedrockRuntime(args.bedrock_base_ms / 1000, args.bedrock_ms_per_ktoken / 1000,
+                                            args.bedrock_tokens_per_sec, recording)
+        bedrock_gateway._clients.clear()
+        for region in ("us-east-1", "us-west-2"):
+            bedrock_gateway._clients[(region, None)] = self.bedrock
+        self.modules["classification"].comprehend_client = StubComprehend()
+
+        stage_handoff.STAGE_HANDOFF = "sqs"
+        stage_handoff.sqs_client = aws["sqs"]
+        for stage, queue in STAGE_QUEUES:
+            if stage in stage_handoff.STAGES:
+                stage_handoff.STAGES[stage]["queue_url"] = self.queues[queue]
+
+    def upload(self, docs):
+        """The messages the upload lambda queues for extraction"""
+        for number in range(docs):
+            docid = f"DOC-{number:04d}"
+            body = {"indexid": f"IDX-{number // 4:04d}", "docid": docid, "s3filename": f"claims/doc-{number}.pdf",
+                    "source": "ManualUpload"}
+            self.aws["sqs"].send_message(QueueUrl=self.queues["NMMDocProcessingQueue"], MessageBody=json.dumps(body))
+
+    def run_function(self, stage, record):
+        """One invocation of a stage's function with one SQS record; returns (seconds, failed)"""
+        body = json.loads(record["body"])
+        if stage == "confidence_score":
+            # The confidence function reads doc-extraction
+            item = self.aws["dynamodb"].Table("nmm-doc-extraction").get_item(Key={"docid": body["docid"]})["Item"]
+            self.aws["dynamodb"].Table("doc-extraction").put_item(Item=item)
+        module = self.modules[stage]
+        handler = module.lambda_handler
+        start = time.perf_counter()
+        result = handler({"Records": [record]}, None)
+        seconds = time.perf_counter() - start
+        return seconds, bool(result.get("batchItemFailures"))
+
+    def poll(self, latencies, failures, stop):
+        """One event source mapping poller sharing the concurrency limit"""
+        sqs = self.aws["sqs"]
+        while not stop.is_set():
+            for stage, queue in STAGE_QUEUES:
+                received = sqs.receive_message(QueueUrl=self.queues[queue], MaxNumberOfMessages=1,
+                                               VisibilityTimeout=900).get("Messages", [])
+                if received:
+                    break
+            else:
+                time.sleep(0.005)
+                continue
+            entry = received[0]
+            record = {"messageId": entry["MessageId"], "body": entry["Body"], "receiptHandle": entry["ReceiptHandle"]}
+            seconds, failed = self.run_function(stage, record)
+            latencies[stage].append(seconds)
+            if failed:
+                failures[stage] += 1
+            else:
+                sqs.delete_message(QueueUrl=self.queues[queue], ReceiptHandle=entry["ReceiptHandle"])
+
+    def completed(self):
+        items = self.aws["dynamodb"].Table("dashboard").scan()["Items"]
+        return sum(item.get("confidence_score_status") == "Completed" for item in items)
+
+    def read_dashboards(self, docs):
+        """Time the dashboard readers over every document"""
+        timings = {reader: [] for reader in READERS}
+
+        def timed(reader, call):
+            start = time.perf_counter()
+            response = call()
+            timings[reader].append(time.perf_counter() - start)
+            assert response["statusCode"] == 200, (reader, response)
+
+        timed("history_dashboard", lambda: self.modules["history_dashboard"].lambda_handler({}, None))
+        for indexid in sorted({f"IDX-{number // 4:04d}" for number in range(docs)}):
+            timed("dashboard_by_indexid", lambda: self.modules["dashboard"].lambda_handler({"indexid": indexid}, None))
+        for number in range(docs):
+            docid = f"DOC-{number:04d}"
+            timed("dashboard_by_docid", lambda: self.modules["dashboard"].lambda_handler({"docid": docid}, None))
+            timed("fetch_extracted_entities",
+                  lambda: self.modules["fetch_extracted_entities"].lambda_handler({"docid": docid}, None))
+        return timings
+
+
+class StubComprehend:
+    def detect_dominant_language(self, Text):
+        return {"Languages": [{"LanguageCode": "en", "Score": 0.99}]}
+
+
+def throughput_run(args):
+    latencies = {stage: [] for stage in FUNCTIONS}
+    failures = {stage: 0 for stage in FUNCTIONS}
+    spans = SpanLines()
+    with aws_env() as aws:
+        pipeline = Pipeline(aws, args)
+        with contextlib.redirect_stdout(spans):
+            pipeline.upload(args.docs)
+            stop = threading.Event()
+            threads = [threading.Thread(target=pipeline.poll, args=(latencies, failures, stop))
+                       for _ in range(args.concurrency)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            deadline = start + args.timeout
+            while pipeline.completed() < args.docs and time.perf_counter() < deadline \
+                    and sum(failures.values()) == 0:
+                time.sleep(0.05)
+            wall = time.perf_counter() - start
+            stop.set()
+            for thread in threads:
+                thread.join()
+            completed = pipeline.completed()
+            readers = pipeline.read_dashboards(args.docs)
+        bedrock = pipeline.bedrock
+        if args.save_bedrock_recording:
+            with open(args.save_bedrock_recording, "w") as file:
+                for key, text in sorted(bedrock.answers.items()):
+                    file.write(json.dumps({"prompt_sha256": key, "text": text}) + "\n")
+    span_stages = {}
+    for stage, duration in spans.spans:
+        span_stages.setdefault(stage, []).append(duration / 1000)
+    return {
+        "docs": args.docs, "completed": completed, "wall_sec": wall,
+        "docs_per_min": completed / wall * 60 if wall else 0.0,
+        "failures": failures, "bedrock_calls": bedrock.calls, "bedrock_replayed": bedrock.replayed,
+        "functions": {stage: percentiles(values) for stage, values in latencies.items()},
+        "readers": {reader: percentiles(values) for reader, values in readers.items()},
+        "spans": {stage: percentiles(values) for stage, values in sorted(span_stages.items())},
+    }
+
+
+def memory_run(args):
+    """Sequential pass with tracemalloc: the allocation high-water mark of each function and reader"""
+    peaks = {}
+    with aws_env() as aws:
+        pipeline = Pipeline(aws, args)
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            pipeline.upload(args.memory_docs)
+            tracemalloc.start()
+            try:
+                pending = True
+                while pending:
+                    pending = False
+                    for stage, queue in STAGE_QUEUES:
+                        for entry in aws["sqs"].receive_message(QueueUrl=pipeline.queues[queue],
+                                                                MaxNumberOfMessages=10).get("Messages", []):
+                            pending = True
+                            record = {"messageId": entry["MessageId"], "body": entry["Body"]}
+                            tracemalloc.reset_peak()
+                            baseline = tracemalloc.get_traced_memory()[0]
+                            pipeline.run_function(stage, record)
+                            peaks[stage] = max(peaks.get(stage, 0), tracemalloc.get_traced_memory()[1] - baseline)
+                            aws["sqs"].delete_message(QueueUrl=pipeline.queues[queue], ReceiptHandle=entry["ReceiptHandle"])
+                            output.seek(0)
+                            output.truncate()
+                tracemalloc.reset_peak()
+                baseline = tracemalloc.get_traced_memory()[0]
+                pipeline.modules["history_dashboard"].lambda_handler({}, None)
+                peaks["history_dashboard"] = tracemalloc.get_traced_memory()[1] - baseline
+            finally:
+                tracemalloc.stop()
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"peak_mib": {name: peak / 2 ** 20 for name, peak in peaks.items()},
+            "max_rss_mib": max_rss / (2 ** 20 if sys.platform == "darwin" else 2 ** 10)}
+
+
+def print_table(title, rows):
+    print(f"\n{title:<26} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, stats in rows.items():
+        if stats:
+            print(f"{name:<26} {stats['count']:>6} " + " ".join(f"{stats[key] * 1000:>9.1f}" for key in
+                                                                  ("p50", "p95", "p99", "max")))
+
+
+def regressions(results, baseline, tolerance):
+    """(name, before, after) of the p95 latencies and memory peaks that grew by more than tolerance"""
+    found = []
+    for section in ("functions", "readers", "spans"):
+        for name, stats in results[section].items():
+            before = baseline.get(section, {}).get(name)
+            if stats and before and stats["p95"] > before["p95"] * (1 + tolerance):
+                found.append((f"{section}.{name} p95", before["p95"] * 1000, stats["p95"] * 1000))
+    for name, peak in results["memory"]["peak_mib"].items():
+        before = baseline.get("memory", {}).get("peak_mib", {}).get(name)
+        if before and peak > before * (1 + tolerance):
+            found.append((f"memory.{name} MiB", before, peak))
+    if results["docs_per_min"] < baseline.get("docs_per_min", 0) * (1 - tolerance):
+        found.append(("documents/min", baseline["docs_per_min"], results["docs_per_min"]))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=24)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--memory-docs", type=int, default=4)
+    parser.add_argument("--textract-job-ms", type=float, default=400.0)
+    parser.add_argument("--textract-api-ms", type=float, default=5.0)
+    parser.add_argument("--bedrock-base-ms", type=float, default=150.0)
+    parser.add_argument("--bedrock-ms-per-ktoken", type=float, default=4.0)
+    parser.add_argument("--bedrock-tokens-per-sec", type=float, default=2000.0)
+    parser.add_argument("--textract-recording", help="directory of recorded get_document_analysis JSON files")
+    parser.add_argument("--bedrock-recording", help="JSON lines of recorded answers to replay")
+    parser.add_argument("--save-bedrock-recording", help="write the answers of this run as JSON lines")
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--save", help="write the results as JSON")
+    parser.add_argument("--baseline", help="results JSON of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    print(f"{args.docs} documents, {args.concurrency} concurrent executions, Textract jobs {args.textract_job_ms:.0f} ms, "
+          f"Bedrock {args.bedrock_base_ms:.0f} ms + {args.bedrock_ms_per_ktoken:.0f} ms/1k tokens")
+    results = throughput_run(args)
+    results["memory"] = memory_run(args)
+
+    print(f"\nCompleted {results['completed']}/{args.docs} in {results['wall_sec']:.1f} s - "
+          f"{results['docs_per_min']:.1f} documents/min, {results['bedrock_calls']} Bedrock calls "
+          f"({results['bedrock_replayed']} replayed)")
+    if any(results["failures"].values()):
+        print("Failed invocations: ", {stage: count for stage, count in results["failures"].items() if count})
+    print_table("Function", results["functions"])
+    print_table("Dashboard reader", results["readers"])
+    print_table("Span stage", results["spans"])
+    print(f"\n{'Memory high-water':<26} {'MiB':>9}")
+    for name, peak in results["memory"]["peak_mib"].items():
+        print(f"{name:<26} {peak:>9.1f}")
+    print(f"{'process max RSS':<26} {results['memory']['max_rss_mib']:>9.1f}")
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            found = regressions(results, json.load(file), args.tolerance)
+        if found:
+            print(f"\nRegressions over {args.tolerance:.0%}:")
+            for name, before, after in found:
+                print(f"  {name}: {before:.1f} -> {after:.1f}")
+            sys.exit(1)
+        print(f"\nNo regression over {args.tolerance:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Skip rate, latency and LLM agreement of the classification pre-classifier.
+
+Builds a synthetic labelled corpus shaped like extracted claim documents: each
+document mixes phrases typical of its type with generic claim vocabulary, some
+documents quote a second type (a legal letter attaching an invoice, ...), and a
+share of labels is flipped to stand in for LLM answers the text does not support.
+The TF-IDF model is trained on one split and scored on the held-out split,
+next to the keyword rules it falls back to when no model is deployed.
+
+Usage:
+    python bench_pre_classifier.py [--docs 2000] [--holdout 0.25] [--label-noise 0.03]
+"""
+import argparse
+import random
+
+from bench_env import load_lambda
+
+TYPE_PHRASES = {
+    "MedicalReport": ["chief complaint", "history of present illness", "physical examination", "assessment and plan",
+                      "diagnosis lumbar strain", "vital signs stable", "follow up in two weeks", "physician notes"],
+    "ClaimForm": ["first report of injury", "date of injury", "employer name", "claim number",
+                  "employee signature", "nature of injury", "body part affected", "witness statement"],
+    "DoctorReportMMI": ["maximum medical improvement", "impairment rating", "whole person impairment",
+                        "ama guides sixth edition", "permanent restrictions", "mmi date", "future medical care"],
+    "PhysicalTherapy": ["physical therapy evaluation", "range of motion", "therapeutic exercise", "plan of care",
+                        "visits authorized", "manual therapy", "strength 4 of 5", "home exercise program"],
+    "Prescription": ["rx", "refills 2", "dispense as written", "sig take one tablet", "qty 30", "pharmacy",
+                     "prescriber dea number", "ibuprofen 800 mg"],
+    "CMS1500": ["health insurance claim form", "approved by nucc", "insured's id number", "referring provider",
+                "federal tax i.d. number", "place of service", "cpt hcpcs", "diagnosis pointer"],
+    "Legal": ["attorney at law", "petition for benefits", "hearing scheduled", "workers' compensation administration",
+              "counsel for the worker", "deposition notice", "subpoena duces tecum", "esq"],
+    "Invoice": ["invoice number", "amount due", "balance due", "remit to", "payment terms net 30", "subtotal",
+                "line item description", "tax id"],
+}
+COMMON = ["patient", "employee", "new mexico mutual", "claim", "date", "page", "signature", "address", "phone",
+          "injury", "work", "insurer", "policy", "provider", "report", "treatment", "status", "name"]
+
+
+def synthetic_document(rng, label, second_label=None):
+    lines = []
+    for _ in range(rng.randint(20, 60)):
+        if second_label and rng.random() < 0.1:
+            lines.append(rng.choice(TYPE_PHRASES[second_label]))
+        elif rng.random() < 0.3:
+            lines.append(rng.choice(TYPE_PHRASES[label]))
+        else:
+            lines.append(" ".join(rng.choice(COMMON) for _ in range(rng.randint(3, 8))))
+    return "\n".join(lines).lower()
+
+
+def synthetic_corpus(docs, label_noise, mixed_share, seed=11):
+    rng = random.Random(seed)
+    labels = list(TYPE_PHRASES)
+    corpus = []
+    for i in range(docs):
+        label = rng.choice(labels)
+        second = rng.choice([l for l in labels if l != label]) if rng.random() < mixed_share else None
+        text = synthetic_document(rng, label, second)
+        if rng.random() < label_noise:
+            label = rng.choice([l for l in labels if l != label])
+        corpus.append((f"DOC{i:06d}", text, label))
+    return corpus
+
+
+def print_table(title, pre_classifier, model, heldout, thresholds):
+    print(title)
+    print(f"{'threshold':>9} {'skip rate':>9} {'agree (skipped)':>15} {'agree (all)':>11} {'p50 ms':>7} {'p99 ms':>7}")
+    for threshold in thresholds:
+        # As deployed with PRECLASSIFIER_THRESHOLD=threshold (the keyword cap follows it)
+        pre_classifier.PRECLASSIFIER_THRESHOLD = threshold
+        report = pre_classifier.evaluate(model, heldout, threshold)
+        print(f"{threshold:>9.2f} {report['skip_rate']:>9.1%} {report['skipped_agreement']:>15.1%} "
+              f"{report['overall_agreement']:>11.1%} {report['p50_ms']:>7.2f} {report['p99_ms']:>7.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=2000)
+    parser.add_argument("--holdout", type=float, default=0.25)
+    parser.add_argument("--label-noise", type=float, default=0.03, help="share of labels the text does not support")
+    parser.add_argument("--mixed", type=float, default=0.2, help="share of documents quoting a second type")
+    args = parser.parse_args()
+
+    pre_classifier = load_lambda("document_classification_lambda", "pre_classifier")
+    corpus = synthetic_corpus(args.docs, args.label_noise, args.mixed)
+    training_script = load_lambda("document_classification_lambda", "train_pre_classifier")
+    training = [(text, label) for docid, text, label in corpus if not training_script.is_holdout(docid, args.holdout)]
+    heldout = [(text, label) for docid, text, label in corpus if training_script.is_holdout(docid, args.holdout)]
+    print(f"{len(training)} training / {len(heldout)} held-out documents, "
+          f"{args.label_noise:.0%} label noise, {args.mixed:.0%} mixed documents\n")
+
+    thresholds = (0.5, 0.7, 0.9, 0.95, 0.99)
+    print_table("Keyword rules (no model deployed)", pre_classifier, pre_classifier.PreClassifier(), heldout, thresholds)
+    model = pre_classifier.train(training)
+    print()
+    print_table(f"TF-IDF centroids ({len(model.idf)} features, temperature {model.temperature})",
+                pre_classifier, model, heldout, thresholds)
+
+
+if __name__ == "__main__":
+    main()
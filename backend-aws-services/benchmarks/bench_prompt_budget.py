@@ -0,0 +1,85 @@
+"""
+Tokens saved and facts kept by the token-budgeted prompt builder (prompt_budget).
+
+Builds long synthetic extractions in the stored nmm-doc-extraction format (str() of
+per-file lists, Textract filler text) and plants one line per ClaimForm template field
+("Date of Injury: ...") on random pages. For each document size it reports the
+estimated document tokens before and after fit_document for every stage, and for
+entity extraction how many planted field lines survive with relevance ranking vs
+keeping the first and last pages (the classification strategy) under the same budget.
+
+Usage:
+    python bench_prompt_budget.py [--pages 20 100 400] [--extraction-budget 20000]
+"""
+import argparse
+import random
+import re
+
+from bench_env import load_lambda
+from textract_stub import WORDS
+
+import prompt_budget  # common layer, on the path once bench_env is imported
+
+FIELD_LINES = [
+    "Employee Name: {name}", "WCB Case Number JCN: {num}", "Date of Injury: 03/14/2024",
+    "Claim Administrator Claim Number: {num}", "Insurer Name: New Mexico Mutual", "Policy Number: {num}",
+    "Employee Date of Birth: 07/01/1985", "Nature of Injury: strain", "Body Part: lower back",
+    "Employee Mailing Address City State Postal Code: Albuquerque NM 87101", "Return to Work Status: modified duty",
+]
+LINES_PER_PAGE = 45
+
+
+def synthetic_extraction(pages, seed=5):
+    """(rawtext, keyvaluesText, tbltxt, planted field lines) of one document, stored-format strings"""
+    rng = random.Random(seed + pages)
+    lines = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 10))) for _ in range(pages * LINES_PER_PAGE)]
+    planted = []
+    for template in FIELD_LINES:
+        line = template.format(name="Maria Lopez", num=str(rng.randint(10 ** 7, 10 ** 8)))
+        # Anywhere past the first quarter of the document
+        lines.insert(rng.randint(len(lines) // 4, len(lines) - 1), line)
+        planted.append(line)
+    rawtext = str([{"claims/packet": "\n".join(lines) + "\n"}])
+    keyvalues = str([{"claims/packet": [f"Key: {rng.choice(WORDS)} {rng.choice(WORDS)}, Value: {rng.randint(1, 999)}"
+                                        for _ in range(pages * 8)]}])
+    tables = str([{"claims/packet": [{i: "Tabluar Data Processing " + ";".join(
+        f"{rng.choice(WORDS)} {rng.randint(1, 99)}," for _ in range(6))} for i in range(pages)]}])
+    return rawtext, keyvalues, tables, planted
+
+
+def kept_facts(planted, text):
+    # Lines are re-joined on real newlines in the output, so compare without separators
+    flat = re.sub(r"\\n|\n", " ", text)
+    return sum(1 for line in planted if line in flat)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[20, 100, 400])
+    parser.add_argument("--extraction-budget", type=int, default=20000,
+                        help="extraction budget for the comparison (the default stage budget is far larger)")
+    args = parser.parse_args()
+
+    prompt_budget.emit_metric = lambda *a, **k: None  # keep the table readable
+    prompt_budget.print = lambda *a, **k: None
+    entity_utility = load_lambda("entityextraction_lambda", "entity_utility")
+    terms = prompt_budget.template_terms(entity_utility.get_entities_template("ClaimForm"))
+
+    print(f"{'pages':>5} {'doc tokens':>10} {'classification':>14} {'summary':>8} {'extraction':>10} "
+          f"{'facts ranked':>12} {'facts head/tail':>15}")
+    for pages in args.pages:
+        raw, kv, tbl, planted = synthetic_extraction(pages)
+        total = sum(prompt_budget.estimate_tokens(text) for text in (raw, kv, tbl))
+        kept = {}
+        for stage in ("classification", "summary"):
+            kept[stage] = sum(prompt_budget.estimate_tokens(t) for t in prompt_budget.fit_document(stage, raw, kv, tbl))
+        ranked = prompt_budget.fit_document("extraction", raw, kv, tbl, terms=terms,
+                                            budget_tokens=args.extraction_budget)
+        head_tail = prompt_budget.fit_document("extraction", raw, kv, tbl, budget_tokens=args.extraction_budget)
+        kept["extraction"] = sum(prompt_budget.estimate_tokens(t) for t in ranked)
+        print(f"{pages:>5} {total:>10} {kept['classification']:>14} {kept['summary']:>8} {kept['extraction']:>10} "
+              f"{kept_facts(planted, ranked[0]):>9}/{len(planted):<2} {kept_facts(planted, head_tail[0]):>12}/{len(planted):<2}")
+
+
+if __name__ == "__main__":
+    main()
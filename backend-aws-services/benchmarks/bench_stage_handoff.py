@@ -0,0 +1,249 @@
+"""
+Billed time, concurrent executions and completed documents of the pipeline after extraction,
+chained RequestResponse invokes vs per-stage SQS queues.
+
+Stand-in stage handlers (classification, entity extraction, confidence score) process an
+SQS-shaped event like the real ones, sleep for their stage's --stage-sec and hand the
+document on with stage_handoff.hand_off. An account concurrency limit of --concurrency
+executions is shared by all functions:
+
+- "invoke": a stand-in lambda client runs the next handler inside the caller, as
+  RequestResponse does, and throttles (TooManyRequestsException, retried twice) when no
+  execution is free. A throttled hand-off is logged and dropped, as before, so the
+  document never reaches its later stages.
+- "sqs": hand-offs go to moto queues. --concurrency poller threads take messages from the
+  three queues (like event source mappings sharing the limit) and run the handler.
+
+First one document through LocalRunner (the in-process stage graph) and through "invoke",
+then --docs documents arriving at once in each mode. Reports wall time, billed seconds per
+document, peak executions per document and in total, and documents completed.
+Sleeps are --time-scale times shorter and reported at full scale.
+
+Usage:
+    python bench_stage_handoff.py [--docs 40] [--concurrency 120 12] [--stage-sec 6 25 35]
+"""
+import argparse
+import contextlib
+import io
+import json
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from bench_env import aws_env, create_pipeline_queues
+
+from sqs_batch import process_sqs_batch, parse_record_body
+import stage_handoff
+
+STAGE_ORDER = ["classification", "entity_extraction", "confidence_score"]
+
+
+class Executions:
+    """Running executions against the account concurrency limit, with billed time"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.running = self.peak = 0
+        self.by_doc, self.peak_by_doc = {}, {}
+        self.billed = 0.0
+
+    def try_start(self, docid):
+        with self.lock:
+            if self.running >= self.limit:
+                return False
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+            self.by_doc[docid] = self.by_doc.get(docid, 0) + 1
+            self.peak_by_doc[docid] = max(self.peak_by_doc.get(docid, 0), self.by_doc[docid])
+            return True
+
+    def finish(self, docid, seconds):
+        with self.lock:
+            self.running -= 1
+            self.by_doc[docid] -= 1
+            self.billed += seconds
+
+
+class Pipeline:
+    def __init__(self, stage_sec, time_scale, executions):
+        self.stage_sec = dict(zip(STAGE_ORDER, stage_sec))
+        self.time_scale = time_scale
+        self.executions = executions
+        self.completed = set()
+        self.lock = threading.Lock()
+
+    def handler(self, stage):
+        def process(record):
+            time.sleep(self.stage_sec[stage] * self.time_scale)
+            following = stage_handoff.STAGES[stage]["next"]
+            if following:
+                stage_handoff.hand_off(following, record)
+            else:
+                with self.lock:
+                    self.completed.add(parse_record_body(record)["docid"])
+            return {'statusCode': 200}
+        return lambda event, context: process_sqs_batch(event, process)
+
+    def start_and_execute(self, stage, event):
+        """Wait for a free execution, like an event source mapping, then execute the stage"""
+        docid = parse_record_body(event['Records'][0])["docid"]
+        while not self.executions.try_start(docid):
+            time.sleep(0.001)
+        return self.execute(stage, event)
+
+    def execute(self, stage, event):
+        """One execution of a stage's function, counted against the limit (the caller has a slot)"""
+        docid = parse_record_body(event['Records'][0])["docid"]
+        start = time.perf_counter()
+        try:
+            return self.handler(stage)(event, None)
+        finally:
+            self.executions.finish(docid, (time.perf_counter() - start) / self.time_scale)
+
+
+class StubLambdaClient:
+    """lambda invoke stand-in: RequestResponse runs the function in the caller's thread"""
+
+    def __init__(self, pipeline, retries=2, backoff_sec=0.1):
+        self.pipeline = pipeline
+        self.stage_of = {stage_handoff.STAGES[stage]["function"]: stage for stage in STAGE_ORDER}
+        self.retries, self.backoff_sec = retries, backoff_sec
+        self.throttles = 0
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        event = json.loads(Payload)
+        docid = parse_record_body(event['Records'][0])["docid"]
+        for attempt in range(self.retries + 1):
+            if self.pipeline.executions.try_start(docid):
+                result = self.pipeline.execute(self.stage_of[FunctionName], event)
+                return {"StatusCode": 200, "Payload": io.BytesIO(json.dumps(result).encode())}
+            self.throttles += 1
+            time.sleep(self.backoff_sec * self.pipeline.time_scale * (attempt + 1))
+        raise ClientError({"Error": {"Code": "TooManyRequestsException", "Message": "Rate Exceeded."}}, "Invoke")
+
+
+def message(docid, stage):
+    body = {"docid": docid, "indexid": "IN" + docid, "s3filename": f"claims/{docid}.pdf", "stage": stage}
+    return {"messageId": docid, "body": json.dumps(body)}
+
+
+def run_invoke(docs, pipeline, concurrency):
+    """The SQS-triggered classification function, invoking the later stages synchronously"""
+    stage_handoff.STAGE_HANDOFF = "invoke"
+    stage_handoff.lambda_client = StubLambdaClient(pipeline)
+    pending = list(docs)
+    lock = threading.Lock()
+
+    def poller():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                docid = pending.pop(0)
+            pipeline.start_and_execute("classification", {"Records": [message(docid, "classification")]})
+
+    threads = [threading.Thread(target=poller) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return stage_handoff.lambda_client.throttles
+
+
+def run_sqs(docs, pipeline, concurrency, sqs, queues, timeout_sec):
+    """Event source mappings of the three queues, sharing the concurrency limit"""
+    stage_handoff.STAGE_HANDOFF = "sqs"
+    stage_handoff.sqs_client = sqs
+    queue_urls = {"classification": queues["NMM_DocProcessingAfterExtractionQueueNew"],
+                  "entity_extraction": queues["NMM_EntityExtractionQueue"],
+                  "confidence_score": queues["NMM_ConfidenceScoreQueue"]}
+    for stage, url in queue_urls.items():
+        stage_handoff.STAGES[stage]["queue_url"] = url
+    for docid in docs:
+        sqs.send_message(QueueUrl=queue_urls["classification"], MessageBody=message(docid, "classification")["body"])
+    deadline = time.perf_counter() + timeout_sec
+
+    def poller():
+        # Later stages first, like mappings whose queues already hold work
+        order = STAGE_ORDER[::-1]
+        while len(pipeline.completed) < len(docs) and time.perf_counter() < deadline:
+            for stage in order:
+                received = sqs.receive_message(QueueUrl=queue_urls[stage], MaxNumberOfMessages=1,
+                                               VisibilityTimeout=600).get("Messages", [])
+                if received:
+                    break
+            else:
+                time.sleep(0.002)
+                continue
+            entry = received[0]
+            record = {"messageId": entry["MessageId"], "body": entry["Body"]}
+            result = pipeline.start_and_execute(stage, {"Records": [record]})
+            if not result["batchItemFailures"]:
+                sqs.delete_message(QueueUrl=queue_urls[stage], ReceiptHandle=entry["ReceiptHandle"])
+
+    threads = [threading.Thread(target=poller) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return 0
+
+
+def report(name, docs, pipeline, wall, throttles):
+    executions = pipeline.executions
+    per_doc = max(executions.peak_by_doc.values()) if executions.peak_by_doc else 0
+    print(f"{name:>10} {len(pipeline.completed):>5}/{len(docs):<4} {wall:>7.1f} "
+          f"{executions.billed / len(docs):>13.1f} {per_doc:>13} {executions.peak:>10} {throttles:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[120, 12])
+    parser.add_argument("--stage-sec", type=float, nargs=3, default=[6.0, 25.0, 35.0],
+                        help="seconds of classification, entity extraction and confidence score")
+    parser.add_argument("--time-scale", type=float, default=0.05)
+    args = parser.parse_args()
+
+    header = (f"{'mode':>10} {'completed':>10} {'wall s':>7} {'billed s/doc':>13} {'peak per doc':>13} "
+              f"{'peak total':>10} {'throttles':>9}")
+    print("One document:")
+    print(header)
+    pipeline = Pipeline(args.stage_sec, args.time_scale, Executions(1))
+    handlers = {stage: (lambda stage: lambda event, context: pipeline.start_and_execute(stage, event))(stage)
+                for stage in STAGE_ORDER}
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        with stage_handoff.LocalRunner(handlers) as runner:
+            runner.submit("classification", parse_record_body(message("DOC-0", "classification")))
+            runner.run()
+        wall = (time.perf_counter() - start) / args.time_scale
+    report("local", ["DOC-0"], pipeline, wall, 0)
+    pipeline = Pipeline(args.stage_sec, args.time_scale, Executions(3))
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        throttles = run_invoke(["DOC-0"], pipeline, 1)
+        wall = (time.perf_counter() - start) / args.time_scale
+    report("invoke", ["DOC-0"], pipeline, wall, throttles)
+
+    docs = [f"DOC-{number}" for number in range(args.docs)]
+    for concurrency in args.concurrency:
+        print(f"\n{args.docs} documents at once, {concurrency} concurrent executions:")
+        print(header)
+        for mode in ("invoke", "sqs"):
+            pipeline = Pipeline(args.stage_sec, args.time_scale, Executions(concurrency))
+            with aws_env() as aws, contextlib.redirect_stdout(io.StringIO()):
+                queues = create_pipeline_queues(aws["sqs"])
+                start = time.perf_counter()
+                if mode == "invoke":
+                    throttles = run_invoke(docs, pipeline, concurrency)
+                else:
+                    timeout = 4 * sum(args.stage_sec) * args.time_scale * len(docs)
+                    throttles = run_sqs(docs, pipeline, concurrency, aws["sqs"], queues, timeout)
+                wall = (time.perf_counter() - start) / args.time_scale
+            report(mode, docs, pipeline, wall, throttles)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Document summary coverage, wall time and Bedrock tokens, single prompt vs map-reduce.
+
+Builds synthetic claim packets of --pages pages over four files (Textract-like filler
+lines plus form key-values) and plants a numbered key fact ("Key fact F007: ...") every
+--fact-every pages. Each packet is stored in moto's nmm-doc-extraction with the chunk
+index the extraction lambda stores (offloaded to moto's S3), and summarized through
+document_summary_lambda.lambda_handler in SUMMARY_MODE "single" (one prompt cut to
+PROMPT_TOKEN_BUDGET_SUMMARY) and "map_reduce".
+
+A local stand-in for bedrock-runtime rejects prompts over the 200k-token context window,
+answers after a latency that grows with the input tokens and with the output tokens
+(--tokens-per-sec), and writes one point per key fact it is shown, cut to max_tokens. It
+does not model how well a real model summarizes a long prompt - the coverage below only
+counts facts that reached the model. Latencies are slept --time-scale times shorter and
+reported at full scale.
+
+Reports per mode the facts in the summary, the (full scale) wall time, Bedrock calls and
+input tokens. Then, with the section cache table, re-summarizes the largest packet after
+a file is added and after a line is added to a page in the middle of a file, counting the
+map calls.
+
+Usage:
+    python bench_summary_map_reduce.py [--pages 20 100 400] [--fact-every 8] [--concurrency 4]
+"""
+import argparse
+import contextlib
+import io
+import json
+import random
+import re
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from bench_env import aws_env, create_pipeline_tables, load_lambda
+from bench_chat_retrieval import FILLER_WORDS, LINES_PER_PAGE
+from textract_stub import WORDS
+
+import bedrock_gateway
+import chunk_index
+import extraction_payloads
+from prompt_budget import estimate_tokens
+
+CONTEXT_WINDOW_TOKENS = 200000
+FILES = 4
+FACT_RE = re.compile(r"Key fact (F\d{3}): reported on page \d+ of [\w/.-]+")
+CACHE_TABLE = "nmm-summary-section-cache"
+
+
+class StubBedrockRuntime:
+    """invoke_model that summarizes the key facts it is shown, with Claude-like timing"""
+
+    def __init__(self, base_sec, per_ktoken_sec, tokens_per_sec, time_scale):
+        self.base_sec, self.per_ktoken_sec, self.tokens_per_sec = base_sec, per_ktoken_sec, tokens_per_sec
+        self.time_scale = time_scale
+        self.calls = self.input_tokens = 0
+        self.lock = threading.Lock()
+
+    def invoke_model(self, modelId, body, **kwargs):
+        request = json.loads(body)
+        prompt = request["messages"][0]["content"][0]["text"]
+        tokens = estimate_tokens(prompt)
+        with self.lock:
+            self.calls += 1
+            self.input_tokens += tokens
+        if tokens > CONTEXT_WINDOW_TOKENS:
+            raise ClientError({"Error": {"Code": "ValidationException",
+                                         "Message": "Input is too long for requested model."}}, "InvokeModel")
+        points, output_tokens = [], 0
+        for fact in dict.fromkeys(match.group(0) for match in FACT_RE.finditer(prompt)):
+            point = f"{len(points) + 1}. {fact}"
+            if output_tokens + estimate_tokens(point) > request["max_tokens"]:
+                break
+            points.append(point)
+            output_tokens += estimate_tokens(point)
+        time.sleep(self.time_scale * (self.base_sec + self.per_ktoken_sec * tokens / 1000
+                                      + output_tokens / self.tokens_per_sec))
+        answer = {"content": [{"type": "text", "text": "\n".join(points) or "No relevant content."}],
+                  "usage": {"input_tokens": tokens, "output_tokens": output_tokens}}
+        return {"body": io.BytesIO(json.dumps(answer).encode())}
+
+
+def synthetic_packet(pages, fact_every, files=FILES, first_file=0, first_page=0, seed=5):
+    """(rawtext, keyvaluesText, page_lines, planted fact ids) of a packet of files files"""
+    rng = random.Random(seed + pages + first_page)
+    rawtext, keyvalues, page_lines, planted = [], [], [], set()
+    per_file = [pages // files + (1 if number < pages % files else 0) for number in range(files)]
+    page = first_page
+    for number, count in enumerate(per_file):
+        name = f"claims/packet-{first_file + number + 1}.pdf"
+        page_texts = []
+        for _ in range(count):
+            page += 1
+            lines = [" ".join(rng.choice(WORDS if rng.random() < 0.2 else FILLER_WORDS) for _ in range(rng.randint(4, 10)))
+                     for _ in range(LINES_PER_PAGE)]
+            if page % fact_every == 0:
+                fact = f"F{page:03d}"
+                lines.insert(rng.randint(0, len(lines)), f"Key fact {fact}: reported on page {page} of {name}")
+                planted.add(fact)
+            page_texts.append(lines)
+        rawtext.append({name: "".join(line + "\n" for lines in page_texts for line in lines)})
+        keyvalues.append({name: [f"Key: Page {page_number + 1} reviewer, Value: initials {rng.randint(10, 99)}"
+                                 for page_number in range(count)]})
+        page_lines.append([len(lines) for lines in page_texts])
+    return rawtext, keyvalues, page_lines, planted
+
+
+def store_packet(dynamodb, docid, rawtext, keyvalues, page_lines):
+    """Store a packet as the extraction lambda does, with its text offloaded to S3"""
+    payloads = {"rawtext": str(rawtext), "keyvaluesText": str(keyvalues), "tbltxt": str([]),
+                "chunk_index": chunk_index.dumps(chunk_index.build_index(rawtext, page_lines))}
+    item = {"docid": docid, "document_name": [name for entry in rawtext for name in entry]}
+    with contextlib.redirect_stdout(io.StringIO()):
+        item.update(extraction_payloads.store_payloads(docid, payloads, storage="s3"))
+    dynamodb.Table("nmm-doc-extraction").put_item(Item=item)
+    return payloads["chunk_index"]
+
+
+def summarize(summary, stub, docid, time_scale):
+    calls, tokens = stub.calls, stub.input_tokens
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        text = summary.lambda_handler({"docid": docid}, None)["body"]
+        wall = (time.perf_counter() - start) / time_scale
+    return set(re.findall(r"F\d{3}", text)), wall, stub.calls - calls, stub.input_tokens - tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[20, 100, 400])
+    parser.add_argument("--fact-every", type=int, default=8)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--base-ms", type=float, default=400.0)
+    parser.add_argument("--per-ktoken-ms", type=float, default=8.0)
+    parser.add_argument("--tokens-per-sec", type=float, default=120.0)
+    parser.add_argument("--time-scale", type=float, default=0.25)
+    args = parser.parse_args()
+
+    with aws_env() as aws:
+        dynamodb = aws["dynamodb"]
+        create_pipeline_tables(dynamodb)
+        aws["s3"].create_bucket(Bucket=extraction_payloads.PAYLOAD_BUCKET)
+        dynamodb.create_table(TableName=CACHE_TABLE,
+                              KeySchema=[{"AttributeName": "section_sha256", "KeyType": "HASH"}],
+                              AttributeDefinitions=[{"AttributeName": "section_sha256", "AttributeType": "S"}],
+                              BillingMode="PAY_PER_REQUEST")
+        summary = load_lambda("document_summary_lambda")
+        map_reduce = summary.map_reduce
+        summary.dynamodb_resource = map_reduce.dynamodb_resource = dynamodb
+        map_reduce.SUMMARY_MAP_CONCURRENCY = args.concurrency
+        stub = StubBedrockRuntime(args.base_ms / 1000, args.per_ktoken_ms / 1000, args.tokens_per_sec, args.time_scale)
+        bedrock_gateway._clients[("us-west-2", summary.os.environ["BEDROCK_ASSUME_ROLE"])] = stub
+
+        print(f"{'pages':>5} {'mode':>10} {'facts in summary':>16} {'wall s':>7} {'calls':>5} {'input tokens':>12}")
+        for pages in args.pages:
+            rawtext, keyvalues, page_lines, planted = synthetic_packet(pages, args.fact_every)
+            docid = f"DOC-{pages}"
+            store_packet(dynamodb, docid, rawtext, keyvalues, page_lines)
+            for mode in ("single", "map_reduce"):
+                map_reduce.SUMMARY_MODE = mode
+                facts, wall, calls, tokens = summarize(summary, stub, docid, args.time_scale)
+                print(f"{pages:>5} {mode:>10} {len(facts & planted):>12}/{len(planted):<3} {wall:>7.1f} "
+                      f"{calls:>5} {tokens:>12}")
+
+        pages = max(args.pages)
+        rawtext, keyvalues, page_lines, planted = synthetic_packet(pages, args.fact_every)
+        map_reduce.SUMMARY_MODE, map_reduce.SUMMARY_CHUNK_CACHE_TABLE = "map_reduce", CACHE_TABLE
+        print(f"\nRe-summarizing the {pages}-page packet with {CACHE_TABLE}:")
+        print(f"{'run':>28} {'sections':>8} {'map calls':>9} {'wall s':>7} {'facts in summary':>16}")
+        runs = [("first run", None), ("unchanged", None), ("file added", "add"), ("line added mid-file", "edit")]
+        for name, change in runs:
+            if change == "add":
+                added = synthetic_packet(24, args.fact_every, files=1, first_file=FILES, first_page=pages)
+                for parts, more in zip((rawtext, keyvalues, page_lines), added):
+                    parts.extend(more)
+                planted |= added[3]
+            elif change == "edit":
+                name_2, middle = next(iter(rawtext[1])), len(page_lines[1]) // 2
+                lines = rawtext[1][name_2].split("\n")
+                lines.insert(sum(page_lines[1][:middle]), "Addendum: claimant returned to modified duty")
+                rawtext[1][name_2] = "\n".join(lines)
+                page_lines[1][middle] += 1
+            stored_index = store_packet(dynamodb, "DOC-CACHED", rawtext, keyvalues, page_lines)
+            sections = len(map_reduce.build_sections(rawtext, str(keyvalues), str([]), stored_index))
+            calls = stub.calls
+            facts, wall, _, _ = summarize(summary, stub, "DOC-CACHED", args.time_scale)
+            print(f"{name:>28} {sections:>8} {stub.calls - calls - 1:>9} {wall:>7.1f} "
+                  f"{len(facts & planted):>12}/{len(planted):<3}")
+
+
+if __name__ == "__main__":
+    main()
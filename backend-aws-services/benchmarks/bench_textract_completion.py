@@ -0,0 +1,93 @@
+"""
+Compare the two Textract completion modes of document_extraction_lambda.
+
+"poll" keeps the extraction lambda running until Textract finishes, so its billed
+duration grows with the job time. "notification" starts the job and exits; the
+results are fetched by textract_completion_handler when StubTextract emits the
+SNS completion message. Both runs must leave identical rows in nmm-doc-extraction
+and one message per document on the classification queue.
+
+Usage:
+    pip install -r requirements.txt
+    python bench_textract_completion.py [--docs 5] [--job-seconds 2] [--pages 3]
+"""
+import argparse
+import contextlib
+import io
+import json
+import time
+import uuid
+
+from bench_env import aws_env, create_pipeline_tables, create_pipeline_queues, load_lambda
+from textract_stub import StubTextract, synthetic_analysis_blocks
+
+
+def sqs_event(docs):
+    records = []
+    for i in range(docs):
+        body = {"indexid": f"IN{i:05d}", "docid": f"DOC{i:05d}", "s3filename": f"claims/doc{i}.pdf", "source": "ManualUpload"}
+        records.append({"messageId": uuid.uuid4().hex, "body": json.dumps(body)})
+    return {"Records": records}
+
+
+def run_mode(mode, args):
+    with aws_env() as aws:
+        create_pipeline_tables(aws["dynamodb"])
+        queues = create_pipeline_queues(aws["sqs"])
+        extraction = load_lambda("document_extraction_lambda")
+        # Clients are module level - point them at this mock before invoking
+        extraction.dynamodb_resource = aws["dynamodb"]
+        extraction.sqs = aws["sqs"]
+        extraction.TEXTRACT_COMPLETION_MODE = mode
+        extraction.TEXTRACT_SNS_TOPIC_ARN = "arn:aws:sns:us-east-1:040504913362:AmazonTextract-bench"
+        extraction.TEXTRACT_SNS_ROLE_ARN = "arn:aws:iam::040504913362:role/textract-sns"
+        blocks = synthetic_analysis_blocks(pages=args.pages)
+        stub = StubTextract(blocks_for=lambda name: blocks, latency_sec=args.api_latency_ms / 1000.0,
+                            job_duration_sec=args.job_seconds if mode == "poll" else None)
+        extraction.textract = stub
+
+        start = time.perf_counter()
+        result = extraction.lambda_handler(sqs_event(args.docs), None)
+        billed = time.perf_counter() - start
+        assert not result["batchItemFailures"], result
+
+        if mode == "notification":
+            time.sleep(args.job_seconds)  # Textract works, no lambda is running
+            start = time.perf_counter()
+            result = extraction.textract_completion_handler(stub.complete_all(), None)
+            billed += time.perf_counter() - start
+            assert not result["batchItemFailures"], result
+
+        rows = aws["dynamodb"].Table("nmm-doc-extraction").scan()["Items"]
+        statuses = {item["extraction_status"] for item in aws["dynamodb"].Table("nmm-dashboard").scan()["Items"]}
+        queued = aws["sqs"].get_queue_attributes(QueueUrl=queues["NMM_DocProcessingAfterExtractionQueueNew"],
+                                                 AttributeNames=["ApproximateNumberOfMessages"])
+        assert statuses == {"Completed"}, statuses
+        assert int(queued["Attributes"]["ApproximateNumberOfMessages"]) == args.docs
+        texts = sorted((item["docid"], item["rawtext"], item["keyvaluesText"], item["tbltxt"]) for item in rows)
+        return billed, stub.calls["get_document_analysis"], texts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=5)
+    parser.add_argument("--job-seconds", type=float, default=2.0, help="simulated Textract job duration")
+    parser.add_argument("--pages", type=int, default=3)
+    parser.add_argument("--api-latency-ms", type=float, default=5.0)
+    parser.add_argument("--verbose", action="store_true", help="show the lambda output")
+    args = parser.parse_args()
+
+    print(f"{'mode':>13} {'billed s':>9} {'get_document_analysis':>22}")
+    results = {}
+    for mode in ["poll", "notification"]:
+        # The lambdas print every step - keep the table readable unless asked for
+        with contextlib.redirect_stdout(io.StringIO()) if not args.verbose else contextlib.nullcontext():
+            billed, calls, texts = run_mode(mode, args)
+        results[mode] = texts
+        print(f"{mode:>13} {billed:>9.2f} {calls:>22}")
+    assert results["poll"] == results["notification"], "modes stored different extraction text"
+    print("Stored extraction identical in both modes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Benchmark concurrent Textract submission in document_extraction_lambda.get_doc_text.
+
+A claim packet of --files attachments is analysed against StubTextract, with job
+durations spread between --min-job-seconds and --max-job-seconds. With one job in
+flight the packet takes the sum of all job times; with every job in flight it
+should take roughly the longest one plus the backoff overshoot of the last poll.
+Also reports the get_document_analysis calls spent on polling and fetching.
+
+Usage:
+    pip install -r requirements.txt
+    python bench_textract_concurrency.py [--files 6] [--min-job-seconds 0.5] [--max-job-seconds 2]
+"""
+import argparse
+import contextlib
+import io
+import threading
+import time
+
+from bench_env import aws_env, load_lambda
+from textract_stub import StubTextract, synthetic_analysis_blocks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=6)
+    parser.add_argument("--min-job-seconds", type=float, default=0.5)
+    parser.add_argument("--max-job-seconds", type=float, default=2.0)
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--api-latency-ms", type=float, default=20.0)
+    parser.add_argument("--poll-base-seconds", type=float, default=0.1)
+    parser.add_argument("--poll-max-seconds", type=float, default=0.5)
+    args = parser.parse_args()
+
+    files = [f"claims/packet/attachment{i}.pdf" for i in range(args.files)]
+    step = (args.max_job_seconds - args.min_job_seconds) / max(1, args.files - 1)
+    durations = {name: args.min_job_seconds + i * step for i, name in enumerate(files)}
+    blocks = synthetic_analysis_blocks(pages=args.pages)
+    print(f"{args.files} files, job times sum {sum(durations.values()):.2f}s, longest {max(durations.values()):.2f}s")
+
+    with aws_env():
+        extraction = load_lambda("document_extraction_lambda")
+        extraction.TEXTRACT_POLL_BASE_SEC = args.poll_base_seconds
+        extraction.TEXTRACT_POLL_MAX_SEC = args.poll_max_seconds
+
+        print(f"{'in-flight cap':>13} {'wall s':>8} {'polls':>6} {'speedup':>8}")
+        baseline = None
+        reference = None
+        for cap in sorted({1, max(1, args.files // 2), args.files}):
+            extraction.textract_inflight = threading.BoundedSemaphore(cap)
+            stub = StubTextract(blocks_for=lambda name: blocks, latency_sec=args.api_latency_ms / 1000.0,
+                                job_duration_sec=durations.__getitem__, max_results=1000)
+            extraction.textract = stub
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = extraction.get_doc_text(files)
+            wall = time.perf_counter() - start
+            reference = reference or result
+            assert result == reference, "results differ between caps"
+            baseline = baseline or wall
+            print(f"{cap:>13} {wall:>8.2f} {stub.calls['get_document_analysis']:>6} {baseline / wall:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Benchmark the streaming Textract parser of document_extraction_lambda.
+
+Compares extract_job_text (result pages parsed as they are fetched, one document
+page buffered) with the previous approach - collect every get_document_analysis
+response, build a trp.Document and concatenate rawtext with += - on synthetic
+documents of increasing length. Reports wall time and the tracemalloc peak; both
+parsers must return identical tblcont/rawtext/keyvaluesText.
+
+Usage:
+    pip install -r requirements.txt
+    python bench_textract_parser.py [--pages 50 200 800]
+"""
+import argparse
+import contextlib
+import io
+import time
+import tracemalloc
+
+from trp import Document
+
+from bench_env import aws_env, load_lambda
+from textract_stub import StubTextract, synthetic_analysis_blocks
+
+
+def collect_pages(textract, jobId):
+    pages = []
+    response = textract.get_document_analysis(JobId=jobId)
+    pages.append(response)
+    while 'NextToken' in response:
+        response = textract.get_document_analysis(JobId=jobId, NextToken=response['NextToken'])
+        pages.append(response)
+    return pages
+
+
+def trp_parseresp(resanal):
+    """The parser the lambda used before streaming"""
+    doc = Document(resanal)
+    tblcont = []
+    rawtext = ""
+    keyvaluesText = []
+    tblindex = 0
+    for resultPage in doc.pages:
+        for Line in resultPage.lines:
+            rawtext += Line.text + "\n"
+        for field in resultPage.form.fields:
+            keyvaluesText.append("Key: {}, Value: {}".format(field.key, field.value))
+        for table in resultPage.tables:
+            clnmtxt = 'Tabluar Data Processing '
+            col = []
+            for r, row in enumerate(table.rows):
+                for c, cell in enumerate(row.cells):
+                    if r == 0:
+                        col.append({str(c): cell.text if cell.text != "" else "description:-"})
+            for r, row in enumerate(table.rows):
+                for c, cell in enumerate(row.cells):
+                    if r != 0:
+                        clnmtxt += col[c][str(c)] + " " + cell.text + ","
+                clnmtxt += ';'
+            tblcont.append({tblindex: clnmtxt})
+            tblindex += 1
+    return tblcont, rawtext, keyvaluesText
+
+
+def measure(parse):
+    tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = parse()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak / 2 ** 20, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[50, 200, 800])
+    args = parser.parse_args()
+
+    with aws_env():
+        extraction = load_lambda("document_extraction_lambda")
+        print(f"{'pages':>6} {'blocks':>8} {'trp s':>7} {'trp MiB':>8} {'stream s':>9} {'stream MiB':>11}")
+        for pages in args.pages:
+            blocks = synthetic_analysis_blocks(pages=pages)
+            stub = StubTextract(blocks_for=lambda name: blocks, auto_complete=True, fresh_responses=True)
+            extraction.textract = stub
+            job_id = stub.start_document_analysis(DocumentLocation={"S3Object": {"Bucket": "b", "Name": "long.pdf"}})["JobId"]
+
+            trp_sec, trp_mib, expected = measure(lambda: trp_parseresp(collect_pages(stub, job_id)))
+            stream_sec, stream_mib, result = measure(lambda: extraction.extract_job_text(job_id))
+            assert result == expected, "streaming parser output differs from trp"
+            print(f"{pages:>6} {len(blocks):>8} {trp_sec:>7.2f} {trp_mib:>8.1f} {stream_sec:>9.2f} {stream_mib:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+Local stand-in for the asynchronous Textract document analysis API.
+
+StubTextract answers start_document_analysis / get_document_analysis from
+synthetic (or recorded) block lists. Jobs stay IN_PROGRESS until complete_job()
+is called, which returns the SQS event the completion SNS topic would have
+delivered - feed it to document_extraction_lambda.textract_completion_handler.
+"""
+import copy
+import itertools
+import json
+import random
+import threading
+import time
+import uuid
+
+WORDS = ["claim", "injury", "employee", "date", "report", "medical", "policy", "number",
+         "treatment", "patient", "insurer", "address", "return", "work", "diagnosis", "status"]
+
+
+def _geometry(rng):
+    left, top = rng.random() * 0.8, rng.random() * 0.9
+    return {
+        "BoundingBox": {"Width": 0.1, "Height": 0.02, "Left": left, "Top": top},
+        "Polygon": [{"X": left, "Y": top}, {"X": left + 0.1, "Y": top},
+                    {"X": left + 0.1, "Y": top + 0.02}, {"X": left, "Y": top + 0.02}],
+    }
+
+
+def synthetic_analysis_blocks(pages=1, lines_per_page=40, fields_per_page=10, tables_per_page=1,
+                              table_rows=5, table_cols=4, seed=7):
+    """
+    Build a Textract FORMS+TABLES block list shaped like a real analysis result
+
+    Every LINE, KEY/VALUE and CELL gets its own WORD children, so block count grows
+    roughly as pages * (2 * lines + 4 * fields + 2 * rows * cols).
+    """
+    rng = random.Random(seed)
+    ids = (f"blk-{n:08d}" for n in itertools.count())
+    blocks = []
+
+    def word_blocks(count, page):
+        words = []
+        for _ in range(count):
+            words.append({"BlockType": "WORD", "Id": next(ids), "Page": page, "Confidence": 99.0,
+                          "Text": rng.choice(WORDS), "Geometry": _geometry(rng)})
+        return words
+
+    for page in range(1, pages + 1):
+        page_block = {"BlockType": "PAGE", "Id": next(ids), "Page": page, "Geometry": _geometry(rng),
+                      "Relationships": [{"Type": "CHILD", "Ids": []}]}
+        blocks.append(page_block)
+        page_children = page_block["Relationships"][0]["Ids"]
+
+        for _ in range(lines_per_page):
+            words = word_blocks(rng.randint(3, 8), page)
+            line = {"BlockType": "LINE", "Id": next(ids), "Page": page, "Confidence": 99.0,
+                    "Text": " ".join(w["Text"] for w in words), "Geometry": _geometry(rng),
+                    "Relationships": [{"Type": "CHILD", "Ids": [w["Id"] for w in words]}]}
+            page_children.append(line["Id"])
+            blocks.append(line)
+            blocks.extend(words)
+
+        for _ in range(fields_per_page):
+            key_words, value_words = word_blocks(2, page), word_blocks(2, page)
+            value = {"BlockType": "KEY_VALUE_SET", "Id": next(ids), "Page": page, "Confidence": 95.0,
+                     "EntityTypes": ["VALUE"], "Geometry": _geometry(rng),
+                     "Relationships": [{"Type": "CHILD", "Ids": [w["Id"] for w in value_words]}]}
+            key = {"BlockType": "KEY_VALUE_SET", "Id": next(ids), "Page": page, "Confidence": 95.0,
+                   "EntityTypes": ["KEY"], "Geometry": _geometry(rng),
+                   "Relationships": [{"Type": "VALUE", "Ids": [value["Id"]]},
+                                     {"Type": "CHILD", "Ids": [w["Id"] for w in key_words]}]}
+            blocks.extend([key, value] + key_words + value_words)
+
+        for _ in range(tables_per_page):
+            cells = []
+            for r in range(1, table_rows + 1):
+                for c in range(1, table_cols + 1):
+                    words = word_blocks(1, page)
+                    cells.append({"BlockType": "CELL", "Id": next(ids), "Page": page, "Confidence": 90.0,
+                                  "RowIndex": r, "ColumnIndex": c, "RowSpan": 1, "ColumnSpan": 1,
+                                  "Geometry": _geometry(rng),
+                                  "Relationships": [{"Type": "CHILD", "Ids": [w["Id"] for w in words]}]})
+                    cells.extend(words)
+            table = {"BlockType": "TABLE", "Id": next(ids), "Page": page, "Confidence": 90.0,
+                     "Geometry": _geometry(rng),
+                     "Relationships": [{"Type": "CHILD", "Ids": [b["Id"] for b in cells if b["BlockType"] == "CELL"]}]}
+            blocks.append(table)
+            blocks.extend(cells)
+
+    return blocks
+
+
+def paginate_blocks(blocks, max_results=1000, pages=None):
+    """Split a block list into get_document_analysis responses of at most max_results blocks"""
+    responses = []
+    pages = pages or max((b.get("Page", 1) for b in blocks), default=1)
+    for start in range(0, max(len(blocks), 1), max_results):
+        responses.append({
+            "JobStatus": "SUCCEEDED",
+            "DocumentMetadata": {"Pages": pages},
+            "Blocks": blocks[start:start + max_results],
+        })
+    for i, response in enumerate(responses[:-1]):
+        response["NextToken"] = f"token-{i + 1}"
+    return responses
+
+
+class StubTextract:
+    """
+    Minimal textract client replacement for start/get_document_analysis
+
+    Args:
+        blocks_for (callable): Returns the block list for an S3 object name. Defaults to a
+            one-page synthetic document
+        latency_sec (float): Delay added to every API call, standing in for the network
+        auto_complete (bool): Jobs succeed as soon as they are started
+        job_duration_sec (float or callable): Jobs succeed on their own this long after they
+            start (for polling mode), or a function of the S3 object name returning that time.
+            None leaves them IN_PROGRESS until complete_job()
+        max_results (int): Blocks per get_document_analysis response
+        fresh_responses (bool): Return a new copy of every response, like botocore deserializing
+            it, so the caller owns (and pays the memory for) each page it keeps
+    """
+
+    def __init__(self, blocks_for=None, latency_sec=0.0, auto_complete=False, job_duration_sec=None, max_results=1000,
+                 fresh_responses=False):
+        self.blocks_for = blocks_for or (lambda name: synthetic_analysis_blocks())
+        self.latency_sec = latency_sec
+        self.auto_complete = auto_complete
+        self.job_duration_sec = job_duration_sec
+        self.max_results = max_results
+        self.fresh_responses = fresh_responses
+        self.jobs = {}
+        self.calls = {"start_document_analysis": 0, "get_document_analysis": 0}
+        self._lock = threading.Lock()
+
+    def _sleep(self):
+        if self.latency_sec:
+            time.sleep(self.latency_sec)
+
+    def start_document_analysis(self, **request):
+        self._sleep()
+        with self._lock:
+            self.calls["start_document_analysis"] += 1
+        job_id = uuid.uuid4().hex
+        name = request["DocumentLocation"]["S3Object"]["Name"]
+        duration = self.job_duration_sec(name) if callable(self.job_duration_sec) else self.job_duration_sec
+        self.jobs[job_id] = {
+            "request": request,
+            "duration": duration,
+            "status": "SUCCEEDED" if self.auto_complete else "IN_PROGRESS",
+            "started": time.monotonic(),
+            "responses": paginate_blocks(self.blocks_for(name), self.max_results),
+        }
+        return {"JobId": job_id}
+
+    def get_document_analysis(self, JobId, NextToken=None, MaxResults=None):
+        self._sleep()
+        with self._lock:
+            self.calls["get_document_analysis"] += 1
+        job = self.jobs[JobId]
+        if (job["status"] == "IN_PROGRESS" and job["duration"] is not None
+                and time.monotonic() - job["started"] >= job["duration"]):
+            job["status"] = "SUCCEEDED"
+        if job["status"] != "SUCCEEDED":
+            return {"JobStatus": job["status"]}
+        index = int(NextToken.split("-")[1]) if NextToken else 0
+        if self.fresh_responses:
+            return copy.deepcopy(job["responses"][index])
+        return job["responses"][index]
+
+    def complete_job(self, job_id, status="SUCCEEDED"):
+        """Finish a job and return the SQS record its SNS completion message produces"""
+        job = self.jobs[job_id]
+        job["status"] = status
+        request = job["request"]
+        message = {
+            "JobId": job_id,
+            "Status": status,
+            "API": "StartDocumentAnalysis",
+            "JobTag": request.get("JobTag"),
+            "Timestamp": int(time.time() * 1000),
+            "DocumentLocation": {
+                "S3ObjectName": request["DocumentLocation"]["S3Object"]["Name"],
+                "S3Bucket": request["DocumentLocation"]["S3Object"]["Bucket"],
+            },
+        }
+        envelope = {
+            "Type": "Notification",
+            "MessageId": uuid.uuid4().hex,
+            "TopicArn": request.get("NotificationChannel", {}).get("SNSTopicArn", "arn:aws:sns:us-east-1:000000000000:stub"),
+            "Message": json.dumps(message),
+        }
+        return {"messageId": uuid.uuid4().hex, "body": json.dumps(envelope)}
+
+    def complete_all(self, status="SUCCEEDED"):
+        """Finish every pending job and return one SQS event holding all completion messages"""
+        pending = [job_id for job_id, job in self.jobs.items() if job["status"] == "IN_PROGRESS"]
+        return {"Records": [self.complete_job(job_id, status) for job_id in pending]}
@@ -0,0 +1,255 @@
+import array
+import base64
+import hashlib
+import json
+import math
+import os
+import re
+import time
+
+import boto3
+from boto3.dynamodb.conditions import Key
+from bedrock_gateway import TITAN_EMBED_MODEL_ID, embed_text
+from instrumentation import emit_metrics
+from structured_log import log
+
+# Answers of earlier standalone questions per document, reused while the extraction is unchanged
+CHAT_ANSWER_CACHE_ENABLED = os.environ.get("CHAT_ANSWER_CACHE", "off") == "on"
+CHAT_ANSWER_CACHE_TABLE = os.environ.get("CHAT_ANSWER_CACHE_TABLE", "nmm-chat-answer-cache")
+CHAT_ANSWER_CACHE_TTL_DAYS = float(os.environ.get("CHAT_ANSWER_CACHE_TTL_DAYS", "30"))
+# Cosine similarity of Titan embeddings above which a differently worded question counts as the
+# same question; 0 matches normalized questions exactly only (no embedding calls)
+CHAT_ANSWER_CACHE_SIMILARITY = float(os.environ.get("CHAT_ANSWER_CACHE_SIMILARITY", "0"))
+# Cached questions of a document compared by similarity, newest keys first
+CHAT_ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("CHAT_ANSWER_CACHE_MAX_ENTRIES", "100"))
+# Answer "what is the <field>" questions from extracted_entities, without Bedrock
+CHAT_FAQ_ANSWERS = os.environ.get("CHAT_FAQ_ANSWERS", "false").lower() == "true"
+# Lowest field confidence (set by the confidence score lambda) answered from extracted_entities
+CHAT_FAQ_MIN_CONFIDENCE = float(os.environ.get("CHAT_FAQ_MIN_CONFIDENCE", "0.8"))
+
+EMBEDDING_DIMENSIONS = 256
+# Questions longer than this are too specific to be asked again
+MAX_CACHEABLE_WORDS = 25
+QUERY_STOPWORDS = {'a', 'an', 'the', 'is', 'are', 'was', 'were', 'be', 'of', 'for', 'in', 'on', 'to', 'at', 'by',
+                   'please', 'tell', 'me', 'can', 'could', 'you', 'would', 'do', 'does', 'did', 'give', 'show',
+                   'document', 'this', 'listed', 'mentioned', 'stated', 'given'}
+# Words that point back into the conversation: the answer depends on the turns before
+FOLLOW_UP_WORDS = {'it', 'its', 'that', 'those', 'these', 'he', 'she', 'him', 'her', 'his', 'hers', 'they',
+                   'them', 'their', 'above', 'previous', 'earlier', 'again', 'else', 'more', 'also', 'same',
+                   'instead', 'then'}
+QUESTION_WORDS = {'what', 'who', 'when', 'where', 'which', 'whose', 'how', 'why', 'name'}
+# Question words that stand for words of a field name (who is the claimant -> employee name)
+FIELD_SYNONYMS = {
+    'employee': {'claimant', 'worker', 'employee'},
+    'employer': {'employer', 'company'},
+    'injury': {'injury', 'accident', 'incident'},
+    'number': {'number', 'no', 'num', 'id'},
+    'insurer': {'insurer', 'carrier', 'insurance'},
+    'physician': {'physician', 'doctor', 'provider'},
+    'birth': {'birth', 'born', 'dob'},
+}
+# Field-name words a question may leave out
+OPTIONAL_FIELD_WORDS = {'name', 'id', 'jcn', 'of', 'the', 'if', 'any', 'initial'}
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+dynamodb_resource = boto3.resource("dynamodb")
+
+
+def query_words(query):
+    words = []
+    for word in _WORD_RE.findall(str(query).lower()):
+        if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        words.append(word)
+    return words
+
+
+def normalize_query(query):
+    """Lower-case words of a question without filler words, e.g. "what date injury" """
+    return " ".join(word for word in query_words(query) if word not in QUERY_STOPWORDS)
+
+
+def is_cacheable(query):
+    """True for questions that stand on their own, i.e. whose answer does not depend on the chat so far"""
+    words = query_words(query)
+    return 0 < len(words) <= MAX_CACHEABLE_WORDS and not FOLLOW_UP_WORDS.intersection(words)
+
+
+def extraction_version(extractionDet):
+    """
+    Fingerprint of what an answer about the document depends on: the extracted entities
+    (rewritten by the confidence score lambda and by reviewers), and the extraction itself
+    (its time and the hash of its offloaded raw text)
+    """
+    parts = [str(extractionDet.get("extracted_entities", "")), str(extractionDet.get("current_datetime", "")),
+             str(extractionDet.get("document_name", "")),
+             str(extractionDet.get("payload_refs", {}).get("rawtext", {}).get("sha256", ""))]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()[:32]
+
+
+def encode_embedding(vector):
+    return base64.b64encode(array.array('f', vector).tobytes()).decode('ascii')
+
+
+def decode_embedding(text):
+    values = array.array('f')
+    values.frombytes(base64.b64decode(text))
+    return values
+
+
+def cosine(first, second):
+    dot = sum(x * y for x, y in zip(first, second))
+    norm = math.sqrt(sum(x * x for x in first)) * math.sqrt(sum(y * y for y in second))
+    return dot / norm if norm else 0.0
+
+
+def entity_leaves(extracted_entities):
+    """(field name, value, confidence or None) of every filled leaf of extracted_entities"""
+    entities = extracted_entities
+    if isinstance(entities, str):
+        try:
+            entities = json.loads(entities)
+        except ValueError:
+            return []
+    leaves = []
+
+    def confidence_of(field):
+        # The confidence score lambda writes "97%" strings; a 0-1 float is taken as it is
+        confidence = field.get('confidence')
+        try:
+            if isinstance(confidence, str) and confidence.strip().endswith('%'):
+                return float(confidence.strip()[:-1]) / 100
+            return float(confidence)
+        except (TypeError, ValueError):
+            return None
+
+    def walk(node):
+        for key, value in node.items():
+            if not isinstance(value, dict):
+                continue
+            if 'value' not in value:
+                walk(value)
+                continue
+            field_value = value.get('value')
+            if isinstance(field_value, dict):
+                field_value = field_value.get('current_value', '')
+            if isinstance(field_value, str) and field_value.strip():
+                leaves.append((key, field_value.strip(), confidence_of(value)))
+    if isinstance(entities, dict):
+        walk(entities)
+    return leaves
+
+
+def _covers(query_word, field_word):
+    return query_word == field_word or query_word in FIELD_SYNONYMS.get(field_word, ())
+
+
+def faq_answer(query, extractionDet):
+    """
+    Answer of a plain "what is the <field>" question from extracted_entities, None otherwise
+
+    The question's words (apart from question and filler words) must all stand for words of
+    exactly one field name, and that field's words must all be asked for. Fields whose
+    confidence is below CHAT_FAQ_MIN_CONFIDENCE, or not scored yet, are left to the LLM.
+    """
+    asked = [word for word in query_words(query) if word not in QUERY_STOPWORDS and word not in QUESTION_WORDS]
+    if not asked or FOLLOW_UP_WORDS.intersection(query_words(query)):
+        return None
+    matches = []
+    for field, value, confidence in entity_leaves(extractionDet.get("extracted_entities")):
+        field_words = [word for word in query_words(field.replace('_', ' ')) if word not in OPTIONAL_FIELD_WORDS]
+        if not field_words:
+            continue
+        if all(any(_covers(word, field_word) for field_word in field_words) for word in asked) and \
+                all(any(_covers(word, field_word) for word in asked) for field_word in field_words):
+            matches.append((field, value, confidence))
+    if len({(field, value) for field, value, _ in matches}) != 1:
+        return None
+    field, value, confidence = matches[0]
+    if CHAT_FAQ_MIN_CONFIDENCE > 0 and (confidence is None or confidence < CHAT_FAQ_MIN_CONFIDENCE):
+        return None
+    label = field.replace('_', ' ')
+    documents = extractionDet.get("document_name") or []
+    source = f" Source: {', '.join(str(name) for name in documents)}" if documents else ""
+    return f"The {label} is {value} (from the extracted fields of the document).{source}"
+
+
+def lookup(docid, query, extractionDet):
+    """
+    Answer of the question without Bedrock, if there is one: from extracted_entities, or an
+    answer cached for the same (or, with embeddings, a similar) question on the same extraction
+
+    Returns:
+        dict: {"answer": str or None, "source": "entities" | "exact" | "similar" | None, ...},
+              to be passed to store() after a Bedrock answer
+    """
+    result = {"answer": None, "source": None, "docid": docid, "query": query,
+              "key": "q#" + normalize_query(query), "version": extraction_version(extractionDet),
+              "cacheable": CHAT_ANSWER_CACHE_ENABLED and is_cacheable(query), "embedding": None}
+    try:
+        if CHAT_FAQ_ANSWERS:
+            answer = faq_answer(query, extractionDet)
+            if answer:
+                result.update(answer=answer, source="entities")
+                return _counted(result)
+        if not result["cacheable"]:
+            return result
+
+        table = dynamodb_resource.Table(CHAT_ANSWER_CACHE_TABLE)
+        item = table.get_item(Key={'docid': docid, 'query_key': result["key"]}).get('Item')
+        if item and item.get('version') == result["version"] and int(item.get('expires_at', 0)) > time.time():
+            result.update(answer=item['answer'], source="exact")
+            return _counted(result)
+
+        if CHAT_ANSWER_CACHE_SIMILARITY > 0:
+            result["embedding"] = embed_text(normalize_query(query) or query, TITAN_EMBED_MODEL_ID,
+                                             EMBEDDING_DIMENSIONS, region="us-west-2",
+                                             assumed_role=os.environ.get("BEDROCK_ASSUME_ROLE"), stage="chat_cache")
+            response = table.query(KeyConditionExpression=Key('docid').eq(docid), ScanIndexForward=False,
+                                   Limit=CHAT_ANSWER_CACHE_MAX_ENTRIES)
+            best, best_item = 0.0, None
+            for entry in response.get('Items', []):
+                if entry.get('version') != result["version"] or not entry.get('embedding'):
+                    continue
+                similarity = cosine(result["embedding"], decode_embedding(entry['embedding']))
+                if similarity > best:
+                    best, best_item = similarity, entry
+            if best_item is not None and best >= CHAT_ANSWER_CACHE_SIMILARITY:
+                log.info("Similar cached question", docid=docid, similarity=round(best, 3))
+                log.debug("Similar cached question", docid=docid, question=best_item.get('question'))
+                result.update(answer=best_item['answer'], source="similar")
+                return _counted(result)
+    except Exception as error:
+        # The cache only saves a Bedrock call - answer normally when it is unavailable
+        log.exception("Exception in answer_cache.lookup()", docid=docid, error=str(error))
+        result["cacheable"] = False
+    return _counted(result)
+
+
+def _counted(result):
+    emit_metrics({"ChatAnswerCacheHit": int(result["source"] in ("exact", "similar")),
+                  "ChatAnswerFromEntities": int(result["source"] == "entities")},
+                 docid=result["docid"], source=result["source"] or "bedrock")
+    return result
+
+
+def store(result, answer):
+    """Cache the Bedrock answer of a question looked up with lookup()"""
+    if not result["cacheable"] or result["source"] or not answer:
+        return
+    item = {
+        "docid": result["docid"],
+        "query_key": result["key"],
+        "question": result["query"],
+        "answer": answer,
+        "version": result["version"],
+        "created_at": int(time.time()),
+        "expires_at": int(time.time() + CHAT_ANSWER_CACHE_TTL_DAYS * 86400),
+    }
+    if result["embedding"]:
+        item["embedding"] = encode_embedding(result["embedding"])
+    try:
+        dynamodb_resource.Table(CHAT_ANSWER_CACHE_TABLE).put_item(Item=item)
+    except Exception as error:
+        log.error("Exception in answer_cache.store()", docid=result["docid"], error=str(error))
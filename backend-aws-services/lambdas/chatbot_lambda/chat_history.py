@@ -0,0 +1,167 @@
+import datetime
+import os
+import re
+import time
+
+import boto3
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from bedrock_gateway import HAIKU_MODEL_ID, invoke_claude
+from structured_log import log
+
+# One item per chat turn, keyed by conversation ("docid#userid#sessionid") and turn time,
+# plus one rolling-summary item per conversation for the turns older than the window
+CHAT_HISTORY_TABLE = os.environ.get("CHAT_HISTORY_TABLE", "nmm-chathistory-turns")
+# Turns sent verbatim with each question
+CHAT_HISTORY_WINDOW = int(os.environ.get("CHAT_HISTORY_WINDOW", "6"))
+# "extractive" - older turns are kept as question + first sentence of the answer
+# "llm"        - older turns are folded into a short summary by Claude 3 Haiku
+CHAT_HISTORY_SUMMARY_MODE = os.environ.get("CHAT_HISTORY_SUMMARY_MODE", "extractive")
+CHAT_HISTORY_SUMMARY_CHARS = int(os.environ.get("CHAT_HISTORY_SUMMARY_CHARS", "4000"))
+# Items expire this long after they are written (DynamoDB TTL on expires_at); 0 keeps them
+CHAT_HISTORY_TTL_DAYS = float(os.environ.get("CHAT_HISTORY_TTL_DAYS", "0"))
+
+TURN_PREFIX = "turn#"
+SUMMARY_KEY = "summary"
+ANSWER_SNIPPET_CHARS = 200
+# Separator and labels of the historicqa text the chatbot always built, so prompts look the same
+TURN_SEPARATOR = "\n------------------------------------\n"
+
+dynamodb_resource = boto3.resource("dynamodb")
+
+
+def conversation_key(docid, userid, sessionid):
+    return f"{docid}#{userid}#{sessionid}"
+
+
+def load_history(docid, userid, sessionid):
+    """
+    The rolling summary and the last CHAT_HISTORY_WINDOW turns of a conversation
+
+    One get_item and one query with Limit, whatever the length of the conversation.
+
+    Returns:
+        dict: {"conversation", "docid", "userid", "sessionid", "summary", "summarized_through",
+               "turns": [{"turn_at", "query", "answer"}] oldest first}
+    """
+    table = dynamodb_resource.Table(CHAT_HISTORY_TABLE)
+    conversation = conversation_key(docid, userid, sessionid)
+    summary_item = table.get_item(Key={'conversation': conversation, 'turn_at': SUMMARY_KEY}).get('Item', {})
+    turns = []
+    if CHAT_HISTORY_WINDOW > 0:
+        response = table.query(
+            KeyConditionExpression=Key('conversation').eq(conversation) & Key('turn_at').begins_with(TURN_PREFIX),
+            ScanIndexForward=False,
+            Limit=CHAT_HISTORY_WINDOW,
+        )
+        turns = [{"turn_at": item["turn_at"], "query": item.get("query", ""), "answer": item.get("answer", "")}
+                 for item in reversed(response.get('Items', []))]
+    return {
+        "conversation": conversation, "docid": docid, "userid": userid, "sessionid": sessionid,
+        "summary": summary_item.get("summary", ""),
+        "summarized_through": summary_item.get("summarized_through", ""),
+        "turns": turns,
+    }
+
+
+def format_turn(query, answer):
+    return TURN_SEPARATOR + " User Query = " + query + " \n\n Answer = " + answer
+
+
+def format_history(history):
+    """historicqa text of a loaded history: the summary of older turns, then the recent turns"""
+    text = ""
+    if history["summary"]:
+        text = "Summary of earlier questions and answers:\n" + history["summary"]
+    for turn in history["turns"]:
+        text += format_turn(turn["query"], turn["answer"])
+    return text
+
+
+def append_turn(history, query, answer):
+    """
+    Write a new turn, and fold the turn that drops out of the window into the summary
+
+    Two writes per turn: the new turn item, and (once the window is full) an update of
+    the summary item. The summary update is conditional on summarized_through, so a turn
+    is never folded in twice.
+    """
+    table = dynamodb_resource.Table(CHAT_HISTORY_TABLE)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    item = {
+        "conversation": history["conversation"],
+        "turn_at": TURN_PREFIX + now.isoformat(),
+        "docid": history["docid"],
+        "userid": history["userid"],
+        "sessionid": history["sessionid"],
+        "query": query,
+        "answer": answer,
+    }
+    if CHAT_HISTORY_TTL_DAYS > 0:
+        item["expires_at"] = int(time.time() + CHAT_HISTORY_TTL_DAYS * 86400)
+    table.put_item(Item=item)
+    history["turns"].append({"turn_at": item["turn_at"], "query": query, "answer": answer})
+
+    if len(history["turns"]) <= CHAT_HISTORY_WINDOW:
+        return
+    evicted = history["turns"].pop(0)
+    if evicted["turn_at"] <= history["summarized_through"]:
+        return
+    summary = update_summary(history["summary"], evicted["query"], evicted["answer"])
+    update = {
+        "Key": {"conversation": history["conversation"], "turn_at": SUMMARY_KEY},
+        "UpdateExpression": "SET summary = :summary, summarized_through = :through, docid = :docid",
+        "ConditionExpression": "attribute_not_exists(summarized_through) OR summarized_through < :through",
+        "ExpressionAttributeValues": {":summary": summary, ":through": evicted["turn_at"],
+                                      ":docid": history["docid"]},
+    }
+    if CHAT_HISTORY_TTL_DAYS > 0:
+        update["UpdateExpression"] += ", expires_at = :expires_at"
+        update["ExpressionAttributeValues"][":expires_at"] = item["expires_at"]
+    try:
+        table.update_item(**update)
+        history["summary"], history["summarized_through"] = summary, evicted["turn_at"]
+    except ClientError as error:
+        if error.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        log.warning("⚠️ Turn was already summarized", turn_at=evicted['turn_at'], conversation=history['conversation'])
+
+
+def update_summary(summary, query, answer):
+    """The rolling summary with one more turn folded in"""
+    if CHAT_HISTORY_SUMMARY_MODE == "llm":
+        try:
+            return llm_summary(summary, query, answer)
+        except Exception as error:
+            log.exception("Exception in llm_summary(), keeping an extractive summary", error=str(error))
+    return extractive_summary(summary, query, answer)
+
+
+def extractive_summary(summary, query, answer):
+    """Question and first sentence of the answer, appended; the oldest lines go past CHAT_HISTORY_SUMMARY_CHARS"""
+    first_sentence = re.split(r"(?<=[.!?])\s", answer.strip(), maxsplit=1)[0][:ANSWER_SNIPPET_CHARS]
+    lines = (summary.split("\n") if summary else []) + [f"Q: {query.strip()} A: {first_sentence}"]
+    while len(lines) > 1 and sum(len(line) + 1 for line in lines) > CHAT_HISTORY_SUMMARY_CHARS:
+        lines.pop(0)
+    return "\n".join(lines)[-CHAT_HISTORY_SUMMARY_CHARS:]
+
+
+def llm_summary(summary, query, answer):
+    prompt = f"""
+    Below is a summary of a conversation about a claim document, and the next question and answer of that conversation.
+    Rewrite the summary so it also covers the new question and answer. Keep names, numbers, dates and sources.
+    Reply with the summary only, at most 150 words.
+
+    <summary>
+    {summary}
+    </summary>
+    <question>
+    {query}
+    </question>
+    <answer>
+    {answer}
+    </answer>
+    """
+    text = invoke_claude(prompt, HAIKU_MODEL_ID, max_tokens=400, region="us-west-2",
+                         assumed_role=os.environ.get("BEDROCK_ASSUME_ROLE"), stage="chat_summary")
+    return text.strip()[:CHAT_HISTORY_SUMMARY_CHARS] if text and text.strip() else extractive_summary(summary, query, answer)
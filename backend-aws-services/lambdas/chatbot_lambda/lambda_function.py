@@ -2,75 +2,50 @@ import boto3
 import json
 import os
 import sys
-from botocore.config import Config
 from botocore.exceptions import ClientError
 import time
 import datetime
 import decimal
-from typing import Optional
-import traceback
 from boto3.dynamodb.conditions import Key, Attr
+from extraction_payloads import hydrate_payloads
+from bedrock_gateway import HAIKU_MODEL_ID, invoke_claude, stream_claude
+from collections import OrderedDict
+import re
+import chunk_index
+from instrumentation import emit_metrics
+from structured_log import log
+from prompt_budget import estimate_tokens
+import chat_history
+import answer_cache
 
 os.environ["AWS_DEFAULT_REGION"] = "us-east-1"
 os.environ["BEDROCK_ASSUME_ROLE"] = "arn:aws:iam::040504913362:role/bedrock"
 
 dynamodb_resource = boto3.resource("dynamodb")
 
-def get_bedrock_client(assumed_role: Optional[str] = None, region: Optional[str] = None, runtime: Optional[bool] = True):
-    if region is None:
-        target_region = os.environ.get("AWS_REGION", os.environ.get("AWS_DEFAULT_REGION"))
-    else:
-        target_region = region
-
-    print(f"Create new client\n  Using region: {target_region}")
-    session_kwargs = {"region_name": target_region}
-    client_kwargs = {**session_kwargs}
-
-    profile_name = os.environ.get("AWS_PROFILE")
-    print('profile_name=', profile_name)
-    if profile_name:
-        print(f"  Using profile: {profile_name}")
-        session_kwargs["profile_name"] = profile_name
-
-    retry_config = Config(
-        region_name=target_region,
-        retries={
-            "max_attempts": 10,
-            "mode": "standard",
-        },
-    )
-    session = boto3.Session(**session_kwargs)
-
-    if assumed_role:
-        print(f"  Using role: {assumed_role}", end='')
-        sts = session.client("sts")
-        response = sts.assume_role(
-            RoleArn=str(assumed_role),
-            RoleSessionName="langchain-llm-1"
-        )
-        print(" ... successful!")
-        client_kwargs["aws_access_key_id"] = response["Credentials"]["AccessKeyId"]
-        client_kwargs["aws_secret_access_key"] = response["Credentials"]["SecretAccessKey"]
-        client_kwargs["aws_session_token"] = response["Credentials"]["SessionToken"]
-
-    if runtime:
-        service_name='bedrock-runtime'
-    else:
-        service_name='bedrock'
-
-    bedrock_client = session.client(
-        service_name=service_name,
-        config=retry_config,
-        **client_kwargs
-    )
+# "full"      - send the whole raw text with every question (original behaviour)
+# "retrieval" - send the CHATBOT_TOP_K chunks of the document most relevant to the question, with
+#               their source pages, from the chunk index built after extraction
+CHATBOT_CONTEXT_MODE = os.environ.get("CHATBOT_CONTEXT_MODE", "full")
+CHATBOT_TOP_K = int(os.environ.get("CHATBOT_TOP_K", "8"))
+# "legacy" - scan nmm-chathistory and save the whole accumulated history every turn (original behaviour)
+# "keyed"  - one item per turn in CHAT_HISTORY_TABLE, read back with a bounded query (see chat_history.py)
+CHAT_HISTORY_STORE = os.environ.get("CHAT_HISTORY_STORE", "legacy")
+# Streamed answers: the first text goes out at once, later text in pieces of about this size / age
+CHAT_STREAM_FLUSH_CHARS = int(os.environ.get("CHAT_STREAM_FLUSH_CHARS", "80"))
+CHAT_STREAM_FLUSH_SEC = float(os.environ.get("CHAT_STREAM_FLUSH_SEC", "0.15"))
+NO_ANSWER_TEXT = "I apologize, but I couldn't generate a response to your query."
+ERROR_ANSWER_TEXT = "I'm sorry, but I encountered an error while processing your question. Please try again."
+STREAM_CUT_OFF_NOTE = "\n\n(The answer was cut off by an error. Please ask again.)"
+connection_clients = {}
+# Parsed chunk indexes of recently asked documents, per container
+CHUNK_INDEX_CACHE_SIZE = 16
+chunk_index_cache = OrderedDict()
 
-    print("boto3 Bedrock client successfully created!")
-    print(bedrock_client._endpoint)
-    return bedrock_client
 
 def get_DashboardDetails(docid):
     
-    print('in get_DashboardDetails begin ',docid)
+    log.debug("Loading the dashboard record", docid=docid)
     
 #     dynamodb_resource = boto3.resource("dynamodb")
     dynamodb_tbl_nm4 = "nmm-dashboard"
@@ -83,7 +58,7 @@ def get_DashboardDetails(docid):
 
 def get_DocExtractionDetails(docid):
     
-    print('in get_DocExtractionDetails begin ', docid)
+    log.debug("Loading the extracted document", docid=docid)
     
 #     dynamodb_resource = boto3.resource("dynamodb")
     dynamodb_tbl_nm5 = "nmm-doc-extraction"
@@ -91,23 +66,27 @@ def get_DocExtractionDetails(docid):
 
     docExtractionDetails = dbtable1.get_item(Key={'docid': docid})
 #     print('docExtractionDetails = ',docExtractionDetails)
+    if 'Item' in docExtractionDetails:
+        # Only rawtext (or its chunk index) is used for the chat context - the other payloads stay in S3
+        item = docExtractionDetails['Item']
+        if CHATBOT_CONTEXT_MODE == "retrieval" and ('chunk_index' in item or 'chunk_index' in item.get('payload_refs', {})):
+            hydrate_payloads(item, fields=('chunk_index',))
+        else:
+            hydrate_payloads(item, fields=('rawtext',))
     
     return docExtractionDetails
 
 
 
 def save_chathistory(userid, sessionid, docid, historicqa):
-    print('inside save_chathistory()')
     try:
         # Get the current datetime
         current_datetime = datetime.datetime.now(datetime.timezone.utc)
         # Convert the datetime to ISO 8601 format        
         sort_key = current_datetime.isoformat()
-        print("sort_key (which is datetime) = ", sort_key)
 
         dynamodb_tbl_nm = "nmm-chathistory"
         dbtable = dynamodb_resource.Table(dynamodb_tbl_nm)
-        print('dbtable = ',dbtable)
         response = dbtable.put_item(
                                    Item={
                                        "docid": docid, 
@@ -118,18 +97,51 @@ def save_chathistory(userid, sessionid, docid, historicqa):
                                          }
                                     )
 
-        print("successfully inserted the record in DynamoDB Table 'nmm-chathistory'")
+        log.info("Saved the chat history", docid=docid, table=dynamodb_tbl_nm, history_chars=len(str(historicqa)))
         return 'Saved successfully to DynamoDB'
     
     except Exception as error:
-        print(f"Exception in save_chathistory() and the error is - {error}")  
-        print('Exception Details in save_chathistory() are - ',traceback.format_exc())
+        log.exception("Exception in save_chathistory()", docid=docid, error=str(error))
         return 'Unable to save the json in DynamoDB'
 
 
-def prep_query_response(query, historicqa, context, bedrock):
-    try:
-        prompt = f"""
+def get_chunk_index(docid, extractionDet):
+    """
+    The chunk index of a document: the one stored after extraction, or one built from the raw
+    text (without page numbers) for documents extracted before indexing was enabled
+    """
+    cache_key = (docid, extractionDet.get("current_datetime"))
+    index = chunk_index_cache.get(cache_key)
+    if index is None:
+        index = chunk_index.loads(extractionDet.get("chunk_index"))
+        if index is None:
+            log.info("No chunk index stored - indexing the raw text", docid=docid)
+            index = chunk_index.build_index(extractionDet.get("rawtext", ""))
+        chunk_index_cache[cache_key] = index
+        while len(chunk_index_cache) > CHUNK_INDEX_CACHE_SIZE:
+            chunk_index_cache.popitem(last=False)
+    chunk_index_cache.move_to_end(cache_key)
+    return index
+
+def previous_query(historicqa):
+    """The last user question of a chat history saved by getResponse"""
+    queries = re.findall(r"User Query = (.*?) \n\n Answer = ", historicqa or "", re.DOTALL)
+    return queries[-1] if queries else ""
+
+def retrieval_context(index, query, historicqa, docid=None):
+    """The CHATBOT_TOP_K chunks most relevant to the question (and the one before it), with their sources"""
+    results = chunk_index.search(index, query, CHATBOT_TOP_K, previous_query(historicqa))
+    if not results:
+        # Nothing matches the words of the question - fall back to the start of the document
+        results = [(0.0, chunk) for chunk in index["chunks"][:CHATBOT_TOP_K]]
+    context = chunk_index.format_context(results)
+    log.info("Retrieved chunks", docid=docid, retrieved=len(results), chunks=len(index['chunks']),
+             sources=[chunk_index.source_reference(chunk) for _, chunk in results])
+    emit_metrics({"ChatContextTokens": estimate_tokens(context), "ChatRetrievedChunks": len(results)}, docid=docid)
+    return context
+
+def build_prompt(query, historicqa, context):
+    return f"""
         <system>
             context is provided in <context></context> xml node.
             user query is provided in <userquery></userquery> xml node.
@@ -151,43 +163,29 @@ def prep_query_response(query, historicqa, context, bedrock):
         {context}
         </context>
         """
-        
-        model_id = "anthropic.claude-3-haiku-20240307-v1:0"
-        response = bedrock.invoke_model(
-            modelId=model_id,
-            body=json.dumps(
-                {
-                    "anthropic_version": "bedrock-2023-05-31",
-                    "max_tokens": 1000,
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": [{"type": "text", "text": prompt}],
-                        }
-                    ],
-                }
-            ),
-        )
 
-        result = json.loads(response.get("body").read())
-        output_list = result.get("content", [])
 
-        if output_list:
-            return output_list[0]["text"]
+def prep_query_response(query, historicqa, context):
+    try:
+        prompt = build_prompt(query, historicqa, context)
+        
+        # Cached client with refreshing assumed-role credentials, rate limited and retried on throttling
+        answer = invoke_claude(prompt, HAIKU_MODEL_ID, max_tokens=1000, region="us-west-2",
+                               assumed_role=os.environ.get("BEDROCK_ASSUME_ROLE"), stage="chatbot")
+
+        if answer:
+            return answer
         else:
-            return "I apologize, but I couldn't generate a response to your query."
+            return NO_ANSWER_TEXT
             
     except Exception as e:
-        print(f"Error in prep_query_response: {e}")
-        return "I'm sorry, but I encountered an error while processing your question. Please try again."
+        log.exception("Error in prep_query_response", error=str(e))
+        return ERROR_ANSWER_TEXT
 
 
 
 def get_HistoryQnA(docid, user_id, session_id):
     
-    print('in docid = ',docid)
-    print('in user_id = ',user_id)
-    print('in session_id = ',session_id)
     
 #     dynamodb_resource = boto3.resource("dynamodb")
     dynamodb_tbl_nm4 = "nmm-chathistory"
@@ -207,39 +205,217 @@ def get_HistoryQnA(docid, user_id, session_id):
     return response.get('Items', [])     
 
 
-def getResponse(userquery, docid, userid, sessionid, bedrock, newcontext):
+def load_chat_history(docid, userid, sessionid):
+    """(historicqa text for the prompt, keyed history to append to - None for the legacy store)"""
+    if CHAT_HISTORY_STORE == "keyed":
+        history = chat_history.load_history(docid, userid, sessionid)
+        historicqa = chat_history.format_history(history)
+        emit_metrics({"ChatHistoryTokens": estimate_tokens(historicqa),
+                      "ChatHistoryTurns": len(history["turns"])}, docid=docid)
+        return historicqa, history
 
     historyqna = get_HistoryQnA(docid, userid, sessionid)
 
 
     if (len(historyqna) != 0):
         histqna = historyqna[0]["historicqa"]
-        print("histqna=",histqna)
         historicqa = histqna
     else:
         historicqa = ""
-    print("\n\nhistoricqa =",historyqna)
+    log.debug("Chat history", docid=docid, records=len(historyqna), historicqa=historicqa)
+    return historicqa, None
+
+
+def save_chat_turn(docid, userid, sessionid, historicqa, history, query, answer):
+    if CHAT_HISTORY_STORE == "keyed":
+        try:
+            chat_history.append_turn(history, query, answer)
+        except Exception as error:
+            # The answer is still returned; only this turn is missing from the history
+            log.exception("Exception in append_turn()", docid=docid, error=str(error))
+    else:
+        historicqa = historicqa + "\n------------------------------------\n User Query = " + query + " \n\n Answer = " + answer
+        save_chathistory(userid, sessionid, docid, historicqa)
+
+
+def getResponse(userquery, docid, userid, sessionid, newcontext, index=None, extractionDet=None):
+
+    historicqa, history = load_chat_history(docid, userid, sessionid)
+    cached = lookup_answer(docid, userquery, extractionDet)
+    if cached and cached["answer"]:
+        log.info("Answer from cache", docid=docid, source=cached['source'])
+        log.debug("Answer", docid=docid, query=userquery, answer=cached["answer"])
+        save_chat_turn(docid, userid, sessionid, historicqa, history, userquery, cached["answer"])
+        return cached["answer"]
     # This will return the most 3 similarity search items for the query asked.
     # query2 = "is Early-stage prostate cancer covered in product sheet?"  # Excluded illness from product sheet
     # query2 = "What is the illness mentioned?"
 #     query2 = "When was the surgery done and by whom?"
     query2 = userquery
 
-    print("\nhistoricqa = ",historicqa)
+
+    if index is not None:
+        # Retrieval mode: only the chunks relevant to this question go into the prompt
+        newcontext = retrieval_context(index, query2, historicqa, docid) + "\n\n" + newcontext
 
     #3 . prepare prompt and call LLM  to get answer to the query
-    result2 = prep_query_response(query2, historicqa, newcontext, bedrock)
+    result2 = prep_query_response(query2, historicqa, newcontext)
     # display(HTML(result))
     # print(result2)
-    print("\nQuery = ", query2)
-    print("\nAnswer = ", result2)
-    historicqa = historicqa + "\n------------------------------------\n User Query = " + query2 + " \n\n Answer = " + result2
+    log.debug("Answer", docid=docid, query=query2, answer=result2)
+
+    if cached and result2 not in (NO_ANSWER_TEXT, ERROR_ANSWER_TEXT):
+        answer_cache.store(cached, result2)
 
     #4 . Save the chat history to DynamoDB along with sessionid
-    outputmssage = save_chathistory(userid, sessionid, docid, historicqa)
+    save_chat_turn(docid, userid, sessionid, historicqa, history, query2, result2)
     
     return result2
 
+
+def lookup_answer(docid, query, extractionDet):
+    """answer_cache lookup of a question, None when neither the cache nor FAQ answers are on"""
+    if extractionDet is None or not (answer_cache.CHAT_ANSWER_CACHE_ENABLED or answer_cache.CHAT_FAQ_ANSWERS):
+        return None
+    return answer_cache.lookup(docid, query, extractionDet)
+
+
+def stream_response(userquery, docid, userid, sessionid, newcontext, index, send, extractionDet=None):
+    """
+    Answer a question like getResponse, passing the answer to send(text) piece by piece as
+    Bedrock generates it
+
+    The first piece is sent as soon as it arrives; after that pieces are coalesced up to
+    CHAT_STREAM_FLUSH_CHARS characters or CHAT_STREAM_FLUSH_SEC seconds, to keep the number
+    of WebSocket messages down. The turn is saved to the chat history once the answer is
+    complete. send() returning False (the client went away) stops the answer without saving.
+
+    Returns:
+        str: The whole answer, or None when the client went away
+    """
+    start = time.perf_counter()
+    historicqa, history = load_chat_history(docid, userid, sessionid)
+    cached = lookup_answer(docid, userquery, extractionDet)
+    if cached and cached["answer"]:
+        if send(cached["answer"]) is False:
+            return None
+        emit_metrics({"ChatTimeToFirstToken": (round((time.perf_counter() - start) * 1000, 1), "Milliseconds")},
+                     docid=docid, source=cached["source"])
+        save_chat_turn(docid, userid, sessionid, historicqa, history, userquery, cached["answer"])
+        return cached["answer"]
+    if index is not None:
+        newcontext = retrieval_context(index, userquery, historicqa, docid) + "\n\n" + newcontext
+    prompt = build_prompt(userquery, historicqa, newcontext)
+
+    pieces, buffer, first_sent_ms, last_flush = [], "", None, time.perf_counter()
+    stream_failed = False
+    try:
+        for text in stream_claude(prompt, HAIKU_MODEL_ID, max_tokens=1000, region="us-west-2",
+                                  assumed_role=os.environ.get("BEDROCK_ASSUME_ROLE"), stage="chatbot"):
+            pieces.append(text)
+            buffer += text
+            if first_sent_ms is not None and len(buffer) < CHAT_STREAM_FLUSH_CHARS and (
+                    time.perf_counter() - last_flush < CHAT_STREAM_FLUSH_SEC):
+                continue
+            if send(buffer) is False:
+                log.warning("⚠️ Client went away", docid=docid, characters=len(''.join(pieces)))
+                return None
+            if first_sent_ms is None:
+                first_sent_ms = (time.perf_counter() - start) * 1000
+            buffer, last_flush = "", time.perf_counter()
+    except Exception as e:
+        log.exception("Error in stream_response", docid=docid, error=str(e))
+        if not pieces:
+            answer = ERROR_ANSWER_TEXT
+            send(answer)
+            return answer
+        # The client already shows part of the answer - say it is cut off, and save it as it stands
+        stream_failed = True
+        pieces.append(STREAM_CUT_OFF_NOTE)
+        buffer += STREAM_CUT_OFF_NOTE
+    if buffer and send(buffer) is False:
+        return None
+
+    answer = "".join(pieces)
+    if not answer:
+        answer = NO_ANSWER_TEXT
+        send(answer)
+    log.debug("Answer", docid=docid, query=userquery, answer=answer)
+    emit_metrics({"ChatTimeToFirstToken": (round(first_sent_ms or 0, 1), "Milliseconds"),
+                  "ChatAnswerDuration": (round((time.perf_counter() - start) * 1000, 1), "Milliseconds")},
+                 docid=docid)
+    if cached and not stream_failed and answer != NO_ANSWER_TEXT:
+        answer_cache.store(cached, answer)
+    save_chat_turn(docid, userid, sessionid, historicqa, history, userquery, answer)
+    return answer
+
+
+def prepare_context(docid):
+    """(document context for the prompt, chunk index in retrieval mode or None, nmm-doc-extraction item)"""
+    extractionDetails = get_DocExtractionDetails(docid)
+    extractionDet = extractionDetails["Item"]
+    dashboardDetails = get_DashboardDetails(docid)
+    dashboardDet = dashboardDetails["Item"]
+    if CHATBOT_CONTEXT_MODE == "retrieval":
+        return str(dashboardDet), get_chunk_index(docid, extractionDet), extractionDet
+    return str(extractionDet["rawtext"]) + str(dashboardDet), None, extractionDet
+
+
+def get_connection_client(endpoint_url):
+    """apigatewaymanagementapi client of a WebSocket API stage, created once per container"""
+    client = connection_clients.get(endpoint_url)
+    if client is None:
+        client = connection_clients[endpoint_url] = boto3.client("apigatewaymanagementapi", endpoint_url=endpoint_url)
+    return client
+
+
+def websocket_handler(event, context):
+    """
+    Streaming chat over an API Gateway WebSocket API
+
+    Routes: $connect and $disconnect just accept; any other route takes a message
+    {"docid", "userid", "sessionid", "userquery"} and answers on the same connection with
+    {"type": "delta", "text"} messages as the answer is generated, then
+    {"type": "done", "text": <whole answer>} (or {"type": "error", "text"}).
+    """
+    request_context = event.get("requestContext", {})
+    route = request_context.get("routeKey")
+    if route in ("$connect", "$disconnect"):
+        return {'statusCode': 200}
+
+    connection_id = request_context["connectionId"]
+    client = get_connection_client(f"https://{request_context['domainName']}/{request_context['stage']}")
+
+    def post(message):
+        try:
+            client.post_to_connection(ConnectionId=connection_id, Data=json.dumps(message).encode("utf-8"))
+            return True
+        except ClientError as error:
+            if error.response.get("Error", {}).get("Code") == "GoneException":
+                return False
+            raise
+
+    try:
+        qtext = json.loads(event.get("body") or "{}")
+        docid, userid = qtext.get('docid'), qtext.get('userid')
+        sessionid, userquery = qtext.get('sessionid'), qtext.get('userquery')
+        if not all([docid, userid, sessionid, userquery]):
+            post({"type": "error", "text": "Missing required parameters. Please provide docid, userid, sessionid, and userquery."})
+            return {'statusCode': 400}
+        log.info("Websocket question", docid=docid, userid=userid, sessionid=sessionid)
+        log.debug("User query", docid=docid, userquery=userquery)
+
+        newcontext, index, extractionDet = prepare_context(docid)
+        answer = stream_response(userquery, docid, userid, sessionid, newcontext, index,
+                                 lambda text: post({"type": "delta", "text": text}), extractionDet)
+        if answer is not None:
+            post({"type": "done", "text": answer})
+    except Exception as e:
+        log.exception("Exception in websocket_handler", error=str(e))
+        post({"type": "error",
+              "text": "I apologize, but I encountered an error while processing your request. Please try again later."})
+    return {'statusCode': 200}
+
 def lambda_handler(event, context):
     headers = {
         'Access-Control-Allow-Origin': '*',
@@ -250,19 +426,10 @@ def lambda_handler(event, context):
     result = ""
     
     try:
-        print('inside lambda_handler() - event = ', event)
-
-        # Initialize Bedrock client
-        bedrock = get_bedrock_client(
-            assumed_role=os.environ.get("BEDROCK_ASSUME_ROLE", None),
-            region="us-west-2"
-        )
+        log.debug("Event", event=event)
 
-        print('bedrock object created successfully')
-        
         # Parse event data
         data_string = event.get("body", {})
-        print("event[body]", data_string, type(data_string))
         
         if isinstance(data_string, dict):
             qtext = data_string
@@ -271,8 +438,6 @@ def lambda_handler(event, context):
                 qtext = json.loads(data_string)
             except json.JSONDecodeError:
                 qtext = data_string
-        
-        print("qtext=json.loads(data_string) :", type(qtext), qtext)
 
         # Extract required parameters with validation
         docid = qtext.get('docid')
@@ -289,23 +454,11 @@ def lambda_handler(event, context):
                 'headers': headers,
             }
 
-        print("docid =", docid)
-        # print("recnumber =", recnumber)
-        print("userid =", userid)
-        print("sessionid =", sessionid)
-        print("userquery =", userquery)
-
-        extractionDetails = get_DocExtractionDetails(docid)
-        extractionDet = extractionDetails["Item"]
-        rawtext = extractionDet["rawtext"]
-        docName = extractionDet["document_name"][0]
-        total_extracted_data = extractionDet["extracted_entities"]
-        print("total_extracted_data = ",total_extracted_data)
+        log.info("Chat question", docid=docid, userid=userid, sessionid=sessionid)
+        log.debug("User query", docid=docid, userquery=userquery)
 
-        dashboardDetails = get_DashboardDetails(docid)
-
-        dashboardDet = dashboardDetails["Item"]
-        print("dashboardDet = ," , dashboardDet)
+        # Prepare context for AI - the same context as the WebSocket path
+        newcontext, index, extractionDet = prepare_context(docid)
         
         # Fetch claim details
         # claimdetails = get_ClaimDetails(claimid)
@@ -367,20 +520,16 @@ def lambda_handler(event, context):
         # print("dbverificationsummary =", dbverificationsummary)
         # print("claim_status =", claim_status)
 
-        # Prepare context for AI
-        newcontext = str(rawtext) + str(dashboardDet)
-        
         if not newcontext.strip():
             result = "I apologize, but I don't have enough information about this claim to answer your question."
         else:
             # Get AI response
-            result = getResponse(userquery, docid, userid, sessionid, bedrock, newcontext)
+            result = getResponse(userquery, docid, userid, sessionid, newcontext, index, extractionDet)
 
-        print("Final result:", result)
+        log.info("Answered", docid=docid, answer_chars=len(result))
 
     except Exception as e:
-        print(f"Exception in lambda_handler: {e}")
-        print('Exception Details are - ', traceback.format_exc())
+        log.exception("Exception in lambda_handler", error=str(e))
         result = "I apologize, but I encountered an error while processing your request. Please try again later."
         
     return {
@@ -2,6 +2,8 @@ import json
 import boto3
 from botocore.exceptions import ClientError
 from boto3.dynamodb.conditions import Attr
+from dynamo_scan import parallel_scan
+from structured_log import log
 
 # dynamodb = boto3.resource('dynamodb')
 # table = dynamodb.Table('nmm-doc-extraction')
@@ -114,7 +116,8 @@ def get_review_items():
     dynamodb = boto3.resource('dynamodb')
     table = dynamodb.Table('nmm-doc-extraction')
  
-    response = table.scan(
+    review_items = parallel_scan(
+        table,
         FilterExpression='mark_for_review = :review' ,
         ExpressionAttributeValues={
             ':review': 'Yes'
@@ -123,13 +126,12 @@ def get_review_items():
         ProjectionExpression='docid, classification, extracted_entities,indexid'
     )
     results = []
-    for item in response['Items']:
+    for item in review_items:
         #rint(item)
-        print(item['classification'])#,item['extracted_entities'],item['docid'])
         if item['classification']=='MedicalReport':
             try:
                 extracted = json.loads(item['extracted_entities'])
-                print(extracted,item.get('indexid'),)
+                log.debug("Extracted entities", docid=item.get('docid'), indexid=item.get('indexid'), extracted=extracted)
             except:
                 extracted = {}
             #extracted = item.get('extracted_entities', {})
@@ -237,10 +239,10 @@ def get_review_items():
 
 def lambda_handler(event, context):
     try:
-        print("event = ", event)
+        log.debug("Event", event=event)
 
         items = get_review_items()
-        print("response = ", items)
+        log.info("Documents marked for review", items=len(items))
         # for item in items:
         #     print(item)
         # response = table.scan(
@@ -0,0 +1,351 @@
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import boto3
+from botocore.config import Config
+from botocore.credentials import RefreshableCredentials
+from botocore.exceptions import ClientError, ConnectionClosedError, ReadTimeoutError
+from botocore.exceptions import ConnectionError as BotocoreConnectionError
+from botocore.session import get_session
+
+from instrumentation import emit_metrics, record_usage
+from structured_log import log
+
+HAIKU_MODEL_ID = "anthropic.claude-3-haiku-20240307-v1:0"
+TITAN_EMBED_MODEL_ID = "amazon.titan-embed-text-v2:0"
+
+# Region of the bedrock-runtime endpoint when the caller does not pass one
+BEDROCK_REGION = os.environ.get("BEDROCK_REGION", "")
+# Attempts per call, counting the first one, and the backoff between them on throttling / 5xx
+BEDROCK_MAX_ATTEMPTS = int(os.environ.get("BEDROCK_MAX_ATTEMPTS", "8"))
+BEDROCK_BACKOFF_BASE_SEC = float(os.environ.get("BEDROCK_BACKOFF_BASE_SEC", "0.5"))
+BEDROCK_BACKOFF_MAX_SEC = float(os.environ.get("BEDROCK_BACKOFF_MAX_SEC", "20"))
+BEDROCK_READ_TIMEOUT_SEC = int(os.environ.get("BEDROCK_READ_TIMEOUT_SEC", "300"))
+# Requests per second per model ID, e.g. {"anthropic.claude-3-haiku-20240307-v1:0": 5}. Models without
+# an entry are not limited until Bedrock throttles them, then they are paced adaptively.
+BEDROCK_RATE_LIMITS = json.loads(os.environ.get("BEDROCK_RATE_LIMITS", "{}") or "{}")
+BEDROCK_MIN_RPS = float(os.environ.get("BEDROCK_MIN_RPS", "0.2"))
+ASSUME_ROLE_SESSION_NAME = "nmm-bedrock-gateway"
+
+RETRYABLE_ERROR_CODES = {"ThrottlingException", "TooManyRequestsException", "ServiceUnavailableException",
+                         "ModelNotReadyException", "InternalServerException", "ModelTimeoutException"}
+THROTTLING_ERROR_CODES = {"ThrottlingException", "TooManyRequestsException"}
+# Network errors - botocore's own retries are off (max_attempts 1), so the gateway retries them
+NETWORK_ERRORS = (BotocoreConnectionError, ConnectionClosedError, ReadTimeoutError)
+
+
+class BedrockGatewayError(Exception):
+    """Raised when a Bedrock call failed for good (non-retryable error or retries exhausted)"""
+
+
+class TokenBucket:
+    """
+    Client-side rate limiter of one model ID
+
+    Callers reserve evenly spaced send slots in arrival order, so waiting threads are served
+    first come first served instead of racing for tokens. The bucket starts at the configured
+    rate, or unlimited. A throttling error cuts the rate to DECREASE times the request rate
+    of the last WINDOW_SEC (at most once per DECREASE_COOLDOWN_SEC, so a burst of throttled
+    calls counts once); every success raises it by INCREASE, up to the configured rate.
+    A throttle storm therefore slows the container down instead of failing its calls.
+    Unconfigured models go back to unlimited after RECOVERY_SEC without throttling.
+    """
+
+    DECREASE = 0.75
+    DECREASE_COOLDOWN_SEC = 1.0
+    INCREASE = 0.02
+    RECOVERY_SEC = 60.0
+    WINDOW_SEC = 10.0
+
+    def __init__(self, rate=None):
+        self.lock = threading.Lock()
+        self.ceiling = float(rate) if rate else None
+        self.rate = self.ceiling
+        self.next_slot = 0.0
+        self.last_throttle = 0.0
+        self.recent = deque()
+
+    def acquire(self):
+        """Wait for this caller's send slot; returns the seconds waited"""
+        with self.lock:
+            now = time.monotonic()
+            self._trim(now)
+            if self.rate is None:
+                self.recent.append(now)
+                return 0.0
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + 1.0 / self.rate
+            self.recent.append(slot)
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def _trim(self, now):
+        while self.recent and now - self.recent[0] > self.WINDOW_SEC:
+            self.recent.popleft()
+
+    def observed_rate(self, now):
+        self._trim(now)
+        if not self.recent:
+            return 0.0
+        return len(self.recent) / max(1.0, now - self.recent[0])
+
+    def on_throttle(self):
+        with self.lock:
+            now = time.monotonic()
+            if now - self.last_throttle < self.DECREASE_COOLDOWN_SEC:
+                return
+            current = self.observed_rate(now)
+            if self.rate is not None:
+                current = min(current, self.rate) if current else self.rate
+            self.rate = max(BEDROCK_MIN_RPS, current * self.DECREASE)
+            self.last_throttle = now
+
+    def on_success(self):
+        with self.lock:
+            if self.rate is None:
+                return
+            if self.ceiling is None and time.monotonic() - self.last_throttle > self.RECOVERY_SEC:
+                self.rate = None
+                return
+            increased = self.rate * (1.0 + self.INCREASE)
+            self.rate = min(self.ceiling, increased) if self.ceiling else increased
+
+
+_clients = {}
+_buckets = {}
+_lock = threading.Lock()
+
+
+def _assume_role_refresher(role_arn, region):
+    sts = boto3.client("sts", region_name=region)
+
+    def refresh():
+        credentials = sts.assume_role(RoleArn=role_arn, RoleSessionName=ASSUME_ROLE_SESSION_NAME)["Credentials"]
+        log.info("🔑 Assumed role for Bedrock", role_arn=role_arn, expiration=credentials['Expiration'])
+        return {
+            "access_key": credentials["AccessKeyId"],
+            "secret_key": credentials["SecretAccessKey"],
+            "token": credentials["SessionToken"],
+            "expiry_time": credentials["Expiration"].isoformat(),
+        }
+    return refresh
+
+
+def _create_client(region, assumed_role):
+    config = Config(
+        region_name=region,
+        read_timeout=BEDROCK_READ_TIMEOUT_SEC,
+        # Throttling and 5xx are retried here with the rate limiter, not by botocore
+        retries={"max_attempts": 1, "mode": "standard"},
+        max_pool_connections=50,
+    )
+    if not assumed_role:
+        return boto3.client("bedrock-runtime", region_name=region, config=config)
+    # Refreshable credentials: botocore calls assume_role again shortly before they expire,
+    # so a warm container keeps its client instead of assuming the role on every invocation
+    refresh = _assume_role_refresher(assumed_role, region)
+    botocore_session = get_session()
+    botocore_session._credentials = RefreshableCredentials.create_from_metadata(
+        metadata=refresh(), refresh_using=refresh, method="sts-assume-role")
+    return boto3.Session(botocore_session=botocore_session, region_name=region).client("bedrock-runtime", config=config)
+
+
+def get_client(region=None, assumed_role=None):
+    """The container's bedrock-runtime client for a region / role, created on first use"""
+    region = region or BEDROCK_REGION or os.environ.get("AWS_REGION") or os.environ.get("AWS_DEFAULT_REGION")
+    key = (region, assumed_role or None)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                log.info("Creating bedrock-runtime client", region=region, assumed_role=assumed_role)
+                client = _clients[key] = _create_client(region, assumed_role)
+    return client
+
+
+def get_bucket(model_id):
+    bucket = _buckets.get(model_id)
+    if bucket is None:
+        with _lock:
+            bucket = _buckets.setdefault(model_id, TokenBucket(BEDROCK_RATE_LIMITS.get(model_id)))
+    return bucket
+
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff for retry number attempt (1-based)"""
+    return random.uniform(0, min(BEDROCK_BACKOFF_MAX_SEC, BEDROCK_BACKOFF_BASE_SEC * (2 ** (attempt - 1))))
+
+
+def call_with_retries(operation, model_id, stage=None, **request):
+    """
+    Call a bedrock-runtime operation through the model's rate limiter, retrying throttling,
+    transient errors and connection failures / read timeouts with backoff
+
+    Returns:
+        tuple: (response, metrics dict with latency, wait and attempts)
+
+    Raises:
+        BedrockGatewayError: Non-retryable error, or BEDROCK_MAX_ATTEMPTS reached
+    """
+    bucket = get_bucket(model_id)
+    waited, throttles = 0.0, 0
+    for attempt in range(1, BEDROCK_MAX_ATTEMPTS + 1):
+        waited += bucket.acquire()
+        start = time.perf_counter()
+        try:
+            response = operation(modelId=model_id, **request)
+        except (ClientError,) + NETWORK_ERRORS as error:
+            if isinstance(error, ClientError):
+                code = error.response.get("Error", {}).get("Code", "")
+                retryable = code in RETRYABLE_ERROR_CODES
+            else:
+                code, retryable = type(error).__name__, True
+            if code in THROTTLING_ERROR_CODES:
+                throttles += 1
+                bucket.on_throttle()
+            if not retryable or attempt == BEDROCK_MAX_ATTEMPTS:
+                emit_metrics({"BedrockErrors": 1, "BedrockThrottles": throttles}, model_id=model_id, stage=stage,
+                             error_code=code)
+                raise BedrockGatewayError(f"{model_id} failed after {attempt} attempt(s): {code} {error}") from error
+            delay = backoff_delay(attempt)
+            log.warning("⚠️ Bedrock call failed, retrying", model_id=model_id, error_code=code, attempt=attempt,
+                        delay_sec=round(delay, 2))
+            time.sleep(delay)
+            waited += delay
+            continue
+        bucket.on_success()
+        return response, {"latency_ms": (time.perf_counter() - start) * 1000, "wait_ms": waited * 1000,
+                          "attempts": attempt, "throttles": throttles}
+    raise BedrockGatewayError(f"{model_id} was not called")  # BEDROCK_MAX_ATTEMPTS < 1
+
+
+def _emit_call_metrics(model_id, stage, call, input_tokens, output_tokens):
+    emit_metrics({
+        "BedrockLatency": (round(call["latency_ms"], 1), "Milliseconds"),
+        "BedrockRateLimitWait": (round(call["wait_ms"], 1), "Milliseconds"),
+        "BedrockInputTokens": input_tokens,
+        "BedrockOutputTokens": output_tokens,
+        "BedrockThrottles": call["throttles"],
+    }, model_id=model_id, stage=stage, attempts=call["attempts"])
+    # Tokens of the pipeline stage the call was made in
+    record_usage(LLMCalls=1, LLMInputTokens=input_tokens, LLMOutputTokens=output_tokens)
+
+
+def invoke_claude(prompt, model_id=HAIKU_MODEL_ID, max_tokens=5000, temperature=None, region=None,
+                  assumed_role=None, stage=None):
+    """
+    Send one user message to an Anthropic model with invoke_model and return the text of its answer
+
+    Raises:
+        BedrockGatewayError: The call failed for good
+    """
+    body = {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": max_tokens,
+        "messages": [{"role": "user", "content": [{"type": "text", "text": prompt}]}],
+    }
+    if temperature is not None:
+        body["temperature"] = temperature
+    client = get_client(region, assumed_role)
+    response, call = call_with_retries(client.invoke_model, model_id, stage, body=json.dumps(body),
+                                       accept="application/json", contentType="application/json")
+    result = json.loads(response["body"].read())
+    usage = result.get("usage", {})
+    _emit_call_metrics(model_id, stage, call, usage.get("input_tokens", 0), usage.get("output_tokens", 0))
+    log.info("Bedrock call", model_id=model_id, stage=stage, latency_ms=call['latency_ms'],
+             input_tokens=usage.get('input_tokens', 0), output_tokens=usage.get('output_tokens', 0))
+    return "".join(part.get("text", "") for part in result.get("content", []) if part.get("type", "text") == "text")
+
+
+def stream_claude(prompt, model_id=HAIKU_MODEL_ID, max_tokens=5000, temperature=None, region=None,
+                  assumed_role=None, stage=None):
+    """
+    Send one user message to an Anthropic model with invoke_model_with_response_stream and yield
+    the text of its answer as it is generated
+
+    Starting the call is rate limited and retried like invoke_claude. An error after the first
+    text has been yielded is not retried, since the caller has already used the partial answer.
+    Emits BedrockTimeToFirstToken besides the usual call metrics.
+
+    Raises:
+        BedrockGatewayError: The call failed for good, or the stream broke off
+    """
+    body = {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": max_tokens,
+        "messages": [{"role": "user", "content": [{"type": "text", "text": prompt}]}],
+    }
+    if temperature is not None:
+        body["temperature"] = temperature
+    client = get_client(region, assumed_role)
+    start = time.perf_counter()
+    response, call = call_with_retries(client.invoke_model_with_response_stream, model_id, stage,
+                                       body=json.dumps(body), accept="application/json",
+                                       contentType="application/json")
+    first_token_ms, input_tokens, output_tokens = None, 0, 0
+    try:
+        for event in response["body"]:
+            if "chunk" not in event:
+                continue
+            chunk = json.loads(event["chunk"]["bytes"])
+            if chunk.get("type") == "message_start":
+                input_tokens = chunk.get("message", {}).get("usage", {}).get("input_tokens", input_tokens)
+            elif chunk.get("type") == "content_block_delta" and chunk.get("delta", {}).get("type") == "text_delta":
+                if first_token_ms is None:
+                    first_token_ms = (time.perf_counter() - start) * 1000
+                yield chunk["delta"]["text"]
+            elif chunk.get("type") == "message_delta":
+                output_tokens = chunk.get("usage", {}).get("output_tokens", output_tokens)
+    except ClientError as error:
+        code = error.response.get("Error", {}).get("Code", "")
+        emit_metrics({"BedrockErrors": 1}, model_id=model_id, stage=stage, error_code=code)
+        raise BedrockGatewayError(f"{model_id} stream broke off: {code} {error}") from error
+    call["latency_ms"] = (time.perf_counter() - start) * 1000 - call["wait_ms"]
+    _emit_call_metrics(model_id, stage, call, input_tokens, output_tokens)
+    if first_token_ms is not None:
+        emit_metrics({"BedrockTimeToFirstToken": (round(first_token_ms, 1), "Milliseconds")},
+                     model_id=model_id, stage=stage)
+    log.info("Bedrock call (streamed)", model_id=model_id, stage=stage, first_token_ms=first_token_ms,
+             latency_ms=call['latency_ms'], input_tokens=input_tokens, output_tokens=output_tokens)
+
+
+def embed_text(text, model_id=TITAN_EMBED_MODEL_ID, dimensions=256, region=None, assumed_role=None, stage=None):
+    """
+    Normalized Titan text embedding of text
+
+    Returns:
+        list: dimensions floats
+
+    Raises:
+        BedrockGatewayError: The call failed for good
+    """
+    client = get_client(region, assumed_role)
+    body = {"inputText": text, "dimensions": dimensions, "normalize": True}
+    response, call = call_with_retries(client.invoke_model, model_id, stage, body=json.dumps(body),
+                                       accept="application/json", contentType="application/json")
+    result = json.loads(response["body"].read())
+    _emit_call_metrics(model_id, stage, call, result.get("inputTextTokenCount", 0), 0)
+    return result["embedding"]
+
+
+def converse_text(prompt, model_id, inference_config=None, region=None, assumed_role=None, stage=None):
+    """
+    Send one user message with the Converse API (any Bedrock model, e.g. Nova) and return the answer text
+
+    Raises:
+        BedrockGatewayError: The call failed for good
+    """
+    client = get_client(region, assumed_role)
+    response, call = call_with_retries(client.converse, model_id, stage,
+                                       messages=[{"role": "user", "content": [{"text": prompt}]}],
+                                       inferenceConfig=inference_config or {})
+    usage = response.get("usage", {})
+    _emit_call_metrics(model_id, stage, call, usage.get("inputTokens", 0), usage.get("outputTokens", 0))
+    return response["output"]["message"]["content"][0]["text"]
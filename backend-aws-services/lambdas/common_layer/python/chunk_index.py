@@ -0,0 +1,241 @@
+import ast
+import json
+import math
+import os
+import re
+from collections import Counter
+
+# Build the index after extraction (document_extraction_lambda) and store it as the
+# chunk_index payload of the nmm-doc-extraction item
+CHUNK_INDEX_ENABLED = os.environ.get("CHUNK_INDEX_ENABLED", "false").lower() == "true"
+# Characters of raw text per chunk - about a third of a page, whole lines only
+CHUNK_CHARS = int(os.environ.get("CHUNK_INDEX_CHUNK_CHARS", "1500"))
+
+INDEX_VERSION = 1
+# BM25 parameters (the usual defaults)
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Terms of the previous question count this much, so follow-ups ("and when was that?") stay on topic
+FOLLOW_UP_WEIGHT = 0.5
+
+_TERM_RE = re.compile(r"[a-z0-9]+")
+_LINE_SPLIT_RE = re.compile(r"\\n|\n")
+# "Date of Injury: 03/14/2024" - a short label at the start of a line, then a colon
+_LABEL_RE = re.compile(r"\s*([A-Za-z][A-Za-z0-9 /#'()-]{1,40}?)\s*:(?!//)")
+MAX_LABEL_TERMS = 4
+STOPWORDS = {'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'did', 'do', 'does', 'for', 'from', 'has', 'have',
+             'how', 'in', 'is', 'it', 'its', 'of', 'on', 'or', 'the', 'this', 'to', 'was', 'were', 'what', 'when',
+             'where', 'which', 'who', 'why', 'with', 'me', 'tell', 'please', 'document', 'give'}
+
+
+def tokenize(text):
+    """Lower-case terms of text without stopwords; a trailing plural s is dropped"""
+    terms = []
+    for term in _TERM_RE.findall(text.lower()):
+        if term in STOPWORDS or (len(term) < 2 and not term.isdigit()):
+            continue
+        if len(term) > 3 and term.endswith('s') and not term.endswith('ss'):
+            term = term[:-1]
+        terms.append(term)
+    return terms
+
+
+def index_terms(text):
+    """
+    Terms and word pairs of text, line by line, and the labels of its form lines
+
+    Pairs of neighbouring terms ("date injury" from "Date of Injury") and the label of a
+    "Label: value" line (label:diagnosi from "Diagnosis: ...") tell a form field apart from
+    the same words scattered over a page.
+    """
+    terms = []
+    for line in _LINE_SPLIT_RE.split(text):
+        label = _LABEL_RE.match(line)
+        if label:
+            label_words = tokenize(label.group(1))
+            if label_words:
+                terms.append("label:" + " ".join(label_words))
+        words = tokenize(line)
+        terms.extend(words)
+        terms.extend(f"{first} {second}" for first, second in zip(words, words[1:]))
+    return terms
+
+
+def query_terms(query):
+    """index_terms of a question, plus every run of its terms as a possible form label"""
+    terms = index_terms(query)
+    words = tokenize(query)
+    for start in range(len(words)):
+        for end in range(start + 1, min(len(words), start + MAX_LABEL_TERMS) + 1):
+            terms.append("label:" + " ".join(words[start:end]))
+    return terms
+
+
+def parse_stored_text(rawtext):
+    """
+    The per-file texts of a rawtext value
+
+    Accepts the list of {file name: text} built by the extraction lambda, or its str() as
+    stored in nmm-doc-extraction.
+
+    Returns:
+        list: (file name, text) pairs
+    """
+    files = rawtext
+    if isinstance(rawtext, str):
+        try:
+            files = ast.literal_eval(rawtext)
+        except (ValueError, SyntaxError, MemoryError, RecursionError):
+            return [("document", rawtext)]
+    if not isinstance(files, list):
+        return [("document", str(rawtext))]
+    pairs = []
+    for entry in files:
+        if isinstance(entry, dict):
+            pairs.extend((str(name), text if isinstance(text, str) else str(text)) for name, text in entry.items())
+        else:
+            pairs.append(("document", str(entry)))
+    return pairs
+
+
+def line_pages(line_count, page_lines):
+    """Page number (1-based) of each line, from the number of lines of each page; None when unknown"""
+    if not page_lines:
+        return [None] * line_count
+    pages = []
+    for page, count in enumerate(page_lines, start=1):
+        pages.extend([page] * count)
+    return (pages + [len(page_lines)] * line_count)[:line_count]
+
+
+def build_chunks(rawtext, page_lines=None):
+    """
+    Cut the raw text of every file into chunks of whole lines of about CHUNK_CHARS
+
+    Args:
+        rawtext: The rawtext list (or its stored str())
+        page_lines (list): Per file, the number of rawtext lines of each page as counted by the
+            Textract parser; chunks carry no page numbers without it
+
+    Returns:
+        list: {"file", "pages": [first, last] or None, "text"} in document order
+    """
+    chunks = []
+    for number, (file_name, text) in enumerate(parse_stored_text(rawtext)):
+        lines = _LINE_SPLIT_RE.split(text)
+        if lines and not lines[-1]:
+            lines.pop()
+        pages = line_pages(len(lines), page_lines[number] if page_lines and number < len(page_lines) else None)
+        current, current_pages, size = [], [], 0
+        for line, page in zip(lines, pages):
+            if not line.strip():
+                continue
+            current.append(line)
+            current_pages.append(page)
+            size += len(line) + 1
+            if size >= CHUNK_CHARS:
+                chunks.append(_chunk(file_name, current, current_pages))
+                current, current_pages, size = [], [], 0
+        if current:
+            chunks.append(_chunk(file_name, current, current_pages))
+    return chunks
+
+
+def _chunk(file_name, lines, pages):
+    known = [page for page in pages if page is not None]
+    return {"file": file_name, "pages": [min(known), max(known)] if known else None, "text": "\n".join(lines)}
+
+
+def build_index(rawtext, page_lines=None):
+    """
+    BM25 index of a document: its chunks with their term counts, and the document frequencies
+
+    Returns:
+        dict: Index for search(); dumps() stores its chunks only
+    """
+    return _index_chunks(build_chunks(rawtext, page_lines))
+
+
+def _index_chunks(chunks):
+    document_frequency = Counter()
+    for number, chunk in enumerate(chunks):
+        counts = Counter(index_terms(chunk["text"]))
+        chunk["id"] = number
+        chunk["terms"] = dict(counts)
+        chunk["length"] = sum(counts.values())
+        document_frequency.update(counts.keys())
+    lengths = [chunk["length"] for chunk in chunks]
+    return {
+        "version": INDEX_VERSION,
+        "chunks": chunks,
+        "df": dict(document_frequency),
+        "avg_length": sum(lengths) / len(lengths) if lengths else 0.0,
+    }
+
+
+def dumps(index):
+    """
+    Stored form of an index: the chunks with their pages, about the size of the raw text
+
+    The term counts are several times larger than the text and quick to count again, so
+    loads() rebuilds them.
+    """
+    chunks = [{"file": chunk["file"], "pages": chunk["pages"], "text": chunk["text"]} for chunk in index["chunks"]]
+    return json.dumps({"version": INDEX_VERSION, "chunks": chunks}, separators=(',', ':'))
+
+
+def loads(text):
+    """Index from its stored JSON, None when missing or of another version"""
+    if not text:
+        return None
+    stored = json.loads(text) if isinstance(text, str) else text
+    if stored.get("version") != INDEX_VERSION:
+        return None
+    return _index_chunks(stored["chunks"])
+
+
+def search(index, query, k=8, previous_query=""):
+    """
+    The k chunks of the index most relevant to a question, by BM25
+
+    Args:
+        previous_query (str): The question before this one; its terms count FOLLOW_UP_WEIGHT
+
+    Returns:
+        list: (score, chunk) pairs, best first; chunks without any query term are left out
+    """
+    weights = Counter()
+    for term in query_terms(previous_query or ""):
+        weights[term] = FOLLOW_UP_WEIGHT
+    for term in query_terms(query):
+        weights[term] = 1.0
+    chunks, document_frequency = index["chunks"], index["df"]
+    average = index["avg_length"] or 1.0
+    scored = []
+    for chunk in chunks:
+        terms, score = chunk["terms"], 0.0
+        for term, weight in weights.items():
+            count = terms.get(term)
+            if not count:
+                continue
+            frequency = document_frequency.get(term, 0)
+            idf = math.log(1 + (len(chunks) - frequency + 0.5) / (frequency + 0.5))
+            score += weight * idf * count * (BM25_K1 + 1) / (
+                count + BM25_K1 * (1 - BM25_B + BM25_B * chunk["length"] / average))
+        if score > 0:
+            scored.append((score, chunk))
+    scored.sort(key=lambda entry: (-entry[0], entry[1]["id"]))
+    return scored[:k]
+
+
+def source_reference(chunk):
+    pages = chunk.get("pages")
+    if not pages:
+        return chunk["file"]
+    return f"{chunk['file']}, page {pages[0]}" if pages[0] == pages[1] else f"{chunk['file']}, pages {pages[0]}-{pages[1]}"
+
+
+def format_context(results):
+    """Retrieved chunks in document order, each headed by its source file and pages"""
+    ordered = sorted((chunk for _, chunk in results), key=lambda chunk: chunk["id"])
+    return "\n\n".join(f"[Source: {source_reference(chunk)}]\n{chunk['text']}" for chunk in ordered)
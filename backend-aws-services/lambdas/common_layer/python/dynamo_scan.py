@@ -0,0 +1,112 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from structured_log import log
+
+# Defaults can be tuned per function through environment variables
+DEFAULT_TOTAL_SEGMENTS = int(os.environ.get("DYNAMO_SCAN_SEGMENTS", "8"))
+DEFAULT_MAX_WORKERS = int(os.environ.get("DYNAMO_SCAN_MAX_WORKERS", "8"))
+DEFAULT_RCU_BUDGET = os.environ.get("DYNAMO_SCAN_RCU_BUDGET")
+
+
+class ScanCapacityExceeded(Exception):
+    """Raised when a scan consumes more read capacity than its budget allows"""
+
+    def __init__(self, consumed, budget, items):
+        super().__init__(f"Scan consumed {consumed} RCUs, budget is {budget}")
+        self.consumed = consumed
+        self.budget = budget
+        self.items = items
+
+
+class _ScanState:
+    """Shared bookkeeping for the segment workers of one parallel scan"""
+
+    def __init__(self, capacity_budget, max_items):
+        self.lock = threading.Lock()
+        self.items = []
+        self.consumed = 0.0
+        self.pages = 0
+        self.capacity_budget = capacity_budget
+        self.max_items = max_items
+        self.stopped = False
+
+    def add_page(self, response):
+        with self.lock:
+            self.pages += 1
+            self.items.extend(response.get('Items', []))
+            self.consumed += response.get('ConsumedCapacity', {}).get('CapacityUnits', 0.0)
+            if self.max_items is not None and len(self.items) >= self.max_items:
+                self.stopped = True
+            if self.capacity_budget is not None and self.consumed > self.capacity_budget:
+                self.stopped = True
+            return not self.stopped
+
+
+def _scan_segment(table, segment, total_segments, state, scan_kwargs):
+    """Walk every page of one scan segment, stopping early when the scan is stopped"""
+    kwargs = dict(scan_kwargs)
+    if total_segments > 1:
+        kwargs['Segment'] = segment
+        kwargs['TotalSegments'] = total_segments
+    while not state.stopped:
+        response = table.scan(**kwargs)
+        if not state.add_page(response) or 'LastEvaluatedKey' not in response:
+            return
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def parallel_scan(table, total_segments=None, max_workers=None, capacity_budget=None, max_items=None, **scan_kwargs):
+    """
+    Read a whole DynamoDB table with a parallel (Segment/TotalSegments) scan
+
+    Args:
+        table: boto3 DynamoDB Table resource. Each worker calls table.scan, which goes
+            through the thread-safe low-level client
+        total_segments (int): Number of scan segments, defaults to DYNAMO_SCAN_SEGMENTS
+        max_workers (int): Maximum segments scanned at the same time, defaults to
+            DYNAMO_SCAN_MAX_WORKERS
+        capacity_budget (float): Maximum read capacity units the scan may consume,
+            defaults to DYNAMO_SCAN_RCU_BUDGET (no limit when unset)
+        max_items (int): Stop once this many items have been collected (useful for
+            "find the first match" filter scans)
+        **scan_kwargs: Passed through to every table.scan call (FilterExpression,
+            ProjectionExpression, ExpressionAttributeValues, ...)
+
+    Returns:
+        list: All scanned items. Order is not stable across segments
+
+    Raises:
+        ScanCapacityExceeded: The scan went over capacity_budget. The items read so far
+            are available on the exception
+    """
+    total_segments = max(1, int(total_segments or DEFAULT_TOTAL_SEGMENTS))
+    max_workers = max(1, min(total_segments, int(max_workers or DEFAULT_MAX_WORKERS)))
+    if capacity_budget is None and DEFAULT_RCU_BUDGET:
+        capacity_budget = float(DEFAULT_RCU_BUDGET)
+
+    scan_kwargs.setdefault('ReturnConsumedCapacity', 'TOTAL')
+    state = _ScanState(capacity_budget, max_items)
+
+    if total_segments == 1:
+        _scan_segment(table, 0, 1, state, scan_kwargs)
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(_scan_segment, table, segment, total_segments, state, scan_kwargs)
+                for segment in range(total_segments)
+            ]
+            # Re-raise the first worker error (throttling, validation, ...)
+            for future in futures:
+                future.result()
+
+    log.info("parallel_scan done", table=table.name, items=len(state.items), pages=state.pages,
+             segments=total_segments, read_units=state.consumed)
+
+    if capacity_budget is not None and state.consumed > capacity_budget:
+        raise ScanCapacityExceeded(state.consumed, capacity_budget, state.items)
+
+    if max_items is not None:
+        return state.items[:max_items]
+    return state.items
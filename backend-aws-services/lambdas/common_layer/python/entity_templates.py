@@ -0,0 +1,431 @@
+# Entity templates per document type, shared by entityextraction_lambda and the fused
+# classification + extraction path of document_classification_lambda
+
+# Document types of the classification prompt; Invoice has no entity template
+DOCUMENT_TYPES = ['MedicalReport', 'ClaimForm', 'DoctorReportMMI', 'PhysicalTherapy', 'Prescription', 'CMS1500', 'Legal', 'Invoice']
+
+
+def get_legal_entities_template(classification):
+    """Get entity extraction template based on document classification"""
+    if classification == 'Legal':
+        return """
+                Extraction Instructions:
+                1. Carefully analyze the entire document text
+                2. Extract entities exactly as they appear in the document
+                3. For fields with no information, use "EMPTY"
+                4. Provide DATE fields ONLY in MM/DD/YYYY format.
+
+                Gather all the following information:
+                1. What is the Case Number?
+                2. What is the Name?
+                3. Whether this document Category is 'Legal' or 'Non Legal'
+                4. Whether this document is related to which 'Matter Type' from the following items ['Lawsuit', 'Arbitration','Hearng','Mediation']
+                5. Whether this document is related to which 'Court Type' from the following items ['Federal','County']
+                6. Whether this document is related to which 'Legal Speciality' from the following items ['Personal Injury','Motor Vehicle Liability', 'General Liability', 'Worker Compensation']
+                7. What is the 'Primary Cause' in the document, pick from the following items ['Court Approval','Statute of Limitation', 'Valuation Dispute', 'Negotiation at Impasse', 'Unreasonable Demand', 'Blind Suit / First Notice', 'Low Settlement Offer', 'Predetermined', 'Delay or insufficient claimant']
+                8. Whether this document sensitivity type is 'Sensitive' or 'Non Sensitive Document'
+                9. What is the Claim Administration Claim Number?
+                10. Provide the confidence for each entity.
+
+                After gathering all the above information, respond in the form of following JSON along with confidence score for each entity:
+
+                Required JSON Output Format:
+                {
+                "legal_section": {
+                    "case_number": {
+                    "value": "STRING",
+                    "confidence": "FLOAT"
+                    },
+                    "name": {
+                    "value": "STRING",
+                    "confidence": "FLOAT"
+                    },
+                    "category": {
+                    "value": "STRING",
+                    "confidence": "FLOAT"
+                    },
+                    "matter_type": {
+                    "value": "STRING",
+                    "confidence": "FLOAT"
+                    },
+                    "court_type": {
+                    "value": "STRING",
+                    "confidence": "FLOAT"
+                    },
+                    "legal_speciality": {
+                    "value": "STRING",
+                    "confidence": "FLOAT"
+                    },
+                    "primary_cause": {
+                    "value": "STRING",
+                    "confidence": "FLOAT"
+                    },
+                    "sensitivity_type": {
+                    "value": "STRING",
+                    "confidence": "FLOAT"
+                    },
+                    "claim_administrator_claim_number": {
+                    "value": "STRING",
+                    "confidence": "FLOAT"
+                    }
+                }
+                }
+
+                CRITICAL: Return ONLY valid JSON. No explanations, no prefixes, no suffixes.
+                Generate only a perfect JSON till end.
+                Do not provide any supporting or explanation text beyond generating the perfect JSON.
+                Skip any preamble text and generate the final JSON ONLY. 
+
+                """
+    return ""
+    ###########################
+
+def get_entities_template(classification):
+    """Get entity extraction template based on document classification"""
+    if classification == 'ClaimForm':
+        return """
+                Extraction Instructions:
+                    1. Carefully analyze the entire document text
+                    2. Extract entities exactly as they appear in the document
+                    3. For fields with no information, use "EMPTY"
+                    4. Provide DATE fields ONLY in MM/DD/YYYY format.
+
+                    Required JSON Output Format:
+                    {
+                        "claim_details_section": {
+                            "employee_name": {
+                                "value": "STRING",
+                                "confidence": FLOAT
+                            },
+                            "wcb_case_number_jcn": {
+                                "value": "STRING", 
+                                "confidence": FLOAT
+                            },
+                            "date_of_injury": {
+                                "value": "STRING", 
+                                "confidence": FLOAT
+                            },
+                            "claim_administrator_claim_number": {
+                                "value": "STRING", 
+                                "confidence": FLOAT
+                            }
+                        },
+                        "insurer_claim_administrator_information_section": {
+                            "insurer_name": {
+                                "value": "STRING",
+                                "confidence": FLOAT
+                            },
+                            "insurer_id": {
+                                "value": "STRING", 
+                                "confidence": FLOAT
+                            }
+                        },
+                        "employee_information_section": {
+                            "employee_first_name": {
+                                "value": "STRING",
+                                "confidence": FLOAT
+                            },
+                            "employee_last_name": {
+                                "value": "STRING", 
+                                "confidence": FLOAT
+                            },
+                            "mailing_address": {
+                                "value": "STRING",
+                                "confidence": FLOAT
+                            },
+                            "city": {
+                                "value": "STRING",
+                                "confidence": FLOAT
+                            },
+                            "state": {
+                                "value": "STRING",
+                                "confidence": FLOAT
+                            },
+                            "postal_code": {
+                                "value": "STRING",
+                                "confidence": FLOAT
+                            },
+                            "date_of_birth": {
+                                "value": "STRING",
+                                "confidence": FLOAT
+                            }
+                        } ,
+                        "employee_injury_section": {
+                            "nature_of_injury": {
+                                "value": "STRING",
+                                "confidence": FLOAT
+                            },
+                            "part_of_body": {
+                                "value": "STRING", 
+                                "confidence": FLOAT
+                            } 
+                        },
+                        "work_status_section": {
+                            "initial_return_to_work_date": {
+                                "value": "STRING",
+                                "confidence": FLOAT
+                            } 
+                        },
+                        "insured_information_section": {
+                            "policy_number_id": {
+                                "value": "STRING",
+                                "confidence": FLOAT
+                            } 
+                        }       
+                    }
+                    CRITICAL: Return ONLY valid JSON. No explanations, no prefixes, no suffixes.
+                    Generate only a perfect JSON till end.
+                    Do not provide any supporting or explanation text beyond generating the perfect JSON.
+                    Skip any preamble text and generate the final JSON ONLY. 
+                    
+                """
+    elif classification == 'MedicalReport':
+        return """
+                Extraction Instructions:
+                    1. Carefully analyze the entire document text
+                    2. Extract entities exactly as they appear in the document
+                    3. For fields with no information, use "EMPTY"
+                    4. Provide DATE fields ONLY in MM/DD/YYYY format.
+
+                    Required JSON Output Format:
+                    {
+                        "medical_report_section": {
+                            "employee_name": {
+                                "value": "STRING",
+                                "confidence": FLOAT
+                            },
+                            "diagnosis": {
+                                "value": "STRING", 
+                                "confidence": FLOAT
+                            },
+                            "date_of_injury": {
+                                "value": "STRING", 
+                                "confidence": FLOAT
+                            } 
+                        }
+                    }
+
+                    CRITICAL: Return ONLY valid JSON. No explanations, no prefixes, no suffixes. 
+                    Generate only a perfect JSON till end.
+                    Do not provide any supporting or explanation text beyond generating the perfect JSON.
+                    Skip any preamble text and generate the final JSON ONLY. 
+                """
+    elif classification == 'DoctorReportMMI':
+        return """
+                Extraction Instructions:
+                    1. Carefully analyze the entire document text
+                    2. Extract entities exactly as they appear in the document
+                    3. For fields with no information, use "EMPTY"
+                    4. Provide DATE fields ONLY in MM/DD/YYYY format.
+
+                    Required JSON Output Format:
+                    {
+                        "claim_details_section": {
+                            "claim_admin_claim_number": {
+                                "value": "STRING",
+                                "confidence": "FLOAT"
+                            }
+                        },
+                        "patients_information_section": {
+                            "patients_name": {
+                                "value": "STRING",
+                                "confidence": "FLOAT"
+                            },
+                            "date_of_injury_illness": {
+                                "value": "STRING", 
+                                "confidence": "FLOAT"
+                            }
+                        },
+                        "diagnosis_information_section": [{
+                            "enter_icd10_code": {
+                                "value": "STRING",
+                                "confidence": "FLOAT"
+                            },
+                            "icd10_descriptor": {
+                                "value": "STRING", 
+                                "confidence": "FLOAT"
+                            }
+                        } ] ,
+                        "maximum_medical_improvement_section": {
+                            "has_the_patient_reached_maximum_medical_improvement": {
+                                "value": "STRING",
+                                "confidence": "FLOAT"
+                            }
+                        },
+                        "functional_capabilities_section": {
+                            "has_the_patient_had_an_injury_illness_since_the_date_of_injury_which_impacts_residual_functional_capacity": {
+                                "value": "STRING",
+                                "confidence": "FLOAT"
+                            }
+                        }
+                        
+                    }
+
+                    CRITICAL: Return ONLY valid JSON. No explanations, no prefixes, no suffixes. 
+                    Generate only a perfect JSON till end.
+                    Do not provide any supporting or explanation text beyond generating the perfect JSON.
+                    Skip any preamble text and generate the final JSON ONLY. 
+                """
+    elif classification == 'PhysicalTherapy':
+        return """
+                Extraction Instructions:
+                    1. Carefully analyze the entire document text
+                    2. Extract entities exactly as they appear in the document
+                    3. For fields with no information, use "EMPTY"
+                    4. Provide DATE fields ONLY in MM/DD/YYYY format.
+
+                    Required JSON Output Format:
+                    {
+                        "physical_therapy_order_section": {
+                            "date": {
+                                "value": "STRING",
+                                "confidence": "FLOAT"
+                            },
+                            "frequency": {
+                                "value": "STRING",
+                                "confidence": "FLOAT"
+                            }
+                            ,
+                            "per_wk_for": {
+                                "value": "STRING",
+                                "confidence": "FLOAT"
+                            }
+                        }
+                        
+                    }
+
+                    CRITICAL: Return ONLY valid JSON. No explanations, no prefixes, no suffixes. 
+                    Generate only a perfect JSON till end.
+                    Do not provide any supporting or explanation text beyond generating the perfect JSON.
+                    Skip any preamble text and generate the final JSON ONLY. 
+
+                """
+    elif classification == 'Prescription':
+        return """
+                Extraction Instructions:
+                    1. Carefully analyze the entire document text
+                    2. Extract entities exactly as they appear in the document
+                    3. For fields with no information, use "EMPTY"
+                    4. Provide DATE fields ONLY in MM/DD/YYYY format.
+
+                    Required JSON Output Format:
+                    {
+                        "prescription_section": {                            
+                            "name": {
+                                "value": "STRING",
+                                "confidence": "FLOAT"
+                            },
+                            "date": {
+                                "value": "STRING",
+                                "confidence": "FLOAT"
+                            }
+                            
+                        }
+                        
+                    }
+                    CRITICAL: Return ONLY valid JSON. No explanations, no prefixes, no suffixes.
+                    Generate only a perfect JSON till end.
+                    Do not provide any supporting or explanation text beyond generating the perfect JSON.
+                    Skip any preamble text and generate the final JSON ONLY. 
+
+                """
+    
+    elif classification == 'CMS1500':
+        return """
+                Extraction Instructions:
+                    1. Carefully analyze the entire document text
+                    2. Extract entities exactly as they appear in the document
+                    3. For fields with no information, use "EMPTY"
+                    4. Provide DATE fields ONLY in MM/DD/YYYY format.
+
+                    Required JSON Output Format:
+                    {
+                        "CMS1500_section": {                            
+                            "patients_name": {
+                                "value": "STRING",
+                                "confidence": "FLOAT"
+                            },
+                            "patients_birth_date": {
+                                "value": "STRING",
+                                "confidence": "FLOAT"
+                            },
+                            "other_claim_id": {
+                                "value": "STRING",
+                                "confidence": "FLOAT"
+                            },
+                            "insureds_policy_group_or_feca_number": {
+                                "value": "STRING",
+                                "confidence": "FLOAT"
+                            },
+                            "date_of_current_illness_injury": {
+                                "value": "STRING",
+                                "confidence": "FLOAT"
+                            },
+                            "total_charge": {
+                                "value": "STRING",
+                                "confidence": "FLOAT"
+                            },
+                            "cpt_hcpcs": {
+                                "value": "STRING",
+                                "confidence": "FLOAT"
+                            }                            
+                            
+                        }
+                        
+                    }
+
+                    CRITICAL: Return ONLY valid JSON. No explanations, no prefixes, no suffixes. 
+                    Generate only a perfect JSON till end.
+                    Do not provide any supporting or explanation text beyond generating the perfect JSON.
+                    Skip any preamble text and generate the final JSON ONLY. 
+
+                """
+    #####################
+    return ""
+
+def extract_empty_keys(data):
+    """Extracts the keys from a JSON object whose values are empty or not filled."""
+    empty_keys = []
+    for key, value in data.items():
+        if not value or value == "None":
+            empty_keys.append(key)
+        elif isinstance(value, dict):
+            nested_empty_keys = extract_empty_keys(value)
+            if nested_empty_keys:
+                empty_keys.extend([f"{key}.{nested_key}" for nested_key in nested_empty_keys])
+    return empty_keys
+
+def calculate_stats(data):
+    """Calculates the total number of keys and the percentage of keys with empty values."""
+    total_keys = 0
+    empty_keys = extract_empty_keys(data)
+    empty_keys_count = len(empty_keys)
+
+    def count_keys(d):
+        nonlocal total_keys
+        total_keys += len(d)
+        for value in d.values():
+            if isinstance(value, dict):
+                count_keys(value)
+
+    count_keys(data)
+    empty_keys_percentage = (empty_keys_count / total_keys) * 100 if total_keys > 0 else 0
+
+    return total_keys, empty_keys_count, empty_keys_percentage
+
+
+def template_for(classification):
+    """The entity template of a document type, "" when it has none"""
+    if classification == 'Legal':
+        return get_legal_entities_template(classification)
+    return get_entities_template(classification)
+
+
+def claim_number_of(parsed_json):
+    """The Guidewire claim number of an extracted entity tree, "Not Available" when it has none"""
+    gw_claim_number = "Not Available"
+    if "value" in parsed_json.get("claim_details_section", {}).get("claim_administrator_claim_number", {}):
+        gw_claim_number = parsed_json["claim_details_section"]["claim_administrator_claim_number"]["value"]
+    if "value" in parsed_json.get("CMS1500_section", {}).get("other_claim_id", {}):
+        gw_claim_number = parsed_json["CMS1500_section"]["other_claim_id"]["value"]
+    return gw_claim_number
@@ -0,0 +1,152 @@
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+
+from structured_log import log
+
+# Large text fields of an nmm-doc-extraction item
+PAYLOAD_FIELDS = ('rawtext', 'keyvaluesText', 'tbltxt')
+
+# "dynamodb" - keep the fields in the item (original behaviour)
+# "s3"       - always write them as gzip objects and keep only payload_refs in the item
+# "auto"     - offload only when the fields together exceed EXTRACTION_PAYLOAD_INLINE_MAX_BYTES
+PAYLOAD_STORAGE = os.environ.get("EXTRACTION_PAYLOAD_STORAGE", "dynamodb")
+PAYLOAD_BUCKET = os.environ.get("EXTRACTION_PAYLOAD_BUCKET", "aimlusecases-pvt")
+PAYLOAD_PREFIX = os.environ.get("EXTRACTION_PAYLOAD_PREFIX", "nmm-extraction-payloads/")
+INLINE_MAX_BYTES = int(os.environ.get("EXTRACTION_PAYLOAD_INLINE_MAX_BYTES", str(100 * 1024)))
+CACHE_MAX_BYTES = int(os.environ.get("EXTRACTION_PAYLOAD_CACHE_MB", "64")) * 1024 * 1024
+
+s3_client = boto3.client('s3')
+
+
+class PayloadIntegrityError(Exception):
+    """Raised when a payload read from S3 does not match the hash stored in DynamoDB"""
+
+
+class _PayloadCache:
+    """Per-container LRU of decoded payloads, keyed by content hash"""
+
+    def __init__(self, max_bytes):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size = 0
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, sha256):
+        with self.lock:
+            entry = self.entries.get(sha256)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(sha256)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, sha256, text, size):
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if sha256 in self.entries:
+                return
+            self.entries[sha256] = (text, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+
+
+payload_cache = _PayloadCache(CACHE_MAX_BYTES)
+
+
+def payload_key(docid, field):
+    return f"{PAYLOAD_PREFIX}{docid}/{field}.txt.gz"
+
+
+def write_payload(docid, field, text):
+    """Write one payload to S3 as a gzip object and return its reference"""
+    data = text.encode('utf-8')
+    sha256 = hashlib.sha256(data).hexdigest()
+    body = gzip.compress(data, mtime=0)
+    key = payload_key(docid, field)
+    s3_client.put_object(Bucket=PAYLOAD_BUCKET, Key=key, Body=body,
+                         ContentType='application/gzip', Metadata={'sha256': sha256})
+    payload_cache.put(sha256, text, len(data))
+    return {
+        'bucket': PAYLOAD_BUCKET,
+        'key': key,
+        'encoding': 'gzip',
+        'size': len(data),
+        'stored_size': len(body),
+        'sha256': sha256,
+    }
+
+
+def store_payloads(docid, payloads, storage=None):
+    """
+    Return the item attributes for the payload fields of an extraction
+
+    Args:
+        docid (str): Document ID, used in the S3 key
+        payloads (dict): field name -> text (the str() values stored today)
+        storage (str): Overrides EXTRACTION_PAYLOAD_STORAGE
+
+    Returns:
+        dict: The payloads themselves when they stay in DynamoDB, otherwise
+            {'payload_refs': {field: {bucket, key, encoding, size, stored_size, sha256}}}
+    """
+    storage = storage or PAYLOAD_STORAGE
+    if storage == "dynamodb":
+        return dict(payloads)
+    if storage == "auto":
+        total = sum(len(text.encode('utf-8')) for text in payloads.values())
+        if total <= INLINE_MAX_BYTES:
+            return dict(payloads)
+
+    with ThreadPoolExecutor(max_workers=max(1, len(payloads))) as executor:
+        futures = {field: executor.submit(write_payload, docid, field, text) for field, text in payloads.items()}
+        refs = {field: future.result() for field, future in futures.items()}
+    log.info("Offloaded payloads to S3", docid=docid, location=f"s3://{PAYLOAD_BUCKET}/{PAYLOAD_PREFIX}{docid}/",
+             sizes={field: [ref['size'], ref['stored_size']] for field, ref in refs.items()})
+    return {'payload_refs': refs}
+
+
+def load_payload(ref):
+    """Return the text of one payload reference, from the cache or S3"""
+    cached = payload_cache.get(ref['sha256'])
+    if cached is not None:
+        return cached
+    body = s3_client.get_object(Bucket=ref['bucket'], Key=ref['key'])['Body'].read()
+    data = gzip.decompress(body) if ref.get('encoding', 'gzip') == 'gzip' else body
+    if hashlib.sha256(data).hexdigest() != ref['sha256']:
+        raise PayloadIntegrityError(f"s3://{ref['bucket']}/{ref['key']} does not match its sha256")
+    text = data.decode('utf-8')
+    payload_cache.put(ref['sha256'], text, len(data))
+    return text
+
+
+def hydrate_payloads(item, fields=PAYLOAD_FIELDS):
+    """
+    Fill the payload fields of an nmm-doc-extraction item in place
+
+    Items written inline are returned unchanged; offloaded fields are loaded from
+    S3 (in parallel) or the local cache. Only the requested fields are read.
+
+    Returns:
+        dict: The same item
+    """
+    refs = item.get('payload_refs') or {}
+    missing = [field for field in fields if field not in item and field in refs]
+    if len(missing) == 1:
+        item[missing[0]] = load_payload(refs[missing[0]])
+    elif missing:
+        with ThreadPoolExecutor(max_workers=len(missing)) as executor:
+            for field, text in zip(missing, executor.map(lambda f: load_payload(refs[f]), missing)):
+                item[field] = text
+    return item
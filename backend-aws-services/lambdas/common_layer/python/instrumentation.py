@@ -0,0 +1,149 @@
+import contextvars
+import json
+import os
+import threading
+import time
+
+# CloudWatch namespace of every metric the lambdas publish
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "NMM/ClaimAssist")
+
+
+def function_name(default="local"):
+    return os.environ.get("AWS_LAMBDA_FUNCTION_NAME", default)
+
+
+def _record(metrics, dimensions, properties):
+    """One EMF line: metrics under the given dimension sets, properties logged alongside"""
+    definitions, values = [], {}
+    for name, value in metrics.items():
+        value, unit = value if isinstance(value, tuple) else (value, "Count")
+        definitions.append({"Name": name, "Unit": unit})
+        values[name] = value
+    record = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": METRICS_NAMESPACE,
+                "Dimensions": dimensions,
+                "Metrics": definitions,
+            }],
+        },
+        "FunctionName": function_name(),
+    }
+    record.update(properties)
+    record.update(values)
+    print(json.dumps(record, default=str))
+
+
+def emit_metrics(metrics, **properties):
+    """
+    Print metrics in CloudWatch Embedded Metric Format
+
+    Lambda ships stdout to CloudWatch Logs, which extracts the metrics - no PutMetricData
+    call and no extra latency. The metrics have a FunctionName dimension; extra keyword
+    properties are logged with them (searchable in Logs Insights) but are not dimensions.
+
+    Args:
+        metrics (dict): name -> value, or name -> (value, unit). The unit defaults to Count
+    """
+    _record(metrics, [["FunctionName"]], properties)
+
+
+def emit_metric(name, value=1, unit="Count", **properties):
+    """Print one metric in CloudWatch Embedded Metric Format, see emit_metrics"""
+    emit_metrics({name: (value, unit)}, **properties)
+
+
+# ---------------------------------------------------------------------------
+# Pipeline spans - one EMF line per stage of a document, with its start time, the usage
+# recorded while it ran and a Stage dimension, so CloudWatch has p50/p95/p99 per stage and
+# Logs Insights can lay out the stages of one docid as a waterfall
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """
+    Time one pipeline stage of a document - textract, translate, classify, extract,
+    confidence, persist or summary
+
+    Usage:
+        with Span("classify", docid):
+            ...
+
+    On exit prints a StageDuration metric (dimensions Stage, and FunctionName + Stage) with the
+    usage recorded by record_usage() while the span was current (LLMInputTokens,
+    LLMOutputTokens, LLMCalls, TextractPages, DynamoDBReadUnits, DynamoDBWriteUnits), and the
+    properties docid, parent_stage, span_start (epoch ms) and status ("ok" or "error").
+    """
+
+    def __init__(self, stage, docid=None, **properties):
+        self.stage, self.docid, self.properties = stage, docid, properties
+        self.usage = {}
+        self._lock = threading.Lock()
+
+    def add(self, **usage):
+        with self._lock:
+            for name, value in usage.items():
+                self.usage[name] = self.usage.get(name, 0) + value
+
+    def __enter__(self):
+        self.parent = _current_span.get()
+        if self.docid is None and self.parent is not None:
+            self.docid = self.parent.docid
+        self._token = _current_span.set(self)
+        self.start_ms = int(time.time() * 1000)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration_ms = round((time.perf_counter() - self._start) * 1000, 1)
+        _current_span.reset(self._token)
+        metrics = {"StageDuration": (duration_ms, "Milliseconds")}
+        with self._lock:
+            metrics.update({name: round(value, 2) for name, value in self.usage.items()})
+        _record(metrics, [["Stage"], ["FunctionName", "Stage"]], dict(
+            self.properties, Stage=self.stage, docid=self.docid,
+            parent_stage=self.parent.stage if self.parent else None, span_start=self.start_ms,
+            status="error" if exc_type else "ok"))
+        return False
+
+
+def current_docid():
+    """The docid of the current span, or None outside of one"""
+    current = _current_span.get()
+    return current.docid if current is not None else None
+
+
+def record_usage(**usage):
+    """Add usage (LLMInputTokens=..., TextractPages=...) to the current span, if any"""
+    current = _current_span.get()
+    if current is not None:
+        current.add(**usage)
+
+
+def record_consumed_capacity(response, kind="write"):
+    """Add the ConsumedCapacity of a DynamoDB response (ReturnConsumedCapacity='TOTAL') to the current span"""
+    consumed = response.get("ConsumedCapacity") if isinstance(response, dict) else None
+    if not consumed:
+        return
+    units = sum(entry.get("CapacityUnits", 0) for entry in (consumed if isinstance(consumed, list) else [consumed]))
+    record_usage(**{"DynamoDBWriteUnits" if kind == "write" else "DynamoDBReadUnits": float(units)})
+
+
+def in_current_span(function):
+    """
+    Wrap function to run in the caller's span
+
+    Worker threads do not inherit the caller's span - wrap functions submitted to a thread
+    pool so their Bedrock tokens and DynamoDB capacity count towards the stage.
+    """
+    parent = _current_span.get()
+
+    def run(*args, **kwargs):
+        token = _current_span.set(parent)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _current_span.reset(token)
+    return run
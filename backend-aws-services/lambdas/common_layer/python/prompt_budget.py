@@ -0,0 +1,192 @@
+import math
+import os
+import re
+
+from instrumentation import emit_metric
+from structured_log import log
+
+# Rough characters per Claude token; Textract output is dense in numbers and punctuation,
+# so this stays below the usual ~4 to over- rather than under-estimate
+CHARS_PER_TOKEN = float(os.environ.get("PROMPT_CHARS_PER_TOKEN", "3.5"))
+
+# Tokens of document text (raw text + key-values + tables) each stage may put in its prompt.
+# Documents below the budget are sent unchanged.
+STAGE_BUDGETS = {
+    'classification': int(os.environ.get("PROMPT_TOKEN_BUDGET_CLASSIFICATION", "8000")),
+    'extraction': int(os.environ.get("PROMPT_TOKEN_BUDGET_EXTRACTION", "120000")),
+    'summary': int(os.environ.get("PROMPT_TOKEN_BUDGET_SUMMARY", "120000")),
+}
+
+# Share of the budget each part gets when the document is over it; what a part does not
+# need is handed to the others. Classification leans on the first/last pages and form keys.
+STAGE_SHARES = {
+    'classification': {'raw_text': 0.6, 'key_value_pair_data': 0.3, 'tabletext': 0.1},
+    'extraction': {'raw_text': 0.5, 'key_value_pair_data': 0.25, 'tabletext': 0.25},
+    'summary': {'raw_text': 0.6, 'key_value_pair_data': 0.2, 'tabletext': 0.2},
+}
+
+# Sections are runs of whole lines / key-values / table rows of about this many characters -
+# roughly a third of a page, so the head and tail sections are the first and last pages
+SECTION_CHARS = int(os.environ.get("PROMPT_SECTION_CHARS", "1200"))
+
+# The stored text is str() of per-file lists, so line breaks are often the two characters "\n"
+_SPLITTERS = {
+    'raw_text': re.compile(r"\\n|\n"),
+    'key_value_pair_data': re.compile(r"(?=Key: )"),
+    'tabletext': re.compile(r";|(?=Tabluar Data Processing )"),
+}
+_TERM_RE = re.compile(r"[a-z0-9]{3,}")
+_TEMPLATE_KEY_RE = re.compile(r'"([A-Za-z0-9_]+)"\s*:\s*\{')
+_TEMPLATE_STOPWORDS = {'section', 'value', 'confidence', 'information', 'details', 'detail', 'the', 'and', 'for'}
+OMITTED_MARKER = "[...]"
+PHRASE_WEIGHT = 5
+
+
+def estimate_tokens(text):
+    return int(math.ceil(len(text) / CHARS_PER_TOKEN)) if text else 0
+
+
+def template_terms(template):
+    """
+    Words and phrases of the field names of an entity template
+
+    "date_of_injury" gives the words date, injury and the phrase "date of injury".
+    """
+    terms = set()
+    for key in _TEMPLATE_KEY_RE.findall(template or ""):
+        words = key.lower().split('_')
+        terms.update(word for word in words if len(word) > 2 and word not in _TEMPLATE_STOPWORDS)
+        if len(words) > 1 and words[-1] not in ('section',):
+            terms.add(" ".join(words))
+    return terms
+
+
+def split_sections(part, text):
+    """Cut text into sections of about SECTION_CHARS, on the natural separators of the part"""
+    sections, current, size = [], [], 0
+    for piece in _SPLITTERS[part].split(text):
+        if not piece.strip():
+            continue
+        current.append(piece)
+        size += len(piece) + 1
+        if size >= SECTION_CHARS:
+            sections.append("\n".join(current))
+            current, size = [], 0
+    if current:
+        sections.append("\n".join(current))
+    return sections
+
+
+def head_tail_order(count):
+    """Section indexes alternating from both ends: 0, n-1, 1, n-2, ..."""
+    order, low, high = [], 0, count - 1
+    while low <= high:
+        order.append(low)
+        if high != low:
+            order.append(high)
+        low, high = low + 1, high - 1
+    return order
+
+
+def relevance_order(sections, terms):
+    """
+    Section indexes by how many template terms they mention, rarer terms counting more
+
+    A whole field-name phrase counts PHRASE_WEIGHT times a word. The first section (the
+    document header) always comes first; ties keep document order.
+    """
+    words = {term for term in terms if ' ' not in term}
+    phrases = [term for term in terms if ' ' in term]
+    section_terms = []
+    for section in sections:
+        lowered = re.sub(r"\s+", " ", section.lower())
+        section_terms.append((set(_TERM_RE.findall(lowered)) & words, {phrase for phrase in phrases if phrase in lowered}))
+    document_frequency = {}
+    for found_words, found_phrases in section_terms:
+        for term in found_words | found_phrases:
+            document_frequency[term] = document_frequency.get(term, 0) + 1
+    weight = {term: math.log(1 + len(sections) / count) for term, count in document_frequency.items()}
+    scores = [sum(weight[term] for term in found_words) + PHRASE_WEIGHT * sum(weight[term] for term in found_phrases)
+              for found_words, found_phrases in section_terms]
+    rest = sorted(range(1, len(sections)), key=lambda i: (-scores[i], i))
+    return [0] + rest if sections else []
+
+
+def fit_text(part, text, budget_tokens, terms=None):
+    """
+    Return text cut down to budget_tokens, keeping whole sections
+
+    Sections are picked from both ends of the document, or by relevance to terms when
+    given, and are put back in document order with OMITTED_MARKER where text was dropped.
+    """
+    if estimate_tokens(text) <= budget_tokens:
+        return text
+    sections = split_sections(part, text)
+    order = relevance_order(sections, terms) if terms else head_tail_order(len(sections))
+    budget_chars = int(budget_tokens * CHARS_PER_TOKEN)
+    kept, used = set(), 0
+    for index in order:
+        size = len(sections[index]) + len(OMITTED_MARKER) + 2
+        if used + size <= budget_chars:
+            kept.add(index)
+            used += size
+    if not kept:
+        return text[:max(0, budget_chars)]
+    output = []
+    for index in range(len(sections)):
+        if index in kept:
+            output.append(sections[index])
+        elif not output or output[-1] != OMITTED_MARKER:
+            output.append(OMITTED_MARKER)
+    return "\n".join(output)
+
+
+def allocate(sizes, shares, budget):
+    """Split budget over parts by share, giving what a part does not need to the others"""
+    allocation = {part: 0 for part in sizes}
+    remaining, open_parts = budget, [part for part in sizes if sizes[part] > 0]
+    while remaining > 0 and open_parts:
+        total_share = sum(shares[part] for part in open_parts)
+        granted = 0
+        for part in list(open_parts):
+            grant = min(sizes[part] - allocation[part], int(remaining * shares[part] / total_share))
+            allocation[part] += grant
+            granted += grant
+            if allocation[part] >= sizes[part]:
+                open_parts.remove(part)
+        remaining -= granted
+        if granted == 0:
+            break
+    return allocation
+
+
+def fit_document(stage, raw_text, key_value_pair_data="", tabletext="", terms=None, docid=None, budget_tokens=None):
+    """
+    Fit the extracted text of a document into the token budget of a pipeline stage
+
+    Args:
+        stage (str): 'classification', 'extraction' or 'summary' (selects budget and shares)
+        raw_text, key_value_pair_data, tabletext (str): The texts as read from nmm-doc-extraction
+        terms (set): Rank sections by these words (see template_terms) instead of keeping
+            the first and last pages
+        docid (str): Only used in the log line
+        budget_tokens (int): Overrides the stage budget
+
+    Returns:
+        tuple: (raw_text, key_value_pair_data, tabletext), unchanged when within budget
+    """
+    budget = STAGE_BUDGETS[stage] if budget_tokens is None else budget_tokens
+    parts = {'raw_text': raw_text or "", 'key_value_pair_data': key_value_pair_data or "", 'tabletext': tabletext or ""}
+    sizes = {part: estimate_tokens(text) for part, text in parts.items()}
+    total = sum(sizes.values())
+    if budget <= 0 or total <= budget:
+        log.info("Prompt within budget", docid=docid, stage=stage, tokens=total, budget=budget)
+        emit_metric("PromptTokensSaved", 0, stage=stage, docid=docid)
+        return parts['raw_text'], parts['key_value_pair_data'], parts['tabletext']
+
+    allocation = allocate(sizes, STAGE_SHARES[stage], budget)
+    fitted = {part: fit_text(part, text, allocation[part], terms) for part, text in parts.items()}
+    kept = sum(estimate_tokens(text) for text in fitted.values())
+    log.info("✂️ Prompt fitted to budget", docid=docid, stage=stage, tokens=total, kept_tokens=kept, budget=budget)
+    emit_metric("PromptTokensSaved", total - kept, stage=stage, docid=docid)
+    return fitted['raw_text'], fitted['key_value_pair_data'], fitted['tabletext']
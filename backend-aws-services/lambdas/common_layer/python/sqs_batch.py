@@ -0,0 +1,68 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from structured_log import log
+
+# Messages of one batch processed at the same time, tune per function
+DEFAULT_BATCH_CONCURRENCY = int(os.environ.get("SQS_BATCH_CONCURRENCY", "4"))
+
+
+def parse_record_body(record):
+    """Return the JSON body of an SQS record as a dict"""
+    data_string = record['body']
+    if type(data_string) is dict:
+        return data_string
+    return json.loads(data_string)
+
+
+def single_record_event(record):
+    """Wrap one record in an SQS-shaped event, for handing a message to the next stage"""
+    return {'Records': [record]}
+
+
+def is_failed_result(result):
+    """A message failed when its processor returned a 5xx response; 4xx means it can never succeed"""
+    return isinstance(result, dict) and int(result.get('statusCode', 200)) >= 500
+
+
+def process_sqs_batch(event, process_record, max_concurrency=None):
+    """
+    Process every record of an SQS event and report the failed ones
+
+    Args:
+        event (dict): SQS event with a 'Records' list
+        process_record (callable): Called with each record, returns a response dict. Raising
+            or returning a 5xx statusCode marks the message as failed
+        max_concurrency (int): Records processed concurrently, defaults to SQS_BATCH_CONCURRENCY
+
+    Returns:
+        dict: {'batchItemFailures': [{'itemIdentifier': messageId}, ...]} - with
+            ReportBatchItemFailures enabled on the event source mapping SQS only
+            redelivers those messages
+    """
+    records = event.get('Records', [])
+    max_concurrency = max(1, min(len(records) or 1, int(max_concurrency or DEFAULT_BATCH_CONCURRENCY)))
+    log.info("Processing SQS batch", records=len(records), concurrency=max_concurrency)
+
+    def run(index, record):
+        message_id = record.get('messageId', str(index))
+        try:
+            result = process_record(record)
+            if is_failed_result(result):
+                log.warning("Message failed", message_id=message_id, result=result)
+                return message_id
+            return None
+        except Exception as e:
+            log.exception("Exception while processing message", message_id=message_id, error=str(e))
+            return message_id
+
+    if max_concurrency == 1:
+        failed = [run(i, record) for i, record in enumerate(records)]
+    else:
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            failed = list(executor.map(run, range(len(records)), records))
+
+    batch_item_failures = [{'itemIdentifier': message_id} for message_id in failed if message_id is not None]
+    log.info("SQS batch done", succeeded=len(records) - len(batch_item_failures), failed=len(batch_item_failures))
+    return {'batchItemFailures': batch_item_failures}
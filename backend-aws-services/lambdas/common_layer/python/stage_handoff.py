@@ -0,0 +1,161 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import boto3
+
+from instrumentation import emit_metrics
+from sqs_batch import parse_record_body, single_record_event
+from structured_log import log, response_summary
+
+# How a stage passes a document to the next one:
+# "invoke" - synchronous lambda invoke (RequestResponse) of the next function (original behaviour);
+#            the caller stays running, and billed, until every later stage is done
+# "sqs"    - a message on the next stage's queue, whose event source mapping triggers its function;
+#            the caller returns straight away, so one stage of a document runs at a time
+STAGE_HANDOFF = os.environ.get("STAGE_HANDOFF", "invoke")
+
+QUEUE_URL_PREFIX = "https://sqs.us-east-1.amazonaws.com/040504913362/"
+
+# The document pipeline after extraction. document_extraction_lambda already queues every
+# document on NMM_DocProcessingAfterExtractionQueueNew for classification.
+STAGES = {
+    "classification": {
+        "function": os.environ.get("CLASSIFICATION_LAMBDA", "nmm_document_classification_lambda"),
+        "queue_url": QUEUE_URL_PREFIX + "NMM_DocProcessingAfterExtractionQueueNew",
+        "next": "entity_extraction",
+    },
+    "entity_extraction": {
+        "function": os.environ.get("ENTITY_EXTRACTION_LAMBDA", "nmm_entityextraction_lambda"),
+        "queue_url": os.environ.get("ENTITY_EXTRACTION_QUEUE_URL", QUEUE_URL_PREFIX + "NMM_EntityExtractionQueue"),
+        "next": "confidence_score",
+    },
+    "confidence_score": {
+        "function": os.environ.get("CONFIDENCE_SCORE_LAMBDA", "nmm_confidence_score_lambda"),
+        "queue_url": os.environ.get("CONFIDENCE_SCORE_QUEUE_URL", QUEUE_URL_PREFIX + "NMM_ConfidenceScoreQueue"),
+        "next": None,
+    },
+}
+
+lambda_client = boto3.client('lambda')
+sqs_client = boto3.client('sqs')
+
+# The LocalRunner in use, if any - it takes every hand-off whatever STAGE_HANDOFF says
+_local_runner = None
+
+
+class StageHandoffError(Exception):
+    """Raised when a document could not be queued for its next stage"""
+
+
+def hand_off(stage, record):
+    """
+    Pass the document of an SQS record on to a stage
+
+    In "invoke" mode an invoke error is logged and swallowed, as the lambdas did before. In
+    "sqs" mode a failed send raises StageHandoffError, so the caller's message is reported as
+    failed and SQS redelivers it instead of the document stalling.
+
+    Args:
+        stage (str): Name of the next stage in STAGES
+        record (dict): The SQS record the current stage is processing
+    """
+    if _local_runner is not None:
+        _local_runner.submit(stage, parse_record_body(record))
+        return
+    target = STAGES[stage]
+    docid = parse_record_body(record).get('docid')
+    if STAGE_HANDOFF == "sqs":
+        body = dict(parse_record_body(record), stage=stage)
+        try:
+            response = sqs_client.send_message(
+                QueueUrl=target["queue_url"],
+                MessageBody=json.dumps(body),
+                MessageAttributes={
+                    'DocId': {'StringValue': str(docid), 'DataType': 'String'},
+                    'Stage': {'StringValue': stage, 'DataType': 'String'},
+                },
+            )
+        except Exception as e:
+            raise StageHandoffError(f"Could not queue docid {docid} for {stage}: {e}") from e
+        log.info("✅ Queued for next stage", docid=docid, stage=stage, message_id=response['MessageId'])
+        return
+
+    start = time.time()
+    try:
+        response = lambda_client.invoke(
+            FunctionName=target["function"],
+            InvocationType='RequestResponse',
+            Payload=json.dumps(single_record_event(record))  # Pass only this document's record
+        )
+        log.debug("Lambda invoke response", docid=docid, stage=stage, response=response_summary(response))
+    except Exception as e:
+        log.error("Error invoking next stage", docid=docid, function=target['function'], error=str(e))
+    # Time this stage stayed running (and billed) waiting for the later ones
+    emit_metrics({"StageHandoffWait": (round((time.time() - start) * 1000, 1), "Milliseconds")},
+                 docid=docid, stage=stage)
+
+
+class LocalRunner:
+    """
+    Runs the stage graph in-process, for tests and benchmarks
+
+    Stage handlers are called with an SQS-shaped event of one record, like the queue-triggered
+    functions. A hand-off queues the next stage, which runs once the current stage has
+    returned - one stage at a time, as in "sqs" mode.
+
+    Usage:
+        with LocalRunner({"classification": classification.lambda_handler, ...}) as runner:
+            runner.submit("classification", {"docid": ..., "indexid": ..., "s3filename": ...})
+            runner.run()
+    """
+
+    def __init__(self, handlers):
+        self.handlers = handlers
+        self.pending = deque()
+        self.lock = threading.Lock()
+        self.runs = []  # {"stage", "docid", "seconds", "failed"} in run order
+        self.active = self.peak_active = 0
+
+    def __enter__(self):
+        global _local_runner
+        self._previous, _local_runner = _local_runner, self
+        return self
+
+    def __exit__(self, *exc):
+        global _local_runner
+        _local_runner = self._previous
+
+    def submit(self, stage, body):
+        with self.lock:
+            self.pending.append((stage, body))
+
+    def run(self):
+        """Run queued stages (and the stages they hand off to) until none is left"""
+        number = 0
+        while True:
+            with self.lock:
+                if not self.pending:
+                    return self.runs
+                stage, body = self.pending.popleft()
+            number += 1
+            handler = self.handlers.get(stage)
+            if handler is None:
+                log.info("No local handler for stage - document stops here", docid=body.get('docid'), stage=stage)
+                continue
+            record = {'messageId': f"local-{number}", 'body': json.dumps(dict(body, stage=stage))}
+            self.active += 1
+            self.peak_active = max(self.peak_active, self.active)
+            start = time.perf_counter()
+            try:
+                result = handler(single_record_event(record), None)
+                failed = bool(isinstance(result, dict) and result.get('batchItemFailures'))
+            except Exception as e:
+                log.error("Stage raised", docid=body.get('docid'), stage=stage, error=str(e))
+                failed = True
+            finally:
+                self.active -= 1
+            self.runs.append({"stage": stage, "docid": body.get('docid'),
+                              "seconds": time.perf_counter() - start, "failed": failed})
@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import random
+import traceback
+
+from instrumentation import current_docid, function_name
+
+LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+
+# Lowest level written - DEBUG also writes the payload lines (events, document text, prompts,
+# DynamoDB items) that the lambdas printed in full before
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# Longest string value of a line; longer ones are cut with a "...(+N chars)" marker. 0 - no limit
+LOG_PAYLOAD_MAX_CHARS = int(os.environ.get("LOG_PAYLOAD_MAX_CHARS", "1000"))
+# Share of documents whose DEBUG lines are written although LOG_LEVEL is higher. Sampled by
+# docid, so a sampled document has all of its DEBUG lines in every lambda of the pipeline
+LOG_DEBUG_SAMPLE_RATE = float(os.environ.get("LOG_DEBUG_SAMPLE_RATE", "0"))
+
+
+def _threshold():
+    return LEVELS.get(LOG_LEVEL, LEVELS["INFO"])
+
+
+def sampled(docid):
+    """True for the LOG_DEBUG_SAMPLE_RATE share of docids - the same answer in every lambda"""
+    if LOG_DEBUG_SAMPLE_RATE <= 0:
+        return False
+    if LOG_DEBUG_SAMPLE_RATE >= 1:
+        return True
+    if docid is None:
+        return random.random() < LOG_DEBUG_SAMPLE_RATE
+    digest = hashlib.sha1(str(docid).encode()).hexdigest()
+    return int(digest[:8], 16) / 0x100000000 < LOG_DEBUG_SAMPLE_RATE
+
+
+def clip(text, keep_tail=False):
+    """Cut text to LOG_PAYLOAD_MAX_CHARS, keeping its start (or its end, for tracebacks)"""
+    limit = LOG_PAYLOAD_MAX_CHARS
+    if not limit or len(text) <= limit:
+        return text
+    if keep_tail:
+        return f"(+{len(text) - limit} chars)..." + text[-limit:]
+    return text[:limit] + f"...(+{len(text) - limit} chars)"
+
+
+def _field(value, keep_tail=False):
+    """A JSON-ready field value - small structures as they are, anything long as clipped text"""
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, str):
+        return clip(value, keep_tail)
+    text = json.dumps(value, default=str, ensure_ascii=False)
+    return value if not LOG_PAYLOAD_MAX_CHARS or len(text) <= LOG_PAYLOAD_MAX_CHARS else clip(text)
+
+
+def response_summary(response):
+    """
+    The parts of a boto3 response worth logging
+
+    DynamoDB update_item(ReturnValues='ALL_NEW') and get_item responses carry the whole item -
+    log its status, capacity and attribute names instead of the item.
+    """
+    if not isinstance(response, dict):
+        return response
+    summary = {"status": response.get("ResponseMetadata", {}).get("HTTPStatusCode")}
+    for key in ("Attributes", "Item"):
+        if key in response:
+            summary[key.lower()] = sorted(response[key])
+    if "Items" in response:
+        summary["items"] = len(response["Items"])
+    if "ConsumedCapacity" in response:
+        summary["consumed_capacity"] = response["ConsumedCapacity"]
+    return summary
+
+
+class StructuredLogger:
+    """
+    JSON log lines on stdout, one per call, with a level, a message and fields
+
+    Usage:
+        log.info("Classification stored", docid=docid, classification=classificationtype)
+        log.debug("Document text", rawtext=rawtext)     # payloads - DEBUG, clipped
+
+    A line has level, message, FunctionName and the docid (given, or the current Span's), so
+    Logs Insights can filter one document's lines across the pipeline. Lines below LOG_LEVEL
+    are dropped before their fields are serialized; DEBUG lines of sampled docids
+    (LOG_DEBUG_SAMPLE_RATE) are written anyway, with "sampled": true.
+    """
+
+    def enabled(self, level, docid=None):
+        if LEVELS[level] >= _threshold():
+            return True
+        return level == "DEBUG" and sampled(docid if docid is not None else current_docid())
+
+    def log(self, level, message, docid=None, **fields):
+        if docid is None:
+            docid = current_docid()
+        if LEVELS[level] < _threshold():
+            if not (level == "DEBUG" and sampled(docid)):
+                return
+            fields["sampled"] = True
+        line = {"level": level, "message": message, "FunctionName": function_name()}
+        if docid is not None:
+            line["docid"] = docid
+        line.update((name, _field(value, keep_tail=name == "traceback")) for name, value in fields.items())
+        print(json.dumps(line, default=str, ensure_ascii=False))
+
+    def debug(self, message, **fields):
+        self.log("DEBUG", message, **fields)
+
+    def info(self, message, **fields):
+        self.log("INFO", message, **fields)
+
+    def warning(self, message, **fields):
+        self.log("WARNING", message, **fields)
+
+    def error(self, message, **fields):
+        self.log("ERROR", message, **fields)
+
+    def exception(self, message, **fields):
+        """An ERROR line with the traceback of the exception being handled (its last frames if clipped)"""
+        fields["traceback"] = traceback.format_exc()
+        self.log("ERROR", message, **fields)
+
+
+log = StructuredLogger()
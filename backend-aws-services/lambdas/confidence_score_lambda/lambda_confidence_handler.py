@@ -1,35 +1,39 @@
 import json
-import logging
 import boto3
 from utils import run_confidence_scorer,run_confidence_scorer_with_doc_score,get_entity_weights, update_doc_status_new
+from sqs_batch import process_sqs_batch, parse_record_body
+from extraction_payloads import hydrate_payloads
+from local_scorer import LOCAL_SCORER_MODE
+from instrumentation import Span, record_consumed_capacity
+from structured_log import log
 
-logging.basicConfig(level=logging.INFO)
+# Created once - boto3.resource() on the default session is not safe to call from the batch worker threads
+dynamodb = boto3.resource('dynamodb')
 
 def lambda_handler(event, context):
-    try:
-        print("Event = ", event)
+    log.debug("Event", event=event)
 
-        if 'Records' in event:
-            data_string = event['Records'][0]['body']   # this change is done only to accept the 'body' from SQS
-        else:
-            data_string = event
-        print("event[body]",data_string,type(data_string))
-        
-        if type(data_string) is dict:
-            qtext = data_string
-        else:
-            qtext = json.loads(data_string)
-        #print("\n","Lambda Handler context:",type(context),context)
-        
-        print("qtext=json.loads(data_string) :",type(qtext),qtext)
+    if 'Records' in event:
+        # SQS batch (or a single-record event from the entity extraction lambda) -
+        # score every record and report the failed ones back to SQS
+        return process_sqs_batch(event, lambda record: score_document(parse_record_body(record)))
+
+    data_string = event
+    if type(data_string) is dict:
+        qtext = data_string
+    else:
+        qtext = json.loads(data_string)
+    return score_document(qtext)
+
+def score_document(qtext):
+    try:
         #s3files = [qtext['s3filename']]  # send the file name in an array
         #indexid = qtext['indexid']
         #print("indexid = ",indexid)
         docid = qtext['docid']
-        print("docid = ",docid)
+        log.info("Scoring document", docid=docid)
 
 
-        dynamodb = boto3.resource('dynamodb')
         table = dynamodb.Table('doc-extraction')
         dbtbl= dynamodb.Table('dashboard')
         
@@ -38,8 +42,8 @@ def lambda_handler(event, context):
         # print("docid =", docid)
         # model_name = event.get('model_name', 'sonnet')
         # model_id = event.get('model_id', 'anthropic.claude-3-5-sonnet-20240620-v1:0')
-        region = event.get('region', 'us-east-1')
-        batch_size = event.get('batch_size', 20)
+        region = qtext.get('region', 'us-east-1')
+        batch_size = qtext.get('batch_size', 20)
         
         if not docid:
             return {
@@ -48,7 +52,9 @@ def lambda_handler(event, context):
             }
         
         # Read from DynamoDB
-        response = table.get_item(Key={'docid': docid})
+        with Span("load", docid, table=table.name):
+            response = table.get_item(Key={'docid': docid}, ReturnConsumedCapacity='TOTAL')
+            record_consumed_capacity(response, "read")
         
         if 'Item' not in response:
             return {
@@ -56,7 +62,9 @@ def lambda_handler(event, context):
                 'body': json.dumps({'error': 'Document not found'})
             }
         
-        item = response['Item']
+        # The local scorer also reads the form key-values
+        payload_fields = ('rawtext',) if LOCAL_SCORER_MODE == 'off' else ('rawtext', 'keyvaluesText')
+        item = hydrate_payloads(response['Item'], fields=payload_fields)
         text = item.get('rawtext', '')
         extracted_entities = item.get('extracted_entities', '{}')
         
@@ -76,42 +84,45 @@ def lambda_handler(event, context):
         if isinstance(extracted_entities, str):
             extracted_entities = json.loads(extracted_entities)
         
-        print("extracted_entities =", extracted_entities)
+        log.debug("Extracted entities", docid=docid, extracted_entities=extracted_entities)
         field_weights=get_entity_weights("ClaimForm")
-        print("field wghts",field_weights)
         # Run confidence scoring
-        updated_entities,doc_score = run_confidence_scorer_with_doc_score(
-            text=text,
-            extracted_entities=extracted_entities,
-            model_name= "sonnet", # "model_name",
-            model_id= "anthropic.claude-3-5-sonnet-20240620-v1:0", # model_id,
-            field_weights=field_weights,
-            region=region,
-            batch_size=batch_size
-        )
-        print("updated entities",updated_entities)
+        with Span("confidence", docid):
+            updated_entities,doc_score = run_confidence_scorer_with_doc_score(
+                text=text,
+                extracted_entities=extracted_entities,
+                model_name= "sonnet", # "model_name",
+                model_id= "anthropic.claude-3-5-sonnet-20240620-v1:0", # model_id,
+                field_weights=field_weights,
+                region=region,
+                batch_size=batch_size,
+                key_values=item.get('keyvaluesText', '') if LOCAL_SCORER_MODE != 'off' else ''
+            )
         # Convert back to string for DynamoDB storage
         updated_entities_str = json.dumps(updated_entities)
-        print("updated_entities_str =", updated_entities_str)
+        log.debug("Scored entities", docid=docid, updated_entities=updated_entities_str)
         # Update DynamoDB with scored entities
-        table.update_item(
-            Key={'docid': docid},
-            UpdateExpression='SET extracted_entities = :val, document_conf_score=:val1',
-            ExpressionAttributeValues={':val': updated_entities_str,':val1': doc_score}
-        )
-        dbtbl.update_item(
-            Key={'docid': docid},
-            UpdateExpression='SET document_conf_score = :val, confidence_score_status=:val1',
-            ExpressionAttributeValues={':val': doc_score,':val1':'Completed'}
-        )
+        with Span("persist", docid, table=table.name):
+            record_consumed_capacity(table.update_item(
+                Key={'docid': docid},
+                UpdateExpression='SET extracted_entities = :val, document_conf_score=:val1',
+                ExpressionAttributeValues={':val': updated_entities_str,':val1': doc_score},
+                ReturnConsumedCapacity='TOTAL'
+            ))
+            record_consumed_capacity(dbtbl.update_item(
+                Key={'docid': docid},
+                UpdateExpression='SET document_conf_score = :val, confidence_score_status=:val1',
+                ExpressionAttributeValues={':val': doc_score,':val1':'Completed'},
+                ReturnConsumedCapacity='TOTAL'
+            ))
 
         ######################################
-        print("before updating email_reader_v1 -> docid = ", docid)
         res = update_doc_status_new(docid, "Completed")
-        print("successfully updated email_reader status = ", res)
+        log.info(res, docid=docid)
 
         #######################################
-        print("Updated database table with updated confidence score for each field.")
+        log.info("Updated database table with updated confidence score for each field", docid=docid,
+                 document_conf_score=doc_score)
         return {
             'statusCode': 200,
             'body': json.dumps({
@@ -122,7 +133,7 @@ def lambda_handler(event, context):
         }
         
     except Exception as e:
-        logging.error(f"Error in lambda_handler: {str(e)}")
+        log.exception("Error in lambda_handler", error=str(e))
         return {
             'statusCode': 500,
             'body': json.dumps({'error': str(e)})
@@ -0,0 +1,282 @@
+import difflib
+import os
+import re
+import unicodedata
+from collections import defaultdict
+
+# "off"    - every field is scored by the LLM (original behaviour)
+# "shadow" - every field is scored by the LLM, and the local scores are logged/emitted next to its scores
+# "on"     - fields with a local score of at least LOCAL_SCORER_THRESHOLD are not sent to the LLM
+LOCAL_SCORER_MODE = os.environ.get("CONFIDENCE_LOCAL_SCORER", "off")
+LOCAL_SCORER_THRESHOLD = float(os.environ.get("CONFIDENCE_LOCAL_THRESHOLD", "0.9"))
+
+# Scores of the kinds of evidence. Anything below the threshold is left to the LLM - a value
+# that is not found verbatim may still be implied by the text, which only the LLM can judge.
+EXACT_SCORE = 0.97
+DATE_SCORE = 0.95
+IDENTIFIER_SCORE = 0.95
+FUZZY_WEIGHT = 0.95
+KEY_VALUE_SCORE = 0.92
+KEY_VALUE_BONUS = 0.05
+KEY_VALUE_CONFLICT_SCORE = 0.5
+# Dates, yes/no and other short values occur all over a claim document, so finding one says
+# nothing about whether it belongs to this field. Without a form key or a label naming the
+# field they score at most this (and always below LOCAL_SCORER_THRESHOLD)
+UNLABELLED_SCORE = 0.85
+SHORT_VALUE_TOKENS = 3
+# A label is the last few words before a value in the text
+LABEL_WINDOW_WORDS = 6
+LABEL_CONTEXT_CHARS = 120
+MAX_LABEL_OCCURRENCES = 50
+
+# Values longer than this are narrative (diagnoses, descriptions) and left to the LLM
+MAX_FUZZY_TOKENS = 12
+# Window starts tried per document for the fuzzy match of one value
+MAX_FUZZY_ANCHORS = 300
+# Share of the field-name words a form key must contain to count as that field's key
+KEY_MATCH_SHARE = 0.6
+FIELD_NAME_STOPWORDS = {'of', 'the', 'and', 'or', 'id', 'no', 'if', 'any', 'to', 'for', 'enter'}
+
+MONTHS = {name: number for number, names in enumerate(
+    [('jan', 'january'), ('feb', 'february'), ('mar', 'march'), ('apr', 'april'), ('may',), ('jun', 'june'),
+     ('jul', 'july'), ('aug', 'august'), ('sep', 'sept', 'september'), ('oct', 'october'), ('nov', 'november'),
+     ('dec', 'december')], start=1) for name in names}
+_MONTH_NAMES = "|".join(sorted(MONTHS, key=len, reverse=True))
+_DATE_PATTERNS = [
+    # 2024-03-14
+    ('ymd', re.compile(r"(?<!\d)(\d{4})[/.\-](\d{1,2})[/.\-](\d{1,2})(?!\d)")),
+    # 03/14/2024, 3-14-24 (US order; day-first when the month would be over 12)
+    ('mdy', re.compile(r"(?<!\d)(\d{1,2})[/.\-](\d{1,2})[/.\-](\d{4}|\d{2})(?!\d)")),
+    # March 14, 2024 / Mar. 14th 2024
+    ('Mdy', re.compile(r"\b(" + _MONTH_NAMES + r")\.?\s+(\d{1,2})(?:st|nd|rd|th)?,?\s+(\d{4})\b", re.IGNORECASE)),
+    # 14 March 2024
+    ('dMy', re.compile(r"\b(\d{1,2})(?:st|nd|rd|th)?\s+(" + _MONTH_NAMES + r")\.?,?\s+(\d{4})\b", re.IGNORECASE)),
+]
+# "Key: Date of Injury, Value: 03/14/2024" up to the quote / escaped newline str() left after it
+_KEY_VALUE_RE = re.compile(r"Key: (.*?), Value: (.*?)(?=['\"]\s*[,\]]|\\n|\n|Key: |$)")
+_NON_ALNUM_RE = re.compile(r"[^a-z0-9]+")
+
+
+def normalize(text):
+    """Lower-case words and numbers separated by single spaces, accents and punctuation removed"""
+    text = unicodedata.normalize('NFKD', str(text)).encode('ascii', 'ignore').decode()
+    # The stored text is str() of per-file lists, so line breaks are often the two characters "\n"
+    text = text.replace('\\n', ' ').lower()
+    return _NON_ALNUM_RE.sub(' ', text).strip()
+
+
+def _iso_date(year, month, day):
+    year, month, day = int(year), int(month), int(day)
+    if year < 100:
+        year += 2000 if year < 50 else 1900
+    if month > 12 and day <= 12:
+        month, day = day, month
+    if not (1 <= month <= 12 and 1 <= day <= 31 and 1900 <= year <= 2100):
+        return None
+    return f"{year:04d}-{month:02d}-{day:02d}"
+
+
+def _date_from_match(kind, groups):
+    if kind == 'ymd':
+        return _iso_date(groups[0], groups[1], groups[2])
+    if kind == 'mdy':
+        return _iso_date(groups[2], groups[0], groups[1])
+    if kind == 'Mdy':
+        return _iso_date(groups[2], MONTHS[groups[0].lower()], groups[1])
+    return _iso_date(groups[2], MONTHS[groups[1].lower()], groups[0])
+
+
+def _date_matches(text):
+    """(ISO date, start offset) of every date written in text"""
+    for kind, pattern in _DATE_PATTERNS:
+        for match in pattern.finditer(text):
+            date = _date_from_match(kind, match.groups())
+            if date:
+                yield date, match.start()
+
+
+def find_dates(text):
+    """ISO dates (YYYY-MM-DD) of every date written in text, in any of the usual formats"""
+    return {date for date, _ in _date_matches(text)}
+
+
+def canonical_date(value):
+    """ISO date of a value that is a date and nothing else, None otherwise"""
+    value = value.strip()
+    for kind, pattern in _DATE_PATTERNS:
+        match = pattern.fullmatch(value)
+        if match:
+            return _date_from_match(kind, match.groups())
+    return None
+
+
+def is_identifier(normalized_value):
+    """Claim / policy / case numbers and postal codes: one token-ish value with at least 4 digits"""
+    compact = normalized_value.replace(' ', '')
+    return len(compact) >= 5 and sum(char.isdigit() for char in compact) >= 4 and len(normalized_value.split()) <= 3
+
+
+def field_words(field_name):
+    return {word for word in normalize(field_name.replace('_', ' ')).split() if word not in FIELD_NAME_STOPWORDS}
+
+
+def needs_label(normalized_value, value_date):
+    """Dates and short values (yes/no, a word or a name) - common enough to belong to any field"""
+    if value_date:
+        return True
+    return len(normalized_value.split()) <= SHORT_VALUE_TOKENS and not is_identifier(normalized_value)
+
+
+class EvidenceIndex:
+    """
+    The source text of one document, prepared once for scoring all of its fields
+
+    Holds the normalized text and its tokens with their positions (for fuzzy matching),
+    the text with spaces removed (identifiers written with other separators), every date
+    in canonical form with the words before each of its occurrences, and the form
+    key-values from keyvaluesText.
+    """
+
+    def __init__(self, text, key_values=""):
+        self.text = " " + normalize(text) + " "
+        self.tokens = self.text.split()
+        self.positions = defaultdict(list)
+        for position, token in enumerate(self.tokens):
+            self.positions[token].append(position)
+        self.compact = self.text.replace(' ', '')
+        raw_text = str(text).replace('\\n', ' ')
+        self.date_labels = defaultdict(list)
+        for date, start in _date_matches(raw_text):
+            preceding = normalize(raw_text[max(0, start - LABEL_CONTEXT_CHARS):start]).split()
+            self.date_labels[date].append(set(preceding[-LABEL_WINDOW_WORDS:]))
+        self.dates = set(self.date_labels) | find_dates(str(key_values).replace('\\n', ' '))
+        self.key_values = [(set(normalize(key).split()), normalize(value), canonical_date(value))
+                           for key, value in _KEY_VALUE_RE.findall(str(key_values or "")) if value.strip()]
+
+    def fuzzy_ratio(self, normalized_value):
+        """Best difflib ratio of the value against text windows of about its length"""
+        words = normalized_value.split()
+        if not words or len(words) > MAX_FUZZY_TOKENS:
+            return 0.0
+        # Windows start near tokens the value shares with the text, rarest first
+        anchors = sorted(((len(self.positions[word]), offset, word) for offset, word in enumerate(words)
+                          if word in self.positions))
+        starts, tried = set(), 0
+        for _, offset, word in anchors:
+            for position in self.positions[word]:
+                starts.add(max(0, position - offset))
+                tried += 1
+                if tried >= MAX_FUZZY_ANCHORS:
+                    break
+            if tried >= MAX_FUZZY_ANCHORS:
+                break
+        best = 0.0
+        matcher = difflib.SequenceMatcher(autojunk=False)
+        matcher.set_seq2(normalized_value)
+        for start in starts:
+            for length in {max(1, len(words) - 1), len(words), len(words) + 1}:
+                matcher.set_seq1(" ".join(self.tokens[start:start + length]))
+                if matcher.real_quick_ratio() > best and matcher.quick_ratio() > best:
+                    best = max(best, matcher.ratio())
+        return best
+
+    def labels(self, normalized_value, value_date):
+        """Word sets of the last words before each occurrence of the value in the text"""
+        if value_date:
+            return self.date_labels.get(value_date, [])
+        found, needle = [], f" {normalized_value} "
+        position = self.text.find(needle)
+        while position >= 0 and len(found) < MAX_LABEL_OCCURRENCES:
+            found.append(set(self.text[max(0, position - LABEL_CONTEXT_CHARS):position].split()[-LABEL_WINDOW_WORDS:]))
+            position = self.text.find(needle, position + 1)
+        return found
+
+    def labelled(self, field_name, normalized_value, value_date):
+        """True when the words before an occurrence of the value name the field"""
+        words = field_words(field_name)
+        return bool(words) and any(len(words & label) >= KEY_MATCH_SHARE * len(words)
+                                   for label in self.labels(normalized_value, value_date))
+
+    def key_value_support(self, field_name, normalized_value, value_date):
+        """
+        True when a form key naming the field holds the value, False when such keys only hold
+        other values, None when no key names the field
+        """
+        words = field_words(field_name)
+        if not words:
+            return None
+        supported = None
+        for key_words, key_value, key_date in self.key_values:
+            if len(words & key_words) < KEY_MATCH_SHARE * len(words):
+                continue
+            if value_date or is_identifier(normalized_value):
+                # A day or a digit off is another value, not a misread
+                matches = (value_date == key_date if value_date
+                           else key_value.replace(' ', '') == normalized_value.replace(' ', ''))
+            else:
+                matches = (key_value == normalized_value
+                           or difflib.SequenceMatcher(None, key_value, normalized_value).ratio() >= 0.9)
+            if matches:
+                return True
+            supported = False
+        return supported
+
+    def score(self, field_name, value):
+        """
+        Local confidence in [0, 1] that the text supports the value, and the evidence found
+
+        Returns:
+            tuple: (score, reason)
+        """
+        normalized_value = normalize(value)
+        if not normalized_value:
+            return 0.0, "empty"
+        value_date = canonical_date(value)
+        score, reason = 0.0, "not found"
+        if value_date:
+            if value_date in self.dates:
+                score, reason = DATE_SCORE, "date"
+        elif len(normalized_value) >= 3 and f" {normalized_value} " in self.text:
+            score, reason = EXACT_SCORE, "exact"
+        elif is_identifier(normalized_value) and normalized_value.replace(' ', '') in self.compact:
+            score, reason = IDENTIFIER_SCORE, "identifier"
+        elif len(normalized_value) >= 3:
+            ratio = self.fuzzy_ratio(normalized_value)
+            score, reason = round(FUZZY_WEIGHT * ratio, 3), f"fuzzy {ratio:.2f}"
+
+        support = self.key_value_support(field_name, normalized_value, value_date)
+        if support:
+            score, reason = round(min(1.0, max(score + KEY_VALUE_BONUS, KEY_VALUE_SCORE)), 3), reason + " + key-value"
+        elif support is False:
+            # Found somewhere, but the form field itself says otherwise - let the LLM decide
+            score, reason = min(score, KEY_VALUE_CONFLICT_SCORE), reason + ", form key holds another value"
+        cap = min(UNLABELLED_SCORE, LOCAL_SCORER_THRESHOLD - 0.01)
+        if not support and score > cap and needs_label(normalized_value, value_date) \
+                and not self.labelled(field_name, normalized_value, value_date):
+            # Found, but nothing ties it to this field - it may be another field's value
+            score, reason = cap, reason + ", no label for the field"
+        return score, reason
+
+
+def score_fields_locally(fields, text, key_values=""):
+    """
+    Local scores of fields as returned by extract_fields_for_scoring
+
+    Returns:
+        list: (score, reason) per field, in field order
+    """
+    index = EvidenceIndex(text, key_values)
+    return [index.score(item["field"], item["value"]) for item in fields]
+
+
+def pearson(xs, ys):
+    """Pearson correlation of two equally long sequences, None when undefined"""
+    if len(xs) < 2:
+        return None
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    covariance = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+    spread_x = sum((x - mean_x) ** 2 for x in xs) ** 0.5
+    spread_y = sum((y - mean_y) ** 2 for y in ys) ** 0.5
+    if not spread_x or not spread_y:
+        return None
+    return covariance / (spread_x * spread_y)
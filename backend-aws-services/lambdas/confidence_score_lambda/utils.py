@@ -1,48 +1,39 @@
 import json
-import logging
 import re
 import copy
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any, List
 import boto3
-from botocore.exceptions import ClientError
+from dynamo_scan import parallel_scan
+from bedrock_gateway import invoke_claude, converse_text
+from prompt_budget import estimate_tokens
+from instrumentation import emit_metrics, in_current_span
+from structured_log import log
+from local_scorer import LOCAL_SCORER_MODE, LOCAL_SCORER_THRESHOLD, pearson, score_fields_locally
 
-logging.basicConfig(level=logging.INFO)
+
+dynamodb_resource = boto3.resource('dynamodb')
+
+# Scoring batches of one document sent to Bedrock at the same time
+CONFIDENCE_MAX_CONCURRENCY = int(os.environ.get("CONFIDENCE_MAX_CONCURRENCY", "4"))
+CONFIDENCE_MIN_BATCH_FIELDS = int(os.environ.get("CONFIDENCE_MIN_BATCH_FIELDS", "5"))
+# Input tokens one document may spend on scoring (every batch re-sends the text), and may
+# have in flight at once - long texts get fewer, larger batches and less concurrency
+CONFIDENCE_INPUT_TOKEN_BUDGET = int(os.environ.get("CONFIDENCE_INPUT_TOKEN_BUDGET", "400000"))
+CONFIDENCE_INFLIGHT_TOKEN_BUDGET = int(os.environ.get("CONFIDENCE_INFLIGHT_TOKEN_BUDGET", "200000"))
 
 def invoke_claude_model(prompt: str, model_id: str, region: str, max_tokens: int = 8000, temperature: float = 0.5) -> str:
-    client = boto3.client("bedrock-runtime", region_name=region)
-    request_body = {
-        "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": max_tokens,
-        "temperature": temperature,
-        "messages": [
-            {"role": "user", "content": [{"type": "text", "text": prompt}]}
-        ]
-    }
-    try:
-        response = client.invoke_model(
-            modelId=model_id,
-            body=json.dumps(request_body),
-            accept="application/json",
-            contentType="application/json"
-        )
-        model_response = json.loads(response["body"].read())
-        return model_response["content"][0]["text"]
-    except (ClientError, Exception) as e:
-        logging.error(f"Failed to invoke model '{model_id}': {e}")
-        return ""
+    # Cached client per region, rate limited per model and retried on throttling; a call that
+    # fails for good raises BedrockGatewayError, which score_entity_confidence logs per batch
+    return invoke_claude(prompt, model_id, max_tokens=max_tokens, temperature=temperature, region=region,
+                         stage="confidence_score")
 
 def call_nova(prompt: str, model_id: str, region: str, max_tokens: int = 8000) -> str:
-    client = boto3.client("bedrock-runtime", region_name=region)
-    try:
-        response = client.converse(
-            modelId=model_id,
-            messages=[{"role": "user", "content": [{"text": prompt}]}],
-            inferenceConfig={"temperature": 0.5, "maxTokens": max_tokens, "topP": 0.9}
-        )
-        return response["output"]["message"]["content"][0]["text"]
-    except (ClientError, Exception) as e:
-        logging.error(f"Failed to invoke Nova '{model_id}': {e}")
-        return ""
+    return converse_text(prompt, model_id, inference_config={"temperature": 0.5, "maxTokens": max_tokens, "topP": 0.9},
+                         region=region, stage="confidence_score")
 
 def dispatch_llm_call(prompt: str, model_name: str, model_id: str, region: str, max_tokens: int = 8000) -> str:
     if model_name in ["haiku", "sonnet"]:
@@ -67,7 +58,6 @@ def extract_fields_for_scoring(template: Dict[str, Any]) -> List[Dict[str, str]]
 def extract_fields_for_scoring(entities: Dict[str, Any]) -> List[Dict[str, str]]:
     """Extract fields from extracted_entities structure"""
     fields = []
-    print(entities.items())
     def traverse_dict(obj, path=""):
         for key, value in obj.items():
             current_path = f"{path}.{key}" if path else key
@@ -131,61 +121,153 @@ def parse_llm_scores(raw: str) -> Dict[str, float]:
                 return {}
         return {}
 
-def score_entity_confidence(text: str,entities: Dict[str, Any], model_name: str, model_id: str, region: str, batch_size: int) -> Dict[str, Any]:
+def plan_batches(fields: List[Dict[str, str]], text: str, batch_size: int):
+    """
+    Split fields into scoring batches and pick how many to run at once
+
+    A call takes longer the more fields it scores, so fields are spread over as many batches
+    as can run at once (of CONFIDENCE_MIN_BATCH_FIELDS or more); batch_size is only the
+    upper bound. Every batch re-sends the whole text, so long texts get fewer,
+    larger batches (at most CONFIDENCE_INPUT_TOKEN_BUDGET input tokens per document) and fewer
+    of them run at once (at most CONFIDENCE_INFLIGHT_TOKEN_BUDGET input tokens in flight).
+    Fields are spread evenly, so there is no small trailing batch.
+
+    Returns:
+        tuple: (list of field batches in field order, worker count)
+    """
+    text_tokens = max(1, estimate_tokens(text))
+    max_workers = max(1, min(CONFIDENCE_MAX_CONCURRENCY, CONFIDENCE_INFLIGHT_TOKEN_BUDGET // text_tokens))
+    batch_count = max(math.ceil(len(fields) / max(1, batch_size)),
+                      min(max_workers, len(fields) // CONFIDENCE_MIN_BATCH_FIELDS), 1)
+    # Full waves: 6 batches on 4 workers take as long as 8 smaller ones
+    if batch_count > max_workers:
+        batch_count = math.ceil(batch_count / max_workers) * max_workers
+    batch_count = max(1, min(batch_count, len(fields), CONFIDENCE_INPUT_TOKEN_BUDGET // text_tokens))
+    per_batch = math.ceil(len(fields) / batch_count)
+    batches = [fields[i:i + per_batch] for i in range(0, len(fields), per_batch)]
+    return batches, min(len(batches), max_workers)
+
+def score_batch(text: str, batch: List[Dict[str, str]], model_name: str, model_id: str, region: str) -> Dict[str, float]:
+    prompt = build_confidence_prompt(text, batch)
+    raw = dispatch_llm_call(prompt, model_name, model_id, region)
+    return parse_llm_scores(raw)
+
+def apply_scores(entities: Dict[str, Any], batch: List[Dict[str, str]], scores: Dict[str, float]) -> None:
+    for item in batch:
+        field_name = item["field"]
+        path = item["path"]
+        score = scores.get(field_name)
+
+        if score is not None:
+            # Convert to percentage (0-100%)
+            percentage = f"{int(round(score * 100))}%"
+
+            # Navigate to the correct location and update confidence
+            path_parts = path.split('.')
+            current = entities
+
+            # Navigate to the parent of the target field
+            for part in path_parts[:-1]:
+                if part in current and isinstance(current[part], dict):
+                    current = current[part]
+                else:
+                    break
+            else:
+                # Update confidence if the field exists
+                final_field = path_parts[-1]
+                if final_field in current and isinstance(current[final_field], dict):
+                    current[final_field]["confidence"] = percentage
+
+def score_locally(entities: Dict[str, Any], fields: List[Dict[str, str]], text: str, key_values: str) -> tuple:
+    """
+    Run the local evidence scorer (see local_scorer.py) over the fields
+
+    In "on" mode fields scoring at least LOCAL_SCORER_THRESHOLD get that score written into
+    entities and are not sent to the LLM.
+
+    Returns:
+        tuple: (fields still to be scored by the LLM, local (score, reason) per field or None when off)
+    """
+    if LOCAL_SCORER_MODE not in ("shadow", "on"):
+        return fields, None
+    start_time = time.time()
+    local_scores = score_fields_locally(fields, text, key_values)
+    resolved = [score >= LOCAL_SCORER_THRESHOLD for score, _ in local_scores]
+    log.info("Local scorer", resolved=sum(resolved), fields=len(fields), threshold=LOCAL_SCORER_THRESHOLD,
+             seconds=round(time.time() - start_time, 3))
+    if LOCAL_SCORER_MODE != "on":
+        return fields, local_scores
+    for item, (score, reason), is_resolved in zip(fields, local_scores, resolved):
+        if is_resolved:
+            log.debug("🎯 Scored locally", path=item['path'], value=item['value'], score=score, reason=reason)
+            apply_scores(entities, [item], {item["field"]: score})
+    emit_metrics({"LocalScoreResolved": sum(resolved), "LocalScoreLLMFields": len(fields) - sum(resolved)})
+    return [item for item, is_resolved in zip(fields, resolved) if not is_resolved], local_scores
+
+def compare_local_scores(fields: List[Dict[str, str]], local_scores: list, batch_results: list) -> None:
+    """Shadow mode: log the local score next to the LLM score of every field and emit how well they agree"""
+    llm_scores = {}
+    for batch, scores in batch_results:
+        for item in batch:
+            score = scores.get(item["field"])
+            if isinstance(score, (int, float)):
+                llm_scores[item["path"]] = float(score)
+    pairs = []
+    for item, (score, reason) in zip(fields, local_scores):
+        llm_score = llm_scores.get(item["path"])
+        if llm_score is not None:
+            pairs.append((score, llm_score, score >= LOCAL_SCORER_THRESHOLD))
+            log.debug("Local vs LLM score", path=item['path'], score=score, reason=reason, llm_score=llm_score)
+    resolvable = [(local, llm) for local, llm, is_resolved in pairs if is_resolved]
+    correlation = pearson([local for local, _, _ in pairs], [llm for _, llm, _ in pairs])
+    log.info("Local scorer shadow", resolvable=len(resolvable), compared=len(pairs), correlation=correlation)
+    metrics = {"LocalScoreResolvable": len(resolvable), "LocalScoreCompared": len(pairs)}
+    if resolvable:
+        metrics["LocalScoreAbsError"] = round(sum(abs(local - llm) for local, llm in resolvable) / len(resolvable), 3)
+    emit_metrics(metrics)
+
+def score_entity_confidence(text: str,entities: Dict[str, Any], model_name: str, model_id: str, region: str, batch_size: int, key_values: str = "") -> Dict[str, Any]:
     """Score confidence for  extracted_entities structure"""
     fields = extract_fields_for_scoring(entities)
-    print("extracted fileds", fields)
+    log.debug("Fields to score", fields=fields)
     if not fields:
-        logging.info("No fields with 'value' found; nothing to score.")
+        log.info("No fields with 'value' found; nothing to score.")
         return entities
 
-    for i in range(0, len(fields), batch_size):
-        batch = fields[i:i + batch_size]
-        prompt = build_confidence_prompt(text, batch)
-
+    llm_fields, local_scores = score_locally(entities, fields, text, key_values)
+    if not llm_fields:
+        return entities
+    batches, workers = plan_batches(llm_fields, text, batch_size)
+    log.info("Scoring fields", fields=len(llm_fields), batches=len(batches), workers=workers)
+    start_time = time.time()
+    # Batches are scored concurrently; the entity tree is only written afterwards, in batch
+    # order, so the result does not depend on which call finished first
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # in_current_span: the tokens of every batch count towards the document's confidence span
+        futures = [executor.submit(in_current_span(score_batch), text, batch, model_name, model_id, region) for batch in batches]
+    batch_results = []
+    for number, (batch, future) in enumerate(zip(batches, futures), start=1):
         try:
-            raw = dispatch_llm_call(prompt, model_name, model_id, region)
-            scores = parse_llm_scores(raw)
+            scores = future.result()
         except Exception as e:
-            logging.warning(f"Failed to obtain/parse LLM output for batch {i//batch_size + 1}: {e}")
+            log.warning("Failed to obtain/parse LLM output for batch", batch=number, error=str(e))
             continue
+        apply_scores(entities, batch, scores)
+        batch_results.append((batch, scores))
+    log.info("Scored fields", seconds=round(time.time() - start_time, 2))
 
-        for item in batch:
-            field_name = item["field"]
-            path = item["path"]
-            score = scores.get(field_name)
-            
-            if score is not None:
-                # Convert to percentage (0-100%)
-                percentage = f"{int(round(score * 100))}%"
-                
-                # Navigate to the correct location and update confidence
-                path_parts = path.split('.')
-                current = entities
-                
-                # Navigate to the parent of the target field
-                for part in path_parts[:-1]:
-                    if part in current and isinstance(current[part], dict):
-                        current = current[part]
-                    else:
-                        break
-                else:
-                    # Update confidence if the field exists
-                    final_field = path_parts[-1]
-                    if final_field in current and isinstance(current[final_field], dict):
-                        current[final_field]["confidence"] = percentage
-
+    if LOCAL_SCORER_MODE == "shadow":
+        compare_local_scores(fields, local_scores, batch_results)
     return entities
 
 def run_confidence_scorer(text: str, extracted_entities: Dict[str, Any], model_name: str, model_id: str, region: str = "us-east-1", batch_size: int = 20) -> Dict[str, Any]:
     """Run confidence scoring for  extracted_entities"""
     try:
         safe_entities = copy.deepcopy(extracted_entities)
-        print("inside score entity ", safe_entities)
         updated = score_entity_confidence(safe_entities, text, model_name, model_id, region, batch_size)
         return updated
     except Exception as e:
-        logging.error(f"Error in  confidence scoring module: {str(e)}")
+        log.exception("Error in confidence scoring module", error=str(e))
         return extracted_entities
 
 
@@ -236,16 +318,14 @@ def calculate_document_confidence_score(
                 
             score_str = field_data.get("confidence", "")
             score_num=percent_to_decimal(score_str)
-            print(field_name,score_str,score_num)
             if not score_num or score_num == "":
                 continue
                 
             try:
                 score = float(score_num)
-                print(field_name,score)
                 weight = weights.get(field_name, 0.05)  # default low weight for unknown fields
                 weighted_sum += score * weight
-                print("weiged sum",weighted_sum)
+                log.debug("Field score", field=field_name, confidence=score_str, score=score, weighted_sum=weighted_sum)
                 total_weight += weight
             except (ValueError, TypeError):
                 continue
@@ -261,25 +341,24 @@ def run_confidence_scorer_with_doc_score(
     model_id: str,
     field_weights: Dict[str, float] = None,
     region: str = "us-east-1",
-    batch_size: int = 20
+    batch_size: int = 20,
+    key_values: str = ""
 ) -> Dict[str, Any]:
     """
     Enhanced version that includes document-level confidence score.
+    key_values is the keyvaluesText of the document, used by the local scorer.
     """
     try:
         #batch_size = confidence_config.get("field_batch_size", 20)
         #safe_template = copy.deepcopy(validated_template)
-        print("inside conf scoering")
-        updated = score_entity_confidence(text, extracted_entities, model_name, model_id, region, batch_size)
-        print("updated",updated)
+        updated = score_entity_confidence(text, extracted_entities, model_name, model_id, region, batch_size, key_values)
         # Add document-level confidence score
         doc_score = calculate_document_confidence_score(updated, field_weights)
         doc_score_perc= f"{int(round(doc_score * 100))}%"
         #updated["document_confidence_score"] = doc_score_perc        
         return updated,doc_score_perc
     except Exception as e:
-        logging.error(f"Error in confidence scoring module: {str(e)}")
-        #logging.error(traceback.format_exc())
+        log.exception("Error in confidence scoring module", error=str(e))
         return {}
 
 def get_entity_weights(classification):
@@ -381,23 +460,20 @@ def get_entity_weights(classification):
 #     return "Updated Email Reader Status to Completed for docid"
 
 def update_doc_status_new(docid, new_status):
-    print("inside update_doc_status_new()  docid and new_status  = ", docid, new_status)
-    dynamodb = boto3.resource('dynamodb')
-    table = dynamodb.Table('email_reader_v1')
-    print("table  = ", table)
-    # First, find the item by docid (assuming it's a GSI or you need to scan)
-    response = table.scan(
+    table = dynamodb_resource.Table('email_reader_v1')
+    # First, find the item by docid (no index on doc_id, so scan - in parallel and stop at the first match)
+    matching_items = parallel_scan(
+        table,
+        max_items=1,
         FilterExpression=boto3.dynamodb.conditions.Attr('doc_id').eq(docid)
     )
-    print("before updating the record is  = ", response['Items'])
+    log.debug("email_reader_v1 record", docid=docid, items=matching_items)
 
-    if response['Items']:
-        item = response['Items'][0]
+    if matching_items:
+        item = matching_items[0]
         # Get the partition key from the found item
         partition_key = item['seqid']  # Replace with actual partition key name
-        print("partition_key = ", partition_key)
         seqid_sort = item['seqid_sort']  # Replace with actual partition key name
-        print("seqid_sort = ", seqid_sort)
         
 
         # Update only the doc_status field
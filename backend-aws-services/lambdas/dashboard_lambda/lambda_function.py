@@ -1,26 +1,26 @@
 import json
 import boto3
 from botocore.exceptions import ClientError
+from structured_log import log
 
 
 
 def get_all_doc_details(indexid):
     dynamodb = boto3.resource('dynamodb')
     table = dynamodb.Table('nmm-dashboard')
-    print("in get_all_doc_details() - indexid = ", indexid )
     response = table.scan(
         FilterExpression=boto3.dynamodb.conditions.Attr('indexid').eq(indexid)
     )
-    print("response items = ", response['Items'])
+    log.info("Dashboard records of indexid", indexid=indexid, items=len(response['Items']))
+    log.debug("Dashboard records", indexid=indexid, items=response['Items'])
     
     return response['Items']
 
 def get_individual_doc_details(docid):
     dynamodb = boto3.resource('dynamodb')
     table = dynamodb.Table('nmm-dashboard')
-    print("in get_individual_doc_details() - docid = ", docid )
     response = table.get_item(Key={'docid': docid})
-    print("individual doc details = ", response['Item'])
+    log.debug("Dashboard record", docid=docid, item=response['Item'])
     
     return response['Item']
 
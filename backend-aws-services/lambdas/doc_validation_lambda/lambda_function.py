@@ -2,6 +2,7 @@ import boto3
 import json
 from datetime import datetime
 from botocore.exceptions import ClientError
+from structured_log import log
 
 # def dt_convert (sourcedate, sourceformat):
 #     date_str = str(sourcedate) #'2013-04-15'
@@ -25,7 +26,7 @@ def lambda_handler(event, context):
         response = table.get_item(Key={'docid': docid})
 
         doc_classification = response['Item']['classification']
-        print("doc_classification = ", doc_classification)
+        log.info("Validating document", docid=docid, classification=doc_classification)
 
         if doc_classification != 'ClaimForm':
             return {
@@ -35,13 +36,12 @@ def lambda_handler(event, context):
 
         extracted_entities_str = response['Item']['extracted_entities']
         extracted_entities = json.loads(extracted_entities_str)
-        print("extracted_entities = ", extracted_entities)
+        log.debug("Extracted entities", docid=docid, extracted_entities=extracted_entities)
         date_of_injury = datetime.strptime(extracted_entities['claim_details_section']['date_of_injury']['value'], '%m/%d/%Y')
         initial_return_date = datetime.strptime(extracted_entities['work_status_section']['initial_return_to_work_date']['value'], '%m/%d/%Y')
         injury_dt = extracted_entities['claim_details_section']['date_of_injury']['value']
-        print("injury_dt = ", injury_dt)
         work_return_date = extracted_entities['work_status_section']['initial_return_to_work_date']['value']
-        print("work_return_date = ", work_return_date)
+        log.info("Validation dates", docid=docid, date_of_injury=injury_dt, initial_return_to_work_date=work_return_date)
         result = 'Pass - Date of Injury (' + str(injury_dt) + ') is before Intial Return To Work Date ('+ str(work_return_date) + ').' if date_of_injury < initial_return_date else 'Fail - Date of Injury (' + str(injury_dt) + ') cannot be after Intial Return To Work Date ('+ str(work_return_date) + ').'
         
         return {
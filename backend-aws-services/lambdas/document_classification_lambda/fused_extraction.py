@@ -0,0 +1,123 @@
+import json
+import os
+import time
+
+from bedrock_gateway import HAIKU_MODEL_ID, invoke_claude
+from entity_templates import DOCUMENT_TYPES, calculate_stats, claim_number_of, extract_empty_keys, template_for
+from instrumentation import emit_metrics
+from structured_log import log
+from prompt_budget import fit_document, template_terms
+from utility import upsert_dashboard_record
+
+# "two_step" - classify here, extract the entities in nmm_entityextraction_lambda (original behaviour)
+# "fused"    - one Bedrock call returns the type and the entities of that type; documents whose
+#              type is ambiguous fall back to the two-step path
+CLASSIFY_EXTRACT_MODE = os.environ.get("CLASSIFY_EXTRACT_MODE", "two_step")
+# Lowest type confidence the model may report for its entities to be used
+FUSED_MIN_TYPE_CONFIDENCE = float(os.environ.get("FUSED_MIN_TYPE_CONFIDENCE", "0.8"))
+
+_EXTRACTION_TYPES = [doc_type for doc_type in DOCUMENT_TYPES if template_for(doc_type)]
+
+
+def compact(template):
+    """A template without its indentation and blank lines - the same instructions in fewer tokens"""
+    return "\n".join(line.strip() for line in template.splitlines() if line.strip())
+
+
+def get_fused_prompt(raw_text, tabletext, key_value_pair_data):
+    templates = "\n\n".join(f"<template type=\"{doc_type}\">\n{compact(template_for(doc_type))}\n</template>"
+                            for doc_type in _EXTRACTION_TYPES)
+    return f"""Human: You are an expert in understanding and analyzing Worker Compensation Industry Documents, and
+    an expert document information extraction assistant.
+
+    You are provided with the document within the <raw_text>, <key_value_pair_data> and <table_text> xml tags.
+
+    <raw_text>{raw_text}</raw_text> ,
+    <key_value_pair_data>{key_value_pair_data}</key_value_pair_data> ,
+    <table_text>{tabletext}</table_text>
+
+    The raw text of the document is within <raw_text> xml tag.
+    The key value pair of the document are mentioned as a list within <key_value_pair_data> xml tag.
+    The tabular data of the document are mentioned as a json array with objects within <table_text> xml tag.
+
+    First identify the Classification Type of the document from one of these types {DOCUMENT_TYPES}.
+    If you are not able to identify the document type then reply the Classification Type as Unidentified Type.
+    Give your confidence in the type as a number between 0 and 1.
+
+    Then extract the entities of the document with the template of its type. The templates are within
+    the <template> xml tags:
+
+    {templates}
+
+    If the type is Invoice or Unidentified Type, or your confidence in the type is below {FUSED_MIN_TYPE_CONFIDENCE},
+    do not extract anything and reply "entities" as {{}}.
+
+    Required JSON Output Format:
+    {{
+        "classification_type": "STRING",
+        "classification_confidence": FLOAT,
+        "entities": {{ the JSON of the template of the type }}
+    }}
+
+    Generate only a perfect JSON till end.
+    Do not provide any supporting or explanation text beyond generating the perfect JSON.
+    Skip any preamble text and generate the final JSON ONLY.
+
+    Assistant:"""
+
+
+def classify_and_extract(docid, rawtext, keyvaluesText, tbltxt):
+    """
+    Classify a document and extract its entities in one Bedrock call
+
+    Returns:
+        dict: {"classification_type", "extracted_entities": JSON text or None}. Entities are None
+            when the type is clear but they did not parse; the entity extraction lambda extracts
+            them as usual then.
+        None: The type is ambiguous (unidentified, without a template, or below
+            FUSED_MIN_TYPE_CONFIDENCE) - classify with the classification prompt instead
+    """
+    start = time.time()
+    # The extraction budget, keeping the sections that mention any template's field names
+    terms = set().union(*(template_terms(template_for(doc_type)) for doc_type in _EXTRACTION_TYPES))
+    raw_part, kv_part, tbl_part = fit_document('extraction', str(rawtext), str(keyvaluesText), str(tbltxt),
+                                               terms=terms, docid=docid)
+    result = invoke_claude(get_fused_prompt(raw_part, tbl_part, kv_part), HAIKU_MODEL_ID, max_tokens=5000,
+                           stage="classification_extraction")
+    try:
+        answer = json.loads(result, strict=False)
+        classification_type = answer.get("classification_type")
+        confidence = float(answer.get("classification_confidence", 0))
+        entities = answer.get("entities")
+    except (ValueError, TypeError, AttributeError) as e:
+        log.warning("Fused answer did not parse - classifying in two steps", docid=docid, error=str(e))
+        emit_metrics({"FusedFallback": 1}, docid=docid, reason="unparsed")
+        return None
+
+    if classification_type not in _EXTRACTION_TYPES or confidence < FUSED_MIN_TYPE_CONFIDENCE:
+        log.info("Type is ambiguous for the fused path - classifying in two steps", docid=docid,
+                 classification=classification_type, confidence=confidence)
+        emit_metrics({"FusedFallback": 1}, docid=docid, reason="ambiguous")
+        return None
+    extracted_entities = json.dumps(entities) if isinstance(entities, dict) and entities else None
+    log.info("Fused classification", docid=docid, classification=classification_type, confidence=confidence,
+             entities_extracted=bool(extracted_entities), seconds=round(time.time() - start, 2))
+    emit_metrics({"FusedFallback": 0, "FusedEntities": int(bool(extracted_entities))}, docid=docid,
+                 classification=classification_type)
+    return {"classification_type": classification_type, "extracted_entities": extracted_entities}
+
+
+def store_entities(docid, llm_extracted_json):
+    """Write fused entities as the entity extraction lambda writes its own"""
+    parsed_json = json.loads(llm_extracted_json, strict=False)
+    empty_keys = extract_empty_keys(parsed_json)
+    total_keys, empty_keys_count, empty_keys_percentage = calculate_stats(parsed_json)
+    empty_key_perc = str(round(empty_keys_percentage)) + "%"
+    upsert_dashboard_record('nmm-doc-extraction', docid=docid,
+                            extracted_entities=llm_extracted_json,
+                            total_keys=total_keys,
+                            empty_keys_count=empty_keys_count,
+                            empty_keys=empty_keys,
+                            empty_key_perc=empty_key_perc)
+    upsert_dashboard_record('nmm-dashboard', docid=docid, entity_extraction_status="Completed",
+                            gw_claim_id=claim_number_of(parsed_json))
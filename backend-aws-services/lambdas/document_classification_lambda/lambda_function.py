@@ -1,13 +1,28 @@
 import json
+import time
 import boto3
 from utility import get_docs_extract, get_prompt_ready, execute_model, upsert_dashboard_record
+from sqs_batch import process_sqs_batch
+from stage_handoff import hand_off
+from instrumentation import Span, emit_metric
+from structured_log import log
+from prompt_budget import fit_document
+from pre_classifier import PRECLASSIFIER_MODE, PRECLASSIFIER_THRESHOLD, pre_classify
+from fused_extraction import CLASSIFY_EXTRACT_MODE, classify_and_extract, store_entities
+
+# Module-level clients - shared by the batch worker threads and reused across warm invocations
+translate_client = boto3.client('translate')
+comprehend_client = boto3.client('comprehend')
 
 def lambda_handler(event, context):
+    log.debug("Event", event=event)
+    # Process every record of the SQS batch and report the failed ones back to SQS
+    return process_sqs_batch(event, process_record)
+
+def process_record(record):
     try:
-        # Extract document ID from event
-        print("Event - ", event)
-        data_string = event['Records'][0]['body']   # this change is done only to accept the 'body' from SQS
-        print("event[body]",data_string,type(data_string))
+        # Extract document ID from the SQS record
+        data_string = record['body']   # this change is done only to accept the 'body' from SQS
         
         if type(data_string) is dict:
             qtext = data_string
@@ -15,28 +30,22 @@ def lambda_handler(event, context):
             qtext = json.loads(data_string)
         #print("\n","Lambda Handler context:",type(context),context)
         
-        print("qtext=json.loads(data_string) :",type(qtext),qtext)
         s3files = [qtext['s3filename']]  # send the file name in an array
         indexid = qtext['indexid']
-        print("indexid = ",indexid)
         docid = qtext['docid']
-        print("docid = ",docid)
+        log.info("Classifying document", docid=docid, indexid=indexid)
 
         #docid = event.get('docid')
         if not docid:
-            print("Error: docid is not present, hence returning")
+            log.error("docid is not present, hence returning", body=qtext)
             return {
                 'statusCode': 400,
                 'body': json.dumps({'error': 'docid is required'})
             }
         
-        # Initialize Bedrock client
-        bedrock = boto3.client('bedrock-runtime')
-        print("bedrock - ", bedrock)
-        
         # Get document extract details
         docs_extract_details = get_docs_extract(docid)
-        print("docs_extract_details - ", docs_extract_details)
+        log.debug("Extracted document", docid=docid, item=docs_extract_details.get('Item'))
         
         if 'Item' not in docs_extract_details:
             return {
@@ -52,49 +61,82 @@ def lambda_handler(event, context):
         
         #########################################
         ## Here we will check document language and translate to english
-        translate_client = boto3.client('translate')
-        comprehend_client = boto3.client('comprehend')
         translated_text=""
-        # Detect language
-        language_response = comprehend_client.detect_dominant_language(Text=rawtext)
-        detected_language = language_response['Languages'][0]['LanguageCode']
-        print("detected language = ", detected_language)
-        doc_language = "English"
-        # Translate if not English
-        if detected_language == 'en':
-            #translated_text = rawtext
+        with Span("translate", docid):
+            # Detect language
+            language_response = comprehend_client.detect_dominant_language(Text=rawtext)
+            detected_language = language_response['Languages'][0]['LanguageCode']
+            log.info("Detected language", docid=docid, language=detected_language)
             doc_language = "English"
-            print("detected lang is english")
-        else:
-            translation_response = translate_client.translate_text(
-                Text=rawtext,
-                SourceLanguageCode=detected_language,
-                TargetLanguageCode='en'
-            )
-            doc_language = "Spanish"
-            translated_text = translation_response['TranslatedText']
-            # Update Document Extraction table with TranslatedText
-            resTanslate = upsert_dashboard_record('nmm-doc-extraction', docid=docid, translated_text=translated_text)
-            print ("resTanslate = ", resTanslate)
-            print("translated_text = ", translated_text)
+            # Translate if not English
+            if detected_language == 'en':
+                #translated_text = rawtext
+                doc_language = "English"
+            else:
+                translation_response = translate_client.translate_text(
+                    Text=rawtext,
+                    SourceLanguageCode=detected_language,
+                    TargetLanguageCode='en'
+                )
+                doc_language = "Spanish"
+                translated_text = translation_response['TranslatedText']
+                # Update Document Extraction table with TranslatedText
+                resTanslate = upsert_dashboard_record('nmm-doc-extraction', docid=docid, translated_text=translated_text)
+                log.debug("Translated text", docid=docid, translated_text=translated_text)
 
         #########################################
         
-        # Generate prompt and classify document
-        if detected_language == 'en':
-            prompt = get_prompt_ready(str(rawtext), str(tbltxt), str(keyvaluesText))
-        else:
-            prompt = get_prompt_ready(str(translated_text), "", "")
-            
-        classification_result = execute_model(prompt, bedrock)
-        ##########################################
-        # prompt = get_prompt_ready(str(rawtext), str(tbltxt), str(keyvaluesText))
-        # classification_result = execute_model(prompt, bedrock)
-        
-        # Parse classification result
-        llm_extracted_json = json.loads(classification_result)
-        classificationtype = llm_extracted_json['classification_type']
-        
+        with Span("classify", docid):
+            # Local pre-classifier (English text only - it was trained on the extracted English text)
+            local_type, local_confidence = None, 0.0
+            if PRECLASSIFIER_MODE in ("shadow", "on") and detected_language == 'en':
+                start_time = time.time()
+                local_type, local_confidence = pre_classify(rawtext, keyvaluesText, tbltxt)
+                log.info("Pre-classifier", docid=docid, classification=local_type, confidence=round(local_confidence, 3),
+                         ms=round((time.time() - start_time) * 1000, 1))
+
+            local_skip = PRECLASSIFIER_MODE == "on" and local_type and local_confidence >= PRECLASSIFIER_THRESHOLD
+
+            # Type and entities in one Bedrock call (CLASSIFY_EXTRACT_MODE=fused) - None when the type is ambiguous
+            fused = None
+            if CLASSIFY_EXTRACT_MODE == "fused" and not local_skip and detected_language == 'en':
+                fused = classify_and_extract(docid, rawtext, keyvaluesText, tbltxt)
+
+            if local_skip:
+                # Confident enough - Bedrock is not called for this document
+                classificationtype = local_type
+                classification_source = "local"
+                emit_metric("PreClassifierSkip")
+            elif fused:
+                classificationtype = fused['classification_type']
+                classification_source = "llm"
+            else:
+                # Generate prompt and classify document
+                # Only the first and last pages and the form keys are needed to tell the type
+                if detected_language == 'en':
+                    raw_part, kv_part, tbl_part = fit_document('classification', str(rawtext), str(keyvaluesText), str(tbltxt), docid=docid)
+                    prompt = get_prompt_ready(raw_part, tbl_part, kv_part)
+                else:
+                    raw_part, _, _ = fit_document('classification', str(translated_text), docid=docid)
+                    prompt = get_prompt_ready(raw_part, "", "")
+
+                classification_result = execute_model(prompt)
+                ##########################################
+                # prompt = get_prompt_ready(str(rawtext), str(tbltxt), str(keyvaluesText))
+                # classification_result = execute_model(prompt)
+
+                # Parse classification result
+                llm_extracted_json = json.loads(classification_result)
+                classificationtype = llm_extracted_json['classification_type']
+                classification_source = "llm"
+                if PRECLASSIFIER_MODE != "off":
+                    emit_metric("PreClassifierLLMCall")
+                if local_type:
+                    agrees = local_type == classificationtype
+                    log.info("Pre-classifier agrees with LLM" if agrees else "Pre-classifier disagrees with LLM", docid=docid,
+                             local_type=local_type, classification=classificationtype)
+                    emit_metric("PreClassifierAgreement", int(agrees), confidence=round(local_confidence, 3))
+
         # # Update Document Extraction table with classification type
         # upsert_dashboard_record('nmm-doc-extraction', docid=docid, classification=classificationtype)
         
@@ -102,63 +144,35 @@ def lambda_handler(event, context):
         # upsert_dashboard_record('nmm-dashboard', docid=docid, classification_status="Completed")
         ####################################
         # Update Document Extraction table with classification type
-        resExtraction = upsert_dashboard_record('nmm-doc-extraction', docid=docid, classification=classificationtype)
-        print ("resExtraction = ", resExtraction)
+        # classification_source lets train_pre_classifier.py keep the model's own answers out of its labels
+        classification_fields = {'classification': classificationtype, 'classification_source': classification_source}
+        if local_type:
+            classification_fields['preclassifier_type'] = local_type
+            classification_fields['preclassifier_confidence'] = str(round(local_confidence, 3))
+        resExtraction = upsert_dashboard_record('nmm-doc-extraction', docid=docid, **classification_fields)
 
         if "ResponseMetadata" in resExtraction:
             if "HTTPStatusCode" in resExtraction["ResponseMetadata"]:
-                print("@@@HTTP Response Code of resExtraction = ", resExtraction["ResponseMetadata"]["HTTPStatusCode"])
                 
                 if resExtraction["ResponseMetadata"]["HTTPStatusCode"] == 200:
-                    print("success to call next dashboard")
                     # Update Dashboard table with classification status
                     restDashboard = upsert_dashboard_record('nmm-dashboard', docid=docid, classification_status="Completed", classification=classificationtype, doc_language=doc_language, s3filename=s3files)
-                    print ("restDashboard = ", restDashboard)
                     
                     if "ResponseMetadata" in restDashboard:
                         if "HTTPStatusCode" in restDashboard["ResponseMetadata"]:
-                            print("@@@HTTP Response Code of restDashboard = ", restDashboard["ResponseMetadata"]["HTTPStatusCode"])
 
                             if restDashboard["ResponseMetadata"]["HTTPStatusCode"] == 200:
-                                print("success to call entity extraction lambda  ")
-                                
-                                ent_payload = """{   'docid': '""" + docid + """' }"""
-                                print("ent_payload = ", ent_payload)
-                                try:
-                                    # Initialize a boto3 client
-                                    lambda_client = boto3.client('lambda')
-                                    function_name = "nmm_entityextraction_lambda"
-                                    # Invoke the nmm_entityextraction_lambda function
-                                    response = lambda_client.invoke(
-                                        FunctionName=function_name,
-                                        InvocationType='RequestResponse',  # Use 'Event' for asynchronous invocation
-                                        Payload=json.dumps(event)  # Pass the event or any payload you need
-                                        # Payload=json.dumps(ent_payload)  # Pass the event or any payload you need
-                                    )
-                                    print("lambda invoke response = ", response)
-                                    # # Read the response payload
-                                    # payload = response['Payload'].read()
-                                    # extracted_entities = json.loads(payload)
-
-                                    # # Example: Log or process the extracted entities
-                                    # print("Extracted Entities:", extracted_entities)
-
-        #                             # Return a response (optional)
-        #                             return {
-        #                                 'statusCode': 200,
-        #                                 'body': json.dumps({
-        #                                     'message': 'Entity extraction successful',
-        #                                     'extracted_entities': extracted_entities
-        #                                 })
-        #                             }
-
-                                except Exception as e:
-                                    print(f"Error invoking Entity Extraction Lambda function: {e}")
-        #                             return {
-        #                                 'statusCode': 500,
-        #                                 'body': json.dumps({'message': 'Error invoking Lambda function'})
-        #                             }
-                                
+                                if fused and fused['extracted_entities']:
+                                    # Entities are already extracted - skip the entity extraction stage
+                                    store_entities(docid, fused['extracted_entities'])
+                                    log.info("✅ Fused entities stored, handing off to confidence score", docid=docid)
+                                    hand_off("confidence_score", record)
+                                else:
+                                    log.info("Classification stored, handing off to entity extraction", docid=docid,
+                                             classification=classificationtype)
+
+                                    # Synchronous invoke, or a message on the entity extraction queue (STAGE_HANDOFF)
+                                    hand_off("entity_extraction", record)
 
 
 
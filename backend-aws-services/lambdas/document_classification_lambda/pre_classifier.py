@@ -0,0 +1,261 @@
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+
+import boto3
+
+from structured_log import log
+
+# Document types the classification prompt allows
+LABELS = ['MedicalReport', 'ClaimForm', 'DoctorReportMMI', 'PhysicalTherapy', 'Prescription', 'CMS1500', 'Legal', 'Invoice']
+
+# "off"    - always call Bedrock (original behaviour)
+# "shadow" - call Bedrock, and log/emit how often the local prediction agrees with it
+# "on"     - skip Bedrock when the local confidence is at least PRECLASSIFIER_THRESHOLD
+PRECLASSIFIER_MODE = os.environ.get("PRECLASSIFIER_MODE", "off")
+PRECLASSIFIER_THRESHOLD = float(os.environ.get("PRECLASSIFIER_THRESHOLD", "0.9"))
+# s3://bucket/key of a model written by train_pre_classifier.py; the bundled file is used otherwise
+PRECLASSIFIER_MODEL_S3 = os.environ.get("PRECLASSIFIER_MODEL_S3", "")
+PRECLASSIFIER_MODEL_PATH = os.environ.get(
+    "PRECLASSIFIER_MODEL_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "pre_classifier_model.json"))
+
+# Keyword rules alone never skip Bedrock: their confidence is capped at this (and always
+# below PRECLASSIFIER_THRESHOLD), so "on" mode needs a trained model to skip any call
+KEYWORD_MAX_CONFIDENCE = 0.75
+
+# Only the start of a document is scored - its title and form header decide the type
+MAX_TEXT_CHARS = 20000
+
+# Phrases that mark a document type on their own, weight 1 each. Seeded from the keyword
+# rules of the frontend classify_document; used when no trained model is available.
+KEYWORD_RULES = {
+    'CMS1500': ['health insurance claim form', 'cms-1500', 'cms 1500', 'nucc', 'approved omb-0938-1197',
+                'insured\'s id number', 'federal tax i.d. number', 'referring provider'],
+    'Prescription': ['prescription', 'rx', 'refills', 'dispense as written', 'sig:', 'pharmacy', 'qty', 'dea'],
+    'DoctorReportMMI': ['maximum medical improvement', 'mmi', 'impairment rating', 'whole person impairment',
+                        'permanent impairment', 'ama guides'],
+    'PhysicalTherapy': ['physical therapy', 'physical therapist', 'range of motion', 'therapeutic exercise',
+                        'plan of care', 'pt evaluation', 'visits authorized'],
+    'Invoice': ['invoice', 'amount due', 'balance due', 'remit to', 'invoice number', 'subtotal', 'payment terms'],
+    'Legal': ['attorney', 'law office', 'petition', 'hearing', 'workers\' compensation administration',
+              'esq', 'subpoena', 'deposition', 'counsel'],
+    'ClaimForm': ['notice of accident', 'employer\'s first report', 'first report of injury', 'workers compensation',
+                  'wcb', 'date of injury', 'claim number', 'employee signature'],
+    'MedicalReport': ['chief complaint', 'history of present illness', 'physical examination', 'assessment',
+                      'diagnosis', 'physician', 'treatment plan', 'vital signs'],
+}
+
+_TOKEN_RE = re.compile(r"[a-z][a-z0-9'\-]+")
+# Whole-phrase matches only, so "rx" does not fire inside "proxy"
+_KEYWORD_PATTERNS = {
+    label: [re.compile(r"(?<![a-z0-9])" + re.escape(phrase) + r"(?![a-z0-9])") for phrase in phrases]
+    for label, phrases in KEYWORD_RULES.items()
+}
+
+s3_client = boto3.client('s3')
+
+
+def document_text(rawtext, keyvaluesText="", tbltxt=""):
+    """The text the pre-classifier scores: raw text first, then key-values and tables"""
+    return "\n".join(str(part) for part in (rawtext, keyvaluesText, tbltxt) if part)[:MAX_TEXT_CHARS].lower()
+
+
+def tokenize(text):
+    """Unigram and bigram features of lower-cased text"""
+    words = _TOKEN_RE.findall(text)
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def keyword_scores(text):
+    """Number of KEYWORD_RULES phrases of each type found in lower-cased text"""
+    scores = {}
+    for label, patterns in _KEYWORD_PATTERNS.items():
+        hits = sum(1 for pattern in patterns if pattern.search(text))
+        if hits:
+            scores[label] = hits
+    return scores
+
+
+def _softmax(scores, temperature):
+    top = max(scores.values())
+    exp = {label: math.exp((score - top) * temperature) for label, score in scores.items()}
+    total = sum(exp.values())
+    return {label: value / total for label, value in exp.items()}
+
+
+class PreClassifier:
+    """
+    TF-IDF nearest-centroid classifier
+
+    Each label is the L2-normalised mean TF-IDF vector of its training documents. A
+    document's cosine similarity to every centroid goes through a softmax whose
+    temperature was fitted on the training set, giving a probability-like confidence.
+    Without a model (idf is empty) it falls back to KEYWORD_RULES.
+    """
+
+    def __init__(self, idf=None, centroids=None, temperature=10.0, trained_on=0):
+        self.idf = idf or {}
+        self.centroids = centroids or {}
+        self.temperature = temperature
+        self.trained_on = trained_on
+
+    @property
+    def trained(self):
+        return bool(self.centroids)
+
+    def vectorize(self, text):
+        counts = Counter(feature for feature in tokenize(text) if feature in self.idf)
+        vector = {feature: (1 + math.log(count)) * self.idf[feature] for feature, count in counts.items()}
+        norm = math.sqrt(sum(value * value for value in vector.values()))
+        return {feature: value / norm for feature, value in vector.items()} if norm else {}
+
+    def similarities(self, text):
+        vector = self.vectorize(text)
+        return {label: sum(weight * centroid.get(feature, 0.0) for feature, weight in vector.items())
+                for label, centroid in self.centroids.items()}
+
+    def predict(self, text):
+        """
+        Return (label, confidence) for lower-cased document text
+
+        The confidence is 0 when nothing in the text is known to the model or the rules.
+        """
+        if self.trained:
+            similarities = self.similarities(text)
+            if not any(similarities.values()):
+                return None, 0.0
+            probabilities = _softmax(similarities, self.temperature)
+        else:
+            scores = keyword_scores(text)
+            if not scores:
+                return None, 0.0
+            # Three or more distinct phrases of a single type is as sure as the rules get
+            probabilities = {label: hits / sum(scores.values()) * min(1.0, hits / 3.0)
+                             for label, hits in scores.items()}
+            label = max(probabilities, key=probabilities.get)
+            return label, min(probabilities[label], KEYWORD_MAX_CONFIDENCE, PRECLASSIFIER_THRESHOLD - 0.01)
+        label = max(probabilities, key=probabilities.get)
+        return label, probabilities[label]
+
+    def to_dict(self):
+        return {'idf': self.idf, 'centroids': self.centroids, 'temperature': self.temperature,
+                'trained_on': self.trained_on}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get('idf'), data.get('centroids'), data.get('temperature', 10.0), data.get('trained_on', 0))
+
+
+def train(samples, min_df=2, max_features=20000, prune_below=1e-3):
+    """
+    Fit a PreClassifier on (text, label) pairs
+
+    Text is lower-cased document_text(); labels outside LABELS are ignored. Features in fewer
+    than min_df documents are dropped and the max_features most frequent are kept.
+    """
+    samples = [(text, label) for text, label in samples if label in LABELS]
+    document_frequency = Counter()
+    for text, _ in samples:
+        document_frequency.update(set(tokenize(text)))
+    kept = [feature for feature, df in document_frequency.most_common(max_features) if df >= min_df]
+    total = len(samples)
+    idf = {feature: math.log((1 + total) / (1 + document_frequency[feature])) + 1 for feature in kept}
+    model = PreClassifier(idf=idf, trained_on=total)
+
+    sums = {}
+    for text, label in samples:
+        centroid = sums.setdefault(label, Counter())
+        centroid.update(model.vectorize(text))
+    for label, centroid in sums.items():
+        norm = math.sqrt(sum(value * value for value in centroid.values()))
+        model.centroids[label] = {feature: round(value / norm, 6) for feature, value in centroid.items()
+                                  if value / norm >= prune_below}
+
+    # Temperature with the best training log-likelihood
+    vectors = [(model.similarities(text), label) for text, label in samples]
+    best = None
+    for temperature in (2, 5, 10, 20, 40, 80):
+        loss = 0.0
+        for similarities, label in vectors:
+            loss -= math.log(max(_softmax(similarities, temperature).get(label, 0.0), 1e-12))
+        if best is None or loss < best[0]:
+            best = (loss, temperature)
+    model.temperature = best[1] if best else 10.0
+    return model
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+def evaluate(model, samples, threshold=PRECLASSIFIER_THRESHOLD):
+    """
+    Score a model on held-out (text, label) pairs, the labels being what the LLM answered
+
+    Returns:
+        dict: documents, skip_rate (share at or above threshold), skipped_agreement (agreement
+            with the LLM on those), overall_agreement (top label on every document) and
+            p50_ms / p99_ms prediction latency
+    """
+    latencies, skipped, skipped_agree, agree = [], 0, 0, 0
+    for text, label in samples:
+        start = time.perf_counter()
+        predicted, confidence = model.predict(text)
+        latencies.append((time.perf_counter() - start) * 1000)
+        agree += predicted == label
+        if predicted is not None and confidence >= threshold:
+            skipped += 1
+            skipped_agree += predicted == label
+    documents = len(samples)
+    return {
+        'documents': documents,
+        'threshold': threshold,
+        'skip_rate': skipped / documents if documents else 0.0,
+        'skipped_agreement': skipped_agree / skipped if skipped else 0.0,
+        'overall_agreement': agree / documents if documents else 0.0,
+        'p50_ms': percentile(latencies, 50),
+        'p99_ms': percentile(latencies, 99),
+    }
+
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def load_model():
+    """The container's PreClassifier: from PRECLASSIFIER_MODEL_S3, the bundled file, or keyword rules only"""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = _read_model()
+    return _model
+
+
+def _read_model():
+    try:
+        if PRECLASSIFIER_MODEL_S3:
+            bucket, _, key = PRECLASSIFIER_MODEL_S3[len("s3://"):].partition("/")
+            data = json.loads(s3_client.get_object(Bucket=bucket, Key=key)['Body'].read())
+            log.info("Loaded pre-classifier model", source=PRECLASSIFIER_MODEL_S3, trained_on=data.get('trained_on', 0))
+            return PreClassifier.from_dict(data)
+        if os.path.exists(PRECLASSIFIER_MODEL_PATH):
+            with open(PRECLASSIFIER_MODEL_PATH) as model_file:
+                data = json.load(model_file)
+            log.info("Loaded pre-classifier model", source=PRECLASSIFIER_MODEL_PATH, trained_on=data.get('trained_on', 0))
+            return PreClassifier.from_dict(data)
+    except Exception as e:
+        log.warning("⚠️ Could not load pre-classifier model, using keyword rules", error=str(e))
+    return PreClassifier()
+
+
+def pre_classify(rawtext, keyvaluesText="", tbltxt=""):
+    """Return (label, confidence) of the local model for an extracted document"""
+    return load_model().predict(document_text(rawtext, keyvaluesText, tbltxt))
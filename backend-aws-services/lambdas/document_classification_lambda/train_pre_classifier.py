@@ -0,0 +1,89 @@
+"""
+Train the local pre-classifier from past LLM classifications in nmm-doc-extraction.
+
+Every item with a classification the LLM gave (classification_source missing or
+"llm") becomes a (text, label) sample. Documents are split into training and
+held-out sets by a hash of their docid, so re-runs use the same split. The report
+shows, per confidence threshold, the share of held-out documents that would skip
+Bedrock, how often those agree with the LLM, and the prediction latency.
+
+Run with the common layer on the path:
+    PYTHONPATH=../common_layer/python python train_pre_classifier.py \\
+        [--holdout 0.2] [--output pre_classifier_model.json] [--upload s3://bucket/key]
+"""
+import argparse
+import hashlib
+import json
+
+import boto3
+from boto3.dynamodb.conditions import Attr
+
+from dynamo_scan import parallel_scan
+from extraction_payloads import hydrate_payloads
+from pre_classifier import LABELS, document_text, evaluate, train
+
+REPORT_THRESHOLDS = (0.6, 0.7, 0.8, 0.9, 0.95, 0.99)
+
+
+def load_samples(table_name):
+    """(docid, text, label) of every document the LLM classified into one of LABELS"""
+    table = boto3.resource("dynamodb").Table(table_name)
+    items = parallel_scan(
+        table,
+        FilterExpression=Attr('classification').is_in(LABELS) & (
+            Attr('classification_source').not_exists() | Attr('classification_source').eq('llm')),
+    )
+    samples = []
+    for item in items:
+        hydrate_payloads(item)
+        text = document_text(item.get('rawtext', ''), item.get('keyvaluesText', ''), item.get('tbltxt', ''))
+        if text.strip():
+            samples.append((item['docid'], text, item['classification']))
+    return samples
+
+
+def is_holdout(docid, holdout):
+    return int(hashlib.sha256(docid.encode('utf-8')).hexdigest()[:8], 16) / 0xFFFFFFFF < holdout
+
+
+def print_report(model, heldout):
+    print(f"{'threshold':>9} {'skip rate':>9} {'agree (skipped)':>15} {'agree (all)':>11} {'p50 ms':>7} {'p99 ms':>7}")
+    for threshold in REPORT_THRESHOLDS:
+        report = evaluate(model, heldout, threshold)
+        print(f"{threshold:>9.2f} {report['skip_rate']:>9.1%} {report['skipped_agreement']:>15.1%} "
+              f"{report['overall_agreement']:>11.1%} {report['p50_ms']:>7.2f} {report['p99_ms']:>7.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--table", default="nmm-doc-extraction")
+    parser.add_argument("--holdout", type=float, default=0.2, help="share of documents kept for evaluation")
+    parser.add_argument("--output", default="pre_classifier_model.json")
+    parser.add_argument("--upload", help="s3://bucket/key to upload the model to (PRECLASSIFIER_MODEL_S3)")
+    args = parser.parse_args()
+
+    samples = load_samples(args.table)
+    training = [(text, label) for docid, text, label in samples if not is_holdout(docid, args.holdout)]
+    heldout = [(text, label) for docid, text, label in samples if is_holdout(docid, args.holdout)]
+    print(f"📄 {len(samples)} labelled documents: {len(training)} training, {len(heldout)} held out")
+    if not training:
+        print("❌ No training documents, nothing written")
+        return
+
+    model = train(training)
+    print(f"✅ Trained on {model.trained_on} documents, {len(model.idf)} features, temperature {model.temperature}")
+    if heldout:
+        print_report(model, heldout)
+
+    body = json.dumps(model.to_dict(), separators=(',', ':'))
+    with open(args.output, "w") as model_file:
+        model_file.write(body)
+    print(f"💾 Wrote {args.output} ({len(body) // 1024} KB)")
+    if args.upload:
+        bucket, _, key = args.upload[len("s3://"):].partition("/")
+        boto3.client("s3").put_object(Bucket=bucket, Key=key, Body=body.encode('utf-8'), ContentType='application/json')
+        print(f"☁️ Uploaded {args.upload}")
+
+
+if __name__ == "__main__":
+    main()
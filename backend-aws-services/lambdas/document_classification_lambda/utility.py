@@ -1,21 +1,28 @@
 import boto3
-import json
-import time
 import datetime
-import traceback
 from botocore.exceptions import ClientError
+from extraction_payloads import hydrate_payloads
+from bedrock_gateway import HAIKU_MODEL_ID, invoke_claude
+from instrumentation import Span, record_consumed_capacity
+from structured_log import log, response_summary
 
 # Initialize DynamoDB resource
 dynamodb_resource = boto3.resource("dynamodb")
 
 def get_docs_extract(docid):
     """Retrieve document extract details from DynamoDB"""
-    print('in get_docs_extract begin', docid)
-    
+    log.debug("Loading the extracted document", docid=docid)
+
     dynamodb_tbl_nm = "nmm-doc-extraction"
     dbtable = dynamodb_resource.Table(dynamodb_tbl_nm)
-    
-    return dbtable.get_item(Key={'docid': docid})
+
+    with Span("load", docid, table=dynamodb_tbl_nm):
+        response = dbtable.get_item(Key={'docid': docid}, ReturnConsumedCapacity='TOTAL')
+        record_consumed_capacity(response, "read")
+        if 'Item' in response:
+            # rawtext / keyvaluesText / tbltxt may have been offloaded to S3
+            hydrate_payloads(response['Item'])
+    return response
 
 # def get_prompt_ready(raw_text, tabletext, key_value_pair_data):
 #     """Generate prompt for document classification"""
@@ -79,37 +86,11 @@ def get_prompt_ready(raw_text, tabletext, key_value_pair_data):
 
     return prompbody
 
-def execute_model(prompt, bedrock):
+def execute_model(prompt):
     """Execute Claude model for document classification"""
-    try:
-        print("inside execute_model() method. Please wait Large Language Model (Haiku) is preparing your JSON....")
-        
-        start_time = time.time()
-        model_id = "anthropic.claude-3-haiku-20240307-v1:0"
-        response = bedrock.invoke_model(
-            modelId=model_id,
-            body=json.dumps({
-                "anthropic_version": "bedrock-2023-05-31",
-                "max_tokens": 5000,
-                "messages": [{
-                    "role": "user",
-                    "content": [{"type": "text", "text": prompt}],
-                }]
-            }),
-        )
-        
-        end_time = time.time()
-        print(f"Time taken by execute_model() {end_time - start_time} sec")
-        
-        result = json.loads(response.get("body").read())
-        output_list = result["content"]
-        for output in output_list:
-            return output["text"]
-            
-    except Exception as error:
-        print(f"Exception in execute_model(): {error}")
-        print('Exception Details:', traceback.format_exc())
-        return ""
+    # Cached client, rate limited and retried on throttling; raises BedrockGatewayError when it fails for good
+    result = invoke_claude(prompt, HAIKU_MODEL_ID, max_tokens=5000, stage="classification")
+    return result
 
 def upsert_dashboard_record(tablename, docid, **kwargs):
     """
@@ -135,17 +116,20 @@ def upsert_dashboard_record(tablename, docid, **kwargs):
 
     # Remove trailing comma and space
     update_expression = update_expression.rstrip(", ")
-    print("update_expression =", update_expression)
+    log.debug("Updating record", docid=docid, table=tablename, update_expression=update_expression)
     
     try:
-        response = table.update_item(
-            Key={'docid': docid},
-            UpdateExpression=update_expression,
-            ExpressionAttributeValues=expression_attribute_values,
-            ReturnValues='ALL_NEW'
-        )
-        print("response =", response)
+        with Span("persist", docid, table=tablename):
+            response = table.update_item(
+                Key={'docid': docid},
+                UpdateExpression=update_expression,
+                ExpressionAttributeValues=expression_attribute_values,
+                ReturnValues='ALL_NEW',
+                ReturnConsumedCapacity='TOTAL'
+            )
+            record_consumed_capacity(response)
+        log.info("Updated record", docid=docid, table=tablename, response=response_summary(response))
         return response
     except ClientError as e:
-        print(f"Error updating record: {e}")
+        log.error("Error updating record", docid=docid, table=tablename, error=str(e))
         raise
@@ -0,0 +1,90 @@
+import base64
+import binascii
+import hashlib
+import os
+import time
+
+import boto3
+from boto3.dynamodb.conditions import Attr
+from dynamo_scan import parallel_scan
+
+# Content-addressed cache of earlier extractions: SHA-256 of the uploaded file -> docid
+DEDUP_CACHE_ENABLED = os.environ.get("DEDUP_CACHE_ENABLED", "false").lower() == "true"
+DEDUP_CACHE_TABLE = os.environ.get("DEDUP_CACHE_TABLE", "nmm-doc-dedup-cache")
+# Entries expire this long after their last hit (DynamoDB TTL on expires_at)
+DEDUP_CACHE_TTL_DAYS = float(os.environ.get("DEDUP_CACHE_TTL_DAYS", "30"))
+
+HASH_CHUNK_BYTES = 8 * 1024 * 1024
+
+s3_client = boto3.client('s3')
+dynamodb_resource = boto3.resource("dynamodb")
+
+
+def object_sha256(bucket, key):
+    """
+    Return the hex SHA-256 of an S3 object
+
+    Uses the full-object checksum S3 stored at upload time when there is one, otherwise
+    streams the object through hashlib in HASH_CHUNK_BYTES chunks.
+    """
+    head = s3_client.head_object(Bucket=bucket, Key=key, ChecksumMode='ENABLED')
+    checksum = head.get('ChecksumSHA256')
+    # Multipart uploads carry a checksum of part checksums ("...-<parts>"), not of the content
+    if checksum and head.get('ChecksumType', 'FULL_OBJECT') == 'FULL_OBJECT' and '-' not in checksum:
+        return binascii.hexlify(base64.b64decode(checksum)).decode('ascii')
+
+    digest = hashlib.sha256()
+    body = s3_client.get_object(Bucket=bucket, Key=key)['Body']
+    for chunk in body.iter_chunks(HASH_CHUNK_BYTES):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def lookup_cache_entry(content_sha256):
+    """Return the live cache entry of a content hash, None on a miss or an expired entry"""
+    item = dynamodb_resource.Table(DEDUP_CACHE_TABLE).get_item(Key={'content_sha256': content_sha256}).get('Item')
+    # TTL deletion runs in the background, so expired entries can still be read for a while
+    if not item or int(item.get('expires_at', 0)) <= int(time.time()):
+        return None
+    return item
+
+
+def register_cache_entry(content_sha256, docid, s3filename):
+    """Point a content hash at the docid whose extraction should be reused"""
+    now = int(time.time())
+    dynamodb_resource.Table(DEDUP_CACHE_TABLE).put_item(Item={
+        'content_sha256': content_sha256,
+        'docid': docid,
+        's3filename': s3filename,
+        'created_at': now,
+        'expires_at': now + int(DEDUP_CACHE_TTL_DAYS * 86400),
+        'hit_count': 0,
+    })
+
+
+def touch_cache_entry(content_sha256):
+    """Count a hit and push the entry's expiry out by another TTL"""
+    dynamodb_resource.Table(DEDUP_CACHE_TABLE).update_item(
+        Key={'content_sha256': content_sha256},
+        UpdateExpression='SET expires_at = :expires_at, last_hit_at = :now ADD hit_count :one',
+        ExpressionAttributeValues={
+            ':expires_at': int(time.time()) + int(DEDUP_CACHE_TTL_DAYS * 86400),
+            ':now': int(time.time()),
+            ':one': 1,
+        },
+    )
+
+
+def mark_email_doc_completed(docid):
+    """Set doc_status of an emailed document to Completed, as the confidence score lambda does"""
+    table = dynamodb_resource.Table('email_reader_v1')
+    matching_items = parallel_scan(table, max_items=1, FilterExpression=Attr('doc_id').eq(docid))
+    if not matching_items:
+        return "Could not Update Email Reader Status for docid"
+    item = matching_items[0]
+    table.update_item(
+        Key={'seqid': item['seqid'], 'seqid_sort': item['seqid_sort']},
+        UpdateExpression='SET doc_status = :status',
+        ExpressionAttributeValues={':status': "Completed"}
+    )
+    return "Updated Email Reader Status to Completed for docid"
@@ -5,20 +5,27 @@ import sys
 from logging import exception
 from botocore.exceptions import ClientError
 
-import trp
-from trp import Document
 from typing import Dict
-from typing import Optional
 # Import date class from datetime module
 # from datetime import date
 # from datetime import datetime
 import datetime
 import decimal
-import traceback
 import botocore
 from botocore.config import Config
 import re
 import time
+import uuid
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from sqs_batch import process_sqs_batch, parse_record_body
+from extraction_payloads import store_payloads
+from chunk_index import CHUNK_INDEX_ENABLED, build_index, dumps as dump_chunk_index
+from dedup_cache import (DEDUP_CACHE_ENABLED, object_sha256, lookup_cache_entry, register_cache_entry,
+                         touch_cache_entry, mark_email_doc_completed)
+from instrumentation import Span, emit_metric, in_current_span, record_consumed_capacity, record_usage
+from structured_log import log, response_summary
 
 
 module_path = ".."
@@ -35,106 +42,45 @@ os.environ["BEDROCK_ASSUME_ROLE"] = "arn:aws:iam::040504913362:role/bedrock"  #
 
 s3bkt = "aimlusecases-pvt"
 
-textract = boto3.client('textract', region_name='us-east-1')
+# "poll"         - start the Textract job and wait for it inside this invocation (original behaviour)
+# "notification" - start the job with an SNS NotificationChannel and exit; textract_completion_handler
+#                  picks the results up when the completion message arrives
+TEXTRACT_COMPLETION_MODE = os.environ.get("TEXTRACT_COMPLETION_MODE", "poll")
+TEXTRACT_SNS_TOPIC_ARN = os.environ.get("TEXTRACT_SNS_TOPIC_ARN")
+TEXTRACT_SNS_ROLE_ARN = os.environ.get("TEXTRACT_SNS_ROLE_ARN")
+
+# Concurrent analysis in "poll" mode - size TEXTRACT_MAX_INFLIGHT_JOBS so that it times reserved concurrency stays
+# within the account's StartDocumentAnalysis / GetDocumentAnalysis TPS quotas
+TEXTRACT_MAX_INFLIGHT_JOBS = int(os.environ.get("TEXTRACT_MAX_INFLIGHT_JOBS", "5"))
+TEXTRACT_POLL_BASE_SEC = float(os.environ.get("TEXTRACT_POLL_BASE_SEC", "1"))
+TEXTRACT_POLL_MAX_SEC = float(os.environ.get("TEXTRACT_POLL_MAX_SEC", "20"))
+TEXTRACT_FETCH_WORKERS = int(os.environ.get("TEXTRACT_FETCH_WORKERS", "4"))
+textract_inflight = threading.BoundedSemaphore(TEXTRACT_MAX_INFLIGHT_JOBS)
+
+# Adaptive retries rate-limit the client when Textract answers with throttling errors
+textract = boto3.client('textract', region_name='us-east-1', config=Config(retries={'max_attempts': 10, 'mode': 'adaptive'}))
 # Define DynamoDB Database and the Dynamo Table
 dynamodb_resource = boto3.resource("dynamodb")
+sqs = boto3.client('sqs')
 
 
-def get_bedrock_client(assumed_role: Optional[str] = None, region: Optional[str] = None, runtime: Optional[bool] = True):
-    
-#     """Create a boto3 client for Amazon Bedrock, with optional configuration overrides
-
-# #     Parameters
-# #     ----------
-# #     assumed_role :
-# #         Optional ARN of an AWS IAM role to assume for calling the Bedrock service. If not
-# #         specified, the current active credentials will be used.
-# #     region :
-# #         Optional name of the AWS Region in which the service should be called (e.g. "us-east-1").
-# #         If not specified, AWS_REGION or AWS_DEFAULT_REGION environment variable will be used.
-# #     runtime :
-# #         Optional choice of getting different client to perform operations with the Amazon Bedrock service.
-# #     """
-    if region is None:
-        target_region = os.environ.get("AWS_REGION", os.environ.get("AWS_DEFAULT_REGION"))
-    else:
-        target_region = region
-    
-    print(f"Create new client Using region: {target_region}")
-    session_kwargs = {"region_name": target_region}
-    client_kwargs = {**session_kwargs}
-
-    profile_name = os.environ.get("AWS_PROFILE")
-    print('profile_name=', profile_name)
-    if profile_name:
-        print(f"  Using profile: {profile_name}")
-        session_kwargs["profile_name"] = profile_name
-
-    retry_config = Config(
-        region_name=target_region,
-        retries={
-            "max_attempts": 10,
-            "mode": "standard",
-        },
-    )
-    session = boto3.Session(**session_kwargs)
-
-    if assumed_role:
-        print(f"  Using role: {assumed_role}", end='')
-        sts = session.client("sts")
-        response = sts.assume_role(
-            RoleArn=str(assumed_role),
-            RoleSessionName="langchain-llm-1"
-        )
-        print(" ... successful!")
-        client_kwargs["aws_access_key_id"] = response["Credentials"]["AccessKeyId"]
-        client_kwargs["aws_secret_access_key"] = response["Credentials"]["SecretAccessKey"]
-        client_kwargs["aws_session_token"] = response["Credentials"]["SessionToken"]
-#         print('client_kwargs = ',client_kwargs)
-
-    if runtime:
-        service_name='bedrock-runtime'
-    else:
-        service_name='bedrock'
-
-    bedrock_client = session.client(
-        service_name=service_name,
-        config=retry_config,
-        **client_kwargs
-    )
-
-    print("boto3 Bedrock client successfully created!")
-    print(bedrock_client._endpoint)
-    return bedrock_client
-
-# COPIED FROM PREVIOUS POCs
-# ---------------------------
-def get_doc_text(s3files):
+
+def get_doc_text(s3files, page_lines=None):
     tbltxt=[]
     rawtext=[]
     keyvaluesText=[]
-    print('in get_doc_text()')
-    jobids = resp_id(s3files)
+    log.info("Analyzing documents", files=len(s3files))
+    # All files are analysed concurrently, so a packet takes as long as its slowest document
+    results = analyze_documents(s3files, page_lines)
     
-    print('in get_doc_text()-> jobids', jobids)
-    print('Please wait till we analyze the documents for the job ids...')
-    for jobid in jobids:
-        filname=list(jobid.keys())[0].split('.')[0]
-        print('filname=',filname)
-        jobidss=list(jobid.values())[0]
-        print('jobidss=',jobidss)
-        
-        resanal="NotComplete"
-        while(resanal=="NotComplete"):
-            resanal=getJobResults(jobidss)
+    for s3PDF, resanal in zip(s3files, results):
+        filname=s3PDF.split('.')[0]
+        log.debug("Parsed document", filname=filname)
             
-        if resanal=="FAILED":
-            tabletxt="FAILED"
-        else:
-            tabletxt=parseresp(resanal)    
+        # Already parsed while the pages were fetched
+        tabletxt=resanal
         
         response=json.dumps({"text":tabletxt})
-        print('\nCOMPLETE jobidss=',jobidss)
         
         resp=json.loads(response)
         tbltxt.append({filname:resp['text'][0]})
@@ -143,161 +89,284 @@ def get_doc_text(s3files):
         
     return tbltxt,rawtext,keyvaluesText
 
-# COPIED FROM PREVIOUS POCs
-# ---------------------------
-def resp_id(s3files):
-#     client = boto3.client('textract')
-#     s3bkt = "aimlusecasesv1"
-
-    # Step1: Textract(Getting JobID) 
-    jobids = []
-    for s3PDF in s3files:
-        print('s3PDF =',s3PDF)
-#         s3filename = 'iassureclaim/policydocuments/' + s3PDF
-        s3filename = s3PDF
-        response = textract.start_document_analysis(
-                DocumentLocation={
-                    'S3Object': {
-                        'Bucket': s3bkt,
-                        'Name': s3filename
-                    }
-                },
-                FeatureTypes=["TABLES","FORMS"],
-                OutputConfig={
-                    'S3Bucket': s3bkt,
-                    'S3Prefix': s3PDF + '_extractedoutput.txt' #'iassureclaim/policydocuments/tblr-pdf/output'
-                },
-            )
+def start_textract_job(s3filename, job_tag=None):
+    """Start an asynchronous Textract analysis, with a completion notification in "notification" mode"""
+    request = {
+        'DocumentLocation': {
+            'S3Object': {
+                'Bucket': s3bkt,
+                'Name': s3filename
+            }
+        },
+        'FeatureTypes': ["TABLES","FORMS"],
+        'OutputConfig': {
+            'S3Bucket': s3bkt,
+            'S3Prefix': s3filename + '_extractedoutput.txt' #'iassureclaim/policydocuments/tblr-pdf/output'
+        },
+    }
+    if TEXTRACT_COMPLETION_MODE == "notification":
+        request['NotificationChannel'] = {
+            'SNSTopicArn': TEXTRACT_SNS_TOPIC_ARN,
+            'RoleArn': TEXTRACT_SNS_ROLE_ARN
+        }
+        if job_tag:
+            # JobTag comes back in the completion message - we use the docid
+            request['JobTag'] = job_tag
+    response = textract.start_document_analysis(**request)
+    return response['JobId']
+
+def poll_delay(attempt):
+    """Exponential backoff with jitter between status checks of one job"""
+    delay = min(TEXTRACT_POLL_MAX_SEC, TEXTRACT_POLL_BASE_SEC * (2 ** attempt))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def analyze_documents(s3files, page_lines=None):
+    """
+    Run Textract analysis on every file concurrently
 
-        jobid=response['JobId']
-        print('jobid=',jobid)
-        resp = json.dumps({"text":jobid})
-        print('resp=',resp)
-        jobids.append({s3PDF:jobid})
-    txtract_jobid=jobids
-    return txtract_jobid
+    All jobs are started up front (at most TEXTRACT_MAX_INFLIGHT_JOBS at a time, shared by every
+    message of the batch) and polled together with jittered exponential backoff. Result pages of
+    finished jobs are fetched and parsed on a thread pool while the remaining jobs are still running.
+    When page_lines is given (one list per file), the line count of each page is appended to it.
 
-# COPIED FROM PREVIOUS POCs
-# ---------------------------
-def getJobResults(jobId):
+    Returns:
+        list: (tblcont, rawtext, keyvaluesText) of each file (or "FAILED"), in s3files order
+    """
+    results = [None] * len(s3files)
+    pending = list(enumerate(s3files))
+    running = {}  # jobid -> {'index', 'attempt', 'next_poll'}
+    fetches = {}
+    with ThreadPoolExecutor(max_workers=TEXTRACT_FETCH_WORKERS) as executor:
+        try:
+            while pending or running:
+                # Start jobs while there is room - wait for a slot only when nothing of ours is running
+                while pending and textract_inflight.acquire(blocking=not running):
+                    index, s3filename = pending[0]
+                    try:
+                        jobid = start_textract_job(s3filename)
+                    except Exception:
+                        textract_inflight.release()
+                        raise
+                    pending.pop(0)
+                    log.info("Started Textract job", s3filename=s3filename, jobid=jobid)
+                    running[jobid] = {'index': index, 'attempt': 0, 'next_poll': time.monotonic() + poll_delay(0)}
+
+                if running:
+                    time.sleep(max(0.0, min(job['next_poll'] for job in running.values()) - time.monotonic()))
+
+                now = time.monotonic()
+                for jobid, job in list(running.items()):
+                    if job['next_poll'] > now:
+                        continue
+                    status = textract.get_document_analysis(JobId=jobid, MaxResults=1)['JobStatus']
+                    if status == "IN_PROGRESS":
+                        job['attempt'] += 1
+                        job['next_poll'] = time.monotonic() + poll_delay(job['attempt'])
+                        continue
+                    del running[jobid]
+                    textract_inflight.release()
+                    log.info("Textract job finished", jobid=jobid, status=status, polls=job['attempt'] + 1)
+                    if status == "FAILED":
+                        results[job['index']] = "FAILED"
+                    else:
+                        fetches[job['index']] = executor.submit(
+                            in_current_span(extract_job_text), jobid, page_lines[job['index']] if page_lines else None)
+        finally:
+            # Jobs still running after an error no longer count against the cap
+            for _ in running:
+                textract_inflight.release()
+
+        for index, future in fetches.items():
+            results[index] = future.result()
+    return results
 
-    pages = []
-    pgcnt=1
-    
-    response = textract.get_document_analysis(JobId=jobId,MaxResults=3) 
-    pages.append(response) 
-#     print('JobStatus=',response['JobStatus']) 
-    
-    if response['JobStatus']=="SUCCEEDED":
-        print('JobStatus=',response['JobStatus']) 
-        nextToken = None
-        if('NextToken' in response):
-            nextToken = response['NextToken'] 
-        while(nextToken):
-            pgcnt+=1
-            print(pgcnt) 
-            response = textract.get_document_analysis(JobId=jobId, NextToken=nextToken)
-            pages.append(response)
-            nextToken = None
-            if('NextToken' in response):
-                nextToken = response['NextToken'] 
-        print("coming out from token formatting func")
-        return pages
-    elif response['JobStatus']=="FAILED":
-        return("FAILED")
-    else:
-        return("NotComplete")
-    
-# COPIED FROM PREVIOUS POCs
 # ---------------------------
-def parseresp(resanal):
-#     print('\nresanal=',resanal)
-    doc = Document(resanal)
-    prevpg=''
-    tblcont=[]
-    rawtext=""
-    keyvaluesText=[]
-    tblindex=0
-    for resultPage in doc.pages: #pages of read PDF
-        for Line in resultPage.lines:
-            rawtext+=Line.text+"\n"
-            
-        for field in resultPage.form.fields:
-    #         print("Key: {}, Value: {}".format(field.key, field.value))
-            keyvaluesText.append("Key: {}, Value: {}".format(field.key, field.value))
-        
-        for table in resultPage.tables: #for each table 
-            print("table #",tblindex)
-            clnmtxt='Tabluar Data Processing '
-            col=[]
-            
-            # try to get its shape - how many columns and rows
-            for r, row in enumerate(table.rows):
-                for c, cell in enumerate(row.cells):
-                    if r==0:
-                        if cell.text=="":
-                            colval="description:-"
-                        else:
-                            colval=cell.text
-                        col.append({str(c):colval})
-#             print('columns',col)           
-            # for each row define your format to get the data points
-            for r, row in enumerate(table.rows):
-
-                for c, cell in enumerate(row.cells):
-                    if r!=0: # this is not the header row
-                        clnmtxt+=col[c][str(c)]+" "+cell.text+","
-                clnmtxt+=';'
-
-            tblcont.append({tblindex:clnmtxt})
-            tblindex+=1
-            
-#     print('\n--------------------------------------------------')
-#     print('tblcont = ',tblcont)
+# Streaming Textract result parser - result pages are consumed as they are fetched and only
+# the blocks of the current document page are held in memory
+
+def iter_job_results(jobId):
+    """Yield the get_document_analysis responses of a finished job one at a time"""
+    response = textract.get_document_analysis(JobId=jobId)
+    yield response
+    while 'NextToken' in response:
+        response = textract.get_document_analysis(JobId=jobId, NextToken=response['NextToken'])
+        yield response
+
+def iter_document_pages(responses):
+    """
+    Regroup a stream of result pages into document pages
 
-#     print('\n--------------------------------------------------')
-#     print('rawtext = ',rawtext)
+    Textract returns the blocks of a document page together, starting with its PAGE block, so
+    a page is complete when the next PAGE block (or the end of the stream) arrives.
 
-#     print('\n--------------------------------------------------')
-#     print('keyvaluesText = ',keyvaluesText)
-            
-    return tblcont, rawtext, keyvaluesText
+    Yields:
+        dict: Id -> block map of one document page, in block order
+    """
+    page = {}
+    for response in responses:
+        for block in response['Blocks']:
+            if block['BlockType'] == 'PAGE' and page:
+                yield page
+                page = {}
+            page[block['Id']] = block
+    if page:
+        yield page
+
+def child_blocks(block, page, relationship_type='CHILD'):
+    """Yield the related blocks of a block that are on the same page"""
+    for relationship in block.get('Relationships') or []:
+        if relationship['Type'] == relationship_type:
+            for block_id in relationship['Ids']:
+                if block_id in page:
+                    yield page[block_id]
+
+def field_text(key_block, page):
+    """Return "Key: ..., Value: ..." for a KEY block, None when the key has no content"""
+    key = None
+    value = None
+    for relationship in key_block.get('Relationships') or []:
+        if relationship['Type'] == 'CHILD':
+            key = ' '.join(page[i]['Text'] for i in relationship['Ids'] if i in page and page[i]['BlockType'] == 'WORD')
+        elif relationship['Type'] == 'VALUE':
+            for value_block in (page[i] for i in relationship['Ids'] if i in page):
+                if 'VALUE' not in value_block.get('EntityTypes', []):
+                    continue
+                for vrel in value_block.get('Relationships') or []:
+                    if vrel['Type'] == 'CHILD':
+                        children = [page[i] for i in vrel['Ids'] if i in page]
+                        words = [b['Text'] for b in children if b['BlockType'] == 'WORD']
+                        selections = [b['SelectionStatus'] for b in children if b['BlockType'] == 'SELECTION_ELEMENT']
+                        value = ' '.join(words) if words else (selections[-1] if selections else "")
+    if key is None:
+        return None
+    return "Key: {}, Value: {}".format(key, value)
+
+def cell_text(cell, page):
+    """Text of a table CELL - words followed by a space, selection marks by a comma"""
+    parts = []
+    for child in child_blocks(cell, page):
+        if child['BlockType'] == 'WORD':
+            parts.append(child['Text'] + ' ')
+        elif child['BlockType'] == 'SELECTION_ELEMENT':
+            parts.append(child['SelectionStatus'] + ', ')
+    return ''.join(parts)
+
+def iter_table_rows(table_block, page):
+    """Yield the cell texts of each row of a TABLE block"""
+    row = []
+    row_index = 1
+    for cell in child_blocks(table_block, page):
+        if cell['RowIndex'] > row_index:
+            yield row
+            row = []
+            row_index = cell['RowIndex']
+        row.append(cell_text(cell, page))
+    if row:
+        yield row
+
+def table_text(table_block, page):
+    """Flatten a table to "header value," pairs per row, rows separated by ';'"""
+    parts = ['Tabluar Data Processing ']
+    col = []
+    for r, row in enumerate(iter_table_rows(table_block, page)):
+        for c, text in enumerate(row):
+            if r == 0:
+                col.append(text if text != "" else "description:-")
+            else:
+                parts.append(col[c] + " " + text + ",")
+        parts.append(';')
+    return ''.join(parts)
+
+def iter_page_content(page):
+    """Yield ('line' | 'field' | 'table', text) for one document page, in block order"""
+    for block in page.values():
+        if block['BlockType'] == 'LINE':
+            yield 'line', block.get('Text') or ""
+        elif block['BlockType'] == 'KEY_VALUE_SET' and 'KEY' in block.get('EntityTypes', []):
+            text = field_text(block, page)
+            if text is not None:
+                yield 'field', text
+        elif block['BlockType'] == 'TABLE':
+            yield 'table', table_text(block, page)
+
+def parse_textract_stream(responses, page_lines=None):
+    """
+    Parse get_document_analysis responses into (tblcont, rawtext, keyvaluesText)
+
+    Same output as building a trp.Document from all responses, without keeping them:
+    tblcont is [{index: table text}], rawtext has one line per LINE block and
+    keyvaluesText is ["Key: ..., Value: ..."]. When page_lines is given, the number of
+    rawtext lines of each page is appended to it (page references of the chunk index).
+    """
+    rawtext_parts = []
+    keyvaluesText = []
+    tblcont = []
+    pages = 0
+    for page in iter_document_pages(responses):
+        pages += 1
+        lines_before = len(rawtext_parts)
+        for kind, text in iter_page_content(page):
+            if kind == 'line':
+                rawtext_parts.append(text + "\n")
+            elif kind == 'field':
+                keyvaluesText.append(text)
+            else:
+                log.debug("Table parsed", table=len(tblcont))
+                tblcont.append({len(tblcont): text})
+        if page_lines is not None:
+            page_lines.append(len(rawtext_parts) - lines_before)
+    log.info("Parsed document pages", pages=pages)
+    record_usage(TextractPages=pages)
+    return tblcont, ''.join(rawtext_parts), keyvaluesText
+
+def extract_job_text(jobId, page_lines=None):
+    """Fetch and parse the results of a finished job, one result page at a time"""
+    return parse_textract_stream(iter_job_results(jobId), page_lines)
 # -------------------------------------------------------------------------
 
 
 ##########################
 
-def save_docs_extract(docid, indexid, s3filename, rawtext, keyvaluesText, tbltxt, source):
-    print('inside save_claimform_attributes()')
+def save_docs_extract(docid, indexid, s3filename, rawtext, keyvaluesText, tbltxt, source, chunk_index=None):
     try:
         # Get the current datetime
         current_datetime = datetime.datetime.now(datetime.timezone.utc)
         # Convert the datetime to ISO 8601 format        
         sort_key = current_datetime.isoformat()
-        print("sort_key (which is datetime) = ", sort_key)
 
         dynamodb_tbl_nm = "nmm-doc-extraction"
         dbtable = dynamodb_resource.Table(dynamodb_tbl_nm)
-        print('dbtable = ',dbtable)
+        # rawtext / keyvaluesText / tbltxt (used by classification, entities, summary and chatbot)
+        # stay in the item or go to S3 with only payload_refs kept, see EXTRACTION_PAYLOAD_STORAGE
+        payloads = {
+                                       "rawtext" : rawtext,
+                                       "keyvaluesText" : keyvaluesText,
+                                       "tbltxt" : tbltxt,
+                                         }
+        payload_attributes = store_payloads(docid, payloads)
+        if chunk_index is not None:
+            # BM25 chunk index of the raw text, read by the chatbot instead of the whole document.
+            # Always in S3 - inline it about doubles the item (400 KB limit) and every get_item's read units
+            chunk_refs = store_payloads(docid, {"chunk_index": chunk_index}, storage="s3")['payload_refs']
+            payload_attributes.setdefault('payload_refs', {}).update(chunk_refs)
         response = dbtable.put_item(
                                    Item={
                                        "docid": docid, 
                                        "indexid": indexid, 
                                        "document_name" : s3filename,
                                        "current_datetime" : str(sort_key), 
-                                       "rawtext" : rawtext,   # This holds the rawtext which is used for chatbot
-                                       "keyvaluesText" : keyvaluesText,   # This holds the keyvaluesText which is used for chatbot
-                                       "tbltxt" : tbltxt,   # This holds the tbltxt which is used for chatbot
                                        "doc_source" : source,   # document source (email or manual upload)
-                                         }
+                                       **payload_attributes,
+                                         },
+                                   ReturnConsumedCapacity='TOTAL'
                                     )
+        record_consumed_capacity(response)
 
-        print("successfully inserted the record in DynamoDB Table")
+        log.info("Saved the extracted document", docid=docid, table=dynamodb_tbl_nm)
         return 'Saved successfully to DynamoDB'
     
     except Exception as error:
-        print(f"Exception in save_docs_extract() and the error is - {error}")  
-        print('Exception Details in save_docs_extract() are - ',traceback.format_exc())
+        log.exception("Exception in save_docs_extract()", docid=docid, error=str(error))
         return 'Unable to save the json in DynamoDB'
 
 
@@ -327,32 +396,32 @@ def upsert_dashboard_record(docid, **kwargs):
 
     # Remove trailing comma and space
     update_expression = update_expression.rstrip(", ")
-    print ("update_expression = ", update_expression)
+    log.debug("Updating nmm-dashboard", docid=docid, update_expression=update_expression)
     try:
         response = table.update_item(
             Key={'docid': docid},
             UpdateExpression=update_expression,
             ExpressionAttributeValues=expression_attribute_values,
-            ReturnValues='ALL_NEW'
+            ReturnValues='ALL_NEW',
+            ReturnConsumedCapacity='TOTAL'
         )
-        print ("response = ", response)
+        record_consumed_capacity(response)
+        log.info("Updated nmm-dashboard", docid=docid, response=response_summary(response))
         return response
     except ClientError as e:
-        print(f"Error updating record: {e}")
+        log.error("Error updating record", docid=docid, error=str(e))
         raise
 
         
 def sendtodocproQ(indexid, s3filename, docid, source):
     """Send message to Document processing queue"""
-    sqs = boto3.client('sqs')
-    
     queue_url = "https://sqs.us-east-1.amazonaws.com/040504913362/NMM_DocProcessingAfterExtractionQueueNew"
     try:
         message_body = {
             "indexid": indexid,
             "s3filename": s3filename,
             "docid": docid,
-            "timestamp": str(boto3.Session().region_name),
+            "timestamp": str(sqs.meta.region_name),
             "message_type": "document_processing",
             "source" : source
         }
@@ -381,113 +450,220 @@ def sendtodocproQ(indexid, s3filename, docid, source):
             }
         )
         
-        print(f"✅ Message sent to document processing queue successfully!")
-        print(f"✅ MessageId: {response['MessageId']}")
-        print(f"📨 Message body: {json.dumps(message_body)}")
+        log.info("✅ Message sent to document processing queue", docid=docid, message_id=response['MessageId'])
+        log.debug("📨 Message body", docid=docid, message_body=message_body)
         
         return {"status": "success", "MessageId": response['MessageId']}
         
     except Exception as e:
-        print(f"❌ Error sending to document processing queue: {str(e)}")
-        import traceback
-        print(f"Full traceback: {traceback.format_exc()}")
+        log.exception("❌ Error sending to document processing queue", docid=docid, error=str(e))
         mock_id = str(uuid.uuid4())
         return {"status": "error", "MessageId": mock_id, "error": str(e)}
         
 #    *****************************************************************************************
     
-def lambda_handler(event, context):
-    saveres=""
-    headers = {
-            'Access-Control-Allow-Origin': '*',  # Replace with your client's origin
-            'Access-Control-Allow-Headers': '*',
-            'Access-Control-Allow-Methods': '*',  # Adjust based on the allowed methods
-        }
-    try:
-        print ('inside lambda_handler()')
-        print('event= ', event)
-        
-        lambda_runtime_region = os.environ['AWS_REGION']    
-        print('This Lambda Function was run in region: ', lambda_runtime_region)
-        print('This Lambda Function was run in os.environ["AWS_DEFAULT_REGION"] : ', os.environ["AWS_DEFAULT_REGION"])
-        
-        bedrock = get_bedrock_client(
-            assumed_role=os.environ.get("BEDROCK_ASSUME_ROLE", None),
-            region="us-west-2"  #os.environ.get("AWS_DEFAULT_REGION", None)  #setting us-west-2 for bedrock but lambda in us-east-1 region
-        )
+def process_document_message(qtext):
+    """Extract one document described by an SQS message body and hand it to the next queue"""
+    s3files = [qtext['s3filename']]  # send the file name in an array
+    indexid = qtext['indexid']
+    docid = qtext['docid']
+    source = qtext['source']
+    log.info("Extracting document", docid=docid, indexid=indexid, source=source, s3filename=s3files[0])
+    
+    # Upsert the Dashboard table before extraction
+    upsert_dashboard_record(docid=docid,  indexid=indexid, gw_claim_id="To Be Processed", extraction_status="To Be Processed", classification_status="To Be Processed", confidence_score_status="To Be Processed", entity_extraction_status="To Be Processed" , doc_source= source )
+
+    content_sha256 = None
+    if DEDUP_CACHE_ENABLED:
+        # The same file uploaded again under a new docid reuses the earlier results
+        try:
+            content_sha256 = object_sha256(s3bkt, s3files[0])
+            log.debug("Content hash", docid=docid, content_sha256=content_sha256)
+            reused = reuse_cached_extraction(docid, indexid, s3files, source, content_sha256)
+            if reused is not None:
+                return reused
+        except Exception as e:
+            log.exception("❌ Dedup cache lookup failed, extracting the document", docid=docid, error=str(e))
+
+    if TEXTRACT_COMPLETION_MODE == "notification":
+        # Phase 1 of 2: start the job and exit, textract_completion_handler finishes the document
+        jobid = start_textract_job(s3files[0], job_tag=docid)
+        log.info("Textract job started, waiting for its completion notification", docid=docid, jobid=jobid)
+        pending = {'content_sha256': content_sha256} if content_sha256 else {}
+        upsert_dashboard_record(docid=docid, textract_job_id=jobid, extraction_status="In Progress", **pending)
+        return 'Textract job started - ' + jobid
+    
+    page_lines = [[] for _ in s3files]
+    with Span("textract", docid):
+        tbltxt,rawtext,keyvaluesText = get_doc_text(s3files, page_lines)
+   
+    # Payloads are DEBUG - serialized only when the level (or the docid's sample) lets them through
+    log.debug("Extracted text", docid=docid, keyvaluesText=keyvaluesText, tbltxt=tbltxt)
+    
+    return persist_extraction(docid, indexid, s3files, tbltxt, rawtext, keyvaluesText, source, content_sha256, page_lines)
 
-        print('bedrock object which is assuming a role and region to create a bedrock client = ',bedrock)
-        
-#         data_string = event["body"]  # if using from postman, we can directly use this but in this case, SQS is triggering lambda so the 
-        #  event is having different attributes and 'body' is inside this
-        data_string = event['Records'][0]['body']   # this change is done only to accept the 'body' from SQS
-        print("event[body]",data_string,type(data_string))
-        
-        if type(data_string) is dict:
-            qtext = data_string
-        else:
-            qtext = json.loads(data_string)
-        #print("\n","Lambda Handler context:",type(context),context)
-        
-        print("qtext=json.loads(data_string) :",type(qtext),qtext)
-        s3files = [qtext['s3filename']]  # send the file name in an array
-        indexid = qtext['indexid']
-        print("indexid = ",indexid)
-        docid = qtext['docid']
-        print("docid = ",docid)
-        source = qtext['source']
-        print("source = ",source)
-        
-        # Upsert the Dashboard table before extraction
-        upsert_dashboard_record(docid=docid,  indexid=indexid, gw_claim_id="To Be Processed", extraction_status="To Be Processed", classification_status="To Be Processed", confidence_score_status="To Be Processed", entity_extraction_status="To Be Processed" , doc_source= source )
+def build_chunk_index(docid, rawtext, page_lines):
+    """JSON of the chunk index of the raw text, None when disabled or when it cannot be built"""
+    if not CHUNK_INDEX_ENABLED:
+        return None
+    try:
+        start = time.time()
+        index = build_index(rawtext, page_lines)
+        log.info("Built chunk index", docid=docid, chunks=len(index['chunks']), seconds=round(time.time() - start, 2))
+        return dump_chunk_index(index)
+    except Exception as e:
+        # The chatbot falls back to indexing the raw text itself
+        log.error("❌ Unable to build the chunk index", docid=docid, error=str(e))
+        return None
 
-        
-        start2 = time.time()  # record start time
-        tbltxt,rawtext,keyvaluesText = get_doc_text(s3files)
-        end2 = time.time() # record end time
-        print("Time taken by extract tbltxt,rawtext,keyvaluesText = ", end2-start2, "sec")
-       
-        print('keyvaluesText=',keyvaluesText)
-        print('tbltxt=',tbltxt)
-        
+def persist_extraction(docid, indexid, s3files, tbltxt, rawtext, keyvaluesText, source, content_sha256=None, page_lines=None):
+    """Save the extraction, mark it Completed on the dashboard and queue the document for classification"""
+    with Span("persist", docid):
         # Save the JSON Data into DynamoDB for future querying
-        saveres = save_docs_extract(docid, indexid, s3files, str(rawtext), str(keyvaluesText), str(tbltxt), source)
-        
-        print('after saving the extracted document in DB - saveres - ',saveres)      
-        
-#         # Upsert to update the record and mark ExtractionStatus as completed.
-#         resExtraction = upsert_dashboard_record(docid=docid, indexid=indexid, gw_claim_id="To Be Processed", extraction_status="Completed", classification_status="To Be Processed", confidence_score_status="To Be Processed", entity_extraction_status="To Be Processed" )
-#         print('Updated dashboard table and marked extraction_status as Completed ')
+        saveres = save_docs_extract(docid, indexid, s3files, str(rawtext), str(keyvaluesText), str(tbltxt), source,
+                                    build_chunk_index(docid, rawtext, page_lines))
 
-########################################################
-        
-        resExtraction = upsert_dashboard_record(docid=docid, indexid=indexid, gw_claim_id="To Be Processed", extraction_status="Completed", 
-                                                classification_status="To Be Processed", confidence_score_status="To Be Processed", 
-                                                entity_extraction_status="To Be Processed")
-
-        # print ("resExtraction = ", resExtraction)
-        print('Updated dashboard table and marked extraction_status as Completed ')
-
-        if "ResponseMetadata" in resExtraction:
-            if "HTTPStatusCode" in resExtraction["ResponseMetadata"]:
-        #         print("@@@HTTP Response Code of resExtraction = ", resExtraction["ResponseMetadata"]["HTTPStatusCode"])
-
-                if resExtraction["ResponseMetadata"]["HTTPStatusCode"] == 200:
-                    print("Now put a message in SQS queue for future processing")
-                    response = sendtodocproQ(indexid, s3files[0], docid, source)
-                    print(f"📤 Queue response: {response}")
-#########################################################################
-    except Exception as e:
-        print('Exception in lambda_handler() - ', e)
-        print('Exception Details in lambda_handler() are - ',traceback.format_exc())
+        log.info("Saved the extraction", docid=docid, saveres=saveres)
+
+        if content_sha256 and saveres == 'Saved successfully to DynamoDB':
+            # Later uploads of the same file reuse this docid's extraction (and LLM results once they finish)
+            register_cache_entry(content_sha256, docid, s3files[0])
+
+        return complete_extraction(docid, indexid, s3files, source, saveres)
+
+def complete_extraction(docid, indexid, s3files, source, saveres):
+    """Mark the extraction Completed on the dashboard and queue the document for classification"""
+    resExtraction = upsert_dashboard_record(docid=docid, indexid=indexid, gw_claim_id="To Be Processed", extraction_status="Completed", 
+                                            classification_status="To Be Processed", confidence_score_status="To Be Processed", 
+                                            entity_extraction_status="To Be Processed")
+
+    log.info("Marked extraction_status Completed", docid=docid)
+
+    if "ResponseMetadata" in resExtraction:
+        if "HTTPStatusCode" in resExtraction["ResponseMetadata"]:
+            if resExtraction["ResponseMetadata"]["HTTPStatusCode"] == 200:
+                response = sendtodocproQ(indexid, s3files[0], docid, source)
+                log.debug("📤 Queue response", docid=docid, response=response)
     
-    return {
-            "statusCode": 200,
-            "headers": headers,
-#             "body": json.dumps(json_string)
-            "body": saveres #result 
-        }
+    return saveres
+
+# Dashboard fields produced by classification, entity extraction and confidence scoring
+REUSED_DASHBOARD_FIELDS = ['classification', 'doc_language', 'gw_claim_id', 'classification_status',
+                           'entity_extraction_status', 'confidence_score_status', 'document_conf_score']
+# nmm-doc-extraction fields that describe the upload rather than the file content
+DOCUMENT_IDENTITY_FIELDS = {'docid', 'indexid', 'document_name', 'current_datetime', 'doc_source'}
 
+def reuse_cached_extraction(docid, indexid, s3files, source, content_sha256):
+    """
+    Reuse the results of an earlier upload of the same file
 
+    The earlier nmm-doc-extraction item (text and any LLM outputs) is copied to the new docid.
+    When its classification and entity extraction are finished the dashboard record is
+    completed from the earlier one and the LLM stages are skipped; otherwise the document is
+    queued for classification as after a normal extraction.
 
+    Returns:
+        str: Result message on a cache hit, None on a miss
+    """
+    entry = lookup_cache_entry(content_sha256)
+    prior = None
+    if entry and entry['docid'] != docid:
+        prior = dynamodb_resource.Table('nmm-doc-extraction').get_item(Key={'docid': entry['docid']}).get('Item')
+    if not prior:
+        log.info("Dedup cache miss", docid=docid, content_sha256=content_sha256)
+        emit_metric("DedupCacheMiss")
+        return None
+
+    source_docid = entry['docid']
+    log.info("Dedup cache hit - reusing the results of an earlier upload", docid=docid, source_docid=source_docid)
+    emit_metric("DedupCacheHit")
+    touch_cache_entry(content_sha256)
+
+    current_datetime = datetime.datetime.now(datetime.timezone.utc)
+    item = {key: value for key, value in prior.items() if key not in DOCUMENT_IDENTITY_FIELDS}
+    item.update({
+        "docid": docid,
+        "indexid": indexid,
+        "document_name": s3files,
+        "current_datetime": str(current_datetime.isoformat()),
+        "doc_source": source,
+        "dedup_source_docid": source_docid,
+    })
+    dynamodb_resource.Table('nmm-doc-extraction').put_item(Item=item)
+    saveres = 'Reused the extraction of docid ' + source_docid
+
+    prior_dashboard = dynamodb_resource.Table('nmm-dashboard').get_item(Key={'docid': source_docid}).get('Item') or {}
+    if prior_dashboard.get('classification_status') != "Completed" or prior_dashboard.get('entity_extraction_status') != "Completed":
+        log.info("LLM results of the earlier upload are not complete yet - sending the document to classification",
+                 docid=docid, source_docid=source_docid)
+        return complete_extraction(docid, indexid, s3files, source, saveres)
+
+    reused_fields = {key: prior_dashboard[key] for key in REUSED_DASHBOARD_FIELDS if key in prior_dashboard}
+    upsert_dashboard_record(docid=docid, indexid=indexid, extraction_status="Completed", s3filename=s3files,
+                            dedup_source_docid=source_docid, **reused_fields)
+    log.info("Updated dashboard table from the earlier upload - skipping classification, entity extraction and "
+             "confidence scoring", docid=docid, source_docid=source_docid)
+    if source != "ManualUpload":
+        log.info(mark_email_doc_completed(docid), docid=docid)
+    return saveres + ' and its LLM results'
+
+def process_record(record):
+    """Process one SQS record; exceptions mark the message as failed so SQS retries it"""
+    log.debug("SQS record", body=record['body'])
+    saveres = process_document_message(parse_record_body(record))
+    return {"statusCode": 200, "body": saveres}
 
+#    *****************************************************************************************
+    
+def lambda_handler(event, context):
+    log.debug("Event", event=event, region=os.environ['AWS_REGION'], default_region=os.environ["AWS_DEFAULT_REGION"])
+    
+    # SQS triggers this lambda - process every record of the batch, not only Records[0],
+    # and report the failed ones so SQS redelivers just those messages
+    return process_sqs_batch(event, process_record)
+
+#    *****************************************************************************************
+#    Phase 2 of the "notification" mode - triggered by the SQS queue subscribed to the
+#    Textract completion SNS topic
+
+def parse_textract_notification(record):
+    """Return the Textract completion message of an SQS record, unwrapping the SNS envelope if present"""
+    body = parse_record_body(record)
+    if 'Message' in body and body.get('Type') == 'Notification':
+        return json.loads(body['Message'])
+    return body
+
+def process_textract_completion(record):
+    """Parse and persist the results of one completed Textract job"""
+    notification = parse_textract_notification(record)
+    log.debug("Textract notification", notification=notification)
+    jobid = notification['JobId']
+    docid = notification.get('JobTag')
+    status = notification['Status']
+    s3filename = notification['DocumentLocation']['S3ObjectName']
+
+    dashboard = dynamodb_resource.Table('nmm-dashboard').get_item(Key={'docid': docid}).get('Item') if docid else None
+    if not dashboard or dashboard.get('textract_job_id') != jobid:
+        # Unknown document or a superseded job (the document was re-submitted) - nothing to retry
+        log.warning("Ignoring Textract job - no matching dashboard record", docid=docid, jobid=jobid)
+        return {"statusCode": 404, "body": "No document waiting for this Textract job"}
+
+    indexid = dashboard['indexid']
+    source = dashboard.get('doc_source', "ManualUpload")
+    if status != "SUCCEEDED":
+        log.warning("Textract job did not succeed", docid=docid, jobid=jobid, status=status)
+        upsert_dashboard_record(docid=docid, extraction_status="Failed")
+        return {"statusCode": 422, "body": f"Textract job {status}"}
+
+    # Same JSON round trip as get_doc_text so the stored text is identical in both modes
+    page_lines = []
+    with Span("textract", docid, jobid=jobid):
+        resp = json.loads(json.dumps({"text": extract_job_text(jobid, page_lines)}))
+    filname = s3filename.split('.')[0]
+    saveres = persist_extraction(docid, indexid, [s3filename], [{filname: resp['text'][0]}], [{filname: resp['text'][1]}], [{filname: resp['text'][2]}], source,
+                                 dashboard.get('content_sha256'), [page_lines])
+    return {"statusCode": 200, "body": saveres}
+
+def textract_completion_handler(event, context):
+    log.debug("Event", event=event)
+    return process_sqs_batch(event, process_textract_completion)
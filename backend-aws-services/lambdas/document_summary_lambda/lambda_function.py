@@ -1,15 +1,17 @@
 import boto3, json
-import time
 import os
 from logging import exception
 from botocore.exceptions import ClientError
 from typing import Dict 
 import datetime
 import decimal
-from typing import Optional
-import traceback
 import botocore
-from botocore.config import Config
+from extraction_payloads import hydrate_payloads
+from prompt_budget import fit_document
+from bedrock_gateway import HAIKU_MODEL_ID, invoke_claude
+from instrumentation import Span, record_consumed_capacity
+from structured_log import log, response_summary
+import map_reduce
 
 
 os.environ["AWS_DEFAULT_REGION"] = "us-east-1"  # E.g. "us-west-2"
@@ -19,82 +21,21 @@ dynamodb_resource = boto3.resource("dynamodb")
 
 ####################################
 
-def get_bedrock_client(assumed_role: Optional[str] = None, region: Optional[str] = None, runtime: Optional[bool] = True):
-    
-#     """Create a boto3 client for Amazon Bedrock, with optional configuration overrides
-
-# #     Parameters
-# #     ----------
-# #     assumed_role :
-# #         Optional ARN of an AWS IAM role to assume for calling the Bedrock service. If not
-# #         specified, the current active credentials will be used.
-# #     region :
-# #         Optional name of the AWS Region in which the service should be called (e.g. "us-east-1").
-# #         If not specified, AWS_REGION or AWS_DEFAULT_REGION environment variable will be used.
-# #     runtime :
-# #         Optional choice of getting different client to perform operations with the Amazon Bedrock service.
-# #     """
-    if region is None:
-        target_region = os.environ.get("AWS_REGION", os.environ.get("AWS_DEFAULT_REGION"))
-    else:
-        target_region = region
-    
-    print(f"Create new client Using region: {target_region}")
-    session_kwargs = {"region_name": target_region}
-    client_kwargs = {**session_kwargs}
-
-    profile_name = os.environ.get("AWS_PROFILE")
-    print('profile_name=', profile_name)
-    if profile_name:
-        print(f"  Using profile: {profile_name}")
-        session_kwargs["profile_name"] = profile_name
-
-    retry_config = Config(
-        region_name=target_region,
-        retries={
-            "max_attempts": 10,
-            "mode": "standard",
-        },
-    )
-    session = boto3.Session(**session_kwargs)
-
-    if assumed_role:
-        print(f"  Using role: {assumed_role}", end='')
-        sts = session.client("sts")
-        response = sts.assume_role(
-            RoleArn=str(assumed_role),
-            RoleSessionName="langchain-llm-1"
-        )
-        print(" ... successful!")
-        client_kwargs["aws_access_key_id"] = response["Credentials"]["AccessKeyId"]
-        client_kwargs["aws_secret_access_key"] = response["Credentials"]["SecretAccessKey"]
-        client_kwargs["aws_session_token"] = response["Credentials"]["SessionToken"]
-#         print('client_kwargs = ',client_kwargs)
-
-    if runtime:
-        service_name='bedrock-runtime'
-    else:
-        service_name='bedrock'
-
-    bedrock_client = session.client(
-        service_name=service_name,
-        config=retry_config,
-        **client_kwargs
-    )
-
-    print("boto3 Bedrock client successfully created!")
-    print(bedrock_client._endpoint)
-    return bedrock_client
 
 def get_docs_extract(docid):
     
-    print('in get_docs_extract begin ',docid)
+    log.debug("Loading the extracted document", docid=docid)
     
     dynamodb_tbl_nm4 = "nmm-doc-extraction"
     dbtable1 = dynamodb_resource.Table(dynamodb_tbl_nm4)
 
-    docs_extractDetails = dbtable1.get_item(Key={'docid': docid})
-#     print('docs_extractDetails = ',docs_extractDetails)
+    with Span("load", docid, table=dynamodb_tbl_nm4):
+        docs_extractDetails = dbtable1.get_item(Key={'docid': docid}, ReturnConsumedCapacity='TOTAL')
+        record_consumed_capacity(docs_extractDetails, "read")
+#         print('docs_extractDetails = ',docs_extractDetails)
+        if 'Item' in docs_extractDetails:
+            # rawtext / keyvaluesText / tbltxt may have been offloaded to S3
+            hydrate_payloads(docs_extractDetails['Item'])
     
     return docs_extractDetails
 
@@ -124,47 +65,12 @@ def get_prompt_ready(raw_text, tabletext, key_value_pair_data):
 
     return prompbody
 
-def execute_model(prompt, bedrock):
-    
-    try:
-        
-        print("inside execute_model() method. Please wait Large Langauage Model (Haiku) is preparing your JSON.... ")
-
-        start3 = time.time()  # record start time
-        model_id = "anthropic.claude-3-haiku-20240307-v1:0"
-        response = bedrock.invoke_model(
-            modelId=model_id,
-            body=json.dumps(
-                {
-                    "anthropic_version": "bedrock-2023-05-31",
-                    "max_tokens": 5000,
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": [{"type": "text", "text": prompt}],
-                        }
-                    ],
-                }
-            ),
-        )
-
-        end3 = time.time() # record end time
-        print("Time taken by execute_model() ", end3-start3, "sec")
-
-        # print("\nresponse = ", response)
-        # Process and print the response
-        result = json.loads(response.get("body").read())
-        # print("\nresult = ", result)
-        output_list = result["content"]
-        for output in output_list:
-            result = output["text"]
-        
-        return result
-
-    except Exception as error:
-        print(f"Exception in execute_model() and the error is - {error}")  
-        print('Exception Details in save_claimform_attributes() are - ',traceback.format_exc())
-        return ""
+def execute_model(prompt):
+    # Cached client whose assumed-role credentials refresh before they expire; rate limited and
+    # retried on throttling, raises BedrockGatewayError when it fails for good
+    result = invoke_claude(prompt, HAIKU_MODEL_ID, max_tokens=5000, region="us-west-2",
+                           assumed_role=os.environ.get("BEDROCK_ASSUME_ROLE"), stage="summary")
+    return result
 
 
 
@@ -193,18 +99,21 @@ def upsert_document_summary(tablename, docid, **kwargs):
 
     # Remove trailing comma and space
     update_expression = update_expression.rstrip(", ")
-    print ("update_expression = ", update_expression)
+    log.debug("Updating record", docid=docid, table=tablename, update_expression=update_expression)
     try:
-        response = table.update_item(
-            Key={'docid': docid},
-            UpdateExpression=update_expression,
-            ExpressionAttributeValues=expression_attribute_values,
-            ReturnValues='ALL_NEW'
-        )
-        print ("response = ", response)
+        with Span("persist", docid, table=tablename):
+            response = table.update_item(
+                Key={'docid': docid},
+                UpdateExpression=update_expression,
+                ExpressionAttributeValues=expression_attribute_values,
+                ReturnValues='ALL_NEW',
+                ReturnConsumedCapacity='TOTAL'
+            )
+            record_consumed_capacity(response)
+        log.info("Updated record", docid=docid, table=tablename, response=response_summary(response))
         return response
     except ClientError as e:
-        print(f"Error updating record: {e}")
+        log.error("Error updating record", docid=docid, table=tablename, error=str(e))
         raise
 
 
@@ -218,28 +127,16 @@ def lambda_handler(event, context):
             'Access-Control-Allow-Methods': '*',  # Adjust based on the allowed methods
         }
     try:
-        print ('inside lambda_handler() - event = ', event)
-
-        lambda_runtime_region = os.environ['AWS_REGION']    
-        print('This Lambda Function was run in region: ', lambda_runtime_region)
-        print('This Lambda Function was run in os.environ["AWS_DEFAULT_REGION"] : ', os.environ["AWS_DEFAULT_REGION"])
+        log.debug("Event", event=event, region=os.environ['AWS_REGION'], default_region=os.environ["AWS_DEFAULT_REGION"])
         
         data_string = event  #["queryStringParameters"]
-        print("event[body]",data_string,type(data_string))
         
         if type(data_string) is dict:
             qtext = data_string
         else:
             qtext = json.loads(data_string)
-        print("qtext=json.loads(data_string) :",type(qtext),qtext)
         
         docid = qtext["docid"]
-        print("docid = ",docid)
-
-        bedrock = get_bedrock_client(
-                    assumed_role=os.environ.get("BEDROCK_ASSUME_ROLE", None),
-                    region="us-west-2"  #os.environ.get("AWS_DEFAULT_REGION", None)  #setting us-west-2 for bedrock but lambda in us-east-1 region
-                )
 
         accept = 'application/json'
         contentType = 'application/json'
@@ -247,30 +144,36 @@ def lambda_handler(event, context):
         docs_extract_details = get_docs_extract(docid)
         # print("docs_extract_details = ", docs_extract_details)
         document_name = docs_extract_details["Item"]["document_name"]
-        print("document_name = ",document_name)
         rawtext = docs_extract_details["Item"]["rawtext"]
         # print("rawtext1 = ",rawtext1)
         tbltxt = docs_extract_details["Item"]["tbltxt"]
         # print("tbltxt1 = ",tbltxt1)
         keyvaluesText = docs_extract_details["Item"]["keyvaluesText"]
         # print("keyvaluesText1 = ",keyvaluesText1)
-        print("fetched rawtext, tbltext and also keyvaluesText from claim details table of database")
+        log.info("Summarizing document", docid=docid, document_name=document_name)
 
        
 
-        prompt = get_prompt_ready(str(rawtext), str(keyvaluesText), str(tbltxt))
-        # print(str(ps_det_prompt))
-        summary = execute_model(prompt, bedrock)
-        print("\nJSON Output from LLM : ",summary)
+        with Span("summary", docid):
+            if map_reduce.use_map_reduce(rawtext, keyvaluesText, tbltxt):
+                # Sections summarized in parallel and merged, instead of truncating a long document
+                item = docs_extract_details["Item"]
+                if 'chunk_index' in item.get('payload_refs', {}):
+                    hydrate_payloads(item, fields=('chunk_index',))
+                summary = map_reduce.map_reduce_summary(docid, rawtext, keyvaluesText, tbltxt, item.get('chunk_index'))
+            else:
+                raw_part, kv_part, tbl_part = fit_document('summary', str(rawtext), str(keyvaluesText), str(tbltxt), docid=docid)
+                prompt = get_prompt_ready(raw_part, tbl_part, kv_part)
+                # print(str(ps_det_prompt))
+                summary = execute_model(prompt)
+        log.debug("Summary from LLM", docid=docid, summary=summary)
 
         # Update Document Extraction table with classification type
         updateres = upsert_document_summary('nmm-doc-extraction', docid=docid, doc_summary =summary )
-        print("updateres = ",updateres)
 
 
     except Exception as e:
-        print('Exception in lambda_handler() - ', e)
-        print('Exception Details in lambda_handler() are - ',traceback.format_exc())
+        log.exception("Exception in lambda_handler()", error=str(e))
      
     return {
             "statusCode": 200,
@@ -0,0 +1,249 @@
+import ast
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from bedrock_gateway import HAIKU_MODEL_ID, invoke_claude
+from chunk_index import INDEX_VERSION, build_chunks, parse_stored_text, source_reference
+from instrumentation import emit_metrics, in_current_span
+from prompt_budget import estimate_tokens
+from structured_log import log
+
+# "single"     - the whole (budget-fitted) document in one call (original behaviour)
+# "map_reduce" - summarize sections of the document in parallel, then merge the section summaries
+# "auto"       - map_reduce for documents over SUMMARY_MAP_REDUCE_MIN_TOKENS, single otherwise
+SUMMARY_MODE = os.environ.get("SUMMARY_MODE", "single")
+SUMMARY_MAP_REDUCE_MIN_TOKENS = int(os.environ.get("SUMMARY_MAP_REDUCE_MIN_TOKENS", "60000"))
+# Tokens of document text per section, cut between chunks of whole lines
+SUMMARY_SECTION_TOKENS = int(os.environ.get("SUMMARY_SECTION_TOKENS", "12000"))
+SUMMARY_MAP_CONCURRENCY = int(os.environ.get("SUMMARY_MAP_CONCURRENCY", "4"))
+SUMMARY_MAP_MAX_TOKENS = int(os.environ.get("SUMMARY_MAP_MAX_TOKENS", "800"))
+# Section summaries merged per reduce call; more are first merged in groups
+SUMMARY_REDUCE_INPUT_TOKENS = int(os.environ.get("SUMMARY_REDUCE_INPUT_TOKENS", "80000"))
+# Section summaries by content hash, so an updated document only re-summarizes changed sections
+SUMMARY_CHUNK_CACHE_TABLE = os.environ.get("SUMMARY_CHUNK_CACHE_TABLE", "")
+SUMMARY_CHUNK_CACHE_TTL_DAYS = float(os.environ.get("SUMMARY_CHUNK_CACHE_TTL_DAYS", "90"))
+
+# Part of the cache key: a changed map prompt must not reuse summaries made with the old one
+MAP_PROMPT_VERSION = "1"
+BATCH_GET_LIMIT = 100
+
+dynamodb_resource = boto3.resource("dynamodb")
+
+
+def document_tokens(rawtext, keyvaluesText, tbltxt):
+    return estimate_tokens(str(rawtext)) + estimate_tokens(str(keyvaluesText)) + estimate_tokens(str(tbltxt))
+
+
+def use_map_reduce(rawtext, keyvaluesText, tbltxt):
+    if SUMMARY_MODE == "map_reduce":
+        return True
+    return SUMMARY_MODE == "auto" and document_tokens(rawtext, keyvaluesText, tbltxt) > SUMMARY_MAP_REDUCE_MIN_TOKENS
+
+
+def _group(chunks):
+    """Runs of consecutive chunks of one file of up to about SUMMARY_SECTION_TOKENS"""
+    sections, current = [], []
+
+    def close():
+        if current:
+            known = [chunk["pages"] for chunk in current if chunk.get("pages")]
+            pages = [known[0][0], known[-1][1]] if known else None
+            sections.append({"file": current[0]["file"], "pages": pages,
+                             "text": "\n".join(chunk["text"] for chunk in current)})
+
+    size = 0
+    for chunk in chunks:
+        tokens = estimate_tokens(chunk["text"])
+        if current and (chunk["file"] != current[0]["file"] or size + tokens > SUMMARY_SECTION_TOKENS):
+            close()
+            current, size = [], 0
+        current.append(chunk)
+        size += tokens
+    close()
+    return sections
+
+
+def stored_chunks(chunk_index):
+    """Chunks (with their pages) of a stored chunk_index payload, None when missing or of another version"""
+    if not chunk_index:
+        return None
+    stored = json.loads(chunk_index) if isinstance(chunk_index, str) else chunk_index
+    return stored["chunks"] if stored.get("version") == INDEX_VERSION else None
+
+
+def file_lines(stored):
+    """[{file name: text}] of a stored keyvaluesText / tbltxt value, whose per-file values may be lists"""
+    files = stored
+    if isinstance(stored, str):
+        try:
+            files = ast.literal_eval(stored)
+        except (ValueError, SyntaxError, MemoryError, RecursionError):
+            return [{name: text} for name, text in parse_stored_text(stored)]
+    if not isinstance(files, list):
+        return [{name: text} for name, text in parse_stored_text(stored)]
+    texts = []
+    for entry in files:
+        for name, value in (entry.items() if isinstance(entry, dict) else [("document", entry)]):
+            text = "\n".join(str(line) for line in value) if isinstance(value, list) else str(value)
+            if text.strip():
+                texts.append({str(name): text})
+    return texts
+
+
+def build_sections(rawtext, keyvaluesText="", tbltxt="", chunk_index=None):
+    """
+    Sections of a document for the map pass, file by file: the raw text (from the chunks of
+    the stored chunk index, which know their pages, or cut again), then the form key-values
+    and the tables of the file
+
+    Sections never span files, so a changed or added file leaves the sections of the other
+    files - and their cached summaries - as they were.
+    """
+    by_file = {}
+    for chunk in stored_chunks(chunk_index) or build_chunks(rawtext):
+        by_file.setdefault(chunk["file"], []).append(chunk)
+    for heading, stored in (("Form key-values", keyvaluesText), ("Tables", tbltxt)):
+        for chunk in build_chunks(file_lines(stored)):
+            by_file.setdefault(chunk["file"], []).append(dict(chunk, text=f"[{heading}]\n{chunk['text']}"))
+    return _group([chunk for chunks in by_file.values() for chunk in chunks])
+
+
+def section_label(section):
+    return source_reference(section)
+
+
+def section_key(section):
+    digest = hashlib.sha256()
+    for part in (MAP_PROMPT_VERSION, HAIKU_MODEL_ID, str(SUMMARY_MAP_MAX_TOKENS), section_label(section), section["text"]):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x1f")
+    return digest.hexdigest()
+
+
+def map_prompt(section):
+    return f"""Human: You are an expert in understanding and analyzing Worker Compensation documents.
+
+    Below is one part of a larger document: {section_label(section)}.
+
+    <document_part>
+    {section["text"]}
+    </document_part>
+
+    Summarize this part as short numbered points for a verification officer. Keep every name, date,
+    claim / policy number, amount, diagnosis, treatment and work status it states, and say which
+    page a point comes from when the part spans pages. Do not add anything the part does not say.
+    If the part holds nothing of substance, answer "No relevant content."
+    Skip any preamble and answer with the points only.
+
+    Assistant:"""
+
+
+def reduce_prompt(summaries):
+    parts = "\n\n".join(f"<part source=\"{label}\">\n{summary}\n</part>" for label, summary in summaries)
+    return f"""Human: You are an expert in understanding and analyzing Worker Compensation documents.
+
+    The document was too long to read at once, so each part of it has been summarized. The part
+    summaries are within the <part> xml tags, in document order, with their source.
+
+    {parts}
+
+    Your objective is to merge them into a separate brief summary of the whole document with point numbers
+    so that it is readable for the verification officer. Merge points that repeat across parts and keep
+    names, dates, numbers and amounts exactly as given.
+
+    Do not provide any supporting or explanation text beyond generating the perfect pointwise summary.
+    Skip any preamble text and generate the final pointwise summary ONLY.
+
+    Assistant:"""
+
+
+def cached_summaries(keys):
+    """{section key: summary} of the keys found in SUMMARY_CHUNK_CACHE_TABLE"""
+    if not SUMMARY_CHUNK_CACHE_TABLE or not keys:
+        return {}
+    found, unique = {}, list(dict.fromkeys(keys))
+    now = int(time.time())
+    for start in range(0, len(unique), BATCH_GET_LIMIT):
+        request = {SUMMARY_CHUNK_CACHE_TABLE: {"Keys": [{"section_sha256": key} for key in unique[start:start + BATCH_GET_LIMIT]]}}
+        while request:
+            response = dynamodb_resource.batch_get_item(RequestItems=request)
+            for item in response.get("Responses", {}).get(SUMMARY_CHUNK_CACHE_TABLE, []):
+                if int(item.get("expires_at", 0)) > now:
+                    found[item["section_sha256"]] = item["summary"]
+            request = response.get("UnprocessedKeys") or None
+    return found
+
+
+def store_summaries(entries):
+    if not SUMMARY_CHUNK_CACHE_TABLE or not entries:
+        return
+    expires_at = int(time.time() + SUMMARY_CHUNK_CACHE_TTL_DAYS * 86400)
+    with dynamodb_resource.Table(SUMMARY_CHUNK_CACHE_TABLE).batch_writer(overwrite_by_pkeys=["section_sha256"]) as batch:
+        for key, summary in entries.items():
+            batch.put_item(Item={"section_sha256": key, "summary": summary, "expires_at": expires_at})
+
+
+def summarize_section(section):
+    return invoke_claude(map_prompt(section), HAIKU_MODEL_ID, max_tokens=SUMMARY_MAP_MAX_TOKENS, region="us-west-2",
+                         assumed_role=os.environ.get("BEDROCK_ASSUME_ROLE"), stage="summary_map").strip()
+
+
+def reduce_summaries(summaries, max_tokens):
+    """One pointwise summary of (label, summary) pairs, merging in groups while they exceed SUMMARY_REDUCE_INPUT_TOKENS"""
+    reduce_calls = 0
+    while True:
+        groups, current, size = [], [], 0
+        for label, summary in summaries:
+            tokens = estimate_tokens(summary) + estimate_tokens(label)
+            if current and size + tokens > SUMMARY_REDUCE_INPUT_TOKENS:
+                groups.append(current)
+                current, size = [], 0
+            current.append((label, summary))
+            size += tokens
+        groups.append(current)
+        if len(groups) == 1:
+            result = invoke_claude(reduce_prompt(groups[0]), HAIKU_MODEL_ID, max_tokens=max_tokens, region="us-west-2",
+                                   assumed_role=os.environ.get("BEDROCK_ASSUME_ROLE"), stage="summary_reduce")
+            return result, reduce_calls + 1
+        log.info("Merging section summaries in groups first", summaries=len(summaries), groups=len(groups))
+        with ThreadPoolExecutor(max_workers=max(1, SUMMARY_MAP_CONCURRENCY)) as executor:
+            merged = list(executor.map(in_current_span(lambda group: invoke_claude(
+                reduce_prompt(group), HAIKU_MODEL_ID, max_tokens=SUMMARY_MAP_MAX_TOKENS * 2, region="us-west-2",
+                assumed_role=os.environ.get("BEDROCK_ASSUME_ROLE"), stage="summary_reduce")), groups))
+        reduce_calls += len(groups)
+        summaries = [(f"{group[0][0]} to {group[-1][0]}", text.strip()) for group, text in zip(groups, merged)]
+
+
+def map_reduce_summary(docid, rawtext, keyvaluesText="", tbltxt="", chunk_index=None, max_tokens=5000):
+    """
+    Summary of a long document: its sections summarized in parallel (reusing cached section
+    summaries), then merged in one reduce call
+
+    Raises:
+        BedrockGatewayError: A map or reduce call failed for good
+    """
+    start = time.time()
+    sections = build_sections(rawtext, keyvaluesText, tbltxt, chunk_index)
+    keys = [section_key(section) for section in sections]
+    summaries = cached_summaries(keys)
+    missing = [(key, section) for key, section in zip(keys, sections) if key not in summaries]
+    missing = list({key: section for key, section in missing}.items())
+    log.info("Summarizing document in sections", docid=docid, sections=len(sections),
+             cached=len(sections) - len(missing), to_summarize=len(missing), concurrency=SUMMARY_MAP_CONCURRENCY)
+    if missing:
+        with ThreadPoolExecutor(max_workers=max(1, SUMMARY_MAP_CONCURRENCY)) as executor:
+            new = dict(zip([key for key, _ in missing], executor.map(in_current_span(summarize_section), [s for _, s in missing])))
+        store_summaries(new)
+        summaries.update(new)
+
+    section_summaries = [(section_label(section), summaries[key]) for key, section in zip(keys, sections)
+                         if summaries[key] and "no relevant content" not in summaries[key].lower()[:40]]
+    summary, reduce_calls = reduce_summaries(section_summaries, max_tokens) if section_summaries else ("", 0)
+    emit_metrics({"SummarySections": len(sections), "SummarySectionsCached": len(sections) - len(missing),
+                  "SummaryMapCalls": len(missing), "SummaryReduceCalls": reduce_calls,
+                  "SummaryDuration": (round((time.time() - start) * 1000, 1), "Milliseconds")}, docid=docid)
+    return summary
@@ -1,13 +1,13 @@
 import json
 import boto3
-import traceback
+from structured_log import log
 
 # Initialize DynamoDB resource
 dynamodb_resource = boto3.resource("dynamodb")
 
 def get_docs_dashboard(docid):
     """Retrieve document extract details from DynamoDB"""
-    print('in get_docs_extract begin', docid)
+    log.debug("Loading the dashboard record", docid=docid)
     
     dynamodb_tbl_nm = "nmm-dashboard"
     dbtable = dynamodb_resource.Table(dynamodb_tbl_nm)
@@ -16,7 +16,7 @@ def get_docs_dashboard(docid):
 
 def get_docs_extract(docid):
     """Retrieve document extract details from DynamoDB"""
-    print('in get_docs_extract begin', docid)
+    log.debug("Loading the extracted entities", docid=docid)
     
     dynamodb_tbl_nm = "nmm-doc-extraction"
     dbtable = dynamodb_resource.Table(dynamodb_tbl_nm)
@@ -28,13 +28,13 @@ def get_docs_extract(docid):
 
 def lambda_handler(event, context):
     try:
-        print("Event = ", event)
+        log.debug("Event", event=event)
 
         docid = event.get('docid')
-        print("docid = ",docid)
+        log.info("Fetching document details", docid=docid)
 
         if not docid:
-            print("Error: docid is not present")
+            log.error("docid is not present")
             return {
                 'statusCode': 400,
                 'body': json.dumps({'error': 'docid is required'})
@@ -44,13 +44,13 @@ def lambda_handler(event, context):
         # Get document extract details
         docs_dashboard = get_docs_dashboard(docid)
         docs_det = docs_dashboard['Item']
-        print("docs_dashboard = ",docs_det)
+        log.debug("Dashboard record", docid=docid, item=docs_det)
 
         docs_extract = get_docs_extract(docid)
         # docs_det = docs_extract['Item']
         # # extracted_entities = docs_extract_details['extracted_entities']
         json_docs_det = json.loads(docs_extract)
-        print("docs_extract_details  = ",json_docs_det)
+        log.debug("Extracted entities", docid=docid, extracted_entities=docs_extract)
 
         
         # body = json.dumps ({
@@ -70,8 +70,7 @@ def lambda_handler(event, context):
         }
         
     except Exception as e:
-        print(f"Exception in execute_model() and the error is - {e}")  
-        print('Exception Details in lambda handler () are - ',traceback.format_exc())
+        log.exception("Exception in lambda_handler()", error=str(e))
         return {
             'statusCode': 500,
             'body': json.dumps({'error': str(e)})
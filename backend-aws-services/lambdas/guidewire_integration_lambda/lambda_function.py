@@ -9,11 +9,11 @@ from logging import exception
 from botocore.exceptions import ClientError
 import datetime
 import decimal
-import traceback
 import botocore
 from botocore.config import Config
 import re
 import time
+from structured_log import log
 
 serverpath = "http://xx.xx.xx.xx:8080/xx/xx/hcl/"  ## replace
 # API credentials
@@ -28,34 +28,29 @@ def lambda_handler(event, context):
             'Access-Control-Allow-Methods': '*',  # Adjust based on the allowed methods
         }
     try:
-        print('inside lambda_handler() event= ', event)
+        log.debug("Event", event=event)
         if type(event) is dict:
             qtext = event
         else:
             qtext = json.loads(event)
-        print("qtext=json.loads(event) :",type(qtext),qtext)
         
         req_type = qtext['req_type']
-        print("req_type = ",req_type)
         req_payload = qtext['req_payload']
-        print("req_payload = ",req_payload)
+        log.info("Guidewire request", req_type=req_type)
+        log.debug("Guidewire request payload", req_type=req_type, req_payload=req_payload)
         
         if req_type == 'checkclaim' or req_type == 'fetchmatchingclaims':
             wsdl_url =  serverpath + "/search/ClaimSearch_Ext?WSDL"
         elif req_type == 'updategwentities' or req_type == 'updategwdms' or req_type == 'updategwlegal':
             wsdl_url = serverpath + "/idp/ClaimAPI_Ext?WSDL"
 
-        print("wsdl_url = ",wsdl_url)
 
         # Create a custom session with authentication
         session = Session()
         session.auth = HTTPBasicAuth(api_userid, api_password)
-        print("session = ", session)
         # Initialize the SOAP client with the custom session
         transport = Transport(session=session)
-        print("transport = ", transport)
         client = Client(wsdl_url, transport=transport)
-        print("client = ", client)
         
         # Make the SOAP request
         if req_type == 'checkclaim':
@@ -69,12 +64,11 @@ def lambda_handler(event, context):
         elif req_type == 'updategwlegal':
             soap_response = client.service.createNewMatter(req_payload)
         
-        print("SOAP Response:", soap_response)
+        log.debug("SOAP Response", req_type=req_type, soap_response=soap_response)
         
 
     except Exception as e:
-        print('Exception in lambda_handler() - ', e)
-        print('Exception Details in lambda_handler() are - ',traceback.format_exc())
+        log.exception("Exception in lambda_handler()", error=str(e))
     
     return {
             "statusCode": 200,
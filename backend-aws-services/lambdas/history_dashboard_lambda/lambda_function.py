@@ -1,6 +1,8 @@
 import boto3
 from boto3.dynamodb.conditions import Key
 import json
+from dynamo_scan import parallel_scan
+from structured_log import log
 
 def lambda_handler(event, context):
     dynamodb = boto3.resource('dynamodb')
@@ -9,15 +11,15 @@ def lambda_handler(event, context):
     extraction_table = dynamodb.Table('nmm-doc-extraction')
     dashboard_table = dynamodb.Table('nmm-dashboard')
     
-    # Scan both tables
-    extraction_data = extraction_table.scan()['Items']
-    dashboard_data = dashboard_table.scan()['Items']
+    # Scan both tables (all pages, segments read in parallel)
+    extraction_data = parallel_scan(extraction_table)
+    dashboard_data = parallel_scan(dashboard_table)
     
     # Create lookup dict for dashboard data
     dashboard_lookup = {item['docid']: item for item in dashboard_data}
     
     # Columns to exclude
-    exclude_columns = {'rawtext', 'tbltxt', 'keyvaluesText', 'empty_key_perc', 'empty_keys', 'empty_keys_count', 'total_keys', 'doc_summary', 'extracted_entities'}
+    exclude_columns = {'rawtext', 'tbltxt', 'keyvaluesText', 'chunk_index', 'payload_refs', 'empty_key_perc', 'empty_keys', 'empty_keys_count', 'total_keys', 'doc_summary', 'extracted_entities'}
     
     # Combine data based on docid, only for ManualUpload status
     combined_data = []
@@ -40,7 +42,8 @@ def lambda_handler(event, context):
             
             combined_data.append(combined_item)
     
-    print("combined_data = ", type(combined_data),  combined_data)
+    log.info("Combined records", records=len(combined_data))
+    log.debug("Combined records", combined_data=combined_data)
     return {
         'statusCode': 200,
         'body': json.dumps({
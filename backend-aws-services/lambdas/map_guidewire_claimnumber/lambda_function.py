@@ -1,5 +1,6 @@
 import json
 import boto3
+from structured_log import log, response_summary
 
 # Initialize DynamoDB resource
 dynamodb_resource = boto3.resource("dynamodb")
@@ -28,7 +29,7 @@ def upsert_dashboard_record(tablename, docid, **kwargs):
 
     # Remove trailing comma and space
     update_expression = update_expression.rstrip(", ")
-    print("update_expression =", update_expression)
+    log.debug("Updating record", docid=docid, table=tablename, update_expression=update_expression)
     
     try:
         response = table.update_item(
@@ -37,10 +38,10 @@ def upsert_dashboard_record(tablename, docid, **kwargs):
             ExpressionAttributeValues=expression_attribute_values,
             ReturnValues='ALL_NEW'
         )
-        print("response =", response)
+        log.info("Updated record", docid=docid, table=tablename, response=response_summary(response))
         return response
     except ClientError as e:
-        print(f"Error updating record: {e}")
+        log.error("Error updating record", docid=docid, table=tablename, error=str(e))
         raise
 
 
@@ -50,15 +51,14 @@ def lambda_handler(event, context):
     docid = event.get('docid')
     gw_claim_number = event.get('gw_claim_number')
     if not docid:
-        print("Error: docid is not present")
+        log.error("docid is not present")
         return {
             'statusCode': 400,
             'body': json.dumps({'error': 'docid is required'})
         }
-    print("before updating dashboard ")
     # Update Dashboard table with entity extraction status
     resUpdate = upsert_dashboard_record('dashboard', docid=docid, gw_claim_id=gw_claim_number)
-    print("after updating dashboard response : ", resUpdate)
+    log.info("Mapped the Guidewire claim number", docid=docid, gw_claim_number=gw_claim_number)
 
     return {
         'statusCode': 200,
@@ -2,6 +2,7 @@ import boto3
 import json
 from decimal import Decimal
 from botocore.exceptions import ClientError
+from structured_log import log, response_summary
 
 # Initialize DynamoDB resource
 dynamodb_resource = boto3.resource("dynamodb")
@@ -30,7 +31,7 @@ def upsert_dashboard_record(tablename, docid, **kwargs):
 
     # Remove trailing comma and space
     update_expression = update_expression.rstrip(", ")
-    print("update_expression =", update_expression)
+    log.debug("Updating record", docid=docid, table=tablename, update_expression=update_expression)
     
     try:
         response = table.update_item(
@@ -39,10 +40,10 @@ def upsert_dashboard_record(tablename, docid, **kwargs):
             ExpressionAttributeValues=expression_attribute_values,
             ReturnValues='ALL_NEW'
         )
-        print("response =", response)
+        log.info("Updated record", docid=docid, table=tablename, response=response_summary(response))
         return response
     except ClientError as e:
-        print(f"Error updating record: {e}")
+        log.error("Error updating record", docid=docid, table=tablename, error=str(e))
         raise
 
 def lambda_handler(event, context):
@@ -52,11 +53,10 @@ def lambda_handler(event, context):
     try:
         # Extract parameters from event
         docid = event.get('docid')
-        print("docid =", docid)
 
         # Update Document Extraction table with classification type
         resExtraction = upsert_dashboard_record('nmm-doc-extraction', docid=docid, mark_for_review="Yes")
-        print ("resExtraction = ", resExtraction)       
+        log.info("Marked the document for review", docid=docid)
          
         
         return {
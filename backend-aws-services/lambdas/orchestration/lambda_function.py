@@ -10,8 +10,11 @@ from utilities import (
     singleclaimfetch, 
     verifyclaim, 
     GenerateEmail, 
-    fetchtmpltemail
+    fetchtmpltemail,
+    allitempage,
+    InvalidPageRequest
 )
+from structured_log import log
 
 headers = {
     'Access-Control-Allow-Origin': '*',
@@ -21,31 +24,26 @@ headers = {
 
 def lambda_handler(event, context):
     try:
-        print(f"📥 Received event: {event}")
+        log.debug("📥 Received event", event=event)
         # Parse the input parameters from the API Gateway event
         if 'body' in event:
             body = json.loads(event['body']) if isinstance(event['body'], str) else event['body']
         else:
             body = event
 
-        print(f"📥 Received body: {body}")
         tasktype = body.get('tasktype')
-        print(f"🔧 Task type: {tasktype}")
+        log.info("🔧 Processing request", tasktype=tasktype)
+        log.debug("📥 Received body", body=body)
 
         # Handle different task types
         if tasktype == 'SEND_TO_QUEUE':
-            print('📤 Processing SEND_TO_QUEUE request')
             indexid = body.get('indexid')
             s3filename = body.get('s3filename')
             docid = body.get('docid')
             source = body.get('source')
-            print(f"Doc source: {source}")
             if source == None or source == "":
                 source = "ManualUpload"
-            print(f"Final source going to SQS queue: {source}")
-            print(f"🆔 Claim ID: {indexid}")
-            print(f"📁 S3 Filename: {s3filename}")
-            print(f"📁 S3 docid inside docid : {docid}")
+            log.info("📁 Document upload", docid=docid, indexid=indexid, s3filename=s3filename, source=source)
             
             if not indexid or not s3filename:
                 return {
@@ -57,7 +55,7 @@ def lambda_handler(event, context):
                 }
             
             response = sendtodocproQ(indexid, s3filename, docid, source)
-            print(f"📤 Queue response: {response}")
+            log.debug("📤 Queue response", docid=docid, response=response)
             
             return {
                 'statusCode': 200,
@@ -69,7 +67,6 @@ def lambda_handler(event, context):
             }
 
         elif tasktype == 'SEND_TO_PS_QUEUE':
-            print('📤 Processing SEND_TO_PS_QUEUE request')
             claimid = body.get('claimid')
             s3filename = body.get('s3filename')
             actionn = body.get('actionn')
@@ -95,7 +92,34 @@ def lambda_handler(event, context):
             }
 
         elif tasktype == 'FETCH_ALL_CLAIMS':
-            print('📋 Processing FETCH_ALL_CLAIMS request')
+            # Paginated mode - the UI pages through the claim list instead of
+            # pulling the whole table (and its extraction text) in one response
+            if any(k in body for k in ('page_size', 'next_token', 'attributes')):
+                try:
+                    page = allitempage(
+                        page_size=body.get('page_size', 100),
+                        next_token=body.get('next_token'),
+                        attributes=body.get('attributes')
+                    )
+                except InvalidPageRequest as e:
+                    return {
+                        'statusCode': 400,
+                        'headers': headers,
+                        'body': json.dumps({
+                            'error': str(e)
+                        })
+                    }
+                
+                return {
+                    'statusCode': 200,
+                    'headers': headers,
+                    'body': json.dumps({
+                        'allclaimdata': page['items'],
+                        'next_token': page['next_token'],
+                        'count': len(page['items'])
+                    })
+                }
+            
             allclaimdata = allitemscan()
             
             return {
@@ -107,12 +131,9 @@ def lambda_handler(event, context):
             }
 
         elif tasktype == 'FETCH_SINGLE_CLAIM':
-            print('🔍 Processing FETCH_SINGLE_CLAIM request')
             claimid = body.get('claimid')
-            print(f"🆔 Searching for Claim ID: {claimid}")
             
             singleclaimdata = fetchsinglerec(claimid)
-            print(f"📄 Single claim data result: {type(singleclaimdata)}")
             
             return {
                 'statusCode': 200,
@@ -123,7 +144,6 @@ def lambda_handler(event, context):
             }
 
         elif tasktype == 'FETCH_ALL_ACT_CLAIMS':
-            print('📋 Processing FETCH_ALL_ACT_CLAIMS request')
             allclaimactdata = allclaimsfetch()
             
             return {
@@ -135,12 +155,9 @@ def lambda_handler(event, context):
             }
 
         elif tasktype == 'FETCH_SINGLE_ACT_CLAIM':
-            print('🔍 Processing FETCH_SINGLE_ACT_CLAIM request')
             claimid = body.get('claimid')
-            print(f"🆔 Searching for Active Claim ID: {claimid}")
             
             claimactdata = singleclaimfetch(claimid)
-            print(f"📄 Active claim data result: {type(claimactdata)}")
             
             return {
                 'statusCode': 200,
@@ -151,13 +168,9 @@ def lambda_handler(event, context):
             }
 
         elif tasktype == 'VERIFY_CLAIM':
-            print('✅ Processing VERIFY_CLAIM request')
             claimid = body.get('claimid')
             psid = body.get('psid')
             
-            print(f"🆔 Claim ID: {claimid}")
-            print(f"📋 PS ID: {psid}")
-            
             verifresult = verifyclaim(claimid, psid)
             
             return {
@@ -169,13 +182,9 @@ def lambda_handler(event, context):
             }
 
         elif tasktype == 'GENERATE_EMAIL':
-            print('📧 Processing GENERATE_EMAIL request')
             claimid = body.get('claimid')
             psid = body.get('psid')
             
-            print(f"🆔 Claim ID: {claimid}")
-            print(f"📋 PS ID: {psid}")
-            
             generatedemail = GenerateEmail(claimid, psid)
             
             return {
@@ -187,7 +196,6 @@ def lambda_handler(event, context):
             }
 
         elif tasktype == 'FETCH_EMAIL':
-            print('📧 Processing FETCH_EMAIL request')
             claimid = body.get('claimid')
             emailbody = fetchtmpltemail(claimid)
             
@@ -209,7 +217,7 @@ def lambda_handler(event, context):
             }
 
     except json.JSONDecodeError as e:
-        print(f"❌ JSON decode error: {str(e)}")
+        log.error("❌ JSON decode error", error=str(e))
         return {
             'statusCode': 400,
             'headers': headers,
@@ -219,9 +227,7 @@ def lambda_handler(event, context):
             })
         }
     except Exception as e:
-        print(f"❌ Unexpected error: {str(e)}")
-        import traceback
-        print(f"Full traceback: {traceback.format_exc()}")
+        log.exception("❌ Unexpected error", error=str(e))
         
         return {
             'statusCode': 500,
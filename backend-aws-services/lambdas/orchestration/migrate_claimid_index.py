@@ -0,0 +1,108 @@
+"""
+One-off migration for the keyed FETCH_SINGLE_CLAIM lookup.
+
+Backfills existing rows whose ``claimid`` is not stored as a string (a
+string-keyed index cannot cover them), then creates the KEYS_ONLY
+``claimid-index`` GSI on the claim details table - unless claimid is already
+the partition key - and waits for it to become ACTIVE.
+
+Usage:
+    python migrate_claimid_index.py [--table claimassistv2-claimdetails] [--index claimid-index] [--dry-run]
+"""
+import argparse
+import os
+import time
+import boto3
+from decimal import Decimal
+
+# Same defaults as utilities.py - not imported from there, it needs the common layer on the path
+CLAIM_TABLE_NAME = os.environ.get("CLAIM_TABLE_NAME", "claimassistv2-claimdetails")
+CLAIMID_INDEX_NAME = os.environ.get("CLAIMID_INDEX_NAME", "claimid-index")
+
+
+def ensure_claimid_index(client, table_name, index_name):
+    """Create the claimid GSI if it is missing and wait until it is ACTIVE"""
+    description = client.describe_table(TableName=table_name)['Table']
+    hash_key = [k['AttributeName'] for k in description['KeySchema'] if k['KeyType'] == 'HASH'][0]
+    if hash_key == 'claimid':
+        print(f"✅ claimid is already the partition key of {table_name}, no index needed")
+        return False
+
+    existing = [gsi['IndexName'] for gsi in description.get('GlobalSecondaryIndexes', [])]
+    if index_name not in existing:
+        print(f"🔧 Creating GSI {index_name} on {table_name}...")
+        index_update = {
+            'Create': {
+                'IndexName': index_name,
+                'KeySchema': [{'AttributeName': 'claimid', 'KeyType': 'HASH'}],
+                'Projection': {'ProjectionType': 'KEYS_ONLY'},
+            }
+        }
+        # Provisioned tables need throughput on the index as well
+        throughput = description.get('ProvisionedThroughput', {})
+        if description.get('BillingModeSummary', {}).get('BillingMode') != 'PAY_PER_REQUEST' and throughput.get('ReadCapacityUnits'):
+            index_update['Create']['ProvisionedThroughput'] = {
+                'ReadCapacityUnits': throughput['ReadCapacityUnits'],
+                'WriteCapacityUnits': throughput['WriteCapacityUnits'],
+            }
+        client.update_table(
+            TableName=table_name,
+            AttributeDefinitions=[{'AttributeName': 'claimid', 'AttributeType': 'S'}],
+            GlobalSecondaryIndexUpdates=[index_update]
+        )
+
+    while True:
+        description = client.describe_table(TableName=table_name)['Table']
+        status = [gsi['IndexStatus'] for gsi in description.get('GlobalSecondaryIndexes', []) if gsi['IndexName'] == index_name]
+        print(f"⏳ {index_name} status: {status}")
+        if status and status[0] == 'ACTIVE':
+            return True
+        time.sleep(15)
+
+
+def backfill_claimid_strings(table, dry_run=False):
+    """Rewrite numeric claimid values as strings so the rows are picked up by the GSI"""
+    key_names = [k['AttributeName'] for k in table.key_schema]
+    scan_kwargs = {'ProjectionExpression': ', '.join(set(key_names + ['claimid']))}
+    scanned = 0
+    fixed = 0
+    while True:
+        response = table.scan(**scan_kwargs)
+        for item in response['Items']:
+            scanned += 1
+            claimid = item.get('claimid')
+            if claimid is None or isinstance(claimid, str):
+                continue
+            new_claimid = str(int(claimid)) if isinstance(claimid, Decimal) and claimid % 1 == 0 else str(claimid)
+            print(f"🔧 claimid {claimid!r} -> {new_claimid!r}")
+            if not dry_run:
+                table.update_item(
+                    Key={k: item[k] for k in key_names},
+                    UpdateExpression='SET claimid = :claimid',
+                    ExpressionAttributeValues={':claimid': new_claimid}
+                )
+            fixed += 1
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    print(f"✅ Scanned {scanned} rows, normalized {fixed} claimid values{' (dry run)' if dry_run else ''}")
+    return scanned, fixed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--table', default=CLAIM_TABLE_NAME)
+    parser.add_argument('--index', default=CLAIMID_INDEX_NAME)
+    parser.add_argument('--dry-run', action='store_true', help='report rows that need a backfill without writing')
+    args = parser.parse_args()
+
+    dynamodb = boto3.resource('dynamodb')
+    table = dynamodb.Table(args.table)
+    # Normalize first: a string-typed index cannot be created over numeric claimid values
+    backfill_claimid_strings(table, dry_run=args.dry_run)
+    if not args.dry_run:
+        ensure_claimid_index(dynamodb.meta.client, args.table, args.index)
+
+
+if __name__ == '__main__':
+    main()
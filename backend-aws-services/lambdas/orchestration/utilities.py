@@ -1,8 +1,13 @@
 import json
 import boto3
 from decimal import Decimal
-from boto3.dynamodb.conditions import Attr
+from boto3.dynamodb.conditions import Attr, Key
 import uuid
+import os
+import base64
+from botocore.exceptions import ClientError
+from dynamo_scan import parallel_scan
+from structured_log import log
 
 def convert_dynamodb_to_json(item):
     """Convert DynamoDB item to regular JSON"""
@@ -31,143 +36,86 @@ def convert_decimals(obj):
     else:
         return obj
 
+CLAIM_TABLE_NAME = os.environ.get("CLAIM_TABLE_NAME", "claimassistv2-claimdetails")
+CLAIMID_INDEX_NAME = os.environ.get("CLAIMID_INDEX_NAME", "claimid-index")
+
+dynamodb_resource = boto3.resource('dynamodb')
+
+# Cached per container so warm invocations do not repeat DescribeTable
+_claim_table_hash_key = None
+
+def get_claim_table_hash_key(table):
+    """Return the partition key attribute name of the claim details table"""
+    global _claim_table_hash_key
+    if _claim_table_hash_key is None:
+        for key in table.key_schema:
+            if key['KeyType'] == 'HASH':
+                _claim_table_hash_key = key['AttributeName']
+    return _claim_table_hash_key
+
+def query_claimid_index(table, claimid):
+    """Keys of the claim from the claimid GSI, None when the index does not exist (yet)"""
+    try:
+        response = table.query(
+            IndexName=CLAIMID_INDEX_NAME,
+            KeyConditionExpression=Key('claimid').eq(claimid),
+            Limit=1
+        )
+    except ClientError as e:
+        code = e.response.get('Error', {}).get('Code')
+        if code not in ('ValidationException', 'ResourceNotFoundException'):
+            raise
+        log.warning("⚠️ claimid index not usable, scanning instead - run migrate_claimid_index.py",
+                    index=CLAIMID_INDEX_NAME, error_code=code, error=e.response['Error'].get('Message', ''))
+        return None
+    return response['Items']
+
 def singleclaimfetch(claimid):
     """Fetch a single claim by claim ID"""
-    dynamodb_tbl_nm = "claimassistv2-claimdetails"
-    dynamodb = boto3.resource('dynamodb')
-    table = dynamodb.Table(dynamodb_tbl_nm)
+    table = dynamodb_resource.Table(CLAIM_TABLE_NAME)
     
-    print(f"Searching for claimid: {claimid}")
+    log.info("Searching for claimid", claimid=claimid)
     
-    try:
-        # Instead of using FilterExpression, let's scan all and filter in Python
-        print("Scanning database for the specific claim...")
-        
-        response = table.scan()
-        all_items = response['Items']
-        
-        # Handle pagination
-        while 'LastEvaluatedKey' in response:
-            response = table.scan(ExclusiveStartKey=response['LastEvaluatedKey'])
-            all_items.extend(response['Items'])
-        
-        print(f"Total items scanned: {len(all_items)}")
-        
-        # Find the specific claim in Python (more reliable)
-        matching_items = []
-        for item in all_items:
-            if item.get('claimid') == claimid:
-                matching_items.append(item)
-        
-        print(f"Found {len(matching_items)} matching items for claimid: {claimid}")
-        
-        if len(matching_items) > 0:
-            item = matching_items[0]
-            converted_item = convert_decimals(item)
-            
-            print(f"✅ Returning data for claimid: {claimid}")
-            print(f"Item keys: {list(converted_item.keys())}")
-            
-            # Check for extracted data
-            if 'total_extracted_data' in converted_item:
-                extracted_data = converted_item['total_extracted_data']
-                if extracted_data and str(extracted_data).strip():
-                    print(f"✅ Has extracted data (length: {len(str(extracted_data))})")
-                    print(f"Data preview: {str(extracted_data)[:200]}...")
-                else:
-                    print("⚠️ total_extracted_data field exists but is empty/null")
-            else:
-                print("⚠️ No total_extracted_data field found")
-            
-            return converted_item
-        else:
-            print(f"❌ No matching item found for claimid: {claimid}")
-            
-            # Debug: Show what claim IDs actually exist
-            existing_ids = [item.get('claimid') for item in all_items[:10] if 'claimid' in item]
-            print(f"Sample existing claim IDs: {existing_ids}")
-            
-            return "claim data not present"
-            
-    except Exception as e:
-        print(f"❌ Error querying DynamoDB: {str(e)}")
-        import traceback
-        print(f"Full traceback: {traceback.format_exc()}")
-        return "claim data not present"    """Fetch a single claim by claim ID"""
-    dynamodb_tbl_nm = "claimassistv2-claimdetails"
-    dynamodb = boto3.resource('dynamodb')
-    table = dynamodb.Table(dynamodb_tbl_nm)
+    if not claimid:
+        log.warning("❌ No claimid provided")
+        return "claim data not present"
     
-    print(f"Searching for claimid: {claimid}")
+    # The index key is a string attribute (migrate_claimid_index.py normalizes old rows)
+    claimid = str(claimid)
     
     try:
-        # First, let's see what claim IDs actually exist in the database
-        print("Scanning database for existing claim IDs...")
-        scan_response = table.scan(ProjectionExpression="claimid")
-        
-        all_claim_ids = []
-        for item in scan_response['Items']:
-            if 'claimid' in item:
-                all_claim_ids.append(item['claimid'])
-        
-        # Handle pagination
-        while 'LastEvaluatedKey' in scan_response:
-            scan_response = table.scan(
-                ProjectionExpression="claimid",
-                ExclusiveStartKey=scan_response['LastEvaluatedKey']
-            )
-            for item in scan_response['Items']:
-                if 'claimid' in item:
-                    all_claim_ids.append(item['claimid'])
-        
-        print(f"Total claim IDs in database: {len(all_claim_ids)}")
-        print(f"First 5 claim IDs: {all_claim_ids[:5]}")
-        print(f"Looking for claimid: '{claimid}' (type: {type(claimid)})")
-        
-        # Check if the claimid exists
-        if claimid in all_claim_ids:
-            print(f"✅ Found exact match for claimid: {claimid}")
+        # Keyed lookup - get_item when claimid is the partition key, otherwise
+        # query the claimid GSI (see migrate_claimid_index.py). Both stay O(1)
+        # in the table size, unlike the scan + filter this replaced.
+        if get_claim_table_hash_key(table) == 'claimid':
+            response = table.get_item(Key={'claimid': claimid})
+            items = [response['Item']] if 'Item' in response else []
         else:
-            print(f"❌ No exact match found for claimid: {claimid}")
-            # Show some similar IDs for debugging
-            similar_ids = [cid for cid in all_claim_ids if str(claimid)[:2] in str(cid)][:5]
-            print(f"Similar IDs starting with '{claimid[:2]}': {similar_ids}")
-        
-        # Search for the specific claim
-        response = table.scan(
-            FilterExpression=Attr('claimid').eq(claimid)
-        )
-        
-        items = response['Items']
-        print(f"Found {len(items)} items for claimid: {claimid}")
+            items = query_claimid_index(table, claimid)
+            # The GSI is KEYS_ONLY, so re-read the full item by its primary key
+            if items is None:
+                # No index yet - scan for the claim as before the migration
+                items = parallel_scan(table, max_items=1, FilterExpression=Attr('claimid').eq(claimid))
+            elif items:
+                key = {k['AttributeName']: items[0][k['AttributeName']] for k in table.key_schema}
+                full = table.get_item(Key=key)
+                items = [full['Item']] if 'Item' in full else []
         
         if len(items) > 0:
             item = items[0]
             converted_item = convert_decimals(item)
             
-            print(f"✅ Returning data for claimid: {claimid}")
-            print(f"Item keys: {list(converted_item.keys())}")
-            
-            # Check for extracted data
-            if 'total_extracted_data' in converted_item:
-                extracted_data = converted_item['total_extracted_data']
-                if extracted_data and extracted_data.strip():
-                    print(f"✅ Has extracted data (length: {len(str(extracted_data))})")
-                    print(f"Data preview: {str(extracted_data)[:200]}...")
-                else:
-                    print("⚠️ total_extracted_data field exists but is empty")
-            else:
-                print("⚠️ No total_extracted_data field found")
+            extracted_data = converted_item.get('total_extracted_data')
+            log.info("✅ Returning data for claimid", claimid=claimid, keys=sorted(converted_item),
+                     extracted_data_length=len(str(extracted_data).strip()) if extracted_data else 0)
             
             return converted_item
         else:
-            print(f"❌ No data found for claimid: {claimid}")
+            log.info("❌ No matching item found for claimid", claimid=claimid)
             return "claim data not present"
             
     except Exception as e:
-        print(f"❌ Error querying DynamoDB: {str(e)}")
-        import traceback
-        print(f"Full traceback: {traceback.format_exc()}")
+        log.exception("❌ Error querying DynamoDB", claimid=claimid, error=str(e))
         return "claim data not present"
 
 def fetchsinglerec(claimid):
@@ -176,54 +124,116 @@ def fetchsinglerec(claimid):
 
 def allitemscan():
     """Scan all items from the DynamoDB table"""
-    dynamodb_tbl_nm = "claimassistv2-claimdetails"
-    dynamodb = boto3.resource('dynamodb')
-    table = dynamodb.Table(dynamodb_tbl_nm)
+    table = dynamodb_resource.Table(CLAIM_TABLE_NAME)
     
     try:
-        print("🔍 Starting DynamoDB scan for all items...")
-        response = table.scan()
-        items = response['Items']
-        
-        # Handle pagination
-        while 'LastEvaluatedKey' in response:
-            response = table.scan(ExclusiveStartKey=response['LastEvaluatedKey'])
-            items.extend(response['Items'])
+        items = parallel_scan(table)
         
         converted_items = [convert_decimals(item) for item in items]
-        print(f"✅ Found {len(converted_items)} total items in table")
+        log.info("✅ Found items in table", items=len(converted_items))
         
-        # Enhanced logging for debugging
-        if converted_items:
-            sample_item = converted_items[0]
-            print(f"Sample item keys: {list(sample_item.keys())}")
-            
-            # Show first few claim IDs
-            claim_ids = []
-            for item in converted_items[:10]:
-                if 'claimid' in item:
-                    claim_ids.append(item['claimid'])
-            print(f"First 10 claim IDs: {claim_ids}")
-            
+        # Enhanced logging for debugging - only worked out when DEBUG lines are written
+        if converted_items and log.enabled("DEBUG"):
             # Check how many have extracted data
             with_extracted_data = 0
             for item in converted_items:
                 if item.get('total_extracted_data') and str(item['total_extracted_data']).strip():
                     with_extracted_data += 1
             
-            print(f"Items with extracted data: {with_extracted_data}/{len(converted_items)}")
+            log.debug("Claim items", sample_keys=sorted(converted_items[0]),
+                      first_claim_ids=[item['claimid'] for item in converted_items[:10] if 'claimid' in item],
+                      with_extracted_data=with_extracted_data)
         
         return converted_items
         
     except Exception as e:
-        print(f"❌ Error scanning DynamoDB: {str(e)}")
-        import traceback
-        print(f"Full traceback: {traceback.format_exc()}")
+        log.exception("❌ Error scanning DynamoDB", error=str(e))
         return []
 
+# Attributes left out of paginated claim pages unless the caller asks for them
+LARGE_CLAIM_ATTRIBUTES = {'total_extracted_data'}
+# Attributes of a claim page when the caller names none (the partition key is always added).
+# A ProjectionExpression can only list attributes, so the page projects these rather than
+# reading every attribute and dropping LARGE_CLAIM_ATTRIBUTES afterwards
+CLAIM_PAGE_ATTRIBUTES = [a.strip() for a in os.environ.get("CLAIM_PAGE_ATTRIBUTES", "claimid").split(',') if a.strip()]
+MAX_CLAIM_PAGE_SIZE = 1000
+
+class InvalidPageRequest(ValueError):
+    """Raised for a bad page_size, attribute list or continuation token"""
+
+def encode_page_token(last_evaluated_key):
+    """Wrap a DynamoDB LastEvaluatedKey into an opaque continuation token"""
+    if not last_evaluated_key:
+        return None
+    payload = json.dumps({"v": 1, "k": convert_decimals(last_evaluated_key)}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+def decode_page_token(token):
+    """Turn a continuation token back into an ExclusiveStartKey"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token.encode('ascii')), parse_float=Decimal, parse_int=Decimal)
+    except Exception as e:
+        raise InvalidPageRequest(f"Invalid next_token: {e}")
+    if not isinstance(payload, dict) or payload.get("v") != 1 or not isinstance(payload.get("k"), dict):
+        raise InvalidPageRequest("Invalid next_token")
+    return payload["k"]
+
+def allitempage(page_size=100, next_token=None, attributes=None):
+    """
+    Fetch one page of the claim details table
+
+    Args:
+        page_size (int): Maximum number of items to return (1 - MAX_CLAIM_PAGE_SIZE)
+        next_token (str): Continuation token returned by the previous page, None for the first page
+        attributes (list): Attribute names to project. When omitted the partition key and
+            CLAIM_PAGE_ATTRIBUTES are returned - never LARGE_CLAIM_ATTRIBUTES
+
+    Returns:
+        dict: {'items': [...], 'next_token': str or None}
+    """
+    try:
+        page_size = int(page_size)
+    except (TypeError, ValueError):
+        raise InvalidPageRequest(f"page_size must be an integer, got {page_size!r}")
+    if page_size < 1 or page_size > MAX_CLAIM_PAGE_SIZE:
+        raise InvalidPageRequest(f"page_size must be between 1 and {MAX_CLAIM_PAGE_SIZE}")
+    if attributes is not None:
+        if isinstance(attributes, str):
+            attributes = [a.strip() for a in attributes.split(',') if a.strip()]
+        if not attributes or not all(isinstance(a, str) and a for a in attributes):
+            raise InvalidPageRequest("attributes must be a non-empty list of attribute names")
+
+    table = dynamodb_resource.Table(CLAIM_TABLE_NAME)
+    if not attributes:
+        default = [get_claim_table_hash_key(table)] + CLAIM_PAGE_ATTRIBUTES
+        attributes = [a for i, a in enumerate(default) if a not in default[:i] and a not in LARGE_CLAIM_ATTRIBUTES]
+    scan_kwargs = {'Limit': page_size}
+    if next_token:
+        scan_kwargs['ExclusiveStartKey'] = decode_page_token(next_token)
+    # Placeholders keep reserved words (name, status, ...) usable as attribute names
+    names = {f"#a{i}": attr for i, attr in enumerate(attributes)}
+    scan_kwargs['ProjectionExpression'] = ', '.join(names.keys())
+    scan_kwargs['ExpressionAttributeNames'] = names
+
+    log.info("🔍 Scanning claim page", page_size=page_size, has_token=bool(next_token), attributes=attributes)
+    try:
+        response = table.scan(**scan_kwargs)
+    except ClientError as e:
+        # A well-formed token whose key does not match the table's key schema
+        if next_token and e.response.get('Error', {}).get('Code') == 'ValidationException':
+            raise InvalidPageRequest(f"Invalid next_token: {e.response['Error'].get('Message', '')}")
+        raise
+    items = response['Items']
+
+    page = {
+        'items': [convert_decimals(item) for item in items],
+        'next_token': encode_page_token(response.get('LastEvaluatedKey')),
+    }
+    log.info("✅ Returning claims", items=len(page['items']), more_pages=page['next_token'] is not None)
+    return page
+
 def allclaimsfetch():
     """Fetch all claims data"""
-    print("📋 Fetching all claims data...")
     return allitemscan()
 
 def sendtoPSproQ(claimid, s3filename, action):
@@ -259,13 +269,11 @@ def sendtoPSproQ(claimid, s3filename, action):
             }
         )
         
-        print(f"✅ Message sent to Policy Doc processing queue: {response['MessageId']}")
+        log.info("✅ Message sent to Policy Doc processing queue", claimid=claimid, message_id=response['MessageId'])
         return {"status": "success", "MessageId": response['MessageId']}
         
     except Exception as e:
-        print(f"❌ Error sending to Policy Doc processing queue: {str(e)}")
-        import traceback
-        print(f"Full traceback: {traceback.format_exc()}")
+        log.exception("❌ Error sending to Policy Doc processing queue", claimid=claimid, error=str(e))
         mock_id = str(uuid.uuid4())
         return {"status": "error", "MessageId": mock_id, "error": str(e)}
 
@@ -283,7 +291,6 @@ def sendtodocproQ(indexid, s3filename, docid, source):
             "message_type": "document_processing",
             "source": source
         }
-        print(f"Final message_body going to SQS queue: {message_body}")
         response = sqs.send_message(
             QueueUrl=queue_url,
             MessageBody=json.dumps(message_body),
@@ -304,16 +311,13 @@ def sendtodocproQ(indexid, s3filename, docid, source):
             }
         )
         
-        print(f"✅ Message sent to document processing queue successfully!")
-        print(f"✅ MessageId: {response['MessageId']}")
-        print(f"📨 Message body: {json.dumps(message_body)}")
+        log.info("✅ Message sent to document processing queue", docid=docid, message_id=response['MessageId'])
+        log.debug("📨 Message body", docid=docid, message_body=message_body)
         
         return {"status": "success", "MessageId": response['MessageId']}
         
     except Exception as e:
-        print(f"❌ Error sending to document processing queue: {str(e)}")
-        import traceback
-        print(f"Full traceback: {traceback.format_exc()}")
+        log.exception("❌ Error sending to document processing queue", docid=docid, error=str(e))
         mock_id = str(uuid.uuid4())
         return {"status": "error", "MessageId": mock_id, "error": str(e)}
 
@@ -345,19 +349,17 @@ def sendtoembeddingQ(claimid, s3filename):
             }
         )
         
-        print(f"✅ Message sent to embedding queue: {response['MessageId']}")
+        log.info("✅ Message sent to embedding queue", claimid=claimid, message_id=response['MessageId'])
         return {"status": "success", "MessageId": response['MessageId']}
         
     except Exception as e:
-        print(f"❌ Error sending to embedding queue: {str(e)}")
-        import traceback
-        print(f"Full traceback: {traceback.format_exc()}")
+        log.exception("❌ Error sending to embedding queue", claimid=claimid, error=str(e))
         mock_id = str(uuid.uuid4())
         return {"status": "error", "MessageId": mock_id, "error": str(e)}
 
 def verifyclaim(claimid, psid):
     """Verify claim - placeholder implementation"""
-    print(f"🔍 Verifying claim: {claimid} with PS: {psid}")
+    log.info("🔍 Verifying claim", claimid=claimid, psid=psid)
     return {
         "status": "verified", 
         "claimid": claimid, 
@@ -367,7 +369,7 @@ def verifyclaim(claimid, psid):
 
 def GenerateEmail(claimid, psid):
     """Generate email - placeholder implementation"""
-    print(f"📧 Generating email for claim: {claimid} with PS: {psid}")
+    log.info("📧 Generating email", claimid=claimid, psid=psid)
     return {
         "email": "generated", 
         "claimid": claimid, 
@@ -377,7 +379,7 @@ def GenerateEmail(claimid, psid):
     }
 def fetch_extraction_data(claimid):
     """Fetch extracted data from multiple processing tables"""
-    print(f"Fetching all processing data for claimid: {claimid}")
+    log.info("Fetching all processing data", claimid=claimid)
     
     # Initialize result structure
     result = {
@@ -423,7 +425,7 @@ def fetch_extraction_data(claimid):
         return result
         
     except Exception as e:
-        print(f"❌ Error fetching processing data: {str(e)}")
+        log.error("❌ Error fetching processing data", claimid=claimid, error=str(e))
         result['error'] = str(e)
         result['status'] = 'error'
         return result
@@ -441,7 +443,7 @@ def fetch_from_extraction_table(claimid):
             return [convert_decimals(item) for item in items]
         return None
     except Exception as e:
-        print(f"Error fetching extraction data: {e}")
+        log.error("Error fetching extraction data", claimid=claimid, error=str(e))
         return None
 
 def fetch_from_classification_table(claimid):
@@ -459,7 +461,7 @@ def fetch_from_classification_table(claimid):
             return [convert_decimals(item) for item in items]
         return None
     except Exception as e:
-        print(f"Error fetching classification data: {e}")
+        log.error("Error fetching classification data", claimid=claimid, error=str(e))
         return None
 
 def fetch_from_entity_table(claimid):
@@ -477,7 +479,7 @@ def fetch_from_entity_table(claimid):
             return [convert_decimals(item) for item in items]
         return None
     except Exception as e:
-        print(f"Error fetching entity data: {e}")
+        log.error("Error fetching entity data", claimid=claimid, error=str(e))
         return None
 
 def fetch_from_confidence_table(claimid):
@@ -495,7 +497,7 @@ def fetch_from_confidence_table(claimid):
             return [convert_decimals(item) for item in items]
         return None
     except Exception as e:
-        print(f"Error fetching confidence data: {e}")
+        log.error("Error fetching confidence data", claimid=claimid, error=str(e))
         return None
 
 def fetch_final_processed_data(claimid):
@@ -504,7 +506,7 @@ def fetch_final_processed_data(claimid):
 def fetchtmpltemail(claimid):
 
     """Fetch template email - placeholder implementation"""
-    print(f"📧 Fetching template email for claim: {claimid}")
+    log.info("📧 Fetching template email", claimid=claimid)
     return {
         "template": "email", 
         "claimid": claimid,
@@ -129,19 +129,23 @@ def extract_document_text(s3_filename):
             blocks.extend(response['Blocks'])
             next_token = response.get('NextToken')
         
+        # One id -> block index per document, so every relationship lookup is O(1)
+        # and the pass below stays linear in the number of blocks
+        block_index = build_block_index(blocks)
+        
         # Extract text blocks
         for block in blocks:
             if block['BlockType'] == 'LINE':
                 rawtext += block['Text'] + "\n"
             elif block['BlockType'] == 'KEY_VALUE_SET':
                 if 'KEY' in block.get('EntityTypes', []):
-                    key_text = extract_text_from_block(block, blocks)
-                    value_block = find_value_block(block, blocks)
+                    key_text = extract_text_from_block(block, block_index)
+                    value_block = find_value_block(block, block_index)
                     if value_block:
-                        value_text = extract_text_from_block(value_block, blocks)
+                        value_text = extract_text_from_block(value_block, block_index)
                         keyvalues_text.append(f"{key_text}: {value_text}")
             elif block['BlockType'] == 'TABLE':
-                table_text = extract_table_text(block, blocks)
+                table_text = extract_table_text(block, block_index)
                 if table_text:
                     tbltxt.append(table_text)
         
@@ -152,39 +156,43 @@ def extract_document_text(s3_filename):
         print(f"❌ Error in text extraction: {str(e)}")
         raise
 
-def extract_text_from_block(block, all_blocks):
+def build_block_index(blocks):
+    """Map block Id -> block for one Textract response"""
+    return {block['Id']: block for block in blocks}
+
+def extract_text_from_block(block, block_index):
     """Extract text from a block using relationships"""
     text = ""
     if 'Relationships' in block:
         for relationship in block['Relationships']:
             if relationship['Type'] == 'CHILD':
                 for child_id in relationship['Ids']:
-                    child_block = next((b for b in all_blocks if b['Id'] == child_id), None)
+                    child_block = block_index.get(child_id)
                     if child_block and child_block['BlockType'] == 'WORD':
                         text += child_block['Text'] + " "
     return text.strip()
 
-def find_value_block(key_block, all_blocks):
+def find_value_block(key_block, block_index):
     """Find the corresponding value block for a key block"""
     if 'Relationships' in key_block:
         for relationship in key_block['Relationships']:
             if relationship['Type'] == 'VALUE':
                 value_id = relationship['Ids'][0]
-                return next((b for b in all_blocks if b['Id'] == value_id), None)
+                return block_index.get(value_id)
     return None
 
-def extract_table_text(table_block, all_blocks):
+def extract_table_text(table_block, block_index):
     """Extract text from table block"""
     table_data = {}
     if 'Relationships' in table_block:
         for relationship in table_block['Relationships']:
             if relationship['Type'] == 'CHILD':
                 for cell_id in relationship['Ids']:
-                    cell_block = next((b for b in all_blocks if b['Id'] == cell_id), None)
+                    cell_block = block_index.get(cell_id)
                     if cell_block and cell_block['BlockType'] == 'CELL':
                         row = cell_block.get('RowIndex', 0)
                         col = cell_block.get('ColumnIndex', 0)
-                        cell_text = extract_text_from_block(cell_block, all_blocks)
+                        cell_text = extract_text_from_block(cell_block, block_index)
                         if row not in table_data:
                             table_data[row] = {}
                         table_data[row][col] = cell_text
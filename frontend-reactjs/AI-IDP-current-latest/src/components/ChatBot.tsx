@@ -4,6 +4,7 @@ import {
   Copy, RotateCcw, Trash2, Minimize2, Maximize2
 } from 'lucide-react';
 import { awsService } from '../services/awsService';
+import { CHAT_WEBSOCKET_URL, streamChat } from '../services/chatStream';
 
 // Smart welcome message based on context
 const getWelcomeMessage = (userRole?: string, currentStep?: string, currentDocId?: string, hasDocuments?: boolean) => {
@@ -125,6 +126,34 @@ const ChatBot: React.FC<ChatBotProps> = ({ isOpen, onToggle, currentDocId, userR
         }
       };
 
+      if (CHAT_WEBSOCKET_URL) {
+        // Show the answer as the lambda streams it instead of waiting for all of it
+        const botMessageId = (Date.now() + 1).toString();
+        let started = false;
+        // isLoading stays true until "done" or "error" - the socket is shared and its messages
+        // carry no request id, so a second question must not be sent while this one streams
+        const result = await streamChat(payload.body, (textSoFar) => {
+          if (!started) {
+            started = true;
+            setMessages(prev => [...prev, {
+              id: botMessageId, text: '', sender: 'bot', timestamp: new Date(), isStreaming: true
+            }]);
+          }
+          setIsStreaming(true);
+          setStreamingText(textSoFar);
+        });
+        setIsStreaming(false);
+        setStreamingText('');
+        if (started) {
+          setMessages(prev => prev.map(msg =>
+            msg.id === botMessageId ? { ...msg, text: result.text, isStreaming: false } : msg
+          ));
+        } else {
+          setMessages(prev => [...prev, { id: botMessageId, text: result.text, sender: 'bot', timestamp: new Date() }]);
+        }
+        return;
+      }
+
       const response = await awsService.invokeLambda('nmm_chatbot_lambda', payload);
 
       const botMessageId = (Date.now() + 1).toString();
@@ -144,6 +173,12 @@ const ChatBot: React.FC<ChatBotProps> = ({ isOpen, onToggle, currentDocId, userR
 
     } catch (error) {
       console.error('Chat error:', error);
+      if (CHAT_WEBSOCKET_URL) {
+        // Drop the bubble of an answer that broke off mid-stream
+        setIsStreaming(false);
+        setStreamingText('');
+        setMessages(prev => prev.filter(msg => !(msg.isStreaming && !msg.text)));
+      }
       const errorMessage: Message = {
         id: (Date.now() + 1).toString(),
         text: 'Sorry, I\'m having trouble connecting. Please try again.',
@@ -359,7 +394,7 @@ const ChatBot: React.FC<ChatBotProps> = ({ isOpen, onToggle, currentDocId, userR
               ))}
 
               {/* Typing indicator */}
-              {isLoading && (
+              {isLoading && !isStreaming && (
                 <div className="flex justify-start">
                   <div className="flex items-start space-x-2">
                     <div className="w-8 h-8 bg-gray-700 rounded-full flex items-center justify-center">
@@ -0,0 +1,84 @@
+// Streaming chat over the chatbot's API Gateway WebSocket API (chatbot_lambda.websocket_handler).
+// Unset, ChatBot falls back to invoking nmm_chatbot_lambda and waiting for the whole answer.
+export const CHAT_WEBSOCKET_URL = process.env.REACT_APP_CHAT_WEBSOCKET_URL || "";
+
+export interface ChatQuestion {
+  docid: string;
+  userid: string;
+  sessionid: string;
+  userquery: string;
+}
+
+export interface ChatStreamResult {
+  text: string;
+  timeToFirstTokenMs: number | null;
+}
+
+let socket: WebSocket | null = null;
+let socketReady: Promise<WebSocket> | null = null;
+
+const openSocket = (): Promise<WebSocket> => {
+  if (socket && socket.readyState === WebSocket.OPEN && socketReady) {
+    return socketReady;
+  }
+  socketReady = new Promise((resolve, reject) => {
+    const ws = new WebSocket(CHAT_WEBSOCKET_URL);
+    ws.onopen = () => resolve(ws);
+    ws.onerror = () => reject(new Error("Chat connection failed"));
+    ws.onclose = () => {
+      if (socket === ws) {
+        socket = null;
+        socketReady = null;
+      }
+    };
+    socket = ws;
+  });
+  return socketReady;
+};
+
+/**
+ * Ask one question and call onDelta with the answer text received so far as it streams in.
+ * Resolves with the whole answer once the lambda sends "done".
+ */
+export const streamChat = async (
+  question: ChatQuestion,
+  onDelta: (textSoFar: string) => void,
+): Promise<ChatStreamResult> => {
+  const ws = await openSocket();
+  const started = performance.now();
+
+  return new Promise((resolve, reject) => {
+    let text = "";
+    let timeToFirstTokenMs: number | null = null;
+
+    const finish = () => {
+      ws.removeEventListener("message", onMessage);
+      ws.removeEventListener("close", onClose);
+    };
+    const onMessage = (event: MessageEvent) => {
+      const message = JSON.parse(event.data);
+      if (message.type === "delta") {
+        if (timeToFirstTokenMs === null) {
+          timeToFirstTokenMs = performance.now() - started;
+          console.log(`⚡ Chat time to first token: ${Math.round(timeToFirstTokenMs)} ms`);
+        }
+        text += message.text;
+        onDelta(text);
+      } else if (message.type === "done") {
+        finish();
+        resolve({ text: message.text || text, timeToFirstTokenMs });
+      } else if (message.type === "error") {
+        finish();
+        reject(new Error(message.text));
+      }
+    };
+    const onClose = () => {
+      finish();
+      reject(new Error("Chat connection closed"));
+    };
+
+    ws.addEventListener("message", onMessage);
+    ws.addEventListener("close", onClose);
+    ws.send(JSON.stringify({ action: "ask", ...question }));
+  });
+};